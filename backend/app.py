@@ -1,4 +1,4 @@
-from flask import Flask, jsonify, request
+from flask import Flask, jsonify, request, Response, stream_with_context
 from flask_cors import CORS
 from datetime import datetime
 
@@ -16,23 +16,167 @@ parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
 sys.path.append(parent_dir)
 
 from data_processing.kpi_calculator import calculate_all_kpis, count_downtimes_by_reason, get_downtime_data, get_all_equipment_details, get_sensor_data
+from data_processing.kpi_index import calculate_all_kpis_indexed, get_kpi_index
+from data_processing.kpi_rollup import GROUP_BY_LEVELS, calculate_grouped_kpis
+from data_processing.kpi_chunked import calculate_all_kpis_chunked, calculate_kpi_partials_chunked, use_chunked_kpis
+from data_processing.kpi_parallel import calculate_all_kpis_parallel, use_parallel_kpis
+from data_processing.kpi_compare import KPI_COMPARE_MAX_WINDOWS, compare_kpis, merge_windows
+from data_processing.downtime_pareto import DOWNTIME_PARETO_TOP_N, PARETO_LEVELS, PARETO_METRICS, get_downtime_pareto
+from data_processing.live_kpis import get_live_engine
+from data_processing.sensor_buffer import get_sensor_buffer, get_recent_sensor_data
+from data_processing.anomaly_detection import DETECTORS, get_anomalies, get_detection_lead_times, start_streaming_detection
+from data_processing.feature_store import FeatureStoreUpdater, iter_feature_chunks
+from data_processing.precursor_analysis import analyze_failure_precursors
+from data_processing.typed_reader import to_records
+from data_processing.sensor_pyramid import SENSOR_PYRAMID_ENABLED, SENSOR_CHART_POINTS, SensorPyramidUpdater, choose_sensor_level
+from data_processing.segment_cache import get_range_cache
+from data_processing.table_versions import get_table_versions
+from data_processing.single_flight import get_single_flight
+from data_processing.cache_warmer import KPI_WARMER_ENABLED, KpiCacheWarmer, kpi_request_key
+from data_processing.db_connection import get_connection_stats, set_connection_scope, set_statement_timeout
+from data_processing.admission import (
+    ADMISSION_CONTROL_ENABLED, ADMISSION_STATEMENT_TIMEOUT_MS, AdmissionQueueTimeout, QueryBudgetExceeded,
+    get_admission_controller
+)
+from data_processing.ingestion import INGESTION_ENABLED, IngestionBufferFull, get_ingestion_buffer, parse_batch, validate_batch
+from data_processing.metadata_registry import get_metadata_registry
+import queue
+import json
+
+# Répondre à /api/kpis via l'index de cumuls en mémoire (construit à la première requête)
+KPI_INDEX_ENABLED = os.getenv("KPI_INDEX_ENABLED", "0") == "1"
+# Servir les dernières minutes de /api/sensor-data depuis le tampon circulaire en mémoire
+SENSOR_BUFFER_ENABLED = os.getenv("SENSOR_BUFFER_ENABLED", "0") == "1"
+# Détection d'anomalies au fil de l'eau sur les relevés reçus par le tampon de capteurs
+ANOMALY_DETECTION_ENABLED = os.getenv("ANOMALY_DETECTION_ENABLED", "0") == "1"
+# Mise à jour en tâche de fond du magasin de features glissantes
+FEATURE_STORE_ENABLED = os.getenv("FEATURE_STORE_ENABLED", "0") == "1"
+# Regrouper les appels identiques simultanés à /api/kpis et /api/downtime-reasons
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "1") == "1"
 
 app = Flask(__name__)
 CORS(app) 
 
+def coalesced_body(name, key, compute):
+    """
+    JSON sérialisé de compute() (données sérialisables). Les appels identiques simultanés (même name et
+    même key de paramètres normalisés) attendent un seul calcul et partagent le JSON déjà sérialisé.
+    """
+    if not SINGLE_FLIGHT_ENABLED:
+        return app.json.dumps(compute())
+    body, _ = get_single_flight().do(name, key, lambda: app.json.dumps(compute()))
+    return body
+
+def coalesced_json(name, key, compute):
+    return Response(coalesced_body(name, key, compute), mimetype='application/json')
+
+def estimate_request_rows(name, estimate):
+    """
+    Coût estimé d'une requête (estimate : lignes lues, voir admission). Lève QueryBudgetExceeded
+    avant tout calcul si le budget est dépassé. None si le contrôle d'admission est désactivé.
+    """
+    if not ADMISSION_CONTROL_ENABLED:
+        return None
+    controller = get_admission_controller()
+    estimated_rows = controller.safe_estimate(estimate)
+    controller.check_budget(name, estimated_rows)
+    return estimated_rows
+
+def run_admitted(name, estimated_rows, compute):
+    """compute() dans une place d'admission : les requêtes lourdes attendent l'une des places limitées."""
+    if not ADMISSION_CONTROL_ENABLED:
+        return compute()
+    with get_admission_controller().admit(name, estimated_rows):
+        return compute()
+
+@app.errorhandler(QueryBudgetExceeded)
+def reject_over_budget(e):
+    return jsonify({"error": str(e), "estimated_rows": e.estimated_rows, "max_rows": e.max_rows}), 422
+
+@app.errorhandler(AdmissionQueueTimeout)
+def reject_queue_timeout(e):
+    response = jsonify({"error": str(e)})
+    response.headers['Retry-After'] = str(int(e.retry_after))
+    return response, 503
+
+@app.before_request
+def scope_db_connections():
+    # Connexions comptées par endpoint (/api/metrics, harnais de charge)
+    set_connection_scope(request.url_rule.rule if request.url_rule else request.path)
+    # Requêtes SQL d'une requête HTTP bornées dans le temps (plus longtemps pour les requêtes lourdes admises)
+    if ADMISSION_CONTROL_ENABLED:
+        set_statement_timeout(ADMISSION_STATEMENT_TIMEOUT_MS)
+
+@app.teardown_request
+def unscope_db_connections(exc):
+    set_connection_scope(None)
+    set_statement_timeout(None)
+
 @app.route('/')
 def home():
     return "API du Tableau de Bord Intelligent de Production est en cours d'exécution !"
 
+def compute_kpi_records(start_date, end_date, equipment_id=None, group_by='equipment'):
+    if group_by != 'equipment':
+        # Partiels par équipement (index de cumuls ou cache), puis agrégation ligne / usine
+        partials_df = None
+        if KPI_INDEX_ENABLED:
+            partials_df = get_kpi_index().query(start_date, end_date, equipment_id)
+        elif use_chunked_kpis(start_date, end_date):
+            partials_df = calculate_kpi_partials_chunked(start_date, end_date, equipment_id)
+        kpis_df = calculate_grouped_kpis(start_date, end_date, equipment_id, group_by, partials_df=partials_df)
+    elif KPI_INDEX_ENABLED:
+        kpis_df = calculate_all_kpis_indexed(start_date, end_date, equipment_id)
+    elif use_chunked_kpis(start_date, end_date):
+        # Longue période : lecture par blocs, mémoire bornée par KPI_CHUNK_ROWS
+        kpis_df = calculate_all_kpis_chunked(start_date, end_date, equipment_id)
+    elif use_parallel_kpis(equipment_id):
+        # Toute la flotte : partitions d'équipements calculées en parallèle
+        kpis_df = calculate_all_kpis_parallel(start_date, end_date)
+    else:
+        kpis_df = calculate_all_kpis(start_date, end_date, equipment_id)
+    return kpis_df.to_dict(orient='records')
+
+def kpi_body_with_snapshot(key, compute):
+    """
+    JSON de /api/kpis (regroupé avec les requêtes identiques en cours) et instantané du cache préchauffé
+    pris juste avant la lecture en base ; instantané None si le calcul d'une autre requête a été partagé
+    (celle-ci stocke le résultat).
+    """
+    taken = []
+
+    def snapshot_then_compute():
+        taken.append(kpi_warmer.snapshot())
+        return compute()
+
+    body = coalesced_body('kpis', key, snapshot_then_compute)
+    return body, taken[0] if taken else None
+
+def warm_kpi_body(key):
+    """Calcul d'une clé kpi_request_key pour le préchauffage."""
+    start_date, end_date = datetime.fromisoformat(key[0]), datetime.fromisoformat(key[1])
+    return kpi_body_with_snapshot(key, lambda: compute_kpi_records(start_date, end_date, key[2], key[3]))
+
+def warm_equipment_ids():
+    equipments_df = get_all_equipment_details()
+    return [] if equipments_df.empty else equipments_df['equipment_id'].tolist()
+
+# Cache préchauffé des réponses /api/kpis (tâche de fond démarrée avec le serveur)
+kpi_warmer = KpiCacheWarmer(warm_kpi_body, warm_equipment_ids) if KPI_WARMER_ENABLED else None
+
 @app.route('/api/kpis', methods=['GET'])
 def get_kpis():
     # Récupérer les paramètres de requête pour la période (start_date, end_date)
     start_date_str = request.args.get('start_date')
     end_date_str = request.args.get('end_date')
     equipment_id = request.args.get('equipment_id') 
+    # Niveau d'agrégation : equipment (défaut), line ou plant
+    group_by = request.args.get('group_by', 'equipment')
 
     if not start_date_str or not end_date_str:
         return jsonify({"error": "Les paramètres start_date et end_date sont requis."}), 400
+    if group_by not in GROUP_BY_LEVELS:
+        return jsonify({"error": f"group_by invalide. Valeurs possibles : {', '.join(GROUP_BY_LEVELS)}."}), 400
 
     try:
         start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
@@ -40,10 +184,98 @@ def get_kpis():
     except ValueError:
         return jsonify({"error": "Format de date invalide. Utilisez YYYY-MM-DD."}), 400
 
-   
-    kpis_df = calculate_all_kpis(start_date, end_date, equipment_id)
+    key = kpi_request_key(start_date, end_date, equipment_id, group_by)
+    if kpi_warmer is not None:
+        # Résultat préchauffé si aucune écriture ne l'a périmé depuis son calcul
+        kpi_warmer.access_log.record(key)
+        body = kpi_warmer.lookup(key)
+        if body is not None:
+            return Response(body, mimetype='application/json')
+
+    # L'index de cumuls répond depuis la mémoire : seul le calcul en base passe par le budget
+    estimated_rows = None if KPI_INDEX_ENABLED else estimate_request_rows(
+        'kpis', lambda: get_admission_controller().estimate_kpi_rows(start_date, end_date, equipment_id))
+    compute = lambda: run_admitted(
+        'kpis', estimated_rows, lambda: compute_kpi_records(start_date, end_date, equipment_id, group_by))
+    if kpi_warmer is None:
+        return Response(coalesced_body('kpis', key, compute), mimetype='application/json')
+    body, snapshot = kpi_body_with_snapshot(key, compute)
+    if snapshot is not None:
+        kpi_warmer.store(key, body, snapshot)
+    return Response(body, mimetype='application/json')
+
+@app.route('/api/kpis/compare', methods=['GET'])
+def get_kpis_comparison():
+    """
+    KPIs de plusieurs périodes et écarts de la première avec chacune des suivantes, en une lecture.
+    Paramètres : windows=YYYY-MM-DD/YYYY-MM-DD,... (requis, la première est la référence),
+    labels=... (optionnel, un libellé par période), equipment_id, group_by (comme /api/kpis).
+    """
+    windows_str = request.args.get('windows')
+    equipment_id = request.args.get('equipment_id')
+    group_by = request.args.get('group_by', 'equipment')
+
+    if not windows_str:
+        return jsonify({"error": "Le paramètre windows est requis (ex. 2024-05-01/2024-06-01,2024-04-01/2024-05-01)."}), 400
+    if group_by not in GROUP_BY_LEVELS:
+        return jsonify({"error": f"group_by invalide. Valeurs possibles : {', '.join(GROUP_BY_LEVELS)}."}), 400
+    try:
+        windows = []
+        for window_str in windows_str.split(','):
+            start_str, end_str = window_str.split('/')
+            windows.append((datetime.strptime(start_str.strip(), '%Y-%m-%d'), datetime.strptime(end_str.strip(), '%Y-%m-%d')))
+    except ValueError:
+        return jsonify({"error": "Format de période invalide. Utilisez YYYY-MM-DD/YYYY-MM-DD, séparées par des virgules."}), 400
+    if len(windows) > KPI_COMPARE_MAX_WINDOWS:
+        return jsonify({"error": f"Au plus {KPI_COMPARE_MAX_WINDOWS} périodes par comparaison."}), 400
+    if any(end <= start for start, end in windows):
+        return jsonify({"error": "Chaque période doit se terminer après son début."}), 400
+    labels = request.args.get('labels', '').split(',') if request.args.get('labels') else [
+        f"{start:%Y-%m-%d}/{end:%Y-%m-%d}" for start, end in windows]
+    if len(labels) != len(windows):
+        return jsonify({"error": "labels doit contenir un libellé par période."}), 400
+
+    # Coût : lignes de l'union des périodes, lues une seule fois
+    estimated_rows = estimate_request_rows('kpis-compare', lambda: sum(
+        get_admission_controller().estimate_kpi_rows(start, end, equipment_id) for start, end in merge_windows(windows)))
+
+    def compute():
+        window_kpis, deltas = compare_kpis(windows, equipment_id, group_by)
+        if not window_kpis:
+            return {'windows': [], 'deltas': []}
+        return {
+            'windows': [{'label': label, 'start_date': f"{start:%Y-%m-%d}", 'end_date': f"{end:%Y-%m-%d}",
+                         'kpis': kpis_df.to_dict(orient='records')}
+                        for label, (start, end), kpis_df in zip(labels, windows, window_kpis)],
+            'deltas': [{'reference': labels[0], 'compared': label, 'kpis': deltas_df.to_dict(orient='records')}
+                       for label, deltas_df in zip(labels[1:], deltas)],
+        }
+
+    key = (tuple(windows), tuple(labels), equipment_id or None, group_by)
+    return coalesced_json('kpis-compare', key, lambda: run_admitted('kpis-compare', estimated_rows, compute))
+
+@app.route('/api/kpis/live', methods=['GET'])
+def stream_live_kpis():
+    """
+    Flux SSE des KPIs de la journée en cours : un premier message avec toutes les lignes,
+    puis uniquement les lignes des équipements modifiés. Un seul poller sert tous les clients.
+    """
+    engine = get_live_engine()
+    subscriber = engine.subscribe()
+
+    def generate():
+        try:
+            yield f"event: snapshot\ndata: {engine.snapshot()}\n\n"
+            while True:
+                try:
+                    message = subscriber.get(timeout=15)
+                    yield f"event: kpis\ndata: {message}\n\n"
+                except queue.Empty:
+                    yield ": keep-alive\n\n" # Empêche les proxys de couper la connexion
+        finally:
+            engine.unsubscribe(subscriber)
 
-    return jsonify(kpis_df.to_dict(orient='records'))
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
 
 @app.route('/api/downtime-reasons', methods=['GET'])
 def get_downtime_reasons():
@@ -60,12 +292,127 @@ def get_downtime_reasons():
     except ValueError:
         return jsonify({"error": "Format de date invalide. Utilisez YYYY-MM-DD."}), 400
 
-    # Il faut d'abord récupérer les données brutes de downtime pour la fonction count_downtimes_by_reason
-    from data_processing.kpi_calculator import get_downtime_data # Importer la fonction raw data getter
-    downtimes_raw = get_downtime_data(start_time=start_date, end_time=end_date, equipment_id=equipment_id)
+    estimated_rows = estimate_request_rows(
+        'downtime-reasons', lambda: get_admission_controller().estimate_rows('downtime_logs', start_date, end_date, equipment_id))
+
+    def compute():
+        # Il faut d'abord récupérer les données brutes de downtime pour la fonction count_downtimes_by_reason
+        downtimes_raw = get_downtime_data(start_time=start_date, end_time=end_date, equipment_id=equipment_id)
+        downtime_reasons_df = count_downtimes_by_reason(downtimes_raw, start_date, end_date, equipment_id)
+        return downtime_reasons_df.to_dict(orient='records')
+
+    return coalesced_json('downtime-reasons', (start_date, end_date, equipment_id or None),
+                          lambda: run_admitted('downtime-reasons', estimated_rows, compute))
+
+@app.route('/api/downtime-pareto', methods=['GET'])
+def get_downtime_pareto_route():
+    """
+    Pareto des arrêts calculé en base : les top_n premières raisons (level=reason) ou catégories
+    (level=category) classées par durée effective (metric=duration) ou nombre d'incidents (metric=count),
+    avec part et part cumulée, puis une ligne « Autres ». Périmètre : equipment_id ou production_line_id.
+    """
+    start_date_str = request.args.get('start_date')
+    end_date_str = request.args.get('end_date')
+    equipment_id = request.args.get('equipment_id')
+    production_line_id = request.args.get('production_line_id')
+    level = request.args.get('level', 'reason')
+    metric = request.args.get('metric', 'duration')
+
+    if not start_date_str or not end_date_str:
+        return jsonify({"error": "Les paramètres start_date et end_date sont requis."}), 400
+    try:
+        start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
+        end_date = datetime.strptime(end_date_str, '%Y-%m-%d')
+    except ValueError:
+        return jsonify({"error": "Format de date invalide. Utilisez YYYY-MM-DD."}), 400
+    try:
+        top_n = int(request.args.get('top_n', DOWNTIME_PARETO_TOP_N))
+    except ValueError:
+        return jsonify({"error": "top_n doit être un entier."}), 400
+    if top_n < 1:
+        return jsonify({"error": "top_n doit être supérieur ou égal à 1."}), 400
+    if level not in PARETO_LEVELS:
+        return jsonify({"error": f"level invalide. Valeurs possibles : {', '.join(PARETO_LEVELS)}."}), 400
+    if metric not in PARETO_METRICS:
+        return jsonify({"error": f"metric invalide. Valeurs possibles : {', '.join(PARETO_METRICS)}."}), 400
+
+    # Coût : logs d'arrêt parcourus par la requête (toute la flotte pour une ligne, estimation prudente)
+    estimated_rows = estimate_request_rows(
+        'downtime-pareto', lambda: get_admission_controller().estimate_rows('downtime_logs', start_date, end_date, equipment_id))
+
+    def compute():
+        pareto_df = get_downtime_pareto(start_date, end_date, top_n, level, metric, equipment_id, production_line_id)
+        return pareto_df.to_dict(orient='records')
+
+    key = (start_date, end_date, top_n, level, metric, equipment_id or None, production_line_id or None)
+    return coalesced_json('downtime-pareto', key, lambda: run_admitted('downtime-pareto', estimated_rows, compute))
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Compteurs internes : appels regroupés (single-flight), cache de segments, connexions ouvertes par endpoint, admission et versions des tables."""
+    return jsonify({
+        'db_connections': get_connection_stats(),
+        'single_flight': get_single_flight().stats(),
+        'range_cache': get_range_cache().stats(),
+        'kpi_warmer': kpi_warmer.stats() if kpi_warmer is not None else None,
+        'ingestion': get_ingestion_buffer().stats() if INGESTION_ENABLED else None,
+        'admission': get_admission_controller().stats() if ADMISSION_CONTROL_ENABLED else None,
+        'table_versions': get_table_versions().stats(),
+    })
+
+@app.route('/api/ingest/<table>', methods=['POST'])
+def ingest_batch(table):
+    """
+    Ingestion d'un lot de lignes (sensor_readings, production_output, machine_events ou downtime_logs).
+    Corps : NDJSON (application/x-ndjson), JSON en colonnes (application/json) ou flux Arrow
+    (application/vnd.apache.arrow.stream). En-tête Idempotency-Key : un lot renvoyé n'est écrit qu'une fois.
+    wait=1 : répond après l'écriture en base (sinon dès la mise en tampon, 202).
+    """
+    if not INGESTION_ENABLED:
+        return jsonify({"error": "Ingestion désactivée (INGESTION_ENABLED=1)."}), 503
+    try:
+        batch_df = validate_batch(table, parse_batch(request.get_data(), request.content_type))
+    except ValueError as e:
+        return jsonify({"error": f"Lot invalide : {e}"}), 400
+
+    try:
+        result = get_ingestion_buffer().submit(table, batch_df, request.headers.get('Idempotency-Key'),
+                                               wait=request.args.get('wait') == '1')
+    except IngestionBufferFull as e:
+        response = jsonify({"error": str(e)})
+        response.headers['Retry-After'] = str(int(e.retry_after))
+        return response, 503
+    except Exception as e:
+        print(f"Erreur lors de l'écriture du lot {table} : {e}")
+        return jsonify({"error": "Écriture du lot abandonnée, réessayer avec la même Idempotency-Key."}), 500
+    status_code = 200 if result['status'] == 'duplicate' or request.args.get('wait') == '1' else 202
+    return jsonify(result), status_code
 
-    downtime_reasons_df = count_downtimes_by_reason(downtimes_raw, start_date, end_date, equipment_id)
-    return jsonify(downtime_reasons_df.to_dict(orient='records'))
+@app.route('/api/ingest/ids', methods=['POST'])
+def reserve_ingest_ids():
+    """
+    Réserve des plages d'identifiants libres pour un client qui numérote ses lignes (simulate_replay).
+    Corps JSON : {"machine_events": n, "downtime_logs": m}. Réponse : premier identifiant de chaque plage.
+    """
+    if not INGESTION_ENABLED:
+        return jsonify({"error": "Ingestion désactivée (INGESTION_ENABLED=1)."}), 503
+    counts = request.get_json(silent=True)
+    if not isinstance(counts, dict):
+        return jsonify({"error": "Corps JSON attendu : {table: nombre d'identifiants}."}), 400
+    try:
+        return jsonify(get_ingestion_buffer().reserve_ids(counts))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"Erreur lors de la réservation d'identifiants : {e}")
+        return jsonify({"error": "Réservation d'identifiants impossible."}), 500
+
+@app.route('/api/ingest/watermarks', methods=['GET'])
+def get_ingest_watermarks():
+    """Par table : dernier timestamp écrit par l'ingestion, lignes et lots écrits."""
+    if not INGESTION_ENABLED:
+        return jsonify({"error": "Ingestion désactivée (INGESTION_ENABLED=1)."}), 503
+    return jsonify(get_ingestion_buffer().get_watermarks())
 
 @app.route('/api/equipments', methods=['GET'])
 def get_equipments():
@@ -75,19 +422,47 @@ def get_equipments():
     equipments_df = get_all_equipment_details()
     return jsonify(equipments_df.to_dict(orient='records'))
 
+@app.route('/api/metadata', methods=['GET'])
+def get_metadata():
+    """
+    Métadonnées du tableau de bord : équipements, lignes de production, capteurs et unités.
+    Servies depuis le registre en mémoire ; ETag = empreinte des tables (304 si inchangées).
+    """
+    try:
+        version, body = get_metadata_registry().metadata_payload()
+    except Exception as e:
+        print(f"Erreur lors de la récupération des métadonnées : {e}")
+        return jsonify({"error": "Métadonnées indisponibles"}), 500
+    etag = f'"metadata-{version}"'
+    if etag in request.headers.get('If-None-Match', ''):
+        return Response(status=304, headers={'ETag': etag})
+    return Response(body, mimetype='application/json', headers={'ETag': etag, 'Cache-Control': 'no-cache'})
+
 @app.route('/api/sensor-data', methods=['GET'])
 def api_get_sensor_data():
     """
     Endpoint pour récupérer les relevés de capteurs.
-    Paramètres: start_date, end_date (requis), equipment_id, sensor_type (optionnels)
+    Paramètres: start_date, end_date (requis), equipment_id, sensor_type (optionnels),
+    shape=long (défaut, une ligne par relevé) ou wide (une ligne par timestamp et équipement, une colonne par capteur),
+    points : nombre de points souhaité par série (défaut SENSOR_CHART_POINTS). Sur une longue fenêtre, les
+    agrégats de la pyramide sont renvoyés (niveau indiqué dans l'en-tête X-Sensor-Resolution).
+    Au-delà du budget de lignes (ADMISSION_MAX_ROWS), le niveau de la pyramide qui tient dans le budget
+    est imposé ; sans pyramide, la requête est refusée (422).
     """
     start_date_str = request.args.get('start_date')
     end_date_str = request.args.get('end_date')
     equipment_id = request.args.get('equipment_id')
     sensor_type = request.args.get('sensor_type')
+    shape = request.args.get('shape', 'long')
 
     if not start_date_str or not end_date_str:
         return jsonify({"error": "Les paramètres start_date et end_date sont requis."}), 400
+    if shape not in ('long', 'wide'):
+        return jsonify({"error": "shape invalide. Valeurs possibles : long, wide."}), 400
+    try:
+        points = int(request.args.get('points', SENSOR_CHART_POINTS))
+    except ValueError:
+        return jsonify({"error": "points doit être un entier."}), 400
 
     try:
         start_date = datetime.strptime(start_date_str, '%Y-%m-%d %H:%M:%S') # Inclure l'heure
@@ -95,9 +470,173 @@ def api_get_sensor_data():
     except ValueError:
         return jsonify({"error": "Format de date/heure invalide. Utilisez YYYY-MM-DD HH:MM:SS."}), 400
 
-    sensor_df = get_sensor_data(start_date, end_date, equipment_id, sensor_type)
+    # Fenêtre longue : niveau agrégé de la pyramide ; fenêtre courte : relevés bruts (tampon ou base)
+    level = choose_sensor_level(start_date, end_date, points) if SENSOR_PYRAMID_ENABLED else None
+    estimated_rows = None
+    if ADMISSION_CONTROL_ENABLED:
+        controller = get_admission_controller()
+        estimated_rows = controller.safe_estimate(
+            lambda: controller.estimate_sensor_rows(start_date, end_date, equipment_id, sensor_type, level))
+        if SENSOR_PYRAMID_ENABLED and estimated_rows is not None and estimated_rows > controller.max_rows:
+            budget_level = controller.sensor_level_within_budget(start_date, end_date, equipment_id, sensor_type)
+            if budget_level is not None:
+                level = budget_level
+                estimated_rows = controller.estimate_sensor_rows(start_date, end_date, equipment_id, sensor_type, level)
+                controller.record_downsampled('sensor-data')
+        controller.check_budget('sensor-data', estimated_rows)
+
+    def read():
+        if shape == 'wide' or level is not None:
+            return get_sensor_data(start_date, end_date, equipment_id, sensor_type, shape=shape, points=points, level=level)
+        if SENSOR_BUFFER_ENABLED:
+            return get_recent_sensor_data(start_date, end_date, equipment_id, sensor_type)
+        return get_sensor_data(start_date, end_date, equipment_id, sensor_type)
+
+    sensor_df = run_admitted('sensor-data', estimated_rows, read)
+
+    response = jsonify(to_records(sensor_df))
+    response.headers['X-Sensor-Resolution'] = sensor_df.attrs.get('resolution', 'raw')
+    return response
+
+@app.route('/api/sensor-data/live', methods=['GET'])
+def stream_sensor_data():
+    """
+    Flux SSE des nouveaux relevés de capteurs (alimenté par le tampon en mémoire).
+    Paramètres optionnels : equipment_id, sensor_type
+    """
+    sensor_buffer = get_sensor_buffer()
+    subscriber = sensor_buffer.subscribe(request.args.get('equipment_id'), request.args.get('sensor_type'))
+
+    def generate():
+        try:
+            while True:
+                try:
+                    message = subscriber.get(timeout=15)
+                    yield f"event: readings\ndata: {message}\n\n"
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+        finally:
+            sensor_buffer.unsubscribe(subscriber)
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+@app.route('/api/anomalies', methods=['GET'])
+def api_get_anomalies():
+    """
+    Endpoint pour récupérer les anomalies détectées sur les capteurs.
+    Paramètres: start_date, end_date (requis, YYYY-MM-DD), equipment_id, sensor_type, detector (optionnels)
+    """
+    start_date_str = request.args.get('start_date')
+    end_date_str = request.args.get('end_date')
+    detector = request.args.get('detector')
+
+    if not start_date_str or not end_date_str:
+        return jsonify({"error": "Les paramètres start_date et end_date sont requis."}), 400
+    if detector and detector not in DETECTORS:
+        return jsonify({"error": f"detector invalide. Valeurs possibles : {', '.join(DETECTORS)}."}), 400
+
+    try:
+        start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
+        end_date = datetime.strptime(end_date_str, '%Y-%m-%d')
+    except ValueError:
+        return jsonify({"error": "Format de date invalide. Utilisez YYYY-MM-DD."}), 400
+
+    anomalies_df = get_anomalies(start_date, end_date, request.args.get('equipment_id'), request.args.get('sensor_type'), detector)
+    return jsonify(anomalies_df.to_dict(orient='records'))
+
+@app.route('/api/anomalies/lead-times', methods=['GET'])
+def api_get_anomaly_lead_times():
+    """
+    Délai d'anticipation des détections avant chaque arrêt imprévu, et synthèse par raison d'arrêt.
+    Paramètres: start_date, end_date (requis, YYYY-MM-DD), equipment_id, lookback_hours (optionnels)
+    """
+    start_date_str = request.args.get('start_date')
+    end_date_str = request.args.get('end_date')
+
+    if not start_date_str or not end_date_str:
+        return jsonify({"error": "Les paramètres start_date et end_date sont requis."}), 400
+
+    try:
+        start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
+        end_date = datetime.strptime(end_date_str, '%Y-%m-%d')
+        lookback_hours = float(request.args.get('lookback_hours', 24))
+    except ValueError:
+        return jsonify({"error": "Paramètres invalides. Dates au format YYYY-MM-DD, lookback_hours numérique."}), 400
+
+    lead_df, summary_df = get_detection_lead_times(start_date, end_date, request.args.get('equipment_id'), lookback_hours)
+    return jsonify({
+        'lead_times': json.loads(lead_df.to_json(orient='records', date_format='iso')),
+        'summary': json.loads(summary_df.to_json(orient='records')),
+    })
+
+@app.route('/api/features/export', methods=['GET'])
+def export_features():
+    """
+    Export CSV en flux des features glissantes, pour l'entraînement des modèles.
+    Paramètres: start_date, end_date (requis, YYYY-MM-DD), equipment_id, sensor_type (optionnels)
+    """
+    start_date_str = request.args.get('start_date')
+    end_date_str = request.args.get('end_date')
+
+    if not start_date_str or not end_date_str:
+        return jsonify({"error": "Les paramètres start_date et end_date sont requis."}), 400
+
+    try:
+        start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
+        end_date = datetime.strptime(end_date_str, '%Y-%m-%d')
+    except ValueError:
+        return jsonify({"error": "Format de date invalide. Utilisez YYYY-MM-DD."}), 400
+
+    chunks = iter_feature_chunks(start_date, end_date, request.args.get('equipment_id'), request.args.get('sensor_type'))
+
+    def generate():
+        # Un bloc de lignes à la fois : la mémoire ne dépend pas de la taille de l'export
+        for i, chunk in enumerate(chunks):
+            yield chunk.to_csv(index=False, header=(i == 0))
+
+    return Response(stream_with_context(generate()), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename=features_{start_date_str}_{end_date_str}.csv'})
+
+@app.route('/api/failure-precursors', methods=['GET'])
+def api_get_failure_precursors():
+    """
+    Profil moyen des capteurs avant chaque type d'arrêt imprévu, et délais d'anticipation.
+    Paramètres: start_date, end_date (requis, YYYY-MM-DD), equipment_id, window_hours, step_minutes,
+    all_sensors=1 (tous les capteurs au lieu des seuls capteurs liés à la raison) (optionnels)
+    """
+    start_date_str = request.args.get('start_date')
+    end_date_str = request.args.get('end_date')
+
+    if not start_date_str or not end_date_str:
+        return jsonify({"error": "Les paramètres start_date et end_date sont requis."}), 400
+
+    try:
+        start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
+        end_date = datetime.strptime(end_date_str, '%Y-%m-%d')
+        window_hours = float(request.args.get('window_hours', 8))
+        step_minutes = int(request.args.get('step_minutes', 15))
+    except ValueError:
+        return jsonify({"error": "Paramètres invalides. Dates au format YYYY-MM-DD, window_hours et step_minutes numériques."}), 400
+    if window_hours <= 0 or step_minutes <= 0:
+        return jsonify({"error": "window_hours et step_minutes doivent être positifs."}), 400
 
-    return jsonify(sensor_df.to_dict(orient='records'))
+    profiles_df, lead_times_df = analyze_failure_precursors(
+        start_date, end_date, request.args.get('equipment_id'), window_hours, step_minutes,
+        related_only=request.args.get('all_sensors') != '1'
+    )
+    return jsonify({
+        'profiles': json.loads(profiles_df.to_json(orient='records')),
+        'lead_times': json.loads(lead_times_df.to_json(orient='records')),
+    })
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5000) 
\ No newline at end of file
+    if FEATURE_STORE_ENABLED:
+        FeatureStoreUpdater().start()
+    if SENSOR_PYRAMID_ENABLED:
+        SensorPyramidUpdater().start()
+    if kpi_warmer is not None:
+        kpi_warmer.start()
+    if ANOMALY_DETECTION_ENABLED:
+        start_streaming_detection(get_sensor_buffer())
+    # threaded=True : chaque flux SSE ouvert occupe un thread
+    app.run(debug=True, port=5000, threaded=True)
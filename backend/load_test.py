@@ -0,0 +1,279 @@
+import argparse
+import http.client
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from urllib.parse import urlencode, urlsplit
+import numpy as np
+
+# Harnais de charge de l'API du tableau de bord.
+# Chaque utilisateur virtuel reproduit le parcours de App.js : métadonnées au chargement, puis à chaque
+# changement de filtre (période, équipement, capteur) les appels séquentiels /kpis, /downtime-pareto et,
+# si un équipement est sélectionné, /sensor-data (07:00-17:00 du jour de début). Un appel en erreur
+# interrompt la séquence, comme fetchData. Les paliers de concurrence (--users 1,10,50) sont joués
+# l'un après l'autre pour repérer où la latence p99 décroche.
+#
+# Prérequis : base locale alimentée par le simulateur (python data_processing/simulate_data.py) et
+# serveur démarré (python backend/app.py). Exemple :
+#     python backend/load_test.py --users 1,10,25,50 --duration 60
+
+DEFAULT_BASE_URL = 'http://127.0.0.1:5000/api'
+SENSOR_TYPES = ['Temperature_Motor', 'Vibration_Bearing', 'Pressure_Hydraulic', 'Current_Consumption']
+# Durées de période choisies dans le sélecteur de dates (jours) et leurs poids
+RANGE_DAYS = [1, 7, 31, 90]
+RANGE_WEIGHTS = [0.3, 0.3, 0.3, 0.1]
+# Filtre modifié à chaque interaction : période, équipement, type de capteur
+FILTER_CHANGES = ['dates', 'equipment', 'sensor']
+FILTER_WEIGHTS = [0.6, 0.3, 0.1]
+
+
+class Recorder:
+    """Latences, statuts et erreurs par endpoint, pour un palier."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    def record(self, endpoint, latency, status, error=False):
+        with self.lock:
+            self.latencies[endpoint].append(latency)
+            self.statuses[endpoint][status] += 1
+            if error:
+                self.errors[endpoint] += 1
+
+
+class VirtualUser(threading.Thread):
+    """Un onglet du tableau de bord : une connexion HTTP persistante et un état de filtres."""
+
+    def __init__(self, base_url, recorder, stop_event, rng, data_start, data_end, think_time, timeout):
+        super().__init__(daemon=True)
+        parts = urlsplit(base_url)
+        self.host, self.port, self.prefix = parts.hostname, parts.port or 80, parts.path.rstrip('/')
+        self.recorder = recorder
+        self.stop_event = stop_event
+        self.rng = rng
+        self.data_start, self.data_end = data_start, data_end
+        self.think_time = think_time
+        self.timeout = timeout
+        self.conn = None
+        self.equipment_ids = []
+        # Filtres par défaut de App.js
+        self.start_date, self.end_date = datetime(2023, 1, 1), datetime(2023, 2, 1)
+        self.equipment_id = ''
+        self.sensor_type = SENSOR_TYPES[0]
+
+    def get(self, endpoint, params=None):
+        """GET {prefix}{endpoint} ; retourne le JSON ou None en cas d'erreur (enregistrée)."""
+        path = self.prefix + endpoint + ('?' + urlencode(params) if params else '')
+        started = time.perf_counter()
+        try:
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            self.conn.request('GET', path)
+            response = self.conn.getresponse()
+            body = response.read()
+            latency = time.perf_counter() - started
+            ok = 200 <= response.status < 300
+            self.recorder.record(endpoint, latency, response.status, error=not ok)
+            return json.loads(body) if ok else None
+        except Exception as e:
+            self.recorder.record(endpoint, time.perf_counter() - started, type(e).__name__, error=True)
+            self.conn = None # Connexion reprise à l'appel suivant
+            return None
+
+    def load_page(self):
+        metadata = self.get('/metadata')
+        if metadata is not None:
+            self.equipment_ids = [eq['equipment_id'] for eq in metadata['equipments']]
+
+    def change_filter(self):
+        change = self.rng.choices(FILTER_CHANGES, FILTER_WEIGHTS)[0]
+        if change == 'sensor' and not self.equipment_id:
+            change = 'equipment'
+        if change == 'dates':
+            days = self.rng.choices(RANGE_DAYS, RANGE_WEIGHTS)[0]
+            latest_start = max((self.data_end - self.data_start).days - days, 0)
+            self.start_date = self.data_start + timedelta(days=self.rng.randint(0, latest_start))
+            self.end_date = self.start_date + timedelta(days=days)
+        elif change == 'equipment':
+            self.equipment_id = self.rng.choice([''] + self.equipment_ids)
+        else:
+            self.sensor_type = self.rng.choice(SENSOR_TYPES)
+
+    def fetch_data(self):
+        """Séquence de fetchData (App.js)."""
+        params = {'start_date': self.start_date.strftime('%Y-%m-%d'), 'end_date': self.end_date.strftime('%Y-%m-%d')}
+        if self.equipment_id:
+            params['equipment_id'] = self.equipment_id
+        if self.get('/kpis', params) is None or self.get('/downtime-pareto', {**params, 'top_n': 8}) is None:
+            return
+        if self.equipment_id:
+            day = self.start_date.replace(hour=0, minute=0, second=0)
+            self.get('/sensor-data', {
+                'start_date': (day + timedelta(hours=7)).strftime('%Y-%m-%d %H:%M:%S'),
+                'end_date': (day + timedelta(hours=17)).strftime('%Y-%m-%d %H:%M:%S'),
+                'equipment_id': self.equipment_id,
+                'sensor_type': self.sensor_type,
+            })
+
+    def run(self):
+        self.load_page()
+        self.fetch_data()
+        while not self.stop_event.is_set():
+            # Temps de réflexion entre deux interactions (loi exponentielle)
+            if self.stop_event.wait(self.rng.expovariate(1 / self.think_time) if self.think_time > 0 else 0):
+                break
+            self.change_filter()
+            self.fetch_data()
+        if self.conn is not None:
+            self.conn.close()
+
+
+class DbConnectionSampler(threading.Thread):
+    """Échantillonne le nombre de connexions ouvertes sur la base (pg_stat_activity)."""
+
+    def __init__(self, stop_event, interval=0.5):
+        super().__init__(daemon=True)
+        self.stop_event = stop_event
+        self.interval = interval
+        self.samples = []
+
+    def run(self):
+        from data_processing.db_connection import get_db_connection
+        conn = get_db_connection()
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cursor:
+                while not self.stop_event.is_set():
+                    # La connexion d'échantillonnage elle-même est exclue
+                    cursor.execute("SELECT COUNT(*) FROM pg_stat_activity WHERE datname = current_database() AND pid <> pg_backend_pid()")
+                    self.samples.append(cursor.fetchone()[0])
+                    self.stop_event.wait(self.interval)
+        finally:
+            conn.close()
+
+
+def fetch_server_metrics(base_url, timeout):
+    """Compteurs de /api/metrics (connexions ouvertes par endpoint), ou {} si indisponibles."""
+    parts = urlsplit(base_url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=timeout)
+    try:
+        conn.request('GET', parts.path.rstrip('/') + '/metrics')
+        response = conn.getresponse()
+        return json.loads(response.read()) if response.status == 200 else {}
+    except Exception:
+        return {}
+    finally:
+        conn.close()
+
+
+def run_stage(users, args, seed):
+    """Joue un palier de `users` utilisateurs pendant args.duration secondes. Retourne le rapport."""
+    recorder = Recorder()
+    stop_event = threading.Event()
+    metrics_before = fetch_server_metrics(args.base_url, args.timeout)
+    sampler = None
+    if args.sample_db:
+        sampler = DbConnectionSampler(stop_event)
+        sampler.start()
+
+    data_start, data_end = datetime.fromisoformat(args.data_start), datetime.fromisoformat(args.data_end)
+    threads = []
+    started = time.perf_counter()
+    for i in range(users):
+        user = VirtualUser(args.base_url, recorder, stop_event, random.Random(seed + i),
+                           data_start, data_end, args.think_time, args.timeout)
+        user.start()
+        threads.append(user)
+        if args.ramp_up > 0:
+            time.sleep(args.ramp_up / users)
+    stop_event.wait(max(args.duration - (time.perf_counter() - started), 0))
+    stop_event.set()
+    for user in threads:
+        user.join(args.timeout)
+    elapsed = time.perf_counter() - started
+    metrics_after = fetch_server_metrics(args.base_url, args.timeout)
+
+    connections_before = metrics_before.get('db_connections', {})
+    connections_after = metrics_after.get('db_connections', {})
+    endpoints = {}
+    for endpoint, latencies in sorted(recorder.latencies.items()):
+        latencies_ms = np.array(latencies) * 1000
+        opened = connections_after.get('/api' + endpoint, 0) - connections_before.get('/api' + endpoint, 0)
+        endpoints[endpoint] = {
+            'requests': len(latencies),
+            'throughput_rps': len(latencies) / elapsed,
+            'error_rate': recorder.errors[endpoint] / len(latencies),
+            'p50_ms': float(np.percentile(latencies_ms, 50)),
+            'p95_ms': float(np.percentile(latencies_ms, 95)),
+            'p99_ms': float(np.percentile(latencies_ms, 99)),
+            'max_ms': float(latencies_ms.max()),
+            'db_connections_per_request': opened / len(latencies) if connections_after else None,
+            'statuses': {str(status): count for status, count in recorder.statuses[endpoint].items()},
+        }
+    all_latencies_ms = np.concatenate([np.array(l) * 1000 for l in recorder.latencies.values()]) if recorder.latencies else np.array([0.0])
+    total_requests = sum(e['requests'] for e in endpoints.values())
+    return {
+        'users': users,
+        'duration_s': elapsed,
+        'requests': total_requests,
+        'throughput_rps': total_requests / elapsed,
+        'error_rate': sum(recorder.errors.values()) / total_requests if total_requests else 0.0,
+        'p50_ms': float(np.percentile(all_latencies_ms, 50)),
+        'p95_ms': float(np.percentile(all_latencies_ms, 95)),
+        'p99_ms': float(np.percentile(all_latencies_ms, 99)),
+        'db_connections_peak': max(sampler.samples) if sampler and sampler.samples else None,
+        'db_connections_mean': float(np.mean(sampler.samples)) if sampler and sampler.samples else None,
+        'endpoints': endpoints,
+    }
+
+
+def print_report(report):
+    print(f"\n=== {report['users']} utilisateurs, {report['duration_s']:.0f} s : {report['requests']} requêtes, "
+          f"{report['throughput_rps']:.1f} req/s, erreurs {report['error_rate']:.1%}, "
+          f"p50/p95/p99 {report['p50_ms']:.0f}/{report['p95_ms']:.0f}/{report['p99_ms']:.0f} ms")
+    if report['db_connections_peak'] is not None:
+        print(f"Connexions base : pic {report['db_connections_peak']}, moyenne {report['db_connections_mean']:.1f}")
+    print(f"{'endpoint':<20}{'req':>7}{'req/s':>8}{'err':>8}{'p50':>8}{'p95':>8}{'p99':>8}{'max':>8}{'cnx/req':>9}")
+    for endpoint, stats in report['endpoints'].items():
+        per_request = stats['db_connections_per_request']
+        print(f"{endpoint:<20}{stats['requests']:>7}{stats['throughput_rps']:>8.1f}{stats['error_rate']:>8.1%}"
+              f"{stats['p50_ms']:>8.0f}{stats['p95_ms']:>8.0f}{stats['p99_ms']:>8.0f}{stats['max_ms']:>8.0f}"
+              f"{per_request if per_request is not None else float('nan'):>9.2f}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Charge réaliste sur l'API du tableau de bord.")
+    parser.add_argument('--base-url', default=DEFAULT_BASE_URL)
+    parser.add_argument('--users', default='10', help="Paliers de concurrence, ex. 1,10,50")
+    parser.add_argument('--duration', type=float, default=60, help="Durée de chaque palier (s)")
+    parser.add_argument('--ramp-up', type=float, default=5, help="Démarrage progressif des utilisateurs (s)")
+    parser.add_argument('--think-time', type=float, default=2.0, help="Temps moyen entre deux changements de filtre (s)")
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--data-start', default='2023-01-01', help="Début des données simulées")
+    parser.add_argument('--data-end', default='2023-12-31', help="Fin des données simulées")
+    parser.add_argument('--no-db-sampling', dest='sample_db', action='store_false',
+                        help="Ne pas échantillonner pg_stat_activity (base inaccessible depuis le client)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Rapport JSON")
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    import os
+    import sys
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+    args = parse_args()
+    reports = []
+    for users in [int(u) for u in args.users.split(',')]:
+        report = run_stage(users, args, args.seed)
+        print_report(report)
+        reports.append(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(reports, f, indent=2)
@@ -0,0 +1,256 @@
+import os
+import math
+import time
+import threading
+from contextlib import contextmanager
+import pandas as pd
+from data_processing.db_connection import get_db_connection, get_statement_timeout, set_statement_timeout
+from data_processing.metadata_registry import get_metadata_registry
+from data_processing.sensor_layout import WIDE_TABLE, active_sensor_table
+from data_processing.sensor_pyramid import SENSOR_PYRAMID_LEVELS
+
+# Contrôle d'admission des requêtes lourdes de l'API.
+# Rien n'empêchait un client de demander /api/sensor-data pour tous les équipements et capteurs sur un an,
+# ou des KPIs de toute l'usine sur plusieurs années : une seule requête occupait la base et un worker
+# pendant des minutes. Avant d'exécuter une requête, on estime le nombre de lignes lues à partir des
+# statistiques de chaque table (pg_class.reltuples et bornes de la colonne de temps, relues toutes les
+# ADMISSION_STATS_TTL_SECONDS) en supposant une densité uniforme dans le temps :
+#   - au-delà de ADMISSION_MAX_ROWS, la requête est refusée (422) ou, pour les capteurs, servie depuis
+#     le niveau de la pyramide qui tient dans le budget ;
+#   - au-delà de ADMISSION_HEAVY_ROWS, elle attend l'une des ADMISSION_HEAVY_CONCURRENCY places
+#     « lourdes » (503 + Retry-After après ADMISSION_QUEUE_TIMEOUT_SECONDS), pour que les requêtes
+#     légères gardent une latence basse ;
+#   - chaque connexion ouverte pour une requête reçoit un statement_timeout (plus long pour les lourdes).
+# Sans statistiques (erreur de lecture), la requête est admise comme légère.
+
+ADMISSION_CONTROL_ENABLED = os.getenv("ADMISSION_CONTROL_ENABLED", "1") == "1"
+ADMISSION_MAX_ROWS = int(os.getenv("ADMISSION_MAX_ROWS", "5000000"))
+ADMISSION_HEAVY_ROWS = int(os.getenv("ADMISSION_HEAVY_ROWS", "500000"))
+ADMISSION_HEAVY_CONCURRENCY = int(os.getenv("ADMISSION_HEAVY_CONCURRENCY", "2"))
+ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", "10"))
+ADMISSION_STATEMENT_TIMEOUT_MS = int(os.getenv("ADMISSION_STATEMENT_TIMEOUT_MS", "30000"))
+ADMISSION_HEAVY_STATEMENT_TIMEOUT_MS = int(os.getenv("ADMISSION_HEAVY_STATEMENT_TIMEOUT_MS", "300000"))
+ADMISSION_STATS_TTL_SECONDS = float(os.getenv("ADMISSION_STATS_TTL_SECONDS", "300"))
+
+# Colonne de temps de chaque table estimée
+TIME_COLUMNS = {
+    'production_output': 'timestamp',
+    'downtime_logs': 'start_time',
+    'sensor_readings': 'timestamp',
+    WIDE_TABLE: 'timestamp',
+}
+
+
+class QueryBudgetExceeded(Exception):
+    """Estimation au-delà de ADMISSION_MAX_ROWS."""
+
+    def __init__(self, estimated_rows, max_rows):
+        super().__init__(f"Requête trop coûteuse : ~{int(estimated_rows)} lignes estimées (maximum {max_rows}). "
+                         f"Réduire la période ou filtrer par équipement / capteur.")
+        self.estimated_rows = int(estimated_rows)
+        self.max_rows = max_rows
+
+
+class AdmissionQueueTimeout(Exception):
+    """Aucune place lourde libérée dans le délai d'attente."""
+
+    def __init__(self, retry_after):
+        super().__init__("Trop de requêtes lourdes en cours, réessayer plus tard.")
+        self.retry_after = max(math.ceil(retry_after), 1)
+
+
+class AdmissionController:
+    """Estimation du coût des requêtes, budget et file d'attente des requêtes lourdes."""
+
+    def __init__(self, max_rows=ADMISSION_MAX_ROWS, heavy_rows=ADMISSION_HEAVY_ROWS,
+                 heavy_concurrency=ADMISSION_HEAVY_CONCURRENCY, queue_timeout=ADMISSION_QUEUE_TIMEOUT_SECONDS,
+                 stats_ttl=ADMISSION_STATS_TTL_SECONDS):
+        self.max_rows = max_rows
+        self.heavy_rows = heavy_rows
+        self.heavy_concurrency = heavy_concurrency
+        self.queue_timeout = queue_timeout
+        self.stats_ttl = stats_ttl
+        self.heavy_slots = threading.BoundedSemaphore(heavy_concurrency)
+        self.lock = threading.Lock()
+        self.table_stats = {} # table -> (lu à, lignes, premier timestamp, dernier timestamp)
+        self.waiting = 0
+        self.running_heavy = 0
+        self.metrics = {}
+
+    def _count(self, name, field, value=1):
+        counters = self.metrics.setdefault(name, {
+            'admitted': 0, 'heavy': 0, 'rejected': 0, 'downsampled': 0, 'queue_timeouts': 0,
+            'queue_wait_seconds': 0.0, 'max_estimated_rows': 0,
+        })
+        if field == 'max_estimated_rows':
+            counters[field] = max(counters[field], int(value))
+        else:
+            counters[field] += value
+
+    # --- Statistiques ---
+
+    def _read_table_stats(self, table):
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                # reltuples : estimation maintenue par ANALYZE / autovacuum, sans parcours de la table
+                cursor.execute("SELECT GREATEST(reltuples, 0)::bigint FROM pg_class WHERE relname = %s", (table,))
+                row = cursor.fetchone()
+                # MIN / MAX sur la colonne indexée : deux lectures d'index
+                time_column = TIME_COLUMNS[table]
+                cursor.execute(f"SELECT MIN({time_column}), MAX({time_column}) FROM {table}")
+                first, last = cursor.fetchone()
+            return (row[0] if row else 0), first, last
+        finally:
+            conn.close()
+
+    def table_stats_for(self, table):
+        """(lignes, premier timestamp, dernier timestamp) de table, relus au plus toutes les stats_ttl secondes."""
+        with self.lock:
+            cached = self.table_stats.get(table)
+        if cached is not None and time.monotonic() - cached[0] < self.stats_ttl:
+            return cached[1:]
+        rows, first, last = self._read_table_stats(table)
+        with self.lock:
+            self.table_stats[table] = (time.monotonic(), rows, first, last)
+        return rows, first, last
+
+    def _scope_counts(self, equipment_id=None, sensor_type=None):
+        """(équipements demandés, équipements connus, capteurs demandés, capteurs connus)."""
+        registry = get_metadata_registry()
+        total_equipments = max(len(registry.get_equipments()), 1)
+        total_sensors = max(len(registry.get_sensors()), 1)
+        return (1 if equipment_id else total_equipments), total_equipments, (1 if sensor_type else total_sensors), total_sensors
+
+    # --- Estimations ---
+
+    def estimate_rows(self, table, start_time, end_time, equipment_id=None, sensor_type=None):
+        """
+        Lignes lues par une requête sur table entre start_time et end_time (densité uniforme entre le
+        premier et le dernier timestamp de la table). Pour la table large des capteurs, compte une valeur
+        par capteur demandé, comme la forme longue renvoyée.
+        """
+        rows, first, last = self.table_stats_for(table)
+        if not rows or first is None or last is None:
+            return 0
+        first, last = pd.Timestamp(first), pd.Timestamp(last)
+        start = max(pd.Timestamp(start_time), first) if start_time is not None else first
+        end = min(pd.Timestamp(end_time), last) if end_time is not None else last
+        if end < start:
+            return 0
+        span_seconds = max((last - first).total_seconds(), 1)
+        estimate = rows * min(max((end - start).total_seconds(), 1) / span_seconds, 1)
+
+        num_equipments, total_equipments, num_sensors, total_sensors = self._scope_counts(equipment_id, sensor_type)
+        estimate *= num_equipments / total_equipments
+        if table == WIDE_TABLE:
+            estimate *= num_sensors # Une ligne par (timestamp, équipement), une valeur par capteur
+        elif table == 'sensor_readings':
+            estimate *= num_sensors / total_sensors
+        return int(estimate)
+
+    def estimate_sensor_rows(self, start_time, end_time, equipment_id=None, sensor_type=None, level=None):
+        """Lignes lues pour /api/sensor-data : relevés bruts (level=None) ou tranches d'un niveau de la pyramide."""
+        if level is None:
+            return self.estimate_rows(active_sensor_table(), start_time, end_time, equipment_id, sensor_type)
+        window_minutes = (pd.Timestamp(end_time) - pd.Timestamp(start_time)).total_seconds() / 60
+        num_equipments, _, num_sensors, _ = self._scope_counts(equipment_id, sensor_type)
+        return int(window_minutes / SENSOR_PYRAMID_LEVELS[level]) * num_equipments * num_sensors
+
+    def estimate_kpi_rows(self, start_time, end_time, equipment_id=None):
+        """Lignes lues pour un calcul de KPIs : arrêts et production de la période."""
+        return (self.estimate_rows('downtime_logs', start_time, end_time, equipment_id)
+                + self.estimate_rows('production_output', start_time, end_time, equipment_id))
+
+    def sensor_level_within_budget(self, start_time, end_time, equipment_id=None, sensor_type=None):
+        """Niveau le plus fin de la pyramide dont la lecture tient dans le budget (None si aucun)."""
+        for level in SENSOR_PYRAMID_LEVELS:
+            if self.estimate_sensor_rows(start_time, end_time, equipment_id, sensor_type, level) <= self.max_rows:
+                return level
+        return None
+
+    def safe_estimate(self, estimate):
+        """estimate() ; None si les statistiques sont indisponibles (la requête est alors admise)."""
+        try:
+            return estimate()
+        except Exception as e:
+            print(f"Erreur lors de l'estimation du coût de la requête : {e}")
+            return None
+
+    # --- Admission ---
+
+    def check_budget(self, name, estimated_rows):
+        """Lève QueryBudgetExceeded si estimated_rows dépasse le budget."""
+        if estimated_rows is None:
+            return
+        with self.lock:
+            self._count(name, 'max_estimated_rows', estimated_rows)
+            if estimated_rows > self.max_rows:
+                self._count(name, 'rejected')
+                raise QueryBudgetExceeded(estimated_rows, self.max_rows)
+
+    def record_downsampled(self, name):
+        with self.lock:
+            self._count(name, 'downsampled')
+
+    @contextmanager
+    def admit(self, name, estimated_rows):
+        """
+        Exécution d'une requête déjà passée par check_budget. Une requête lourde attend une place
+        (AdmissionQueueTimeout au-delà de queue_timeout) et reçoit le statement_timeout long.
+        """
+        heavy = estimated_rows is not None and estimated_rows >= self.heavy_rows
+        if not heavy:
+            with self.lock:
+                self._count(name, 'admitted')
+            yield
+            return
+
+        with self.lock:
+            self.waiting += 1
+        queued_at = time.monotonic()
+        acquired = self.heavy_slots.acquire(timeout=self.queue_timeout)
+        with self.lock:
+            self.waiting -= 1
+            self._count(name, 'queue_wait_seconds', time.monotonic() - queued_at)
+            if not acquired:
+                self._count(name, 'queue_timeouts')
+            else:
+                self._count(name, 'admitted')
+                self._count(name, 'heavy')
+                self.running_heavy += 1
+        if not acquired:
+            raise AdmissionQueueTimeout(self.queue_timeout)
+
+        previous_timeout = get_statement_timeout()
+        set_statement_timeout(ADMISSION_HEAVY_STATEMENT_TIMEOUT_MS)
+        try:
+            yield
+        finally:
+            set_statement_timeout(previous_timeout)
+            with self.lock:
+                self.running_heavy -= 1
+            self.heavy_slots.release()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'max_rows': self.max_rows,
+                'heavy_rows': self.heavy_rows,
+                'heavy_concurrency': self.heavy_concurrency,
+                'running_heavy': self.running_heavy,
+                'waiting': self.waiting,
+                'endpoints': {name: dict(counters) for name, counters in self.metrics.items()},
+            }
+
+
+_admission_controller = None
+_admission_controller_lock = threading.Lock()
+
+
+def get_admission_controller():
+    global _admission_controller
+    with _admission_controller_lock:
+        if _admission_controller is None:
+            _admission_controller = AdmissionController()
+        return _admission_controller
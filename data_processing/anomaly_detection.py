@@ -0,0 +1,369 @@
+from collections import deque
+import numpy as np
+import pandas as pd
+from psycopg2.extras import execute_values
+from data_processing.db_connection import get_db_connection
+from data_processing.kpi_calculator import PLANNED_DOWNTIME_CATEGORIES, get_sensor_data, get_downtime_data, get_equipments_data
+
+# Détection d'anomalies en ligne sur les relevés de capteurs.
+# Trois détecteurs à mémoire constante par série (equipment_id, sensor_type) :
+#   - ewma   : écart à la moyenne mobile exponentielle, normalisé par l'écart-type exponentiel
+#   - zscore : z-score par rapport à une fenêtre glissante de taille fixe
+#   - cusum  : CUSUM bilatéral sur le z-score EWMA (dérives lentes, ex. tendances avant panne)
+# Deux modes aux résultats identiques : batch (vectorisé sur des tableaux entiers, pour le backfill)
+# et incrémental (un relevé à la fois). Une détection est émise au début de chaque épisode d'alerte.
+
+ANOMALY_DETECTOR_PARAMS = {
+    'warmup_readings': 240, # Relevés ignorés en début de série, le temps que les statistiques se stabilisent
+    'ewma_halflife_readings': 240, # 2 h de relevés à 30 s
+    'ewma_threshold': 4.0,
+    'zscore_window_readings': 120, # 1 h de relevés à 30 s
+    'zscore_threshold': 4.0,
+    'cusum_k': 0.5, # Dérive tolérée (en écarts-types) avant accumulation
+    'cusum_h': 10.0, # Seuil de décision
+}
+DETECTORS = ['ewma', 'zscore', 'cusum']
+
+ANOMALY_TABLE = 'sensor_anomalies'
+ANOMALY_COLUMNS = ['equipment_id', 'sensor_type', 'detector', 'detected_at', 'value', 'score', 'direction']
+
+ANOMALY_TABLE_DDL = f"""
+CREATE TABLE IF NOT EXISTS {ANOMALY_TABLE} (
+    anomaly_id SERIAL PRIMARY KEY,
+    equipment_id VARCHAR(50) NOT NULL,
+    sensor_type VARCHAR(50) NOT NULL,
+    detector VARCHAR(20) NOT NULL,
+    detected_at TIMESTAMP NOT NULL,
+    value DOUBLE PRECISION,
+    score DOUBLE PRECISION,
+    direction VARCHAR(4),
+    created_at TIMESTAMP DEFAULT NOW(),
+    UNIQUE (equipment_id, sensor_type, detector, detected_at)
+);
+CREATE INDEX IF NOT EXISTS idx_{ANOMALY_TABLE}_equipment_time ON {ANOMALY_TABLE} (equipment_id, detected_at);
+CREATE INDEX IF NOT EXISTS idx_{ANOMALY_TABLE}_time ON {ANOMALY_TABLE} (detected_at);
+"""
+
+
+def _ewma_alpha(params):
+    return 1 - np.exp(np.log(0.5) / params['ewma_halflife_readings'])
+
+
+def _episode_starts(flags):
+    """Premier relevé de chaque suite de relevés en alerte."""
+    return flags & ~np.r_[False, flags[:-1]]
+
+
+def _cusum(increments):
+    """
+    CUSUM S_t = max(0, S_{t-1} + x_t) vectorisé : S_t = C_t - min(0, min_{j<=t} C_j), C = cumsum(x).
+    """
+    cumulative = np.cumsum(increments)
+    return cumulative - np.minimum(0, np.minimum.accumulate(cumulative))
+
+
+def detect_anomalies_batch(timestamps, values, params=ANOMALY_DETECTOR_PARAMS):
+    """
+    Mode batch : applique les détecteurs à une série entière (triée par temps).
+    Retourne un DataFrame (detector, detected_at, value, score, direction) des débuts d'épisodes.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    timestamps = pd.to_datetime(pd.Series(timestamps)).to_numpy()
+    n = len(values)
+    if n == 0:
+        return pd.DataFrame(columns=['detector', 'detected_at', 'value', 'score', 'direction'])
+    active = np.arange(n) >= params['warmup_readings']
+
+    # EWMA (adjust=False) : m_t = (1-a) m_{t-1} + a x_t ; v_t = (1-a) (v_{t-1} + a (x_t - m_{t-1})^2)
+    alpha = _ewma_alpha(params)
+    ewm = pd.Series(values).ewm(alpha=alpha, adjust=False)
+    ewma_mean = ewm.mean().to_numpy()
+    ewma_var = ewm.var(bias=True).to_numpy()
+    prev_mean, prev_std = np.r_[np.nan, ewma_mean[:-1]], np.sqrt(np.r_[np.nan, ewma_var[:-1]])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ewma_z = np.where(prev_std > 0, (values - prev_mean) / prev_std, 0.0)
+
+    # z-score sur la fenêtre glissante des w relevés précédents
+    window = params['zscore_window_readings']
+    rolling = pd.Series(values).rolling(window)
+    rolling_mean = np.r_[np.nan, rolling.mean().to_numpy()[:-1]]
+    rolling_std = np.r_[np.nan, rolling.std(ddof=0).to_numpy()[:-1]]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rolling_z = np.where(rolling_std > 0, (values - rolling_mean) / rolling_std, 0.0)
+
+    # CUSUM bilatéral sur le z-score EWMA (accumulé seulement après le warm-up)
+    z_active = np.where(active, np.nan_to_num(ewma_z), 0.0)
+    k = params['cusum_k']
+    cusum_up = _cusum(np.where(active, z_active - k, -k))
+    cusum_down = _cusum(np.where(active, -z_active - k, -k))
+
+    results = []
+    for detector, score, threshold in (
+        ('ewma', ewma_z, params['ewma_threshold']),
+        ('zscore', rolling_z, params['zscore_threshold']),
+    ):
+        starts = _episode_starts(active & (np.abs(score) > threshold))
+        idx = np.flatnonzero(starts)
+        results.append(pd.DataFrame({
+            'detector': detector, 'detected_at': timestamps[idx], 'value': values[idx],
+            'score': score[idx], 'direction': np.where(score[idx] > 0, 'up', 'down'),
+        }))
+    for direction, cusum in (('up', cusum_up), ('down', cusum_down)):
+        idx = np.flatnonzero(_episode_starts(active & (cusum > params['cusum_h'])))
+        results.append(pd.DataFrame({
+            'detector': 'cusum', 'detected_at': timestamps[idx], 'value': values[idx],
+            'score': cusum[idx], 'direction': direction,
+        }))
+    return pd.concat(results, ignore_index=True).sort_values(['detected_at', 'detector'], kind='stable').reset_index(drop=True)
+
+
+class _SeriesState:
+    """État à mémoire constante d'une série pour le mode incrémental."""
+
+    def __init__(self, params):
+        self.n = 0
+        self.ewma_mean = None
+        self.ewma_var = 0.0
+        self.window = deque(maxlen=params['zscore_window_readings'])
+        self.window_sum = 0.0
+        self.window_sumsq = 0.0
+        self.cusum_up = 0.0
+        self.cusum_down = 0.0
+        self.in_alarm = {'ewma': False, 'zscore': False, 'cusum_up': False, 'cusum_down': False}
+
+
+class StreamingAnomalyDetector:
+    """Mode incrémental : update() traite un relevé en O(1) et retourne les détections émises."""
+
+    def __init__(self, params=ANOMALY_DETECTOR_PARAMS):
+        self.params = params
+        self.alpha = _ewma_alpha(params)
+        self.states = {}
+
+    def update(self, equipment_id, sensor_type, timestamp, value):
+        params = self.params
+        state = self.states.setdefault((equipment_id, sensor_type), _SeriesState(params))
+        active = state.n >= params['warmup_readings']
+        detections = []
+
+        def emit(key, detector, flagged, score, direction):
+            if flagged and not state.in_alarm[key]:
+                detections.append({
+                    'equipment_id': equipment_id, 'sensor_type': sensor_type, 'detector': detector,
+                    'detected_at': timestamp, 'value': value, 'score': score, 'direction': direction,
+                })
+            state.in_alarm[key] = flagged
+
+        # EWMA : z-score par rapport aux statistiques AVANT ce relevé
+        if state.ewma_mean is None:
+            ewma_z = 0.0
+            state.ewma_mean = value
+        else:
+            prev_std = np.sqrt(state.ewma_var)
+            ewma_z = (value - state.ewma_mean) / prev_std if prev_std > 0 else 0.0
+            delta = value - state.ewma_mean
+            state.ewma_mean += self.alpha * delta
+            state.ewma_var = (1 - self.alpha) * (state.ewma_var + self.alpha * delta * delta)
+
+        # z-score sur fenêtre glissante (fenêtre pleine uniquement, comme pandas rolling)
+        rolling_z = 0.0
+        if len(state.window) == state.window.maxlen:
+            mean = state.window_sum / len(state.window)
+            std = np.sqrt(max(0.0, state.window_sumsq / len(state.window) - mean * mean))
+            rolling_z = (value - mean) / std if std > 0 else 0.0
+            oldest = state.window[0]
+            state.window_sum -= oldest
+            state.window_sumsq -= oldest * oldest
+        state.window.append(value)
+        state.window_sum += value
+        state.window_sumsq += value * value
+
+        z_active = ewma_z if active else 0.0
+        state.cusum_up = max(0.0, state.cusum_up + (z_active - params['cusum_k'] if active else -params['cusum_k']))
+        state.cusum_down = max(0.0, state.cusum_down + (-z_active - params['cusum_k'] if active else -params['cusum_k']))
+
+        emit('ewma', 'ewma', active and abs(ewma_z) > params['ewma_threshold'], ewma_z, 'up' if ewma_z > 0 else 'down')
+        emit('zscore', 'zscore', active and abs(rolling_z) > params['zscore_threshold'], rolling_z, 'up' if rolling_z > 0 else 'down')
+        emit('cusum_up', 'cusum', active and state.cusum_up > params['cusum_h'], state.cusum_up, 'up')
+        emit('cusum_down', 'cusum', active and state.cusum_down > params['cusum_h'], state.cusum_down, 'down')
+
+        state.n += 1
+        return detections
+
+    def process_readings(self, readings_df):
+        """Traite des relevés (timestamp, equipment_id, sensor_type, value) dans l'ordre chronologique."""
+        detections = []
+        for row in readings_df.sort_values('timestamp', kind='stable').itertuples(index=False):
+            detections.extend(self.update(row.equipment_id, row.sensor_type, row.timestamp, row.value))
+        return pd.DataFrame(detections, columns=ANOMALY_COLUMNS)
+
+
+# --- Persistance ---
+
+def ensure_anomaly_table():
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(ANOMALY_TABLE_DDL)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def save_anomalies(anomalies_df):
+    """Insère les détections (les doublons d'un backfill relancé sont ignorés)."""
+    if anomalies_df.empty:
+        return 0
+    rows = [tuple(row) for row in anomalies_df[ANOMALY_COLUMNS].itertuples(index=False)]
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            execute_values(
+                cursor,
+                f"INSERT INTO {ANOMALY_TABLE} ({', '.join(ANOMALY_COLUMNS)}) VALUES %s "
+                "ON CONFLICT (equipment_id, sensor_type, detector, detected_at) DO NOTHING",
+                rows
+            )
+        conn.commit()
+    finally:
+        conn.close()
+    return len(rows)
+
+
+def backfill_anomalies(start_time, end_time, equipment_ids, params=ANOMALY_DETECTOR_PARAMS):
+    """
+    Mode batch : rejoue les détecteurs sur sensor_readings pour une période, un équipement à la fois
+    (la mémoire reste bornée par un équipement), et enregistre les détections.
+    """
+    ensure_anomaly_table()
+    total = 0
+    for equipment_id in equipment_ids:
+        readings_df = get_sensor_data(start_time, end_time, equipment_id)
+        if readings_df.empty:
+            continue
+        detections = []
+        for sensor_type, series_df in readings_df.groupby('sensor_type', sort=False, observed=True):
+            found = detect_anomalies_batch(series_df['timestamp'], series_df['value'], params)
+            found.insert(0, 'sensor_type', sensor_type)
+            found.insert(0, 'equipment_id', equipment_id)
+            detections.append(found)
+        total += save_anomalies(pd.concat(detections, ignore_index=True))
+        print(f"Backfill des anomalies : {equipment_id} traité.")
+    return total
+
+
+def get_anomalies(start_time=None, end_time=None, equipment_id=None, sensor_type=None, detector=None):
+    """Récupère les détections enregistrées, éventuellement filtrées."""
+    conn = get_db_connection()
+    if conn:
+        try:
+            query = f"SELECT {', '.join(ANOMALY_COLUMNS)} FROM {ANOMALY_TABLE}"
+            conditions = []
+            params = {}
+            for column, operator, value in (
+                ('detected_at', '>=', start_time), ('detected_at', '<', end_time),
+                ('equipment_id', '=', equipment_id), ('sensor_type', '=', sensor_type), ('detector', '=', detector),
+            ):
+                if value is not None:
+                    key = f"{column}_{len(params)}"
+                    conditions.append(f"{column} {operator} %({key})s")
+                    params[key] = value
+            if conditions:
+                query += " WHERE " + " AND ".join(conditions)
+            query += " ORDER BY detected_at"
+
+            df = pd.read_sql(query, conn, params=params)
+            df['detected_at'] = pd.to_datetime(df['detected_at'])
+            return df
+        except Exception as e:
+            print(f"Erreur lors de la récupération des anomalies : {e}")
+            return pd.DataFrame(columns=ANOMALY_COLUMNS)
+        finally:
+            conn.close()
+    return pd.DataFrame(columns=ANOMALY_COLUMNS)
+
+
+_streaming_detector = None
+
+
+def start_streaming_detection(sensor_buffer):
+    """
+    Mode incrémental en production : chaque lot de relevés reçu par le tampon de capteurs passe
+    dans le détecteur, et les détections sont enregistrées au fil de l'eau.
+    """
+    global _streaming_detector
+    if _streaming_detector is not None:
+        return _streaming_detector
+    ensure_anomaly_table()
+    _streaming_detector = StreamingAnomalyDetector()
+
+    def on_readings(readings_df):
+        save_anomalies(_streaming_detector.process_readings(readings_df))
+
+    sensor_buffer.add_listener(on_readings)
+    return _streaming_detector
+
+
+# --- Délai d'anticipation ---
+
+def calculate_detection_lead_times(anomalies_df, downtimes_df, lookback_hours=24):
+    """
+    Pour chaque arrêt imprévu, première détection sur le même équipement dans les lookback_hours
+    précédant le début de l'arrêt, et délai d'anticipation (lead time) correspondant.
+    """
+    unplanned = downtimes_df[~downtimes_df['downtime_category'].isin(PLANNED_DOWNTIME_CATEGORIES)].copy()
+    unplanned = unplanned[['downtime_id', 'equipment_id', 'downtime_category', 'downtime_reason', 'start_time']]
+    # merge_asof exige des clés de même type des deux côtés (catégories / chaînes, datetime64[ns])
+    unplanned['equipment_id'] = unplanned['equipment_id'].astype(str)
+    unplanned['start_time'] = pd.to_datetime(unplanned['start_time']).astype('datetime64[ns]')
+    unplanned['window_start'] = unplanned['start_time'] - pd.Timedelta(hours=lookback_hours)
+
+    anomalies = anomalies_df[['equipment_id', 'sensor_type', 'detector', 'detected_at']].copy()
+    anomalies['equipment_id'] = anomalies['equipment_id'].astype(str)
+    anomalies['detected_at'] = pd.to_datetime(anomalies['detected_at']).astype('datetime64[ns]')
+
+    # Jointure as-of : première détection à partir du début de la fenêtre d'observation
+    lead_df = pd.merge_asof(
+        unplanned.sort_values('window_start'), anomalies.sort_values('detected_at'),
+        left_on='window_start', right_on='detected_at', by='equipment_id', direction='forward'
+    )
+    detected = lead_df['detected_at'] < lead_df['start_time']
+    lead_df.loc[~detected, ['sensor_type', 'detector', 'detected_at']] = None
+    lead_df['detected'] = detected
+    lead_df['lead_time_hours'] = np.where(detected, (lead_df['start_time'] - lead_df['detected_at']).dt.total_seconds() / 3600, np.nan)
+    return lead_df.drop(columns='window_start').sort_values(['equipment_id', 'start_time']).reset_index(drop=True)
+
+
+def summarize_lead_times(lead_df):
+    """Taux de détection et délais d'anticipation par catégorie / raison d'arrêt."""
+    return lead_df.groupby(['downtime_category', 'downtime_reason'], observed=True).agg(
+        num_downtimes=('downtime_id', 'count'),
+        num_detected=('detected', 'sum'),
+        mean_lead_time_hours=('lead_time_hours', 'mean'),
+        median_lead_time_hours=('lead_time_hours', 'median'),
+    ).reset_index().assign(detection_rate=lambda df: df['num_detected'] / df['num_downtimes'])
+
+
+def get_detection_lead_times(start_time, end_time, equipment_id=None, lookback_hours=24):
+    """Délais d'anticipation pour les arrêts imprévus de la période (détections déjà enregistrées)."""
+    downtimes_df = get_downtime_data(start_time=start_time, end_time=end_time, equipment_id=equipment_id)
+    if downtimes_df.empty:
+        return pd.DataFrame(), pd.DataFrame()
+    downtimes_df = downtimes_df[downtimes_df['start_time'] >= start_time]
+    anomalies_df = get_anomalies(start_time - pd.Timedelta(hours=lookback_hours), end_time, equipment_id)
+    lead_df = calculate_detection_lead_times(anomalies_df, downtimes_df, lookback_hours)
+    return lead_df, summarize_lead_times(lead_df)
+
+
+# Backfill : python -m data_processing.anomaly_detection <début> <fin> [equipment_id ...] (depuis la racine du projet)
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) < 3:
+        sys.exit("Usage : python -m data_processing.anomaly_detection <début> <fin> [equipment_id ...]")
+    backfill_start, backfill_end = pd.Timestamp(sys.argv[1]), pd.Timestamp(sys.argv[2])
+    backfill_equipments = sys.argv[3:]
+    if not backfill_equipments:
+        equipments_df = get_equipments_data()
+        backfill_equipments = equipments_df['equipment_id'].tolist() if 'equipment_id' in equipments_df else []
+    saved = backfill_anomalies(backfill_start.to_pydatetime(), backfill_end.to_pydatetime(), backfill_equipments)
+    print(f"Backfill des anomalies terminé : {saved} détections enregistrées ({len(backfill_equipments)} équipements).")
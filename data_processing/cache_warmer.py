@@ -0,0 +1,322 @@
+import json
+import os
+import time
+import threading
+from collections import Counter, OrderedDict
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from data_processing.db_connection import get_db_connection
+from data_processing.table_versions import get_table_versions
+
+# Préchauffage des résultats de /api/kpis.
+# Chaque requête est comptée dans un journal d'accès (période, équipement, niveau d'agrégation).
+# Une tâche de fond surveille le watermark d'ingestion (derniers timestamps de production et
+# d'arrêts) ; à chaque avancée, elle recalcule dans un budget de temps et de workers les fenêtres
+# les plus demandées ainsi que « aujourd'hui », « cette semaine », « ce mois » et les périodes par
+# défaut du tableau de bord, pour tous les filtres d'équipement, et stocke le JSON prêt à servir.
+# Validité : un résultat garde l'instantané pris AVANT son calcul (repère table_versions et numéro
+# d'écriture locale). Il est périmé dès qu'un autre écrivain modifie les tables, et les lignes écrites
+# par le tampon d'ingestion de ce processus suppriment les résultats dont la période et l'équipement
+# les recouvrent, y compris un calcul en cours commencé avant l'écriture.
+
+WARMED_TABLES = ('production_output', 'downtime_logs')
+# Écritures locales récentes retenues pour vérifier les calculs en cours
+KPI_WARM_RECENT_WRITES = 256
+
+KPI_WARMER_ENABLED = os.getenv("KPI_WARMER_ENABLED", "0") == "1"
+KPI_WARM_INTERVAL_SECONDS = float(os.getenv("KPI_WARM_INTERVAL_SECONDS", "30"))
+KPI_WARM_TIME_BUDGET_SECONDS = float(os.getenv("KPI_WARM_TIME_BUDGET_SECONDS", "60"))
+KPI_WARM_WORKERS = int(os.getenv("KPI_WARM_WORKERS", "2"))
+# Nombre de combinaisons (période, équipement, niveau) du journal d'accès préchauffées à chaque cycle
+KPI_WARM_TOP_N = int(os.getenv("KPI_WARM_TOP_N", "20"))
+# Périodes par défaut du tableau de bord, « début:fin » séparées par des virgules (App.js : 1er janv. - 1er févr. 2023)
+KPI_WARM_DEFAULT_RANGES = os.getenv("KPI_WARM_DEFAULT_RANGES", "2023-01-01:2023-02-01")
+# Journal d'accès persistant (JSON lines) ; vide : en mémoire seulement
+KPI_ACCESS_LOG_PATH = os.getenv("KPI_ACCESS_LOG_PATH", "")
+# Clés gardées par le journal d'accès et demi-vie des compteurs
+KPI_ACCESS_LOG_MAX_KEYS = int(os.getenv("KPI_ACCESS_LOG_MAX_KEYS", "1000"))
+KPI_ACCESS_LOG_HALF_LIFE_HOURS = float(os.getenv("KPI_ACCESS_LOG_HALF_LIFE_HOURS", "24"))
+_ACCESS_MIN_COUNT = 0.05 # Compteur décru en dessous : clé oubliée
+KPI_RESULT_CACHE_SIZE = int(os.getenv("KPI_RESULT_CACHE_SIZE", "256"))
+
+
+def kpi_request_key(start_time, end_time, equipment_id=None, group_by='equipment'):
+    """Clé normalisée d'une requête /api/kpis."""
+    return (pd.Timestamp(start_time).isoformat(), pd.Timestamp(end_time).isoformat(), equipment_id or None, group_by)
+
+
+def get_ingestion_watermark():
+    """Derniers timestamps ingérés : (production, début d'arrêt, fin d'arrêt). Change dès qu'une ligne arrive."""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT (SELECT MAX(timestamp) FROM production_output), "
+                "(SELECT MAX(start_time) FROM downtime_logs), (SELECT MAX(end_time) FROM downtime_logs)"
+            )
+            return tuple(pd.Timestamp(value) if value is not None else None for value in cursor.fetchone())
+    finally:
+        conn.close()
+
+
+def builtin_windows(watermark_time):
+    """Aujourd'hui, cette semaine et ce mois (jour du dernier relevé) puis les périodes par défaut."""
+    today = pd.Timestamp(watermark_time).normalize()
+    tomorrow = today + pd.Timedelta(days=1)
+    windows = [(today, tomorrow), (today - pd.Timedelta(days=today.weekday()), tomorrow), (today.replace(day=1), tomorrow)]
+    for window in filter(None, KPI_WARM_DEFAULT_RANGES.split(',')):
+        start, end = window.split(':')
+        windows.append((pd.Timestamp(start), pd.Timestamp(end)))
+    return windows
+
+
+class KpiAccessLog:
+    """
+    Compte les requêtes /api/kpis par clé normalisée. Les compteurs décroissent de moitié toutes les
+    half_life_hours et seules les max_keys clés les plus demandées sont gardées : la mémoire reste bornée
+    et une période qui n'est plus consultée sort du classement. Les requêtes sont ajoutées au fichier
+    configuré par lots (flush, appelé à chaque cycle du préchauffage) et non à chaque requête ; le
+    fichier est réécrit avec les compteurs courants quand il dépasse 2 x max_keys lignes.
+    """
+
+    def __init__(self, path=KPI_ACCESS_LOG_PATH, max_keys=KPI_ACCESS_LOG_MAX_KEYS, half_life_hours=KPI_ACCESS_LOG_HALF_LIFE_HOURS):
+        self.path = path
+        self.max_keys = max_keys
+        self.half_life_seconds = half_life_hours * 3600
+        self.counts = Counter()
+        self.pending = [] # Clés enregistrées depuis le dernier flush
+        self.lines_written = 0
+        self.decayed_at = time.monotonic()
+        self.lock = threading.Lock()
+        self.file_lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    # Ligne d'une requête ([début, fin, équipement, niveau]) ou d'une compaction ({key, count})
+                    entry = json.loads(line)
+                    if isinstance(entry, dict):
+                        self.counts[tuple(entry['key'])] += entry['count']
+                    else:
+                        self.counts[tuple(entry)] += 1
+                    self.lines_written += 1
+            self._cap()
+
+    def _decay(self):
+        # Appelé sous self.lock : décroissance depuis le dernier appel puis plafond de clés
+        now = time.monotonic()
+        factor = 0.5 ** ((now - self.decayed_at) / self.half_life_seconds) if self.half_life_seconds > 0 else 1.0
+        self.decayed_at = now
+        if factor < 1:
+            self.counts = Counter({key: count * factor for key, count in self.counts.items() if count * factor >= _ACCESS_MIN_COUNT})
+        self._cap()
+
+    def _cap(self):
+        if len(self.counts) > self.max_keys:
+            self.counts = Counter(dict(self.counts.most_common(self.max_keys)))
+
+    def record(self, key):
+        with self.lock:
+            self.counts[key] += 1
+            if len(self.counts) > 2 * self.max_keys:
+                self._decay()
+            if self.path:
+                self.pending.append(key)
+            flush_now = len(self.pending) >= self.max_keys # Préchauffage arrêté : le lot reste borné
+        if flush_now:
+            self.flush()
+
+    def flush(self):
+        """Écrit les requêtes en attente dans le fichier (une seule écriture). Retourne le nombre de lignes ajoutées."""
+        with self.file_lock:
+            with self.lock:
+                pending, self.pending = self.pending, []
+                self._decay()
+                compact = self.lines_written + len(pending) > 2 * self.max_keys
+                counts = list(self.counts.items()) if compact else None
+            if not self.path or (not pending and not compact):
+                return 0
+            try:
+                if compact:
+                    tmp_path = self.path + '.tmp'
+                    with open(tmp_path, 'w') as f:
+                        f.write(''.join(json.dumps({'key': list(key), 'count': count}) + '\n' for key, count in counts))
+                    os.replace(tmp_path, self.path)
+                    self.lines_written = len(counts)
+                else:
+                    with open(self.path, 'a') as f:
+                        f.write(''.join(json.dumps(list(key)) + '\n' for key in pending))
+                    self.lines_written += len(pending)
+            except OSError as e:
+                # Les compteurs en mémoire restent à jour ; seul l'historique du fichier est perdu
+                print(f"Erreur lors de l'écriture du journal d'accès KPI : {e}")
+                return 0
+            return len(pending)
+
+    def top(self, n=KPI_WARM_TOP_N):
+        with self.lock:
+            self._decay()
+            return [key for key, _ in self.counts.most_common(n)]
+
+
+class KpiCacheWarmer:
+    """
+    Cache des réponses /api/kpis et tâche de préchauffage.
+    compute(key) retourne (JSON sérialisé, instantané pris avant le calcul ou None si le calcul d'une
+    requête identique en cours a été partagé) pour une clé kpi_request_key ; equipment_ids() la liste
+    des équipements (filtres préchauffés en plus de « tous les équipements »).
+    """
+
+    def __init__(self, compute, equipment_ids, access_log=None,
+                 interval_seconds=KPI_WARM_INTERVAL_SECONDS, time_budget_seconds=KPI_WARM_TIME_BUDGET_SECONDS,
+                 workers=KPI_WARM_WORKERS, top_n=KPI_WARM_TOP_N, max_entries=KPI_RESULT_CACHE_SIZE):
+        self.compute = compute
+        self.equipment_ids = equipment_ids
+        self.access_log = access_log or KpiAccessLog()
+        self.interval_seconds = interval_seconds
+        self.time_budget_seconds = time_budget_seconds
+        self.workers = workers
+        self.top_n = top_n
+        self.max_entries = max_entries
+        self.results = OrderedDict()
+        self.watermark = None
+        self.write_seq = 0
+        self.recent_writes = deque(maxlen=KPI_WARM_RECENT_WRITES) # (numéro, début, fin, équipements)
+        self.lock = threading.Lock()
+        self.metrics = {'hits': 0, 'misses': 0, 'warmed': 0, 'skipped_over_budget': 0, 'cycles': 0,
+                        'invalidated': 0, 'discarded_stale': 0}
+        self._stop_event = threading.Event()
+        self._thread = None
+        get_table_versions().subscribe(self._invalidate_written)
+
+    # --- Cache ---
+
+    @staticmethod
+    def _overlaps(key, first_time, last_time, equipment_ids):
+        if key[2] is not None and equipment_ids is not None and key[2] not in equipment_ids:
+            return False
+        return first_time is None or (first_time <= pd.Timestamp(key[1]) and last_time >= pd.Timestamp(key[0]))
+
+    def snapshot(self):
+        """Instantané à prendre AVANT le calcul d'un résultat puis à passer à store."""
+        marks = get_table_versions().mark(*WARMED_TABLES)
+        with self.lock:
+            return {'marks': marks, 'write_seq': self.write_seq}
+
+    def lookup(self, key):
+        """JSON en cache pour la clé, ou None (résultat absent ou périmé)."""
+        with self.lock:
+            entry = self.results.get(key)
+        if entry is not None and get_table_versions().changed_externally(entry['marks']):
+            with self.lock:
+                if self.results.get(key) is entry:
+                    del self.results[key]
+            entry = None
+        with self.lock:
+            if entry is None:
+                self.metrics['misses'] += 1
+                return None
+            if key in self.results:
+                self.results.move_to_end(key)
+            self.metrics['hits'] += 1
+            return entry['body']
+
+    def store(self, key, body, snapshot):
+        """Stocke le JSON calculé après snapshot, sauf si une écriture locale l'a périmé pendant le calcul."""
+        with self.lock:
+            missed = self.write_seq - snapshot['write_seq']
+            written = [write for write in self.recent_writes if write[0] > snapshot['write_seq']]
+            if len(written) < missed or any(self._overlaps(key, *write[1:]) for write in written):
+                self.metrics['discarded_stale'] += 1
+                return
+            self.results[key] = {'body': body, 'marks': snapshot['marks']}
+            self.results.move_to_end(key)
+            while len(self.results) > self.max_entries:
+                self.results.popitem(last=False)
+
+    def _invalidate_written(self, table, df, first_time, last_time):
+        # Lignes écrites par ce processus : résultats (et calculs en cours) recouvrant la période et l'équipement
+        if table not in WARMED_TABLES:
+            return
+        equipment_ids = set(df['equipment_id']) if 'equipment_id' in df.columns else None
+        with self.lock:
+            self.write_seq += 1
+            self.recent_writes.append((self.write_seq, first_time, last_time, equipment_ids))
+            for key in [key for key in self.results if self._overlaps(key, first_time, last_time, equipment_ids)]:
+                del self.results[key]
+                self.metrics['invalidated'] += 1
+
+    # --- Préchauffage ---
+
+    def candidates(self):
+        """Clés à préchauffer, par priorité : les plus demandées, puis les fenêtres usuelles pour chaque filtre."""
+        keys = list(self.access_log.top(self.top_n))
+        last_data_time = max((value for value in self.watermark if value is not None), default=None)
+        if last_data_time is not None:
+            for start, end in builtin_windows(last_data_time):
+                for equipment_id in [None] + list(self.equipment_ids()):
+                    keys.append(kpi_request_key(start, end, equipment_id))
+        return list(OrderedDict.fromkeys(keys))
+
+    def warm_once(self):
+        """Un cycle : si le watermark a avancé, recalcule les clés périmées dans le budget. Retourne le nombre de calculs."""
+        self.access_log.flush()
+        watermark = get_ingestion_watermark()
+        with self.lock:
+            advanced = watermark != self.watermark
+            self.watermark = watermark
+            self.metrics['cycles'] += 1
+        if not advanced:
+            return 0
+
+        candidates = self.candidates()
+        versions = get_table_versions()
+        with self.lock:
+            entries = {key: self.results.get(key) for key in candidates}
+        stale = [key for key, entry in entries.items() if entry is None or versions.changed_externally(entry['marks'])]
+        deadline = time.monotonic() + self.time_budget_seconds
+
+        def warm(key):
+            if time.monotonic() > deadline:
+                with self.lock:
+                    self.metrics['skipped_over_budget'] += 1
+                return False
+            try:
+                body, snapshot = self.compute(key)
+                if snapshot is not None:
+                    self.store(key, body, snapshot)
+            except Exception as e:
+                print(f"Erreur lors du préchauffage des KPIs {key} : {e}")
+                return False
+            with self.lock:
+                self.metrics['warmed'] += 1
+            return True
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='kpi-warmer') as executor:
+            return sum(executor.map(warm, stale))
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='kpi-cache-warmer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.warm_once()
+            except Exception as e:
+                print(f"Erreur lors du préchauffage des KPIs : {e}")
+            self._stop_event.wait(self.interval_seconds)
+        self.access_log.flush()
+
+    def stats(self):
+        with self.lock:
+            stats = {**self.metrics, 'entries': len(self.results)}
+        with self.access_log.lock:
+            stats['access_log_keys'] = len(self.access_log.counts)
+        return stats
@@ -1,6 +1,8 @@
 import psycopg2
 from dotenv import load_dotenv
 import os
+import threading
+from collections import Counter
 
 load_dotenv()
 
@@ -10,6 +12,31 @@ DB_USER = os.getenv("DB_USER")
 DB_PASSWORD = os.getenv("DB_PASSWORD")
 DB_PORT = os.getenv("DB_PORT")
 
+# Comptage des connexions ouvertes, par portée (endpoint de la requête en cours, 'background' sinon)
+_connection_scope = threading.local()
+_connection_counts = Counter()
+_connection_counts_lock = threading.Lock()
+
+def set_connection_scope(name):
+    """Attribue les connexions ouvertes ensuite par ce thread à `name` (None : 'background')."""
+    _connection_scope.name = name
+
+def set_statement_timeout(milliseconds):
+    """statement_timeout des connexions ouvertes ensuite par ce thread (None : pas de limite)."""
+    _connection_scope.statement_timeout = milliseconds
+
+def get_statement_timeout():
+    return getattr(_connection_scope, 'statement_timeout', None)
+
+def get_connection_stats():
+    """Nombre de connexions ouvertes depuis le démarrage, par portée."""
+    with _connection_counts_lock:
+        return dict(_connection_counts)
+
+def _connection_options():
+    statement_timeout = get_statement_timeout()
+    return {'options': f"-c statement_timeout={int(statement_timeout)}"} if statement_timeout else {}
+
 def get_db_connection():
     """Établit et retourne une connexion à la base de données PostgreSQL."""
     try:
@@ -18,8 +45,11 @@ def get_db_connection():
             database=DB_NAME,
             user=DB_USER,
             password=DB_PASSWORD,
-            port=DB_PORT
+            port=DB_PORT,
+            **_connection_options()
         )
+        with _connection_counts_lock:
+            _connection_counts[getattr(_connection_scope, 'name', None) or 'background'] += 1
         print("Connexion à la base de données établie avec succès.")
         return conn
     except psycopg2.OperationalError as e:
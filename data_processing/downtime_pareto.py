@@ -0,0 +1,179 @@
+import os
+import pandas as pd
+from data_processing.db_connection import get_db_connection
+from data_processing.interval_engine import DOWNTIME_CATEGORY_PRECEDENCE
+
+# Pareto des arrêts calculé dans PostgreSQL.
+# /api/downtime-reasons relisait tous les logs d'arrêt de la période pour les compter en pandas, alors
+# que le graphique n'affiche que les principales raisons. Ici une seule requête renvoie le classement :
+# durée effective par raison (arrêts fusionnés par équipement et catégorie, chevauchements attribués à la
+# catégorie prioritaire, découpés sur la période : mêmes règles qu'interval_engine), nombre d'incidents
+# commençant dans la période, rang, part et part cumulée, les raisons au-delà des top_n premières étant
+# regroupées dans une ligne « Autres ». Seules top_n + 1 lignes sortent de la base.
+
+DOWNTIME_PARETO_TOP_N = int(os.getenv("DOWNTIME_PARETO_TOP_N", "8"))
+
+# Niveau de regroupement -> colonnes de la clé
+PARETO_LEVELS = {
+    'category': ['downtime_category'],
+    'reason': ['downtime_category', 'downtime_reason'],
+}
+# Critère de classement -> colonne
+PARETO_METRICS = {'duration': 'duration_seconds', 'count': 'incident_count'}
+OTHER_LABEL = 'Autres'
+
+PARETO_COLUMNS = ['rank', 'incident_count', 'duration_seconds', 'duration_rank', 'count_rank',
+                  'share', 'cumulative_share', 'is_other']
+
+
+def _category_rank_sql(column):
+    # Rang de priorité (interval_engine.DOWNTIME_CATEGORY_PRECEDENCE) ; catégories inconnues après, par nom
+    cases = " ".join(f"WHEN '{category}' THEN {rank}" for rank, category in enumerate(DOWNTIME_CATEGORY_PRECEDENCE))
+    return f"CASE {column} {cases} ELSE {len(DOWNTIME_CATEGORY_PRECEDENCE)} END"
+
+
+def build_pareto_query(level='reason', metric='duration', equipment_id=None, production_line_id=None):
+    """Requête du Pareto (paramètres nommés start_time, end_time, top_n et les filtres de périmètre)."""
+    keys = PARETO_LEVELS[level]
+    key_list = ", ".join(keys)
+    metric_col = PARETO_METRICS[metric]
+    other_keys = ", ".join(f"'{OTHER_LABEL}' AS {key}" for key in keys)
+
+    scope_filter = ""
+    if equipment_id:
+        scope_filter += " AND d.equipment_id = %(equipment_id)s"
+    if production_line_id:
+        scope_filter += " AND d.equipment_id IN (SELECT equipment_id FROM equipments WHERE production_line_id = %(production_line_id)s)"
+
+    return f"""
+WITH scoped AS (
+    SELECT d.downtime_id, d.equipment_id, d.downtime_category, d.downtime_reason, d.start_time AS raw_start,
+           GREATEST(d.start_time, %(start_time)s) AS clipped_start, LEAST(d.end_time, %(end_time)s) AS clipped_end,
+           {_category_rank_sql('d.downtime_category')} AS category_rank
+    FROM downtime_logs d
+    WHERE d.end_time > %(start_time)s AND d.start_time < %(end_time)s{scope_filter}
+),
+-- 1. Fusion des arrêts qui se chevauchent (ou se touchent) par (équipement, catégorie) : îlots
+flagged AS (
+    SELECT *, CASE WHEN clipped_start <= MAX(clipped_end) OVER (
+                  PARTITION BY equipment_id, downtime_category ORDER BY raw_start, downtime_id
+                  ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING) THEN 0 ELSE 1 END AS new_block
+    FROM scoped
+    WHERE clipped_end > clipped_start
+),
+numbered AS (
+    SELECT *, SUM(new_block) OVER (PARTITION BY equipment_id, downtime_category ORDER BY raw_start, downtime_id
+                                   ROWS UNBOUNDED PRECEDING) AS block_no
+    FROM flagged
+),
+blocks AS (
+    -- Un bloc garde la raison de son premier arrêt
+    SELECT equipment_id, downtime_category, MIN(category_rank) AS category_rank,
+           MIN(clipped_start) AS block_start, MAX(clipped_end) AS block_end, MIN(first_reason) AS downtime_reason
+    FROM (
+        SELECT *, FIRST_VALUE(downtime_reason) OVER (
+                      PARTITION BY equipment_id, downtime_category, block_no ORDER BY raw_start, downtime_id) AS first_reason
+        FROM numbered
+    ) AS block_rows
+    GROUP BY equipment_id, downtime_category, block_no
+),
+-- 2. Segments élémentaires entre bornes de blocs, attribués au bloc de la catégorie prioritaire
+bounds AS (
+    SELECT equipment_id, block_start AS bound FROM blocks
+    UNION
+    SELECT equipment_id, block_end FROM blocks
+),
+segments AS (
+    SELECT equipment_id, bound AS segment_start,
+           LEAD(bound) OVER (PARTITION BY equipment_id ORDER BY bound) AS segment_end
+    FROM bounds
+),
+covered AS (
+    SELECT s.segment_start, s.segment_end, b.downtime_category, b.downtime_reason,
+           ROW_NUMBER() OVER (PARTITION BY s.equipment_id, s.segment_start
+                              ORDER BY b.category_rank, b.downtime_category) AS precedence
+    FROM segments s
+    JOIN blocks b ON b.equipment_id = s.equipment_id
+                 AND b.block_start <= s.segment_start AND b.block_end >= s.segment_end
+    WHERE s.segment_end IS NOT NULL
+),
+-- 3. Incidents (arrêts commençant dans la période) et durées effectives par clé
+metrics AS (
+    SELECT {key_list}, 1 AS incident_count, 0.0 AS duration_seconds
+    FROM scoped WHERE raw_start >= %(start_time)s
+    UNION ALL
+    SELECT {key_list}, 0, EXTRACT(EPOCH FROM (segment_end - segment_start))
+    FROM covered WHERE precedence = 1
+),
+totals AS (
+    SELECT {key_list}, SUM(incident_count) AS incident_count, SUM(duration_seconds) AS duration_seconds
+    FROM metrics
+    GROUP BY {key_list}
+),
+ranked AS (
+    SELECT *,
+           ROW_NUMBER() OVER (ORDER BY {metric_col} DESC, {key_list}) AS rank,
+           RANK() OVER (ORDER BY duration_seconds DESC) AS duration_rank,
+           RANK() OVER (ORDER BY incident_count DESC) AS count_rank,
+           SUM({metric_col}) OVER (ORDER BY {metric_col} DESC, {key_list} ROWS UNBOUNDED PRECEDING) AS cumulative_metric,
+           SUM({metric_col}) OVER () AS total_metric
+    FROM totals
+)
+SELECT rank, {key_list}, incident_count, duration_seconds, duration_rank, count_rank,
+       1.0 * {metric_col} / NULLIF(total_metric, 0) AS share,
+       1.0 * cumulative_metric / NULLIF(total_metric, 0) AS cumulative_share,
+       FALSE AS is_other
+FROM ranked
+WHERE rank <= %(top_n)s
+UNION ALL
+SELECT MIN(rank), {other_keys}, SUM(incident_count), SUM(duration_seconds), NULL, NULL,
+       1.0 * SUM({metric_col}) / NULLIF(MAX(total_metric), 0),
+       1.0 * MAX(cumulative_metric) / NULLIF(MAX(total_metric), 0),
+       TRUE
+FROM ranked
+WHERE rank > %(top_n)s
+HAVING COUNT(*) > 0
+ORDER BY rank
+"""
+
+
+def get_downtime_pareto(start_time, end_time, top_n=DOWNTIME_PARETO_TOP_N, level='reason', metric='duration',
+                        equipment_id=None, production_line_id=None):
+    """
+    Pareto des arrêts de [start_time, end_time) : une ligne par clé du niveau (catégorie ou
+    catégorie + raison) parmi les top_n premières selon metric ('duration' ou 'count'), puis une
+    ligne « Autres » (is_other) pour le reste. Périmètre optionnel : un équipement ou une ligne.
+    Niveau 'reason' : comme interval_engine, des arrêts fusionnés (même équipement et catégorie) comptent
+    leur durée pour la raison du premier d'entre eux, alors que chaque arrêt compte son incident pour sa
+    propre raison ; une raison peut donc avoir des incidents sans durée (mêmes chiffres que
+    count_downtimes_by_reason). Au niveau 'category', durées et incidents vont à la même clé.
+    """
+    if level not in PARETO_LEVELS:
+        raise ValueError(f"Niveau invalide : {level}. Valeurs possibles : {', '.join(PARETO_LEVELS)}.")
+    if metric not in PARETO_METRICS:
+        raise ValueError(f"Critère invalide : {metric}. Valeurs possibles : {', '.join(PARETO_METRICS)}.")
+
+    columns = PARETO_COLUMNS[:1] + PARETO_LEVELS[level] + PARETO_COLUMNS[1:]
+    params = {'start_time': start_time, 'end_time': end_time, 'top_n': int(top_n),
+              'equipment_id': equipment_id, 'production_line_id': production_line_id}
+    conn = get_db_connection()
+    if conn:
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(build_pareto_query(level, metric, equipment_id, production_line_id), params)
+                df = pd.DataFrame.from_records(cursor.fetchall(), columns=columns)
+            for col in ['incident_count', 'duration_seconds', 'share', 'cumulative_share']:
+                df[col] = df[col].astype(float)
+            df['incident_count'] = df['incident_count'].astype('int64')
+            # Pas de rang pour la ligne « Autres » : None (null en JSON) plutôt que NaN
+            for col in ['duration_rank', 'count_rank']:
+                ranks = df[col].astype('Int64').astype(object)
+                df[col] = ranks.where(ranks.notna(), None)
+            df['is_other'] = df['is_other'].astype(bool)
+            return df
+        except Exception as e:
+            print(f"Erreur lors du calcul du Pareto des arrêts : {e}")
+            return pd.DataFrame(columns=columns)
+        finally:
+            conn.close()
+    return pd.DataFrame(columns=columns)
@@ -0,0 +1,273 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+from psycopg2.extras import execute_values
+from data_processing.db_connection import get_db_connection
+from data_processing.kpi_calculator import get_sensor_data
+from data_processing.kpi_chunked import iter_query_chunks
+from data_processing.sensor_layout import active_sensor_table
+
+# Magasin de features glissantes pour la maintenance prédictive.
+# Pour chaque (equipment_id, sensor_type) et chaque tranche de FEATURE_BUCKET_MINUTES, on stocke la
+# moyenne, l'écart-type, la pente (unité/heure) et le max des relevés sur plusieurs fenêtres se
+# terminant à la fin de la tranche. Le calcul passe par des statistiques suffisantes par tranche
+# (n, Σv, Σv², Σt, Σt², Σtv, max) et des sommes cumulées : une fenêtre = différence de deux cumuls.
+
+FEATURE_BUCKET_MINUTES = int(os.getenv("FEATURE_BUCKET_MINUTES", "5"))
+# Fenêtres glissantes (suffixe de colonne -> minutes), multiples de FEATURE_BUCKET_MINUTES
+FEATURE_WINDOWS = {'15m': 15, '1h': 60, '4h': 240}
+FEATURE_NAMES = ['mean', 'std', 'slope', 'max']
+FEATURE_COLUMNS = [f"{name}_{suffix}" for suffix in FEATURE_WINDOWS for name in FEATURE_NAMES]
+FEATURE_KEY_COLUMNS = ['equipment_id', 'sensor_type', 'bucket_start']
+
+
+def _check_feature_windows():
+    """Chaque fenêtre doit couvrir un nombre entier de tranches (sinon elle serait tronquée à la tranche inférieure)."""
+    invalid = [suffix for suffix, minutes in FEATURE_WINDOWS.items() if FEATURE_BUCKET_MINUTES <= 0 or minutes % FEATURE_BUCKET_MINUTES]
+    if invalid:
+        raise ValueError(f"FEATURE_BUCKET_MINUTES={FEATURE_BUCKET_MINUTES} ne divise pas les fenêtres {invalid}")
+
+
+_check_feature_windows()
+
+FEATURE_BACKFILL_CHUNK_DAYS = int(os.getenv("FEATURE_BACKFILL_CHUNK_DAYS", "7"))
+FEATURE_UPDATE_INTERVAL_SECONDS = float(os.getenv("FEATURE_UPDATE_INTERVAL_SECONDS", "60"))
+FEATURE_EXPORT_CHUNK_ROWS = int(os.getenv("FEATURE_EXPORT_CHUNK_ROWS", "50000"))
+
+FEATURE_TABLE = 'sensor_features'
+# REAL (4 octets) suffit pour des features d'entraînement et divise le stockage par deux
+FEATURE_TABLE_DDL = f"""
+CREATE TABLE IF NOT EXISTS {FEATURE_TABLE} (
+    equipment_id VARCHAR(50) NOT NULL,
+    sensor_type VARCHAR(50) NOT NULL,
+    bucket_start TIMESTAMP NOT NULL,
+    num_readings SMALLINT NOT NULL,
+    {', '.join(f'{col} REAL' for col in FEATURE_COLUMNS)},
+    PRIMARY KEY (equipment_id, sensor_type, bucket_start)
+);
+CREATE INDEX IF NOT EXISTS idx_{FEATURE_TABLE}_bucket ON {FEATURE_TABLE} (bucket_start);
+"""
+
+
+def _bucket_floor(timestamp):
+    return pd.Timestamp(timestamp).floor(f"{FEATURE_BUCKET_MINUTES}min")
+
+
+def _max_window():
+    return pd.Timedelta(minutes=max(FEATURE_WINDOWS.values()))
+
+
+def compute_rolling_features(readings_df, start_time, end_time):
+    """
+    Calcule les features des tranches [start_time, end_time) (bornes alignées sur les tranches).
+    readings_df doit contenir les relevés depuis start_time - plus grande fenêtre, pour que les
+    fenêtres des premières tranches soient complètes. Retourne une ligne par série et par tranche
+    contenant au moins un relevé.
+    """
+    _check_feature_windows()
+    output_cols = FEATURE_KEY_COLUMNS + ['num_readings'] + FEATURE_COLUMNS
+    bucket_ns = pd.Timedelta(minutes=FEATURE_BUCKET_MINUTES).value
+    origin = pd.Timestamp(start_time) - _max_window()
+    n_buckets = (pd.Timestamp(end_time) - origin).value // bucket_ns
+
+    timestamps = pd.to_datetime(readings_df['timestamp']).to_numpy(dtype='datetime64[ns]').astype(np.int64)
+    in_range = (timestamps >= origin.value) & (timestamps < pd.Timestamp(end_time).value)
+    readings_df, timestamps = readings_df[in_range], timestamps[in_range]
+    if readings_df.empty or n_buckets <= 0:
+        return pd.DataFrame(columns=output_cols)
+
+    codes, series = pd.factorize(pd.Series(list(zip(readings_df['equipment_id'], readings_df['sensor_type'])), dtype=object))
+    n_series = len(series)
+    bucket = (timestamps - origin.value) // bucket_ns
+    flat = codes * n_buckets + bucket
+    size = n_series * n_buckets
+
+    # Temps en heures depuis l'origine du calcul (petites valeurs : pas de perte de précision)
+    t = (timestamps - origin.value) / 3.6e12
+    v = readings_df['value'].to_numpy(dtype=np.float64)
+
+    def grid(weights=None):
+        return np.bincount(flat, weights=weights, minlength=size).reshape(n_series, n_buckets)
+
+    stats = {'n': grid(), 'v': grid(v), 'vv': grid(v * v), 't': grid(t), 'tt': grid(t * t), 'tv': grid(t * v)}
+    bucket_max = np.full(size, -np.inf)
+    np.maximum.at(bucket_max, flat, v)
+    bucket_max = bucket_max.reshape(n_series, n_buckets)
+
+    # Cumuls avec une colonne de zéros en tête : somme sur les k dernières tranches = C[b+1] - C[b+1-k]
+    cumulative = {key: np.concatenate([np.zeros((n_series, 1)), np.cumsum(values, axis=1)], axis=1) for key, values in stats.items()}
+    positions = np.arange(n_buckets)
+
+    features = {}
+    for suffix, minutes in FEATURE_WINDOWS.items():
+        k = minutes // FEATURE_BUCKET_MINUTES
+        lower = np.maximum(positions + 1 - k, 0)
+        window = {key: values[:, positions + 1] - values[:, lower] for key, values in cumulative.items()}
+        n = window['n']
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = window['v'] / n
+            variance = np.maximum(window['vv'] / n - mean * mean, 0)
+            denominator = n * window['tt'] - window['t'] ** 2
+            slope = (n * window['tv'] - window['t'] * window['v']) / denominator
+        features[f"mean_{suffix}"] = np.where(n > 0, mean, np.nan)
+        features[f"std_{suffix}"] = np.where(n > 1, np.sqrt(variance), np.nan)
+        features[f"slope_{suffix}"] = np.where((n > 1) & (denominator > 1e-12), slope, np.nan)
+        padded = np.concatenate([np.full((n_series, k - 1), -np.inf), bucket_max], axis=1)
+        window_max = sliding_window_view(padded, k, axis=1).max(axis=-1)
+        features[f"max_{suffix}"] = np.where(np.isfinite(window_max), window_max, np.nan)
+
+    # Tranches demandées (hors historique de préchauffage) contenant au moins un relevé
+    first_output = _max_window().value // bucket_ns
+    keep = np.zeros((n_series, n_buckets), dtype=bool)
+    keep[:, first_output:] = stats['n'][:, first_output:] > 0
+    series_idx, bucket_idx = np.nonzero(keep)
+
+    series_keys = np.empty(n_series, dtype=object)
+    series_keys[:] = list(series)
+    result = pd.DataFrame({
+        'equipment_id': [key[0] for key in series_keys[series_idx]],
+        'sensor_type': [key[1] for key in series_keys[series_idx]],
+        'bucket_start': pd.to_datetime((origin.value + bucket_idx * bucket_ns).astype('datetime64[ns]')),
+        'num_readings': stats['n'][series_idx, bucket_idx].astype(np.int64),
+    })
+    for col in FEATURE_COLUMNS:
+        result[col] = features[col][series_idx, bucket_idx].astype(np.float32)
+    return result.sort_values(FEATURE_KEY_COLUMNS).reset_index(drop=True)[output_cols]
+
+
+# --- Persistance ---
+
+def ensure_feature_table():
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(FEATURE_TABLE_DDL)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def save_features(features_df):
+    """Upsert des features (un recalcul d'une tranche remplace l'ancienne ligne)."""
+    if features_df.empty:
+        return 0
+    columns = FEATURE_KEY_COLUMNS + ['num_readings'] + FEATURE_COLUMNS
+    # NaN -> NULL, types NumPy -> types Python
+    rows = features_df[columns].astype(object).where(features_df[columns].notna(), None).itertuples(index=False, name=None)
+    updates = ', '.join(f"{col} = EXCLUDED.{col}" for col in ['num_readings'] + FEATURE_COLUMNS)
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            execute_values(
+                cursor,
+                f"INSERT INTO {FEATURE_TABLE} ({', '.join(columns)}) VALUES %s "
+                f"ON CONFLICT (equipment_id, sensor_type, bucket_start) DO UPDATE SET {updates}",
+                list(rows), page_size=1000
+            )
+        conn.commit()
+    finally:
+        conn.close()
+    return len(features_df)
+
+
+def backfill_feature_store(start_time, end_time, equipment_id=None):
+    """Calcule et enregistre les features de [start_time, end_time), par blocs de FEATURE_BACKFILL_CHUNK_DAYS."""
+    ensure_feature_table()
+    chunk_start, end_time = _bucket_floor(start_time), _bucket_floor(end_time)
+    total = 0
+    while chunk_start < end_time:
+        chunk_end = min(chunk_start + pd.Timedelta(days=FEATURE_BACKFILL_CHUNK_DAYS), end_time)
+        readings_df = get_sensor_data(chunk_start - _max_window(), chunk_end, equipment_id)
+        if not readings_df.empty:
+            total += save_features(compute_rolling_features(readings_df, chunk_start, chunk_end))
+        chunk_start = chunk_end
+    return total
+
+
+def update_feature_store():
+    """
+    Mise à jour incrémentale : calcule les tranches complètes apparues depuis la dernière tranche
+    enregistrée (la dernière tranche est recalculée, elle a pu recevoir des relevés en retard).
+    """
+    ensure_feature_table()
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"SELECT MAX(bucket_start) FROM {FEATURE_TABLE}")
+            last_bucket = cursor.fetchone()[0]
+            cursor.execute(f"SELECT MIN(timestamp), MAX(timestamp) FROM {active_sensor_table()}")
+            first_reading, last_reading = cursor.fetchone()
+    finally:
+        conn.close()
+    if last_reading is None:
+        return 0
+
+    start_time = pd.Timestamp(last_bucket) if last_bucket is not None else _bucket_floor(first_reading)
+    # Seules les tranches terminées sont calculées
+    return backfill_feature_store(start_time, _bucket_floor(last_reading))
+
+
+class FeatureStoreUpdater:
+    """Tâche de fond qui appelle update_feature_store à intervalle régulier."""
+
+    def __init__(self, interval_seconds=FEATURE_UPDATE_INTERVAL_SECONDS):
+        self.interval_seconds = interval_seconds
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='feature-store-updater', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                update_feature_store()
+            except Exception as e:
+                print(f"Erreur lors de la mise à jour du magasin de features : {e}")
+            self._stop_event.wait(self.interval_seconds)
+
+
+# --- Export ---
+
+def iter_feature_chunks(start_time, end_time, equipment_id=None, sensor_type=None, chunksize=FEATURE_EXPORT_CHUNK_ROWS):
+    """
+    Lit les features de [start_time, end_time) par blocs de chunksize lignes (export volumineux), via un
+    curseur serveur : seul le bloc en cours est en mémoire côté client.
+    """
+    query = f"SELECT {', '.join(FEATURE_KEY_COLUMNS + ['num_readings'] + FEATURE_COLUMNS)} FROM {FEATURE_TABLE}"
+    conditions = ["bucket_start >= %(start_time)s", "bucket_start < %(end_time)s"]
+    params = {'start_time': start_time, 'end_time': end_time}
+    if equipment_id:
+        conditions.append("equipment_id = %(equipment_id)s")
+        params['equipment_id'] = equipment_id
+    if sensor_type:
+        conditions.append("sensor_type = %(sensor_type)s")
+        params['sensor_type'] = sensor_type
+    query += " WHERE " + " AND ".join(conditions) + " ORDER BY equipment_id, sensor_type, bucket_start"
+
+    conn = get_db_connection()
+    try:
+        yield from iter_query_chunks(conn, query, params, FEATURE_TABLE, chunk_rows=chunksize)
+    finally:
+        conn.close()
+
+
+def get_features(start_time, end_time, equipment_id=None, sensor_type=None):
+    """Toutes les features de la période dans un seul DataFrame (usage direct dans un notebook)."""
+    try:
+        chunks = list(iter_feature_chunks(start_time, end_time, equipment_id, sensor_type))
+    except Exception as e:
+        print(f"Erreur lors de la récupération des features : {e}")
+        return pd.DataFrame()
+    if not chunks:
+        return pd.DataFrame(columns=FEATURE_KEY_COLUMNS + ['num_readings'] + FEATURE_COLUMNS)
+    return pd.concat(chunks, ignore_index=True)
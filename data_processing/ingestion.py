@@ -0,0 +1,445 @@
+import io
+import os
+import json
+import time
+import atexit
+import threading
+from collections import OrderedDict
+import pandas as pd
+from data_processing.db_connection import get_db_connection
+from data_processing.typed_reader import TABLE_SCHEMAS, apply_schema
+from data_processing.sensor_layout import SENSOR_STORAGE_LAYOUT, WIDE_TABLE, write_wide_sensor_readings
+from data_processing.table_versions import get_table_versions
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError: # Dépendance optionnelle : requise seulement pour les lots Arrow
+    pa = None
+
+# Chemin d'écriture : ingestion par lots des relevés de capteurs, de production, des événements et des arrêts.
+# Les lots reçus (NDJSON, JSON en colonnes ou flux Arrow) sont validés, typés puis placés dans un tampon
+# en mémoire par table. Une tâche de fond vide le tampon par COPY dès INGEST_FLUSH_ROWS lignes ou toutes
+# les INGEST_FLUSH_INTERVAL_SECONDS ; au-delà de INGEST_BUFFER_MAX_ROWS lignes en attente, les envois
+# attendent puis sont refusés (l'appelant réessaie plus tard). Une clé d'idempotence par lot est
+# enregistrée dans ingestion_batches dans la même transaction que les lignes : un lot renvoyé après
+# une erreur réseau n'est écrit qu'une fois, y compris après un redémarrage.
+# Après chaque écriture, le watermark de la table avance et les lignes écrites sont déclarées à
+# table_versions, qui les transmet aux caches en aval (index de cumuls, partiels de KPIs, segments
+# journaliers, résultats préchauffés) : chacun les applique ou invalide la période touchée.
+
+INGESTION_ENABLED = os.getenv("INGESTION_ENABLED", "0") == "1"
+INGEST_FLUSH_ROWS = int(os.getenv("INGEST_FLUSH_ROWS", "20000"))
+INGEST_FLUSH_INTERVAL_SECONDS = float(os.getenv("INGEST_FLUSH_INTERVAL_SECONDS", "1"))
+INGEST_BUFFER_MAX_ROWS = int(os.getenv("INGEST_BUFFER_MAX_ROWS", "500000"))
+# Attente maximale d'un envoi quand le tampon est plein, avant refus
+INGEST_BACKPRESSURE_TIMEOUT_SECONDS = float(os.getenv("INGEST_BACKPRESSURE_TIMEOUT_SECONDS", "2"))
+# Échecs d'écriture d'un lot avant abandon (sa clé d'idempotence est alors libérée)
+INGEST_MAX_FLUSH_ATTEMPTS = int(os.getenv("INGEST_MAX_FLUSH_ATTEMPTS", "5"))
+# Clés d'idempotence gardées en mémoire (les plus anciennes restent vérifiées en base)
+INGEST_IDEMPOTENCY_KEYS = int(os.getenv("INGEST_IDEMPOTENCY_KEYS", "100000"))
+
+INGESTION_BATCHES_TABLE = 'ingestion_batches'
+
+INGESTION_DDL = f"""
+CREATE TABLE IF NOT EXISTS {INGESTION_BATCHES_TABLE} (
+    idempotency_key TEXT PRIMARY KEY,
+    table_name TEXT NOT NULL,
+    row_count INTEGER NOT NULL,
+    committed_at TIMESTAMP NOT NULL DEFAULT now()
+);
+"""
+
+# Colonnes acceptées par table, colonnes obligatoires, colonnes de temps (watermark) et clé d'upsert.
+# Un arrêt est envoyé à son début puis renvoyé avec end_time : il est mis à jour, pas dupliqué.
+INGEST_TABLES = {
+    'sensor_readings': {
+        'columns': ['timestamp', 'equipment_id', 'sensor_type', 'value', 'unit'],
+        'required': ['timestamp', 'equipment_id', 'sensor_type', 'value'],
+        'time_columns': ['timestamp'],
+        'upsert_key': None,
+    },
+    'production_output': {
+        'columns': ['timestamp', 'equipment_id', 'product_id', 'quantity_produced', 'quantity_rejected', 'running_duration_seconds'],
+        'required': ['timestamp', 'equipment_id', 'quantity_produced'],
+        'time_columns': ['timestamp'],
+        'upsert_key': None,
+    },
+    'machine_events': {
+        'columns': ['event_id', 'timestamp', 'equipment_id', 'event_type', 'details'],
+        'required': ['event_id', 'timestamp', 'equipment_id', 'event_type'],
+        'time_columns': ['timestamp'],
+        'upsert_key': None,
+    },
+    'downtime_logs': {
+        'columns': ['downtime_id', 'equipment_id', 'start_time', 'end_time', 'downtime_category', 'downtime_reason', 'duration_seconds'],
+        'required': ['downtime_id', 'equipment_id', 'start_time'],
+        'time_columns': ['start_time', 'end_time'],
+        'upsert_key': 'downtime_id',
+    },
+}
+
+# Identifiants fournis par les clients : plages réservées par reserve_ids pour éviter les collisions
+ID_COLUMNS = {'machine_events': 'event_id', 'downtime_logs': 'downtime_id'}
+
+
+class IngestionBufferFull(Exception):
+    """Tampon plein : le lot n'est pas accepté, l'appelant doit réessayer après retry_after secondes."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Tampon d'ingestion plein, réessayer dans {retry_after:.0f} s.")
+        self.retry_after = retry_after
+
+
+# --- Décodage et validation ---
+
+def parse_batch(body, content_type):
+    """DataFrame d'un lot : NDJSON (une ligne JSON par enregistrement), JSON en colonnes ou flux Arrow IPC."""
+    content_type = (content_type or '').split(';')[0].strip()
+    if content_type == 'application/vnd.apache.arrow.stream':
+        if pa is None:
+            raise ValueError("pyarrow est requis pour les lots Arrow (pip install pyarrow).")
+        return pa.ipc.open_stream(pa.BufferReader(body)).read_pandas()
+    if content_type == 'application/json':
+        payload = json.loads(body)
+        # {"columns": {"timestamp": [...], ...}} ou directement {"timestamp": [...], ...}
+        return pd.DataFrame(payload.get('columns', payload) if isinstance(payload, dict) else payload)
+    if content_type in ('application/x-ndjson', 'application/jsonl', ''):
+        return pd.read_json(io.BytesIO(body if isinstance(body, bytes) else body.encode()), lines=True, dtype=False, convert_dates=False)
+    raise ValueError(f"Content-Type non supporté : {content_type}")
+
+
+def validate_batch(table, df):
+    """Contrôle les colonnes et convertit les types (schéma de lecture) ; lève ValueError si le lot est invalide."""
+    if table not in INGEST_TABLES:
+        raise ValueError(f"Table d'ingestion inconnue : {table}")
+    spec = INGEST_TABLES[table]
+    unknown = [col for col in df.columns if col not in spec['columns']]
+    missing = [col for col in spec['required'] if col not in df.columns]
+    if unknown or missing:
+        raise ValueError(f"Colonnes inconnues : {unknown} ; colonnes obligatoires manquantes : {missing}")
+    if df.empty:
+        return df
+    if df[spec['required']].isna().any().any():
+        raise ValueError(f"Valeurs manquantes dans les colonnes obligatoires {spec['required']}")
+    columns = [col for col in spec['columns'] if col in df.columns]
+    try:
+        return apply_schema(df[columns].copy(), TABLE_SCHEMAS[table])
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Types invalides : {e}")
+
+
+# --- Écriture ---
+
+def _copy_rows(cursor, table, df):
+    """COPY des lignes dans la table (ou dans une table de transit puis upsert si la table a une clé d'upsert)."""
+    spec = INGEST_TABLES[table]
+    columns = [col for col in spec['columns'] if col in df.columns]
+    buffer = io.StringIO()
+    df[columns].to_csv(buffer, index=False, header=False, date_format='%Y-%m-%d %H:%M:%S.%f')
+    buffer.seek(0)
+    column_list = ', '.join(columns)
+    if spec['upsert_key'] is None:
+        cursor.copy_expert(f"COPY {table} ({column_list}) FROM STDIN WITH (FORMAT CSV)", buffer)
+        return
+    key = spec['upsert_key']
+    staging = f"{table}_ingest_staging"
+    cursor.execute(f"CREATE TEMP TABLE IF NOT EXISTS {staging} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS")
+    cursor.copy_expert(f"COPY {staging} ({column_list}) FROM STDIN WITH (FORMAT CSV)", buffer)
+    updates = ', '.join(f"{col} = COALESCE(EXCLUDED.{col}, {table}.{col})" for col in columns if col != key)
+    # DISTINCT ON : la dernière version d'un même arrêt dans le lot l'emporte (ctid croissant avec l'ordre du COPY)
+    cursor.execute(
+        f"INSERT INTO {table} ({column_list}) "
+        f"SELECT DISTINCT ON ({key}) {column_list} FROM {staging} ORDER BY {key}, ctid DESC "
+        f"ON CONFLICT ({key}) DO UPDATE SET {updates}"
+    )
+
+
+def _register_keys(cursor, table, batches):
+    """Enregistre les clés d'idempotence des lots ; retourne celles qui n'étaient pas encore présentes."""
+    keyed = [batch for batch in batches if batch['key'] is not None]
+    if not keyed:
+        return set()
+    cursor.execute(
+        f"INSERT INTO {INGESTION_BATCHES_TABLE} (idempotency_key, table_name, row_count) "
+        "SELECT * FROM unnest(%(keys)s::text[], %(tables)s::text[], %(counts)s::int[]) "
+        "ON CONFLICT (idempotency_key) DO NOTHING RETURNING idempotency_key",
+        {'keys': [batch['key'] for batch in keyed], 'tables': [table] * len(keyed), 'counts': [len(batch['df']) for batch in keyed]}
+    )
+    return {row[0] for row in cursor.fetchall()}
+
+
+def write_batches(conn, table, batches):
+    """
+    Écrit des lots dans une transaction. Les lots dont la clé est déjà dans ingestion_batches sont ignorés.
+    Retourne les lots effectivement écrits.
+    """
+    if table == 'sensor_readings' and SENSOR_STORAGE_LAYOUT == 'wide':
+        # Upsert sur (equipment_id, timestamp) avec sa propre transaction : réécrire un lot déjà reçu
+        # est sans effet, les clés sont donc enregistrées après l'écriture
+        write_wide_sensor_readings(pd.concat([batch['df'] for batch in batches], ignore_index=True), conn)
+        with conn.cursor() as cursor:
+            _register_keys(cursor, table, batches)
+        conn.commit()
+        return batches
+
+    with conn.cursor() as cursor:
+        new_keys = _register_keys(cursor, table, batches)
+        written = [batch for batch in batches if batch['key'] is None or batch['key'] in new_keys]
+        if written:
+            _copy_rows(cursor, table, pd.concat([batch['df'] for batch in written], ignore_index=True))
+    conn.commit()
+    return written
+
+
+class IngestionBuffer:
+    """Tampons par table vidés par COPY, avec contre-pression et clés d'idempotence."""
+
+    def __init__(self, flush_rows=INGEST_FLUSH_ROWS, flush_interval_seconds=INGEST_FLUSH_INTERVAL_SECONDS,
+                 max_rows=INGEST_BUFFER_MAX_ROWS, backpressure_timeout_seconds=INGEST_BACKPRESSURE_TIMEOUT_SECONDS,
+                 max_keys=INGEST_IDEMPOTENCY_KEYS):
+        self.flush_rows = flush_rows
+        self.flush_interval_seconds = flush_interval_seconds
+        self.max_rows = max_rows
+        self.backpressure_timeout_seconds = backpressure_timeout_seconds
+        self.max_keys = max_keys
+        self.pending = {table: [] for table in INGEST_TABLES}
+        self.pending_rows = 0 # Lignes en attente ou en cours d'écriture
+        self.keys = OrderedDict() # (table, clé) -> 'pending' | 'committed'
+        self.next_ids = {} # table -> premier identifiant non réservé par ce processus
+        self.watermarks = {table: {'max_time': None, 'rows': 0, 'batches': 0, 'last_flush': None} for table in INGEST_TABLES}
+        self.metrics = {'accepted_rows': 0, 'duplicate_batches': 0, 'rejected_full': 0, 'flushes': 0,
+                        'flush_errors': 0, 'dropped_batches': 0, 'flush_seconds': 0.0}
+        self.condition = threading.Condition()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def submit(self, table, df, key=None, wait=False):
+        """
+        Place un lot validé dans le tampon. Retourne {'status': 'accepted' | 'duplicate', 'rows': n}.
+        wait=True : attend que le lot soit écrit en base (et lève une erreur si l'écriture est abandonnée).
+        Lève IngestionBufferFull si le tampon reste plein au-delà du délai de contre-pression.
+        """
+        batch = {'df': df, 'key': key, 'attempts': 0, 'done': threading.Event(), 'error': None}
+        with self.condition:
+            if key is not None and (table, key) in self.keys:
+                self.metrics['duplicate_batches'] += 1
+                return {'status': 'duplicate', 'rows': 0}
+            deadline = time.monotonic() + self.backpressure_timeout_seconds
+            while self.pending_rows > 0 and self.pending_rows + len(df) > self.max_rows:
+                self.condition.notify_all() # Réveille la tâche d'écriture
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.metrics['rejected_full'] += 1
+                    raise IngestionBufferFull(max(self.flush_interval_seconds, 1))
+                self.condition.wait(remaining)
+            self.pending[table].append(batch)
+            self.pending_rows += len(df)
+            self.metrics['accepted_rows'] += len(df)
+            if key is not None:
+                self._remember(table, key, 'pending')
+            if self.pending_rows >= self.flush_rows:
+                self.condition.notify_all()
+        if wait:
+            batch['done'].wait()
+            if batch['error'] is not None:
+                raise batch['error']
+        return {'status': 'accepted', 'rows': len(df)}
+
+    def _remember(self, table, key, status):
+        self.keys[(table, key)] = status
+        self.keys.move_to_end((table, key))
+        while len(self.keys) > self.max_keys:
+            oldest = next(iter(self.keys))
+            if self.keys[oldest] == 'pending':
+                break # Les clés en attente d'écriture sont gardées
+            self.keys.popitem(last=False)
+
+    def flush(self):
+        """Écrit tout ce qui est en attente (une transaction par table). Retourne le nombre de lignes écrites."""
+        with self.condition:
+            taken = {table: batches for table, batches in self.pending.items() if batches}
+            self.pending = {table: [] for table in INGEST_TABLES}
+        if not taken:
+            return 0
+
+        written_rows = 0
+        try:
+            conn = get_db_connection()
+        except Exception as e:
+            for table, batches in taken.items():
+                self._requeue(table, batches, e)
+            return 0
+        # Tables ni écrites ni remises en attente : seules celles-ci sont remises en attente si la
+        # connexion tombe (une table déjà remise en attente serait sinon écrite deux fois)
+        unresolved = dict(taken)
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(INGESTION_DDL)
+            conn.commit()
+            for table, batches in taken.items():
+                started = time.perf_counter()
+                try:
+                    written = write_batches(conn, table, batches)
+                except Exception as e:
+                    del unresolved[table]
+                    self._requeue(table, batches, e)
+                    print(f"Erreur lors de l'écriture des lots {table} : {e}")
+                    conn.rollback()
+                    continue
+                del unresolved[table] # Transaction validée
+                written_rows += self._committed(table, batches, written, time.perf_counter() - started)
+        except Exception as e:
+            print(f"Erreur lors de l'écriture des lots ingérés : {e}")
+            for table, batches in unresolved.items():
+                self._requeue(table, batches, e)
+        finally:
+            conn.close()
+        return written_rows
+
+    def _requeue(self, table, batches, error):
+        """Remet en tête du tampon les lots d'une écriture échouée ; abandonne ceux qui ont épuisé leurs essais."""
+        with self.condition:
+            self.metrics['flush_errors'] += 1
+            retry = []
+            for batch in batches:
+                batch['attempts'] += 1
+                if batch['attempts'] < INGEST_MAX_FLUSH_ATTEMPTS:
+                    retry.append(batch)
+                    continue
+                # Abandon : la clé est libérée pour que l'appelant puisse renvoyer le lot
+                self.pending_rows -= len(batch['df'])
+                self.metrics['dropped_batches'] += 1
+                if batch['key'] is not None:
+                    self.keys.pop((table, batch['key']), None)
+                batch['error'] = error
+                batch['done'].set()
+            self.pending[table] = retry + self.pending[table]
+            self.condition.notify_all()
+
+    def _committed(self, table, batches, written, seconds):
+        rows = sum(len(batch['df']) for batch in written)
+        last_time = None
+        if rows:
+            df = pd.concat([batch['df'] for batch in written], ignore_index=True)
+            time_columns = [col for col in INGEST_TABLES[table]['time_columns'] if col in df.columns]
+            last_time = max((df[col].max() for col in time_columns if df[col].notna().any()), default=None)
+            # Lignes tardives comprises : les caches en aval mettent à jour ou invalident la période écrite.
+            # Modifications comptées par PostgreSQL : une par clé pour un upsert (DISTINCT ON)
+            upsert_key = INGEST_TABLES[table]['upsert_key']
+            changes = df[upsert_key].nunique() if upsert_key else len(df)
+            written_table = table
+            if table == 'sensor_readings' and SENSOR_STORAGE_LAYOUT == 'wide':
+                # Table large : une ligne par (équipement, instant), mise à jour si elle existe déjà
+                written_table, changes = WIDE_TABLE, len(df.drop_duplicates(['equipment_id', 'timestamp']))
+            get_table_versions().record_local_write(written_table, df, changes, time_columns)
+        with self.condition:
+            for batch in batches:
+                self.pending_rows -= len(batch['df'])
+                if batch['key'] is not None:
+                    self._remember(table, batch['key'], 'committed')
+                batch['done'].set()
+            self.metrics['duplicate_batches'] += len(batches) - len(written)
+            self.metrics['flushes'] += 1
+            self.metrics['flush_seconds'] += seconds
+            if rows:
+                watermark = self.watermarks[table]
+                if last_time is not None and (watermark['max_time'] is None or last_time > watermark['max_time']):
+                    watermark['max_time'] = last_time
+                watermark['rows'] += rows
+                watermark['batches'] += len(written)
+                watermark['last_flush'] = pd.Timestamp.now()
+            self.condition.notify_all() # Place libérée pour les envois en attente
+        return rows
+
+    def reserve_ids(self, counts):
+        """
+        Réserve des plages d'identifiants (event_id, downtime_id) pour un client qui numérote ses lignes
+        (simulate_replay --sink ingest). counts : table -> nombre d'identifiants. Retourne table -> premier
+        identifiant, au-delà du maximum en base, des lots en attente et des plages déjà réservées.
+        """
+        for table, count in counts.items():
+            if table not in ID_COLUMNS:
+                raise ValueError(f"Table sans identifiant réservable : {table}. Tables possibles : {', '.join(ID_COLUMNS)}.")
+            if not isinstance(count, int) or count < 0:
+                raise ValueError(f"Nombre d'identifiants invalide pour {table} : {count}.")
+        tables = list(counts)
+        if not tables:
+            return {}
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT " + ", ".join(
+                    f"(SELECT COALESCE(MAX({ID_COLUMNS[table]}), -1) + 1 FROM {table})" for table in tables))
+                next_in_db = dict(zip(tables, cursor.fetchone()))
+        finally:
+            conn.close()
+        starts = {}
+        with self.condition:
+            for table in tables:
+                next_pending = max((int(batch['df'][ID_COLUMNS[table]].max()) + 1
+                                    for batch in self.pending[table] if len(batch['df'])), default=0)
+                starts[table] = max(int(next_in_db[table]), next_pending, self.next_ids.get(table, 0))
+                self.next_ids[table] = starts[table] + counts[table]
+        return starts
+
+    def get_watermarks(self):
+        """Par table : dernier timestamp écrit, lignes et lots écrits, heure de la dernière écriture."""
+        with self.condition:
+            return {
+                table: {field: value.isoformat() if isinstance(value, pd.Timestamp) else value for field, value in watermark.items()}
+                for table, watermark in self.watermarks.items()
+            }
+
+    def stats(self):
+        with self.condition:
+            return {**self.metrics, 'pending_rows': self.pending_rows, 'max_rows': self.max_rows}
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='ingestion-flusher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Arrête la tâche d'écriture après avoir vidé le tampon."""
+        self._stop_event.set()
+        with self.condition:
+            self.condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                # Écriture dès INGEST_FLUSH_ROWS lignes en attente, sinon à l'échéance de l'intervalle
+                deadline = time.monotonic() + self.flush_interval_seconds
+                while self.pending_rows < self.flush_rows and not self._stop_event.is_set():
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Erreur lors de l'écriture des lots ingérés : {e}")
+            if self._stop_event.is_set():
+                with self.condition:
+                    if not any(self.pending.values()):
+                        return
+
+
+_ingestion_buffer = None
+_ingestion_buffer_lock = threading.Lock()
+
+
+def get_ingestion_buffer():
+    """Retourne le tampon d'ingestion du processus (tâche d'écriture démarrée au premier appel)."""
+    global _ingestion_buffer
+    with _ingestion_buffer_lock:
+        if _ingestion_buffer is None:
+            _ingestion_buffer = IngestionBuffer()
+            _ingestion_buffer.start()
+            atexit.register(_ingestion_buffer.stop) # Lignes acceptées écrites avant l'arrêt du processus
+    return _ingestion_buffer
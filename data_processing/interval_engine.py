@@ -0,0 +1,160 @@
+import numpy as np
+import pandas as pd
+
+# Moteur d'intervalles vectorisé pour les temps d'arrêt.
+# Les arrêts d'un même équipement peuvent se chevaucher (ex. arrêt sur ALARM pendant une maintenance
+# planifiée) : les sommer séparément compte deux fois le même temps. Ici, chaque instant est attribué
+# à un seul arrêt, celui de la catégorie prioritaire, puis les durées sont découpées sur des périodes
+# ou des tranches arbitraires. Tout est en O(n log n) (tris NumPy + cumuls), sans boucle par ligne.
+
+# Ordre de priorité des catégories quand des arrêts se chevauchent (la première l'emporte).
+# Le temps planifié est exclu du Temps Planifié de production : un arrêt imprévu qui survient
+# pendant une maintenance ne doit pas être retranché une seconde fois.
+DOWNTIME_CATEGORY_PRECEDENCE = ['Planned Maintenance', 'Changeover', 'Unplanned - Breakdown', 'Unplanned - Process']
+
+INTERVAL_COLUMNS = ['equipment_id', 'downtime_category', 'downtime_reason', 'start_time', 'end_time']
+
+
+def _to_ns(values):
+    """Convertit une colonne de dates en entiers (nanosecondes depuis l'epoch)."""
+    return pd.to_datetime(pd.Series(values)).to_numpy(dtype='datetime64[ns]').astype(np.int64)
+
+
+def _from_ns(values):
+    return pd.to_datetime(np.asarray(values, dtype=np.int64).astype('datetime64[ns]'))
+
+
+def _category_ranks(categories, precedence):
+    """Rang de priorité de chaque catégorie ; les catégories inconnues passent après, par ordre alphabétique."""
+    unknown = sorted(set(categories) - set(precedence))
+    rank_map = {category: rank for rank, category in enumerate(list(precedence) + unknown)}
+    return np.array([rank_map[category] for category in categories], dtype=np.int64), len(rank_map)
+
+
+def merge_overlapping(group_codes, starts, ends):
+    """
+    Fusionne les intervalles qui se chevauchent (ou se touchent) au sein de chaque groupe.
+    Retourne (order, first, block_starts, block_ends) : order trie les entrées par (groupe, début),
+    first donne la position (dans l'ordre trié) du premier intervalle de chaque bloc fusionné.
+    """
+    order = np.lexsort((starts, group_codes))
+    g, s, e = group_codes[order], starts[order], ends[order]
+    if len(order) == 0:
+        return order, order, s, e
+
+    # Fin maximale atteinte jusqu'ici dans le groupe (cumulative max) : un nouveau bloc commence
+    # quand le début dépasse toutes les fins précédentes, ou quand on change de groupe.
+    running_end = pd.Series(e).groupby(g).cummax().to_numpy()
+    new_group = np.r_[True, g[1:] != g[:-1]]
+    new_block = new_group | np.r_[True, s[1:] > running_end[:-1]]
+
+    first = np.flatnonzero(new_block)
+    return order, first, s[first], np.maximum.reduceat(e, first)
+
+
+def resolve_downtime_intervals(downtimes_df, precedence=DOWNTIME_CATEGORY_PRECEDENCE):
+    """
+    Transforme des logs d'arrêt (éventuellement chevauchants) en segments disjoints par équipement.
+    Chaque instant couvert est attribué à la catégorie la plus prioritaire active ; au sein d'une
+    catégorie, les arrêts chevauchants sont fusionnés et gardent la raison du premier arrêt.
+    Retourne un DataFrame INTERVAL_COLUMNS trié par équipement et début.
+    """
+    if downtimes_df.empty or not set(INTERVAL_COLUMNS).issubset(downtimes_df.columns):
+        return pd.DataFrame({col: pd.Series(dtype='datetime64[ns]' if col.endswith('_time') else object) for col in INTERVAL_COLUMNS})
+
+    df = downtimes_df.dropna(subset=['start_time', 'end_time'])
+    starts, ends = _to_ns(df['start_time']), _to_ns(df['end_time'])
+    valid = ends > starts
+    df, starts, ends = df[valid], starts[valid], ends[valid]
+
+    eq_codes, eq_values = pd.factorize(df['equipment_id'])
+    categories = df['downtime_category'].to_numpy()
+    ranks, n_ranks = _category_ranks(categories, precedence)
+    reasons = df['downtime_reason'].to_numpy()
+
+    # --- 1. Fusion des arrêts d'une même (équipement, catégorie) ---
+    order, first, block_starts, block_ends = merge_overlapping(eq_codes * n_ranks + ranks, starts, ends)
+    block_eq = eq_codes[order][first]
+    block_rank = ranks[order][first]
+    block_category = categories[order][first]
+    block_reason = reasons[order][first]
+    n_blocks = len(first)
+
+    # --- 2. Balayage : événements d'ouverture / fermeture des blocs, triés par (équipement, temps) ---
+    ev_time = np.r_[block_starts, block_ends]
+    ev_eq = np.r_[block_eq, block_eq]
+    ev_rank = np.r_[block_rank, block_rank]
+    ev_delta = np.r_[np.ones(n_blocks, dtype=np.int64), -np.ones(n_blocks, dtype=np.int64)]
+    ev_block = np.r_[np.arange(n_blocks), np.arange(n_blocks)]
+    ev_order = np.lexsort((ev_time, ev_eq))
+    ev_time, ev_eq, ev_rank, ev_delta, ev_block = (a[ev_order] for a in (ev_time, ev_eq, ev_rank, ev_delta, ev_block))
+
+    # Pour chaque rang (par priorité décroissante) : couverture après chaque événement et dernier bloc ouvert.
+    # Les blocs d'un même rang étant disjoints par équipement, le dernier bloc ouvert est le bloc actif.
+    positions = np.arange(len(ev_time))
+    winner_block = np.full(len(ev_time), -1, dtype=np.int64)
+    for rank in range(n_ranks - 1, -1, -1):
+        is_rank = ev_rank == rank
+        coverage = np.cumsum(np.where(is_rank, ev_delta, 0))
+        last_open = np.maximum.accumulate(np.where(is_rank & (ev_delta > 0), positions, 0))
+        winner_block = np.where(coverage > 0, ev_block[last_open], winner_block)
+
+    # Segments élémentaires entre deux événements consécutifs du même équipement
+    seg = np.flatnonzero((ev_eq[:-1] == ev_eq[1:]) & (ev_time[:-1] < ev_time[1:]) & (winner_block[:-1] >= 0))
+    seg_start, seg_end, seg_block = ev_time[seg], ev_time[seg + 1], winner_block[seg]
+
+    # --- 3. Recollage des segments contigus attribués au même bloc ---
+    if len(seg):
+        new_segment = np.r_[True, (seg_block[1:] != seg_block[:-1]) | (seg_start[1:] != seg_end[:-1])]
+        seg_first = np.flatnonzero(new_segment)
+        seg_last = np.r_[seg_first[1:] - 1, len(seg) - 1]
+        seg_start, seg_end, seg_block = seg_start[seg_first], seg_end[seg_last], seg_block[seg_first]
+
+    return pd.DataFrame({
+        'equipment_id': np.asarray(eq_values, dtype=object)[block_eq[seg_block]],
+        'downtime_category': block_category[seg_block],
+        'downtime_reason': block_reason[seg_block],
+        'start_time': _from_ns(seg_start),
+        'end_time': _from_ns(seg_end),
+    })
+
+
+def clip_intervals(intervals_df, start_time, end_time):
+    """
+    Découpe des intervalles sur [start_time, end_time) et ajoute la durée effective (duration_seconds).
+    Les intervalles sans intersection avec la période sont retirés.
+    """
+    starts = np.maximum(_to_ns(intervals_df['start_time']), pd.Timestamp(start_time).value)
+    ends = np.minimum(_to_ns(intervals_df['end_time']), pd.Timestamp(end_time).value)
+    keep = ends > starts
+    clipped = intervals_df[keep].copy()
+    clipped['start_time'] = _from_ns(starts[keep])
+    clipped['end_time'] = _from_ns(ends[keep])
+    clipped['duration_seconds'] = (ends[keep] - starts[keep]) / 1e9
+    return clipped
+
+
+def durations_by_bucket(intervals_df, bucket_edges, by=('equipment_id', 'downtime_category', 'downtime_reason')):
+    """
+    Répartit la durée d'intervalles (de préférence disjoints, cf. resolve_downtime_intervals) sur des
+    tranches contiguës [bucket_edges[i], bucket_edges[i+1]). Retourne une ligne par (by..., bucket_start).
+    """
+    edges = _to_ns(bucket_edges)
+    starts, ends = _to_ns(intervals_df['start_time']), _to_ns(intervals_df['end_time'])
+
+    first_bucket = np.clip(np.searchsorted(edges, starts, side='right') - 1, 0, len(edges) - 2)
+    last_bucket = np.clip(np.searchsorted(edges, ends, side='left') - 1, 0, len(edges) - 2)
+    inside = (ends > edges[0]) & (starts < edges[-1])
+    counts = np.where(inside, last_bucket - first_bucket + 1, 0)
+
+    # Une ligne par couple (intervalle, tranche touchée)
+    row = np.repeat(np.arange(len(intervals_df)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    bucket = first_bucket[row] + offsets
+    overlap = np.minimum(ends[row], edges[bucket + 1]) - np.maximum(starts[row], edges[bucket])
+
+    exploded = intervals_df.iloc[row][list(by)].reset_index(drop=True)
+    exploded['bucket_start'] = _from_ns(edges[bucket])
+    exploded['duration_seconds'] = overlap / 1e9
+    exploded = exploded[exploded['duration_seconds'] > 0]
+    return exploded.groupby(list(by) + ['bucket_start'], as_index=False, observed=True)['duration_seconds'].sum()
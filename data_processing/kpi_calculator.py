@@ -2,10 +2,44 @@ import pandas as pd
 import numpy as np
 from datetime import timedelta
 from data_processing.db_connection import get_db_connection
+from data_processing.interval_engine import resolve_downtime_intervals, clip_intervals
+from data_processing.typed_reader import DATETIME, TABLE_SCHEMAS, apply_schema, read_sql_typed
+from data_processing.sensor_layout import (
+    SENSOR_STORAGE_LAYOUT, long_to_wide, wide_to_long, read_wide_sensor_data, read_long_sensor_data, read_sensor_readings
+)
+from data_processing.sensor_pyramid import SENSOR_PYRAMID_ENABLED, choose_sensor_level, read_sensor_level
+from data_processing.segment_cache import RANGE_CACHE_ENABLED, get_range_cache
+from data_processing.sensor_archive import SENSOR_ARCHIVE_ENABLED, get_archive_cutoff, read_archived_sensor_data
+from data_processing.metadata_registry import METADATA_REGISTRY_ENABLED, get_metadata_registry
+
+# Catégories d'arrêt considérées comme planifiées (exclues du Temps Planifié)
+PLANNED_DOWNTIME_CATEGORIES = ['Planned Maintenance', 'Changeover']
+
+# Grandeurs additives par équipement à partir desquelles tous les KPIs peuvent être recalculés
+KPI_PARTIAL_COLUMNS = [
+    'production_records', 'total_produced', 'total_rejected', 'total_running_seconds',
+    'total_planned_downtime_seconds', 'total_unplanned_downtime_seconds', 'num_unplanned_incidents'
+]
+
+KPI_OUTPUT_COLUMNS = [
+    'equipment_id', 'equipment_name', 'production_line_id', 'equipment_type',
+    'oee', 'availability', 'performance', 'quality',
+    'total_produced', 'total_good', 'total_rejected', 'reject_rate',
+    'total_downtime_hours',
+    'mtbf_hours', 'mttr_hours', 'num_unplanned_incidents',
+    'average_actual_cycle_time_seconds', 'throughput_per_hour',
+    'run_time_hours', 'planned_production_time_hours'
+]
 
 
 def get_equipments_data():
-    """Récupère les données de la table 'equipments'."""
+    """Récupère les données de la table 'equipments' (depuis le registre en mémoire s'il est activé)."""
+    if METADATA_REGISTRY_ENABLED:
+        try:
+            return get_metadata_registry().get_equipments()
+        except Exception as e:
+            print(f"Erreur lors de la récupération des données équipements : {e}")
+            return pd.DataFrame()
     conn = get_db_connection()
     if conn:
         try:
@@ -22,7 +56,14 @@ def get_downtime_data(start_time=None, end_time=None, equipment_id=None):
     """
     Récupère les logs de downtime, éventuellement filtrés par temps et équipement.
     start_time et end_time devraient être des objets datetime Python.
+    Une période bornée est servie par le cache de segments journaliers (voir segment_cache).
     """
+    if RANGE_CACHE_ENABLED and start_time and end_time:
+        return get_range_cache().get('downtime_logs', start_time, end_time, equipment_id, read_downtime_data)
+    return read_downtime_data(start_time, end_time, equipment_id)
+
+def read_downtime_data(start_time=None, end_time=None, equipment_id=None):
+    """Lit les logs de downtime en base (sans cache)."""
     conn = get_db_connection()
     if conn:
         try:
@@ -45,9 +86,7 @@ def get_downtime_data(start_time=None, end_time=None, equipment_id=None):
             
             query += " ORDER BY equipment_id, start_time"
 
-            df = pd.read_sql(query, conn, params=params)
-            df['start_time'] = pd.to_datetime(df['start_time'])
-            df['end_time'] = pd.to_datetime(df['end_time'])
+            df = read_sql_typed(query, conn, params=params, table='downtime_logs')
             return df
         except Exception as e:
             print(f"Erreur lors de la récupération des logs de downtime : {e}")
@@ -60,7 +99,14 @@ def get_production_data(start_time=None, end_time=None, equipment_id=None):
     """
     Récupère les données de production, éventuellement filtrées par temps et équipement.
     start_time et end_time devraient être des objets datetime Python.
+    Une période bornée est servie par le cache de segments journaliers (voir segment_cache).
     """
+    if RANGE_CACHE_ENABLED and start_time and end_time:
+        return get_range_cache().get('production_output', start_time, end_time, equipment_id, read_production_data)
+    return read_production_data(start_time, end_time, equipment_id)
+
+def read_production_data(start_time=None, end_time=None, equipment_id=None):
+    """Lit les données de production en base (sans cache)."""
     conn = get_db_connection()
     if conn:
         try:
@@ -83,8 +129,7 @@ def get_production_data(start_time=None, end_time=None, equipment_id=None):
             if conditions:
                 query += " WHERE " + " AND ".join(conditions)
 
-            df = pd.read_sql(query, conn, params=params)
-            df['timestamp'] = pd.to_datetime(df['timestamp'])
+            df = read_sql_typed(query, conn, params=params, table='production_output')
             return df
         except Exception as e:
             print(f"Erreur lors de la récupération des données de production : {e}")
@@ -97,22 +142,16 @@ def get_production_data(start_time=None, end_time=None, equipment_id=None):
 def calculate_effective_downtime_in_period(downtimes_df, start_time, end_time):
     """
     Calcule la durée effective des downtimes à l'intérieur d'une période donnée.
-    Retourne un DataFrame avec equipment_id, downtime_category, downtime_reason, effective_duration_seconds.
+    Les arrêts qui se chevauchent pour un même équipement sont d'abord fusionnés (voir
+    interval_engine.resolve_downtime_intervals) : chaque seconde n'est comptée qu'une fois.
+    Retourne un DataFrame avec equipment_id, downtime_category, downtime_reason, duration_seconds.
     """
-    downtimes_df['start_time'] = pd.to_datetime(downtimes_df['start_time'])
-    downtimes_df['end_time'] = pd.to_datetime(downtimes_df['end_time'])
-
-    # Filtre initial pour les arrêts qui ont une intersection avec la période
-    downtimes_in_period = downtimes_df[
-        (downtimes_df['start_time'] < end_time) & (downtimes_df['end_time'] > start_time)
-    ].copy()
+    downtime_segments = resolve_downtime_intervals(downtimes_df)
 
-    # Calculer la durée effective dans la période pour les arrêts à cheval
-    downtimes_in_period['effective_start'] = downtimes_in_period['start_time'].apply(lambda x: max(x, start_time))
-    downtimes_in_period['effective_end'] = downtimes_in_period['end_time'].apply(lambda x: min(x, end_time))
-    downtimes_in_period['effective_duration_seconds'] = (downtimes_in_period['effective_end'] - downtimes_in_period['effective_start']).dt.total_seconds()
+    # Durée effective dans la période pour les arrêts à cheval
+    downtimes_in_period = clip_intervals(downtime_segments, start_time, end_time)
 
-    effective_downtime_summary = downtimes_in_period.groupby(['equipment_id', 'downtime_category', 'downtime_reason'])['effective_duration_seconds'].sum().reset_index(name='duration_seconds')
+    effective_downtime_summary = downtimes_in_period.groupby(['equipment_id', 'downtime_category', 'downtime_reason'], observed=True)['duration_seconds'].sum().reset_index(name='duration_seconds')
 
     return effective_downtime_summary
 
@@ -122,26 +161,26 @@ def calculate_downtime_kpis(effective_downtime_summary):
     Calcule les KPIs liés aux temps d'arrêt à partir du résumé des temps d'arrêt effectifs.
     """
     # Total downtime par équipement (toutes catégories confondues)
-    total_downtime_seconds = effective_downtime_summary.groupby('equipment_id')['duration_seconds'].sum().reset_index(name='total_downtime_seconds')
+    total_downtime_seconds = effective_downtime_summary.groupby('equipment_id', observed=True)['duration_seconds'].sum().reset_index(name='total_downtime_seconds')
 
     # Séparer planned vs unplanned for MTBF/MTTR calculation later
     planned_downtime_seconds = effective_downtime_summary[
-        effective_downtime_summary['downtime_category'].isin(['Planned Maintenance', 'Changeover'])
-    ].groupby('equipment_id')['duration_seconds'].sum().reset_index(name='total_planned_downtime_seconds')
+        effective_downtime_summary['downtime_category'].isin(PLANNED_DOWNTIME_CATEGORIES)
+    ].groupby('equipment_id', observed=True)['duration_seconds'].sum().reset_index(name='total_planned_downtime_seconds')
 
     unplanned_downtime_seconds = effective_downtime_summary[
-        ~effective_downtime_summary['downtime_category'].isin(['Planned Maintenance', 'Changeover'])
-    ].groupby('equipment_id')['duration_seconds'].sum().reset_index(name='total_unplanned_downtime_seconds')
+        ~effective_downtime_summary['downtime_category'].isin(PLANNED_DOWNTIME_CATEGORIES)
+    ].groupby('equipment_id', observed=True)['duration_seconds'].sum().reset_index(name='total_unplanned_downtime_seconds')
     return total_downtime_seconds, planned_downtime_seconds, unplanned_downtime_seconds, effective_downtime_summary
 
 
 
 def calculate_production_kpis(production_df, equip_df):
     """Calcule les KPIs liés à la production, à la qualité et la performance."""
-    production_df['timestamp'] = pd.to_datetime(production_df['timestamp'])
+    apply_schema(production_df, {'timestamp': DATETIME}) # Sans effet si la colonne est déjà typée
 
     # Total produit et rejeté par équipement
-    production_summary = production_df.groupby('equipment_id').agg(
+    production_summary = production_df.groupby('equipment_id', observed=True).agg(
         total_produced=('quantity_produced', 'sum'),
         total_rejected=('quantity_rejected', 'sum'),
         total_running_seconds=('running_duration_seconds', 'sum') # Durée cumulée où la machine était "RUNNING" dans les logs de production
@@ -179,16 +218,9 @@ def calculate_oee_kpis(equip_df, total_downtime_df, production_summary_df, start
     merged_df = pd.merge(merged_df, total_downtime_df[['equipment_id', 'total_downtime_seconds']], on='equipment_id', how='left').fillna(0) # Remplir les NaN avec 0 si un équipement n'a pas eu d'arrêt
 
     # Pour les besoins de l'OEE, on doit aussi connaître les arrêts PLANIFIÉS pour calculer le Temps Planifié
-    # Récupérer les arrêts planifiés
-    planned_downtime_df = get_downtime_data(start_time, end_time).copy()
-    planned_downtime_df = planned_downtime_df[planned_downtime_df['downtime_category'].isin(['Planned Maintenance', 'Changeover'])]
-
-    # Calculer la durée effective dans la période pour les arrêts planifiés à cheval
-    planned_downtime_df['effective_start'] = planned_downtime_df['start_time'].apply(lambda x: max(x, start_time))
-    planned_downtime_df['effective_end'] = planned_downtime_df['end_time'].apply(lambda x: min(x, end_time))
-    planned_downtime_df['effective_duration_seconds'] = (planned_downtime_df['effective_end'] - planned_downtime_df['effective_start']).dt.total_seconds()
-
-    total_planned_downtime_seconds = planned_downtime_df.groupby('equipment_id')['effective_duration_seconds'].sum().reset_index(name='total_planned_downtime_seconds')
+    # Une seule lecture des arrêts, fusionnés puis découpés sur la période (sans double comptage)
+    effective_downtime_summary = calculate_effective_downtime_in_period(get_downtime_data(start_time, end_time), start_time, end_time)
+    _, total_planned_downtime_seconds, total_unplanned_downtime_seconds, _ = calculate_downtime_kpis(effective_downtime_summary)
 
     # Fusionner les arrêts planifiés avec le reste
     merged_df = pd.merge(merged_df, total_planned_downtime_seconds, on='equipment_id', how='left').fillna(0)
@@ -203,13 +235,6 @@ def calculate_oee_kpis(equip_df, total_downtime_df, production_summary_df, start
 
     # Disponibilité = (Temps Planifié - Temps d'Arrêt Total) / Temps Planifié
     # Total downtime includes planned and unplanned
-    unplanned_downtime_df = get_downtime_data(start_time, end_time).copy()
-    unplanned_downtime_df = unplanned_downtime_df[~unplanned_downtime_df['downtime_category'].isin(['Planned Maintenance', 'Changeover'])]
-    unplanned_downtime_df['effective_start'] = unplanned_downtime_df['start_time'].apply(lambda x: max(x, start_time))
-    unplanned_downtime_df['effective_end'] = unplanned_downtime_df['end_time'].apply(lambda x: min(x, end_time))
-    unplanned_downtime_df['effective_duration_seconds'] = (unplanned_downtime_df['effective_end'] - unplanned_downtime_df['effective_start']).dt.total_seconds()
-    total_unplanned_downtime_seconds = unplanned_downtime_df.groupby('equipment_id')['effective_duration_seconds'].sum().reset_index(name='total_unplanned_downtime_seconds')
-
     merged_df = pd.merge(merged_df, total_unplanned_downtime_seconds, on='equipment_id', how='left').fillna(0)
 
     # Temps de Fonctionnement = Temps Planifié - Temps d'Arrêt Imprévu
@@ -247,25 +272,29 @@ def calculate_oee_kpis(equip_df, total_downtime_df, production_summary_df, start
 
     return merged_df[['equipment_id', 'availability', 'performance', 'quality', 'oee', 'total_produced', 'total_good', 'total_rejected', 'total_downtime_seconds', 'total_planned_downtime_seconds', 'total_unplanned_downtime_seconds', 'run_time_seconds', 'planned_production_time_seconds']]
 
-def calculate_mtbf_mttr(downtimes_df, run_time_seconds_df, start_time, end_time):
+def calculate_mtbf_mttr(downtimes_df, run_time_seconds_df, start_time, end_time, effective_downtime_summary=None):
     """
     Calcule le MTBF et le MTTR basés sur les arrêts IMPRÉVUS.
     run_time_seconds_df doit contenir 'equipment_id' et 'run_time_seconds'.
+    effective_downtime_summary (résultat de calculate_effective_downtime_in_period) peut être fourni
+    pour éviter de refusionner les intervalles.
     """
     # Filter for unplanned downtimes that *start* within the period for COUNTING incidents
     unplanned_downtimes_starting_in_period = downtimes_df[
         (downtimes_df['start_time'] >= start_time) &
         (downtimes_df['start_time'] < end_time) &
-        (~downtimes_df['downtime_category'].isin(['Planned Maintenance', 'Changeover']))].copy()
+        (~downtimes_df['downtime_category'].isin(PLANNED_DOWNTIME_CATEGORIES))].copy()
 
     # Count the number of unplanned incidents starting in the period
-    unplanned_incident_counts = unplanned_downtimes_starting_in_period.groupby('equipment_id').size().reset_index(name='num_unplanned_incidents')
+    unplanned_incident_counts = unplanned_downtimes_starting_in_period.groupby('equipment_id', observed=True).size().reset_index(name='num_unplanned_incidents')
 
     # Sum effective duration for MTTR calculation (use effective duration from the period)
-    effective_unplanned_downtime_in_period = calculate_effective_downtime_in_period(downtimes_df, start_time, end_time)
+    if effective_downtime_summary is None:
+        effective_downtime_summary = calculate_effective_downtime_in_period(downtimes_df, start_time, end_time)
+    effective_unplanned_downtime_in_period = effective_downtime_summary
     total_unplanned_downtime_effective_seconds = effective_unplanned_downtime_in_period[
-         ~effective_unplanned_downtime_in_period['downtime_category'].isin(['Planned Maintenance', 'Changeover'])
-    ].groupby('equipment_id')['duration_seconds'].sum().reset_index(name='total_unplanned_downtime_effective_seconds')
+         ~effective_unplanned_downtime_in_period['downtime_category'].isin(PLANNED_DOWNTIME_CATEGORIES)
+    ].groupby('equipment_id', observed=True)['duration_seconds'].sum().reset_index(name='total_unplanned_downtime_effective_seconds')
 
 
     # Fusionner les données nécessaires
@@ -293,6 +322,149 @@ def calculate_mtbf_mttr(downtimes_df, run_time_seconds_df, start_time, end_time)
     return mtbf_mttr_df[['equipment_id', 'mtbf_hours', 'mttr_hours', 'num_unplanned_incidents', 'total_unplanned_downtime_effective_seconds']]
 
 
+def build_empty_kpis(equipments_in_scope):
+    """
+    Construit le DataFrame de KPIs par défaut (zéros / NaN) pour des équipements sans aucune activité.
+    equipments_in_scope doit contenir les colonnes descriptives des équipements.
+    """
+    equipments_in_scope = equipments_in_scope.copy()
+
+    # Create columns with default NaN/0 values
+    kpi_cols_defaults = {
+        'oee': 0.0, 'availability': 0.0, 'performance': 0.0, 'quality': 0.0,
+        'total_produced': 0, 'total_good': 0, 'total_rejected': 0, 'reject_rate': np.nan, # Use NaN for rates/means where denominator is zero
+        'total_downtime_seconds': 0, 'total_planned_downtime_seconds': 0, 'total_unplanned_downtime_seconds': 0,
+        'run_time_seconds': 0, 'planned_production_time_seconds': 0,
+        'average_actual_cycle_time_seconds': np.nan, 'throughput_per_hour': np.nan,
+        'mtbf_seconds': np.nan, 'mttr_seconds': np.nan, 'num_unplanned_incidents': 0
+    }
+    for col, default_val in kpi_cols_defaults.items():
+         equipments_in_scope[col] = default_val
+
+    # Convert durations to hours for final output
+    equipments_in_scope['total_downtime_hours'] = equipments_in_scope['total_downtime_seconds'] / 3600
+    equipments_in_scope['run_time_hours'] = equipments_in_scope['run_time_seconds'] / 3600
+    equipments_in_scope['planned_production_time_hours'] = equipments_in_scope['planned_production_time_seconds'] / 3600
+
+    # Ensure all columns exist in the result
+    output_cols = [col for col in KPI_OUTPUT_COLUMNS if col in equipments_in_scope.columns]
+
+    return equipments_in_scope[output_cols]
+
+
+def calculate_kpi_partials(downtimes_df, production_df, start_time, end_time):
+    """
+    Calcule les grandeurs additives (KPI_PARTIAL_COLUMNS) par équipement pour une période.
+    downtimes_df et production_df sont les données brutes (get_downtime_data / get_production_data).
+    """
+    partials = []
+
+    if not production_df.empty:
+        partials.append(production_df.groupby('equipment_id', observed=True).agg(
+            production_records=('quantity_produced', 'size'),
+            total_produced=('quantity_produced', 'sum'),
+            total_rejected=('quantity_rejected', 'sum'),
+            total_running_seconds=('running_duration_seconds', 'sum')
+        ))
+
+    if not downtimes_df.empty:
+        effective_downtime_summary = calculate_effective_downtime_in_period(downtimes_df, start_time, end_time)
+        is_planned = effective_downtime_summary['downtime_category'].isin(PLANNED_DOWNTIME_CATEGORIES)
+        partials.append(effective_downtime_summary[is_planned].groupby('equipment_id', observed=True)['duration_seconds'].sum().rename('total_planned_downtime_seconds'))
+        partials.append(effective_downtime_summary[~is_planned].groupby('equipment_id', observed=True)['duration_seconds'].sum().rename('total_unplanned_downtime_seconds'))
+
+        # Incidents imprévus COMMENÇANT dans la période (même règle que calculate_mtbf_mttr)
+        unplanned_starting = downtimes_df[
+            (downtimes_df['start_time'] >= start_time) & (downtimes_df['start_time'] < end_time) &
+            (~downtimes_df['downtime_category'].isin(PLANNED_DOWNTIME_CATEGORIES))]
+        partials.append(unplanned_starting.groupby('equipment_id', observed=True).size().rename('num_unplanned_incidents'))
+
+    if not partials:
+        return pd.DataFrame(columns=['equipment_id'] + KPI_PARTIAL_COLUMNS)
+
+    partials_df = pd.concat(partials, axis=1).reindex(columns=KPI_PARTIAL_COLUMNS).fillna(0)
+    for col in ['production_records', 'total_produced', 'total_rejected', 'num_unplanned_incidents']:
+        partials_df[col] = partials_df[col].astype('int64')
+    partials_df.index.name = 'equipment_id'
+    return partials_df.reset_index()
+
+
+def add_kpi_times(kpis_df, start_time, end_time):
+    """
+    Ajoute les temps dérivés par équipement (Temps Planifié, Temps de Fonctionnement, etc.).
+    Ces colonnes restent additives entre équipements : elles peuvent être sommées par ligne ou usine.
+    kpis_df doit contenir KPI_PARTIAL_COLUMNS et ideal_cycle_time_seconds.
+    """
+    kpis_df = kpis_df.copy()
+    kpis_df['total_good'] = kpis_df['total_produced'] - kpis_df['total_rejected']
+    kpis_df['total_downtime_seconds'] = kpis_df['total_planned_downtime_seconds'] + kpis_df['total_unplanned_downtime_seconds']
+
+    period_duration_seconds = (end_time - start_time).total_seconds()
+    kpis_df['planned_production_time_seconds'] = period_duration_seconds - kpis_df['total_planned_downtime_seconds']
+    kpis_df['run_time_seconds'] = (kpis_df['planned_production_time_seconds'] - kpis_df['total_unplanned_downtime_seconds']).clip(lower=0)
+
+    # Temps Complètement Productif = Quantité Totale * Temps Cycle Idéal (numérateur de la Performance)
+    kpis_df['fully_productive_time_seconds'] = kpis_df['total_produced'] * kpis_df['ideal_cycle_time_seconds']
+    return kpis_df
+
+
+# Colonnes additives après add_kpi_times (sommables pour un agrégat de plusieurs équipements)
+KPI_ADDITIVE_COLUMNS = KPI_PARTIAL_COLUMNS + [
+    'total_good', 'total_downtime_seconds', 'planned_production_time_seconds', 'run_time_seconds', 'fully_productive_time_seconds'
+]
+
+
+def calculate_kpi_ratios(kpis_df):
+    """
+    Calcule les ratios (OEE, facteurs, taux, moyennes) à partir des colonnes KPI_ADDITIVE_COLUMNS.
+    Mêmes conventions que calculate_all_kpis : NaN si le dénominateur est nul, rempli par 0 ensuite.
+    """
+    kpis_df = kpis_df.copy()
+    produced = kpis_df['total_produced'].astype(float)
+    running = kpis_df['total_running_seconds'].astype(float)
+    incidents = kpis_df['num_unplanned_incidents'].astype(float)
+    planned = kpis_df['planned_production_time_seconds'].astype(float)
+    run = kpis_df['run_time_seconds'].astype(float)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        kpis_df['availability'] = np.where(planned > 0, run / planned, np.nan)
+        kpis_df['performance'] = np.where(run > 0, np.minimum(1.0, kpis_df['fully_productive_time_seconds'] / run), np.nan)
+        kpis_df['quality'] = np.where(produced > 0, kpis_df['total_good'] / produced, np.nan)
+        kpis_df['reject_rate'] = np.where(produced > 0, kpis_df['total_rejected'] / produced, np.nan)
+        kpis_df['average_actual_cycle_time_seconds'] = np.where(produced > 0, running / produced, np.nan)
+        kpis_df['throughput_per_hour'] = np.where(running > 0, produced / (running / 3600), np.nan)
+        kpis_df['mtbf_hours'] = np.where(incidents > 0, run / incidents, np.nan) / 3600
+        kpis_df['mttr_hours'] = np.where(incidents > 0, kpis_df['total_unplanned_downtime_seconds'] / incidents, np.nan) / 3600
+    kpis_df['oee'] = kpis_df['availability'] * kpis_df['performance'] * kpis_df['quality']
+
+    kpis_df['total_downtime_hours'] = kpis_df['total_downtime_seconds'] / 3600
+    kpis_df['run_time_hours'] = kpis_df['run_time_seconds'] / 3600
+    kpis_df['planned_production_time_hours'] = kpis_df['planned_production_time_seconds'] / 3600
+
+    numeric_output_cols = [col for col in KPI_OUTPUT_COLUMNS if col in kpis_df.select_dtypes(include=np.number).columns]
+    kpis_df[numeric_output_cols] = kpis_df[numeric_output_cols].fillna(0)
+    for col in ['oee', 'availability', 'performance', 'quality', 'reject_rate']:
+        kpis_df[col] = kpis_df[col].clip(0.0, 1.0)
+    return kpis_df
+
+
+def calculate_kpis_from_partials(partials_df, equip_df, start_time, end_time):
+    """
+    Calcule les KPIs finaux à partir des grandeurs additives par équipement (voir KPI_PARTIAL_COLUMNS).
+    Produit le même DataFrame que calculate_all_kpis : seuls les équipements ayant des relevés de
+    production dans la période apparaissent, sauf si aucune activité n'existe (KPIs par défaut).
+    """
+    equipments_in_scope = equip_df[['equipment_id', 'equipment_name', 'equipment_type', 'production_line_id', 'ideal_cycle_time_seconds']].copy()
+    if partials_df.empty or not (partials_df[KPI_PARTIAL_COLUMNS].to_numpy() != 0).any():
+        return build_empty_kpis(equipments_in_scope)
+
+    kpis_df = partials_df[partials_df['production_records'] > 0].copy()
+    kpis_df = kpis_df.merge(equipments_in_scope, on='equipment_id', how='left').sort_values('equipment_id').reset_index(drop=True)
+
+    kpis_df = calculate_kpi_ratios(add_kpi_times(kpis_df, start_time, end_time))
+    return kpis_df[KPI_OUTPUT_COLUMNS]
+
+
 # --- Fonction pour Calculer TOUS les KPIs ---
 
 def calculate_all_kpis(start_time, end_time, equipment_id=None):
@@ -321,40 +493,17 @@ def calculate_all_kpis(start_time, end_time, equipment_id=None):
     
     if downtimes_data_raw.empty and production_data_raw.empty:
         print("Attention : Aucune donnée de downtime ou de production trouvée pour la période/équipement spécifié.")
-        
-
-        # Create columns with default NaN/0 values
-        kpi_cols_defaults = {
-            'oee': 0.0, 'availability': 0.0, 'performance': 0.0, 'quality': 0.0,
-            'total_produced': 0, 'total_good': 0, 'total_rejected': 0, 'reject_rate': np.nan, # Use NaN for rates/means where denominator is zero
-            'total_downtime_seconds': 0, 'total_planned_downtime_seconds': 0, 'total_unplanned_downtime_seconds': 0,
-            'run_time_seconds': 0, 'planned_production_time_seconds': 0,
-            'average_actual_cycle_time_seconds': np.nan, 'throughput_per_hour': np.nan,
-            'mtbf_seconds': np.nan, 'mttr_seconds': np.nan, 'num_unplanned_incidents': 0
-        }
-        for col, default_val in kpi_cols_defaults.items():
-             equipments_in_scope[col] = default_val
-
-        # Convert durations to hours for final output
-        equipments_in_scope['total_downtime_hours'] = equipments_in_scope['total_downtime_seconds'] / 3600
-        equipments_in_scope['run_time_hours'] = equipments_in_scope['run_time_seconds'] / 3600
-        equipments_in_scope['planned_production_time_hours'] = equipments_in_scope['planned_production_time_seconds'] / 3600
-
-        output_cols = [ # Define order for final output
-            'equipment_id', 'equipment_name', 'production_line_id', 'equipment_type',
-            'oee', 'availability', 'performance', 'quality',
-            'total_produced', 'total_good', 'total_rejected', 'reject_rate',
-            'total_downtime_hours',
-            'mtbf_hours', 'mttr_hours', 'num_unplanned_incidents',
-            'average_actual_cycle_time_seconds', 'throughput_per_hour',
-            'run_time_hours', 'planned_production_time_hours'
-        ]
-        # Ensure all columns exist in the result
-        output_cols = [col for col in output_cols if col in equipments_in_scope.columns]
-
-        return equipments_in_scope[output_cols]
+        return build_empty_kpis(equipments_in_scope)
 
+    return calculate_kpis_from_data(equip_data, equip_data_filtered, downtimes_data_raw, production_data_raw, start_time, end_time)
 
+
+def calculate_kpis_from_data(equip_data, equip_data_filtered, downtimes_data_raw, production_data_raw, start_time, end_time):
+    """
+    Étapes de calcul de calculate_all_kpis sur des données brutes déjà lues (arrêts et production des
+    équipements de equip_data_filtered). Chaque équipement est calculé indépendamment des autres :
+    le résultat pour un sous-ensemble d'équipements est le sous-ensemble du résultat global.
+    """
     # --- Étape 1 : Calculer les durées d'arrêt effectives ---
     effective_downtime_summary = calculate_effective_downtime_in_period(downtimes_data_raw, start_time, end_time)
 
@@ -418,7 +567,7 @@ def calculate_all_kpis(start_time, end_time, equipment_id=None):
     # --- Étape 5 : Calculer MTBF/MTTR ---
     # MTBF/MTTR nécessitent le Run Time (calculé dans l'étape OEE) et le *nombre* d'incidents imprévus commençant dans la période
     # Pass the already calculated run_time_seconds from oee_intermediate_df
-    mtbf_mttr_df = calculate_mtbf_mttr(downtimes_data_raw, oee_intermediate_df[['equipment_id', 'run_time_seconds']], start_time, end_time)
+    mtbf_mttr_df = calculate_mtbf_mttr(downtimes_data_raw, oee_intermediate_df[['equipment_id', 'run_time_seconds']], start_time, end_time, effective_downtime_summary)
 
 
     # --- Étape 6 : Consolider tous les résultats dans un seul DataFrame ---
@@ -435,12 +584,8 @@ def calculate_all_kpis(start_time, end_time, equipment_id=None):
     # Add equipment info for context (name, type, line)
     final_kpis_df = final_kpis_df.merge(equip_data[['equipment_id', 'equipment_name', 'equipment_type', 'production_line_id']], on='equipment_id', how='left')
 
-    # Add remaining KPIs from prod_kpis_df that were not already in oee_intermediate_df
-    # These include: reject_rate, average_actual_cycle_time_seconds, throughput_per_hour
-    final_kpis_df = final_kpis_df.merge(
-        prod_kpis_df[['equipment_id', 'reject_rate', 'average_actual_cycle_time_seconds', 'throughput_per_hour']],
-        on='equipment_id', how='left'
-    )
+    # reject_rate, average_actual_cycle_time_seconds et throughput_per_hour viennent déjà de prod_kpis_df
+    # (oee_intermediate_df en est issu) : les re-fusionner créerait des colonnes _x/_y absentes de la sortie
 
 
     # Convert durations from seconds to hours for display
@@ -450,16 +595,7 @@ def calculate_all_kpis(start_time, end_time, equipment_id=None):
 
 
     # Define the desired order and subset of columns for the final output
-    output_cols = [
-        'equipment_id', 'equipment_name', 'production_line_id', 'equipment_type',
-        'oee', 'availability', 'performance', 'quality',
-        'total_produced', 'total_good', 'total_rejected', 'reject_rate',
-        'total_downtime_hours', # Use hours for display
-        'mtbf_hours', 'mttr_hours', 'num_unplanned_incidents',
-        'average_actual_cycle_time_seconds', 'throughput_per_hour',
-        'run_time_hours', 'planned_production_time_hours'
-        # Add other columns as needed for the dashboard
-    ]
+    output_cols = KPI_OUTPUT_COLUMNS
 
     # Ensure all output columns exist in the final DataFrame (handle potential missing columns after merges)
     # Fill missing essential columns with default values before selecting final columns
@@ -514,8 +650,8 @@ def count_downtimes_by_reason(downtimes_df, start_time, end_time, equipment_id=N
     Compte le nombre d'incidents de downtime par catégorie et raison pour une période.
     Utilise les arrêts qui COMMENCENT dans la période pour le comptage.
     """
-    # Assurez-vous que les timestamps sont des objets datetime
-    downtimes_df['start_time'] = pd.to_datetime(downtimes_df['start_time'])
+    # Assurez-vous que les timestamps sont des objets datetime (sans effet si la colonne est déjà typée)
+    apply_schema(downtimes_df, {'start_time': DATETIME})
 
     # Filter for downtimes starting within the period
     downtimes_in_period = downtimes_df[
@@ -526,7 +662,7 @@ def count_downtimes_by_reason(downtimes_df, start_time, end_time, equipment_id=N
         downtimes_in_period = downtimes_in_period[downtimes_in_period['equipment_id'] == equipment_id]
 
     # Count incidents by grouping
-    downtime_counts = downtimes_in_period.groupby(['equipment_id', 'downtime_category', 'downtime_reason']).size().reset_index(name='incident_count')
+    downtime_counts = downtimes_in_period.groupby(['equipment_id', 'downtime_category', 'downtime_reason'], observed=True).size().reset_index(name='incident_count')
 
     effective_downtime_summary = calculate_effective_downtime_in_period(downtimes_df, start_time, end_time)
     downtime_counts = pd.merge(downtime_counts, effective_downtime_summary, on=['equipment_id', 'downtime_category', 'downtime_reason'], how='left').fillna(0)
@@ -537,6 +673,12 @@ def count_downtimes_by_reason(downtimes_df, start_time, end_time, equipment_id=N
 
 def get_all_equipment_details():
     """Récupère tous les equipment_id et equipment_name."""
+    if METADATA_REGISTRY_ENABLED:
+        try:
+            return get_metadata_registry().get_equipments()[['equipment_id', 'equipment_name', 'production_line_id']]
+        except Exception as e:
+            print(f"Erreur lors de la récupération des détails équipements : {e}")
+            return pd.DataFrame()
     conn = get_db_connection()
     if conn:
         try:
@@ -549,39 +691,44 @@ def get_all_equipment_details():
             conn.close()
     return pd.DataFrame()
 
-def get_sensor_data(start_time=None, end_time=None, equipment_id=None, sensor_type=None):
+def get_sensor_data(start_time=None, end_time=None, equipment_id=None, sensor_type=None, shape='long', points=None, level=None):
     """
     Récupère les relevés de capteurs, éventuellement filtrés par temps, équipement et type de capteur.
     start_time et end_time devraient être des objets datetime Python.
+    shape='long' : une ligne par relevé (timestamp, equipment_id, sensor_type, value, unit).
+    shape='wide' : une ligne par (timestamp, equipment_id) et une colonne par capteur (unités dans attrs['units']).
+    Les deux formes sont disponibles quelle que soit la table de stockage (SENSOR_STORAGE_LAYOUT).
+    points : nombre de points souhaité par série (affichage). Si la pyramide est activée et que la
+    fenêtre est longue, les agrégats du niveau adapté sont lus à la place des relevés bruts
+    (value = moyenne de la tranche, voir sensor_pyramid). attrs['resolution'] indique le niveau lu.
+    level : niveau de la pyramide imposé (ex. requête hors budget, voir admission), sinon choisi selon points.
     """
+    if level is None and SENSOR_PYRAMID_ENABLED:
+        level = choose_sensor_level(start_time, end_time, points)
     conn = get_db_connection()
     if conn:
         try:
-            query = "SELECT timestamp, equipment_id, sensor_type, value, unit FROM sensor_readings"
-            conditions = []
-            params = {}
-
-            if start_time:
-                conditions.append("timestamp >= %(start_time)s")
-                params['start_time'] = start_time
-            if end_time:
-                conditions.append("timestamp <= %(end_time)s")
-                params['end_time'] = end_time
-            if equipment_id:
-                conditions.append("equipment_id = %(equipment_id)s")
-                params['equipment_id'] = equipment_id
-            if sensor_type:
-                conditions.append("sensor_type = %(sensor_type)s")
-                params['sensor_type'] = sensor_type
-
-            if conditions:
-                query += " WHERE " + " AND ".join(conditions)
-
-            query += " ORDER BY timestamp" # Ordonner par temps pour les séries temporelles
-
-            df = pd.read_sql(query, conn, params=params)
-            df['timestamp'] = pd.to_datetime(df['timestamp']) # S'assurer que le timestamp est un objet datetime
-            return df
+            if level is not None:
+                df = read_sensor_level(conn, level, start_time, end_time, equipment_id, sensor_type)
+                df = long_to_wide(df) if shape == 'wide' else df
+                df.attrs['resolution'] = level
+                return df
+
+            cutoff = get_archive_cutoff() if SENSOR_ARCHIVE_ENABLED else None
+            if cutoff is not None and (start_time is None or start_time < cutoff):
+                # Relevés antérieurs à cutoff dans l'archive froide, suivants en base
+                df = read_archived_sensor_data(start_time, end_time, equipment_id, sensor_type)
+                if end_time is None or end_time >= cutoff:
+                    hot_df = read_sensor_readings(conn, cutoff.to_pydatetime(), end_time, equipment_id, sensor_type)
+                    df = apply_schema(pd.concat([df, hot_df], ignore_index=True), TABLE_SCHEMAS['sensor_readings'])
+                return long_to_wide(df) if shape == 'wide' else df
+
+            if SENSOR_STORAGE_LAYOUT == 'wide':
+                wide_df = read_wide_sensor_data(conn, start_time, end_time, equipment_id, sensor_type)
+                return wide_df if shape == 'wide' else wide_to_long(wide_df)
+
+            df = read_long_sensor_data(conn, start_time, end_time, equipment_id, sensor_type)
+            return long_to_wide(df) if shape == 'wide' else df
         except Exception as e:
             print(f"Erreur lors de la récupération des données de capteurs : {e}")
             return pd.DataFrame()
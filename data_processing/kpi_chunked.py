@@ -0,0 +1,131 @@
+import os
+import pandas as pd
+from data_processing.db_connection import get_db_connection
+from data_processing.typed_reader import TABLE_SCHEMAS, apply_schema
+from data_processing.kpi_calculator import (
+    KPI_PARTIAL_COLUMNS, get_equipments_data, calculate_kpi_partials, calculate_kpis_from_partials
+)
+
+# Calcul des KPIs à mémoire bornée pour les longues périodes.
+# Au lieu de charger toute la période en un DataFrame, les lignes sont lues par un curseur serveur
+# (nommé) par blocs de KPI_CHUNK_ROWS, et chaque bloc est replié dans des accumulateurs additifs
+# par équipement (KPI_PARTIAL_COLUMNS). Les KPIs finaux sont calculés à partir des accumulateurs :
+# mêmes résultats que calculate_all_kpis, avec une mémoire fixée par la taille des blocs.
+
+KPI_CHUNK_ROWS = int(os.getenv("KPI_CHUNK_ROWS", "100000"))
+# Au-delà de cette durée, /api/kpis passe en mode par blocs
+KPI_CHUNKED_THRESHOLD_DAYS = float(os.getenv("KPI_CHUNKED_THRESHOLD_DAYS", "90"))
+
+
+def iter_query_chunks(conn, query, params, table, chunk_rows=KPI_CHUNK_ROWS):
+    """
+    Exécute la requête sur un curseur serveur : PostgreSQL n'envoie que chunk_rows lignes à la fois.
+    Chaque bloc est typé selon TABLE_SCHEMAS[table].
+    """
+    with conn.cursor(name=f"kpi_chunked_{table}") as cursor:
+        cursor.itersize = chunk_rows
+        cursor.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows:
+                break
+            columns = [desc[0] for desc in cursor.description]
+            yield apply_schema(pd.DataFrame.from_records(rows, columns=columns), TABLE_SCHEMAS.get(table, {}))
+
+
+def _accumulate(accumulator, partials_df):
+    partials_df = partials_df.set_index('equipment_id')
+    partials_df.index = partials_df.index.astype(str)
+    if accumulator is None:
+        return partials_df
+    return accumulator.add(partials_df, fill_value=0)
+
+
+def fold_production_chunks(chunks, start_time, end_time, accumulator=None):
+    """Replie des blocs de production_output dans les accumulateurs (sommes par équipement)."""
+    for chunk in chunks:
+        accumulator = _accumulate(accumulator, calculate_kpi_partials(pd.DataFrame(), chunk, start_time, end_time))
+    return accumulator
+
+
+def fold_downtime_chunks(chunks, start_time, end_time, accumulator=None):
+    """
+    Replie des blocs de downtime_logs triés par (equipment_id, start_time).
+    Les arrêts d'un même équipement peuvent se chevaucher : un équipement n'est résolu qu'une fois
+    toutes ses lignes lues. Les lignes du dernier équipement d'un bloc sont reportées sur le suivant
+    (la mémoire est donc bornée par max(chunk_rows, arrêts d'un équipement sur la période)).
+    """
+    carry = None
+    for chunk in chunks:
+        if carry is not None:
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+        last_equipment = chunk['equipment_id'].iloc[-1]
+        is_last = (chunk['equipment_id'] == last_equipment).to_numpy()
+        complete, carry = chunk[~is_last], chunk[is_last]
+        if not complete.empty:
+            accumulator = _accumulate(accumulator, calculate_kpi_partials(complete, pd.DataFrame(), start_time, end_time))
+    if carry is not None and not carry.empty:
+        accumulator = _accumulate(accumulator, calculate_kpi_partials(carry, pd.DataFrame(), start_time, end_time))
+    return accumulator
+
+
+def calculate_kpi_partials_chunked(start_time, end_time, equipment_id=None, chunk_rows=KPI_CHUNK_ROWS):
+    """Grandeurs additives par équipement (comme calculate_kpi_partials) lues et repliées par blocs."""
+    params = {'start_time': start_time, 'end_time': end_time}
+    equipment_filter = ""
+    if equipment_id:
+        equipment_filter = " AND equipment_id = %(equipment_id)s"
+        params['equipment_id'] = equipment_id
+
+    # Mêmes filtres que get_production_data / get_downtime_data, colonnes utiles uniquement
+    production_query = (
+        "SELECT equipment_id, quantity_produced, quantity_rejected, running_duration_seconds FROM production_output "
+        "WHERE timestamp >= %(start_time)s AND timestamp <= %(end_time)s" + equipment_filter
+    )
+    downtime_query = (
+        "SELECT equipment_id, start_time, end_time, downtime_category, downtime_reason FROM downtime_logs "
+        "WHERE end_time > %(start_time)s AND start_time < %(end_time)s" + equipment_filter +
+        " ORDER BY equipment_id, start_time"
+    )
+
+    conn = get_db_connection()
+    try:
+        accumulator = fold_production_chunks(
+            iter_query_chunks(conn, production_query, params, 'production_output', chunk_rows), start_time, end_time)
+        accumulator = fold_downtime_chunks(
+            iter_query_chunks(conn, downtime_query, params, 'downtime_logs', chunk_rows), start_time, end_time, accumulator)
+    finally:
+        conn.close()
+
+    if accumulator is None:
+        return pd.DataFrame(columns=['equipment_id'] + KPI_PARTIAL_COLUMNS)
+    partials_df = accumulator.reindex(columns=KPI_PARTIAL_COLUMNS).fillna(0)
+    for col in ['production_records', 'total_produced', 'total_rejected', 'num_unplanned_incidents']:
+        partials_df[col] = partials_df[col].astype('int64')
+    partials_df.index.name = 'equipment_id'
+    return partials_df.reset_index()
+
+
+def calculate_all_kpis_chunked(start_time, end_time, equipment_id=None, chunk_rows=KPI_CHUNK_ROWS):
+    """Équivalent de calculate_all_kpis à mémoire bornée par chunk_rows."""
+    equip_data = get_equipments_data()
+    if equip_data.empty:
+        print("Attention : Impossible de récupérer les données équipements.")
+        return pd.DataFrame()
+
+    if equipment_id:
+        equip_data = equip_data[equip_data['equipment_id'] == equipment_id].copy()
+        if equip_data.empty:
+            print(f"Attention : Équipement {equipment_id} non trouvé dans les données équipements.")
+            return pd.DataFrame()
+
+    try:
+        partials_df = calculate_kpi_partials_chunked(start_time, end_time, equipment_id, chunk_rows)
+    except Exception as e:
+        print(f"Erreur lors du calcul des KPIs par blocs : {e}")
+        return pd.DataFrame()
+    return calculate_kpis_from_partials(partials_df, equip_data, start_time, end_time)
+
+
+def use_chunked_kpis(start_time, end_time):
+    return (end_time - start_time) >= pd.Timedelta(days=KPI_CHUNKED_THRESHOLD_DAYS)
@@ -0,0 +1,182 @@
+import os
+import numpy as np
+import pandas as pd
+from data_processing.db_connection import get_db_connection
+from data_processing.typed_reader import read_sql_typed
+from data_processing.interval_engine import resolve_downtime_intervals, durations_by_bucket
+from data_processing.kpi_calculator import (
+    KPI_PARTIAL_COLUMNS, PLANNED_DOWNTIME_CATEGORIES,
+    get_equipments_data, calculate_kpis_from_partials
+)
+from data_processing.kpi_rollup import rollup_kpis
+
+# Comparaison de KPIs sur plusieurs périodes (mois courant / mois précédent / même mois l'an dernier...).
+# Au lieu d'un appel /api/kpis par période (chacun relisant et recalculant tout), les arrêts et la
+# production de toutes les périodes sont lus en une requête par table (union des périodes fusionnées).
+# Les bornes de toutes les périodes découpent le temps en segments élémentaires : chaque relevé de
+# production, chaque incident et chaque intervalle d'arrêt résolu est affecté à son segment
+# (np.searchsorted, durations_by_bucket), les grandeurs additives sont sommées par (équipement, segment),
+# puis par période en additionnant les segments qu'elle couvre. Les périodes peuvent se chevaucher.
+
+KPI_COMPARE_MAX_WINDOWS = int(os.getenv("KPI_COMPARE_MAX_WINDOWS", "12"))
+
+# Colonnes dont l'écart entre périodes n'a pas de sens (identifiants et libellés)
+_KEY_COLUMNS = ['equipment_id', 'equipment_name', 'production_line_id', 'equipment_type', 'group_by', 'group_id']
+
+
+def merge_windows(windows):
+    """Plages disjointes couvrant l'union des périodes [(start, end), ...] (périodes chevauchantes ou contiguës fusionnées)."""
+    merged = []
+    for start, end in sorted((pd.Timestamp(start), pd.Timestamp(end)) for start, end in windows):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+
+def read_windows_data(windows, equipment_id=None):
+    """
+    Arrêts et production de l'union des périodes, une requête par table (mêmes filtres que
+    get_downtime_data / get_production_data pour chaque période, combinés par OR).
+    """
+    params = {}
+    downtime_ranges, production_ranges = [], []
+    for i, (start, end) in enumerate(merge_windows(windows)):
+        params[f'start_{i}'], params[f'end_{i}'] = start.to_pydatetime(), end.to_pydatetime()
+        downtime_ranges.append(f"(end_time > %(start_{i})s AND start_time < %(end_{i})s)")
+        production_ranges.append(f"(timestamp >= %(start_{i})s AND timestamp <= %(end_{i})s)")
+    equipment_filter = ""
+    if equipment_id:
+        equipment_filter = " AND equipment_id = %(equipment_id)s"
+        params['equipment_id'] = equipment_id
+
+    conn = get_db_connection()
+    try:
+        downtimes_df = read_sql_typed(
+            f"SELECT * FROM downtime_logs WHERE ({' OR '.join(downtime_ranges)}){equipment_filter} ORDER BY equipment_id, start_time",
+            conn, params=params, table='downtime_logs')
+        production_df = read_sql_typed(
+            f"SELECT * FROM production_output WHERE ({' OR '.join(production_ranges)}){equipment_filter}",
+            conn, params=params, table='production_output')
+    finally:
+        conn.close()
+    return downtimes_df, production_df
+
+
+def _segment_edges(starts, ends):
+    """Bornes triées des segments élémentaires et, par période, la liste des segments qu'elle couvre."""
+    edges = np.unique(np.concatenate([starts, ends]))
+    first = np.searchsorted(edges, starts)
+    last = np.searchsorted(edges, ends) # segments [first, last) de chaque période
+    window = np.repeat(np.arange(len(starts)), last - first)
+    segment = np.concatenate([np.arange(f, l) for f, l in zip(first, last)]) if len(starts) else np.array([], dtype=np.int64)
+    return edges, pd.DataFrame({'window': window, 'segment': segment})
+
+
+def _sum_by_window(segment_sums, membership):
+    """Sommes par (equipment_id, segment) -> sommes par (window, equipment_id)."""
+    if segment_sums.empty:
+        return pd.DataFrame(columns=['window', 'equipment_id'])
+    value_cols = [col for col in segment_sums.columns if col not in ('equipment_id', 'segment')]
+    by_window = segment_sums.merge(membership, on='segment')
+    return by_window.groupby(['window', 'equipment_id'], observed=True, as_index=False)[value_cols].sum()
+
+
+def calculate_window_partials(downtimes_df, production_df, windows):
+    """
+    Grandeurs additives (KPI_PARTIAL_COLUMNS) par période et par équipement, comme
+    calculate_kpi_partials appelé sur chaque période, en un seul passage sur les données.
+    Retourne un DataFrame window (indice de la période), equipment_id, KPI_PARTIAL_COLUMNS.
+    """
+    window_starts = np.array([pd.Timestamp(start).value for start, _ in windows], dtype=np.int64)
+    window_ends = np.array([pd.Timestamp(end).value for _, end in windows], dtype=np.int64)
+    partials = []
+
+    if not production_df.empty:
+        # Production : bornes incluses [start, end] = [start, end + 1 ns)
+        edges, membership = _segment_edges(window_starts, window_ends + 1)
+        timestamps = production_df['timestamp'].to_numpy(dtype='datetime64[ns]').astype(np.int64)
+        segment = np.searchsorted(edges, timestamps, side='right') - 1
+        inside = (segment >= 0) & (segment < len(edges) - 1)
+        production = production_df.loc[inside, ['equipment_id', 'quantity_produced', 'quantity_rejected', 'running_duration_seconds']]
+        production = production.assign(segment=segment[inside])
+        segment_sums = production.groupby(['equipment_id', 'segment'], observed=True, as_index=False).agg(
+            production_records=('quantity_produced', 'size'),
+            total_produced=('quantity_produced', 'sum'),
+            total_rejected=('quantity_rejected', 'sum'),
+            total_running_seconds=('running_duration_seconds', 'sum'),
+        )
+        partials.append(_sum_by_window(segment_sums, membership))
+
+    if not downtimes_df.empty:
+        # Arrêts : intervalles résolus une fois, durées découpées sur les segments [start, end)
+        edges, membership = _segment_edges(window_starts, window_ends)
+        intervals = resolve_downtime_intervals(downtimes_df)
+        durations = durations_by_bucket(intervals, pd.to_datetime(edges), by=('equipment_id', 'downtime_category'))
+        durations['segment'] = np.searchsorted(edges, durations['bucket_start'].to_numpy(dtype='datetime64[ns]').astype(np.int64))
+        is_planned = durations['downtime_category'].isin(PLANNED_DOWNTIME_CATEGORIES)
+        durations['total_planned_downtime_seconds'] = durations['duration_seconds'].where(is_planned, 0.0)
+        durations['total_unplanned_downtime_seconds'] = durations['duration_seconds'].where(~is_planned, 0.0)
+        segment_sums = durations.groupby(['equipment_id', 'segment'], observed=True, as_index=False)[
+            ['total_planned_downtime_seconds', 'total_unplanned_downtime_seconds']].sum()
+        partials.append(_sum_by_window(segment_sums, membership))
+
+        # Incidents imprévus COMMENÇANT dans la période (même règle que calculate_mtbf_mttr)
+        unplanned = downtimes_df[~downtimes_df['downtime_category'].isin(PLANNED_DOWNTIME_CATEGORIES)]
+        starts = unplanned['start_time'].to_numpy(dtype='datetime64[ns]').astype(np.int64)
+        segment = np.searchsorted(edges, starts, side='right') - 1
+        inside = (segment >= 0) & (segment < len(edges) - 1)
+        incidents = pd.DataFrame({'equipment_id': unplanned['equipment_id'].to_numpy()[inside], 'segment': segment[inside]})
+        segment_sums = incidents.groupby(['equipment_id', 'segment'], observed=True, as_index=False).size()
+        partials.append(_sum_by_window(segment_sums.rename(columns={'size': 'num_unplanned_incidents'}), membership))
+
+    partials = [df.set_index(['window', 'equipment_id']) for df in partials if not df.empty]
+    if not partials:
+        return pd.DataFrame(columns=['window', 'equipment_id'] + KPI_PARTIAL_COLUMNS)
+    partials_df = pd.concat(partials, axis=1).reindex(columns=KPI_PARTIAL_COLUMNS).fillna(0)
+    for col in ['production_records', 'total_produced', 'total_rejected', 'num_unplanned_incidents']:
+        partials_df[col] = partials_df[col].astype('int64')
+    return partials_df.reset_index()
+
+
+def kpi_deltas(reference_df, compared_df, key):
+    """Écarts reference - compared des colonnes numériques, pour les clés présentes dans les deux périodes."""
+    value_cols = [col for col in reference_df.columns
+                  if col not in _KEY_COLUMNS and col in compared_df.columns and pd.api.types.is_numeric_dtype(reference_df[col])]
+    merged = reference_df[[key] + value_cols].merge(compared_df[[key] + value_cols], on=key, suffixes=('', '_compared'))
+    deltas = merged[[key]].copy()
+    for col in value_cols:
+        deltas[col] = merged[col] - merged[f'{col}_compared']
+    return deltas
+
+
+def compare_kpis(windows, equipment_id=None, group_by='equipment', read_data=read_windows_data):
+    """
+    KPIs de chaque période de windows [(start, end), ...] et écarts de la première période avec chacune
+    des suivantes. Retourne (liste de DataFrames de KPIs par période, liste de DataFrames d'écarts).
+    """
+    equip_data = get_equipments_data()
+    if equip_data.empty:
+        print("Attention : Impossible de récupérer les données équipements.")
+        return [], []
+    if equipment_id:
+        equip_data = equip_data[equip_data['equipment_id'] == equipment_id].copy()
+        if equip_data.empty:
+            print(f"Attention : Équipement {equipment_id} non trouvé dans les données équipements.")
+            return [], []
+
+    downtimes_df, production_df = read_data(windows, equipment_id)
+    partials_df = calculate_window_partials(downtimes_df, production_df, windows)
+
+    window_kpis = []
+    for window, (start, end) in enumerate(windows):
+        window_partials = partials_df[partials_df['window'] == window].drop(columns='window').reset_index(drop=True)
+        if group_by == 'equipment':
+            window_kpis.append(calculate_kpis_from_partials(window_partials, equip_data, start, end))
+        else:
+            window_kpis.append(rollup_kpis(window_partials, equip_data, start, end, group_by))
+
+    key = 'equipment_id' if group_by == 'equipment' else 'group_id'
+    deltas = [kpi_deltas(window_kpis[0], compared_df, key) for compared_df in window_kpis[1:]]
+    return window_kpis, deltas
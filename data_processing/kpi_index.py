@@ -0,0 +1,398 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+from data_processing.kpi_calculator import (
+    PLANNED_DOWNTIME_CATEGORIES, KPI_PARTIAL_COLUMNS,
+    get_equipments_data, get_downtime_data, get_production_data, calculate_kpis_from_partials
+)
+from data_processing.interval_engine import INTERVAL_COLUMNS, resolve_downtime_intervals
+from data_processing.table_versions import get_table_versions
+
+# Index de sommes cumulées (prefix sums) par équipement sur une grille temporelle fine.
+# Toutes les grandeurs de KPI_PARTIAL_COLUMNS sont additives dans le temps : la valeur sur [start, end)
+# vaut F(end) - F(start), où F(t) est le cumul depuis l'origine de l'index jusqu'à t (exclu).
+# F est précalculé à chaque frontière de la grille (lookup O(1)) ; pour une borne non alignée,
+# la correction de bord est calculée exactement à partir des événements bruts triés (O(log n)).
+# Comme get_production_data, la production est comptée sur [start, end] (relevé à end inclus).
+# L'index du processus (get_kpi_index) reçoit les lignes écrites par le tampon d'ingestion
+# (table_versions) et est reconstruit si un autre écrivain a modifié production_output ou downtime_logs.
+
+DEFAULT_RESOLUTION_SECONDS = 60
+
+# Séries dérivées de production_output (événements ponctuels au timestamp du relevé)
+PRODUCTION_SERIES = ['production_records', 'total_produced', 'total_rejected', 'total_running_seconds']
+# Séries dérivées de downtime_logs
+DOWNTIME_SERIES = ['total_planned_downtime_seconds', 'total_unplanned_downtime_seconds', 'num_unplanned_incidents']
+SECONDS_SERIES = ['total_running_seconds', 'total_planned_downtime_seconds', 'total_unplanned_downtime_seconds']
+_PRODUCTION_POSITIONS = [KPI_PARTIAL_COLUMNS.index(col) for col in PRODUCTION_SERIES]
+# Précision des durées renvoyées (celle des timestamps en base) : F(end) - F(start) laisse sinon des
+# résidus flottants (~1e-14 s) là où le calcul direct donne 0, ce qui change performance et MTBF
+SECONDS_DECIMALS = 6
+
+
+class _EquipmentSeries:
+    """Événements bruts triés d'un équipement, avec leurs sommes cumulées (temps en secondes depuis l'origine)."""
+
+    def __init__(self):
+        self.production_ts = np.empty(0)
+        self.production_values = np.empty((0, len(PRODUCTION_SERIES)))
+        self.production_cum = np.zeros((1, len(PRODUCTION_SERIES)))
+        self.incident_ts = np.empty(0)
+        # Logs d'arrêt bruts, conservés pour refusionner les chevauchements lors des ajouts
+        self.downtime_rows = None
+        # Par classe d'arrêt ('planned' / 'unplanned') : intervalles disjoints triés + cumul des durées
+        self.intervals = {kind: {'starts': np.empty(0), 'ends': np.empty(0)} for kind in ('planned', 'unplanned')}
+        self.interval_cums = {kind: np.zeros(1) for kind in ('planned', 'unplanned')}
+        self.grid = np.zeros((1, len(KPI_PARTIAL_COLUMNS)))
+
+    def add_production(self, ts, values):
+        order = np.argsort(np.concatenate([self.production_ts, ts]), kind='stable')
+        self.production_ts = np.concatenate([self.production_ts, ts])[order]
+        self.production_values = np.concatenate([self.production_values, values])[order]
+        self.production_cum = np.vstack([np.zeros((1, len(PRODUCTION_SERIES))), np.cumsum(self.production_values, axis=0)])
+
+    def set_intervals(self, kind, starts, ends):
+        # Intervalles disjoints (resolve_downtime_intervals) : trier les débuts trie aussi les fins
+        order = np.argsort(starts, kind='stable')
+        bounds = self.intervals[kind]
+        bounds['starts'] = np.asarray(starts, dtype=float)[order]
+        bounds['ends'] = np.asarray(ends, dtype=float)[order]
+        self.interval_cums[kind] = np.concatenate([[0.0], np.cumsum(bounds['ends'] - bounds['starts'])])
+
+    def add_incidents(self, ts):
+        self.incident_ts = np.sort(np.concatenate([self.incident_ts, ts]))
+
+    def production_through(self, t):
+        """Cumuls de PRODUCTION_SERIES des relevés de timestamp <= t (borne de fin incluse)."""
+        return self.production_cum[np.searchsorted(self.production_ts, t, side='right')]
+
+    def cumulative(self, t):
+        """
+        Valeurs cumulées exactes F(t) pour un tableau de temps t (secondes depuis l'origine).
+        Retourne un tableau (len(t), len(KPI_PARTIAL_COLUMNS)) ordonné comme KPI_PARTIAL_COLUMNS.
+        """
+        t = np.atleast_1d(np.asarray(t, dtype=float))
+        out = np.zeros((len(t), len(KPI_PARTIAL_COLUMNS)))
+
+        # Événements ponctuels : somme des valeurs dont le timestamp est < t
+        k = np.searchsorted(self.production_ts, t, side='left')
+        out[:, _PRODUCTION_POSITIONS] = self.production_cum[k]
+        out[:, KPI_PARTIAL_COLUMNS.index('num_unplanned_incidents')] = np.searchsorted(self.incident_ts, t, side='left')
+
+        # Intervalles disjoints : durées des intervalles terminés avant t, plus la partie écoulée
+        # de l'intervalle en cours (au plus un). Les termes restent de l'ordre des durées cumulées,
+        # pas de t * nombre d'intervalles, pour limiter l'erreur d'arrondi.
+        for kind, col in (('planned', 'total_planned_downtime_seconds'), ('unplanned', 'total_unplanned_downtime_seconds')):
+            starts, ends, cums = self.intervals[kind]['starts'], self.intervals[kind]['ends'], self.interval_cums[kind]
+            n_started = np.searchsorted(starts, t, side='left')
+            n_ended = np.searchsorted(ends, t, side='left')
+            open_start = starts[np.minimum(n_ended, len(starts) - 1)] if len(starts) else 0.0
+            out[:, KPI_PARTIAL_COLUMNS.index(col)] = cums[n_ended] + np.where(n_started > n_ended, t - open_start, 0.0)
+        return out
+
+
+class KpiPrefixIndex:
+    """
+    Index en mémoire des cumuls de KPI_PARTIAL_COLUMNS par équipement.
+    La grille (une ligne par frontière de pas, resolution_seconds) peut être sauvegardée et
+    rechargée en mémoire mappée (voir save / load).
+    """
+
+    def __init__(self, origin, resolution_seconds=DEFAULT_RESOLUTION_SECONDS):
+        self.origin = pd.Timestamp(origin).floor(f'{resolution_seconds}s')
+        self.resolution_seconds = resolution_seconds
+        self.n_bins = 0
+        self.series = {}
+        self.lock = threading.RLock() # Ajouts (ingestion) et requêtes concurrents
+
+    # --- Conversion des temps ---
+
+    def _to_seconds(self, timestamps):
+        if np.isscalar(timestamps) or isinstance(timestamps, pd.Timestamp):
+            return (pd.Timestamp(timestamps) - self.origin) / pd.Timedelta(seconds=1)
+        return ((pd.to_datetime(pd.Series(timestamps)) - self.origin) / pd.Timedelta(seconds=1)).to_numpy(dtype=float)
+
+    def _grid_times(self, first_bin=0):
+        return np.arange(first_bin, self.n_bins + 1, dtype=float) * self.resolution_seconds
+
+    # --- Alimentation de l'index ---
+
+    def _get_series(self, equipment_id):
+        if equipment_id not in self.series:
+            self.series[equipment_id] = _EquipmentSeries()
+            self.series[equipment_id].grid = np.zeros((self.n_bins + 1, len(KPI_PARTIAL_COLUMNS)))
+        return self.series[equipment_id]
+
+    def _extend_and_refresh(self, touched, first_seconds, last_seconds):
+        """Étend la grille jusqu'à last_seconds puis recalcule les cumuls à partir de first_seconds."""
+        needed_bins = int(np.ceil(max(last_seconds, 0) / self.resolution_seconds)) + 1
+        if needed_bins > self.n_bins:
+            self.n_bins = needed_bins
+            for equip_series in self.series.values():
+                old = np.asarray(equip_series.grid)
+                equip_series.grid = np.vstack([old, equip_series.cumulative(self._grid_times(len(old)))])
+
+        first_bin = max(0, int(np.floor(first_seconds / self.resolution_seconds)))
+        for equip_series in touched:
+            grid = np.array(equip_series.grid) # Copie si la grille est mappée en lecture seule
+            grid[first_bin:] = equip_series.cumulative(self._grid_times(first_bin))
+            equip_series.grid = grid
+
+    def append_production(self, production_df):
+        """Ajoute des lignes de production_output (timestamp, equipment_id, quantity_produced, quantity_rejected, running_duration_seconds)."""
+        if production_df.empty:
+            return
+        seconds = self._to_seconds(production_df['timestamp'])
+        if (seconds < 0).any():
+            raise ValueError("Des relevés de production sont antérieurs à l'origine de l'index.")
+
+        values = np.column_stack([
+            np.ones(len(production_df)),
+            production_df['quantity_produced'].to_numpy(dtype=float),
+            production_df['quantity_rejected'].to_numpy(dtype=float),
+            production_df['running_duration_seconds'].to_numpy(dtype=float),
+        ])
+        equipment_ids = production_df['equipment_id'].to_numpy()
+        with self.lock:
+            touched = []
+            for equipment_id in pd.unique(equipment_ids):
+                mask = equipment_ids == equipment_id
+                equip_series = self._get_series(equipment_id)
+                equip_series.add_production(seconds[mask], values[mask])
+                touched.append(equip_series)
+            self._extend_and_refresh(touched, seconds.min(), seconds.max())
+
+    def append_downtimes(self, downtimes_df):
+        """
+        Ajoute des lignes de downtime_logs terminées (les arrêts sans end_time sont ignorés).
+        Un arrêt déjà présent (même downtime_id) est remplacé : un arrêt renvoyé avec sa fin ou
+        corrigé n'est pas compté deux fois. Les arrêts de chaque équipement touché sont refusionnés
+        (resolve_downtime_intervals) pour que les chevauchements ne soient comptés qu'une fois,
+        comme dans calculate_all_kpis.
+        """
+        downtimes_df = downtimes_df.dropna(subset=['start_time', 'end_time'])
+        if downtimes_df.empty:
+            return
+        starts = self._to_seconds(downtimes_df['start_time'])
+        ends = self._to_seconds(downtimes_df['end_time'])
+        if (starts < 0).any():
+            raise ValueError("Des arrêts commencent avant l'origine de l'index.")
+
+        row_columns = INTERVAL_COLUMNS + (['downtime_id'] if 'downtime_id' in downtimes_df.columns else [])
+        equipment_ids = downtimes_df['equipment_id'].to_numpy()
+        first_seconds = starts.min()
+        with self.lock:
+            touched = []
+            for equipment_id in pd.unique(equipment_ids):
+                equip_series = self._get_series(equipment_id)
+                new_rows = downtimes_df[equipment_ids == equipment_id][row_columns]
+                old_rows = equip_series.downtime_rows
+                if old_rows is not None and 'downtime_id' in old_rows.columns and 'downtime_id' in new_rows.columns:
+                    replaced = old_rows['downtime_id'].isin(new_rows['downtime_id']).to_numpy()
+                    if replaced.any():
+                        first_seconds = min(first_seconds, self._to_seconds(old_rows.loc[replaced, 'start_time']).min())
+                        old_rows = old_rows[~replaced]
+                equip_series.downtime_rows = new_rows if old_rows is None else pd.concat([old_rows, new_rows], ignore_index=True)
+                self._refresh_intervals(equip_series)
+                touched.append(equip_series)
+            self._extend_and_refresh(touched, first_seconds, ends.max())
+
+    def _refresh_intervals(self, equip_series):
+        """Intervalles fusionnés et incidents imprévus (débuts) recalculés à partir des logs d'arrêt de l'équipement."""
+        rows = equip_series.downtime_rows
+        segments = resolve_downtime_intervals(rows)
+        seg_starts, seg_ends = self._to_seconds(segments['start_time']), self._to_seconds(segments['end_time'])
+        seg_planned = segments['downtime_category'].isin(PLANNED_DOWNTIME_CATEGORIES).to_numpy()
+        equip_series.set_intervals('planned', seg_starts[seg_planned], seg_ends[seg_planned])
+        equip_series.set_intervals('unplanned', seg_starts[~seg_planned], seg_ends[~seg_planned])
+        unplanned = ~rows['downtime_category'].isin(PLANNED_DOWNTIME_CATEGORIES).to_numpy()
+        equip_series.incident_ts = np.sort(self._to_seconds(rows['start_time'])[unplanned])
+
+    # --- Requêtes ---
+
+    def _cumulative_at(self, equip_series, seconds):
+        """F(t) : lookup direct dans la grille si t tombe sur une frontière, sinon correction exacte."""
+        bin_index, remainder = divmod(seconds, self.resolution_seconds)
+        if remainder == 0 and 0 <= bin_index <= self.n_bins:
+            return np.asarray(equip_series.grid[int(bin_index)])
+        return equip_series.cumulative(seconds)[0]
+
+    def query(self, start_time, end_time, equipment_id=None):
+        """
+        Retourne les grandeurs additives (KPI_PARTIAL_COLUMNS) par équipement sur [start_time, end_time)
+        (production sur [start_time, end_time], comme get_production_data).
+        """
+        start_seconds = self._to_seconds(pd.Timestamp(start_time))
+        end_seconds = self._to_seconds(pd.Timestamp(end_time))
+
+        rows = []
+        with self.lock:
+            equipment_ids = [equipment_id] if equipment_id else sorted(self.series)
+            for eq_id in equipment_ids:
+                equip_series = self.series.get(eq_id)
+                if equip_series is None:
+                    continue
+                end_values = np.array(self._cumulative_at(equip_series, end_seconds))
+                end_values[_PRODUCTION_POSITIONS] = equip_series.production_through(end_seconds)
+                values = end_values - self._cumulative_at(equip_series, start_seconds)
+                rows.append([eq_id, *values])
+
+        partials_df = pd.DataFrame(rows, columns=['equipment_id'] + KPI_PARTIAL_COLUMNS)
+        partials_df[SECONDS_SERIES] = partials_df[SECONDS_SERIES].round(SECONDS_DECIMALS) + 0.0 # + 0.0 : pas de -0.0
+        for col in ['production_records', 'total_produced', 'total_rejected', 'num_unplanned_incidents']:
+            partials_df[col] = partials_df[col].round().astype('int64')
+        return partials_df
+
+    # --- Persistance (grille mappée en mémoire) ---
+
+    def save(self, directory):
+        """Sauvegarde l'index dans un dossier (un fichier .npz d'événements + une grille .npy par équipement)."""
+        os.makedirs(directory, exist_ok=True)
+        meta = {'origin': np.array(str(self.origin)), 'resolution_seconds': np.array(self.resolution_seconds),
+                'n_bins': np.array(self.n_bins), 'equipment_ids': np.array(sorted(self.series), dtype=str)}
+        np.savez(os.path.join(directory, 'meta.npz'), **meta)
+        for equipment_id, equip_series in self.series.items():
+            np.save(os.path.join(directory, f'{equipment_id}_grid.npy'), np.asarray(equip_series.grid))
+            np.savez(
+                os.path.join(directory, f'{equipment_id}_events.npz'),
+                production_ts=equip_series.production_ts, production_values=equip_series.production_values,
+                incident_ts=equip_series.incident_ts,
+                **self._downtime_rows_arrays(equip_series.downtime_rows)
+            )
+
+    def _downtime_rows_arrays(self, downtime_rows):
+        if downtime_rows is None:
+            downtime_rows = pd.DataFrame({col: pd.Series(dtype='datetime64[ns]' if col.endswith('_time') else str) for col in INTERVAL_COLUMNS})
+        return {
+            'downtime_starts': self._to_seconds(downtime_rows['start_time']),
+            'downtime_ends': self._to_seconds(downtime_rows['end_time']),
+            'downtime_categories': downtime_rows['downtime_category'].to_numpy(dtype=str),
+            'downtime_reasons': downtime_rows['downtime_reason'].to_numpy(dtype=str),
+        }
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """Recharge un index sauvegardé ; avec mmap=True les grilles restent sur disque (mode lecture seule)."""
+        meta = np.load(os.path.join(directory, 'meta.npz'))
+        index = cls(pd.Timestamp(str(meta['origin'])), int(meta['resolution_seconds']))
+        index.n_bins = int(meta['n_bins'])
+        for equipment_id in meta['equipment_ids']:
+            equipment_id = str(equipment_id)
+            events = np.load(os.path.join(directory, f'{equipment_id}_events.npz'))
+            equip_series = _EquipmentSeries()
+            equip_series.add_production(events['production_ts'], events['production_values'])
+            equip_series.add_incidents(events['incident_ts'])
+            if len(events['downtime_starts']):
+                equip_series.downtime_rows = pd.DataFrame({
+                    'equipment_id': equipment_id,
+                    'downtime_category': events['downtime_categories'],
+                    'downtime_reason': events['downtime_reasons'],
+                    'start_time': index.origin + pd.to_timedelta(events['downtime_starts'], unit='s'),
+                    'end_time': index.origin + pd.to_timedelta(events['downtime_ends'], unit='s'),
+                })
+                index._refresh_intervals(equip_series)
+            equip_series.grid = np.load(os.path.join(directory, f'{equipment_id}_grid.npy'), mmap_mode='r' if mmap else None)
+            index.series[equipment_id] = equip_series
+        return index
+
+
+def build_kpi_index(start_time=None, end_time=None, resolution_seconds=DEFAULT_RESOLUTION_SECONDS):
+    """Construit un index à partir de production_output et downtime_logs (lecture complète unique)."""
+    production_df = get_production_data(start_time=start_time, end_time=end_time)
+    downtimes_df = get_downtime_data(start_time=start_time, end_time=end_time)
+
+    candidates = []
+    if not production_df.empty:
+        candidates.append(production_df['timestamp'].min())
+    if not downtimes_df.empty:
+        candidates.append(downtimes_df['start_time'].min())
+    origin = start_time if start_time is not None else (min(candidates) if candidates else pd.Timestamp.now())
+
+    index = KpiPrefixIndex(origin, resolution_seconds)
+    if not production_df.empty:
+        index.append_production(production_df)
+    if not downtimes_df.empty:
+        # Les arrêts à cheval sur l'origine sont tronqués à l'origine
+        downtimes_df = downtimes_df.copy()
+        downtimes_df['start_time'] = downtimes_df['start_time'].clip(lower=index.origin)
+        index.append_downtimes(downtimes_df)
+    return index
+
+
+INDEXED_TABLES = ('production_output', 'downtime_logs')
+# Colonnes de production_output facultatives à l'ingestion (NULL en base, ignorées par les sommes)
+_OPTIONAL_PRODUCTION_COLUMNS = ['quantity_rejected', 'running_duration_seconds']
+
+_kpi_index = None
+_kpi_index_marks = None # Repère table_versions pris avant la construction
+_kpi_index_stale = False # Écriture locale impossible à appliquer : reconstruction au prochain appel
+_kpi_index_lock = threading.Lock()
+
+
+def get_kpi_index():
+    """
+    Retourne l'index du processus, construit au premier appel (un seul thread construit, les autres
+    attendent) puis reconstruit si production_output ou downtime_logs ont été modifiées par un
+    autre écrivain que le tampon d'ingestion de ce processus.
+    """
+    global _kpi_index, _kpi_index_marks, _kpi_index_stale
+    versions = get_table_versions()
+    with _kpi_index_lock:
+        if _kpi_index is None or _kpi_index_stale or versions.changed_externally(_kpi_index_marks):
+            marks = versions.mark(*INDEXED_TABLES)
+            _kpi_index = build_kpi_index()
+            _kpi_index_marks, _kpi_index_stale = marks, False
+        return _kpi_index
+
+
+def _apply_written(table, df, first_time, last_time):
+    """Lignes écrites par le tampon d'ingestion : ajoutées à l'index s'il est construit."""
+    global _kpi_index_stale
+    if table not in INDEXED_TABLES:
+        return
+    with _kpi_index_lock:
+        if _kpi_index is None or _kpi_index_stale:
+            return
+        try:
+            if table == 'production_output':
+                production_df = df.copy()
+                for col in _OPTIONAL_PRODUCTION_COLUMNS:
+                    production_df[col] = production_df[col].fillna(0) if col in production_df.columns else 0
+                _kpi_index.append_production(production_df)
+            else:
+                # Seuls les arrêts terminés comptent ; un arrêt renvoyé sans ses catégories (complétées
+                # en base par l'upsert) impose une relecture complète
+                closed = df.dropna(subset=['end_time']) if 'end_time' in df.columns else df.iloc[0:0]
+                if closed.empty:
+                    return
+                if any(col not in closed.columns or closed[col].isna().any() for col in INTERVAL_COLUMNS):
+                    _kpi_index_stale = True
+                    return
+                _kpi_index.append_downtimes(closed)
+        except Exception as e:
+            print(f"Erreur lors de la mise à jour de l'index de cumuls : {e}")
+            _kpi_index_stale = True
+
+
+get_table_versions().subscribe(_apply_written)
+
+
+def calculate_all_kpis_indexed(start_time, end_time, equipment_id=None, index=None):
+    """
+    Équivalent de calculate_all_kpis répondu par l'index de cumuls (deux lookups par équipement).
+    """
+    index = index if index is not None else get_kpi_index()
+    equip_data = get_equipments_data()
+    if equip_data.empty:
+        print("Attention : Impossible de récupérer les données équipements.")
+        return pd.DataFrame()
+
+    if equipment_id:
+        equip_data = equip_data[equip_data['equipment_id'] == equipment_id].copy()
+        if equip_data.empty:
+            print(f"Attention : Équipement {equipment_id} non trouvé dans les données équipements.")
+            return pd.DataFrame()
+
+    partials_df = index.query(start_time, end_time, equipment_id)
+    return calculate_kpis_from_partials(partials_df, equip_data, start_time, end_time)
@@ -0,0 +1,126 @@
+import os
+import atexit
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import pandas as pd
+from data_processing.db_connection import get_db_connection, get_statement_timeout, set_statement_timeout
+from data_processing.typed_reader import read_sql_typed
+from data_processing.kpi_calculator import (
+    KPI_OUTPUT_COLUMNS, get_equipments_data, build_empty_kpis, calculate_kpis_from_data
+)
+
+# Calcul parallèle des KPIs de toute la flotte par partitions d'équipements.
+# Les KPIs d'un équipement ne dépendent que de ses propres arrêts et de sa production : la flotte est
+# répartie en KPI_PARALLEL_SHARDS partitions (équipements triés, distribués tour à tour), chaque partition
+# est lue (sa propre connexion, filtre equipment_id = ANY) et calculée par calculate_kpis_from_data dans
+# un pool de KPI_PARALLEL_WORKERS processus (ou threads), puis les résultats sont concaténés et triés.
+# Le statement_timeout de la requête HTTP (contrôle d'admission, propre au thread appelant) est transmis
+# à chaque partition et appliqué dans le processus ou le thread qui la lit.
+# Même résultat que calculate_all_kpis. Les étapes pandas ligne à ligne (apply) gardent le GIL : seul le
+# pool de processus (défaut) donne une accélération proche du nombre de cœurs ; le pool de threads
+# ne parallélise que l'attente des lectures en base.
+
+KPI_PARALLEL_ENABLED = os.getenv("KPI_PARALLEL_ENABLED", "0") == "1"
+KPI_PARALLEL_WORKERS = int(os.getenv("KPI_PARALLEL_WORKERS", str(os.cpu_count() or 2)))
+KPI_PARALLEL_SHARDS = int(os.getenv("KPI_PARALLEL_SHARDS", str(KPI_PARALLEL_WORKERS)))
+# process ou thread
+KPI_PARALLEL_EXECUTOR = os.getenv("KPI_PARALLEL_EXECUTOR", "process")
+# En dessous de ce nombre d'équipements, le calcul en série reste plus rapide
+KPI_PARALLEL_MIN_EQUIPMENTS = int(os.getenv("KPI_PARALLEL_MIN_EQUIPMENTS", "8"))
+
+EQUIPMENT_SCOPE_COLUMNS = ['equipment_id', 'equipment_name', 'equipment_type', 'production_line_id', 'ideal_cycle_time_seconds']
+
+
+def partition_equipments(equip_data, num_shards=KPI_PARALLEL_SHARDS):
+    """Répartit les équipements (triés par equipment_id) en num_shards partitions de tailles égales à un près."""
+    equip_data = equip_data.sort_values('equipment_id').reset_index(drop=True)
+    num_shards = max(1, min(num_shards, len(equip_data)))
+    return [equip_data.iloc[shard::num_shards].reset_index(drop=True) for shard in range(num_shards)]
+
+
+def read_shard_data(start_time, end_time, equipment_ids):
+    """Arrêts et production des équipements d'une partition (mêmes filtres que get_downtime_data / get_production_data)."""
+    params = {'start_time': start_time, 'end_time': end_time, 'equipment_ids': list(equipment_ids)}
+    conn = get_db_connection()
+    try:
+        downtimes_df = read_sql_typed(
+            "SELECT * FROM downtime_logs WHERE end_time > %(start_time)s AND start_time < %(end_time)s "
+            "AND equipment_id = ANY(%(equipment_ids)s) ORDER BY equipment_id, start_time",
+            conn, params=params, table='downtime_logs')
+        production_df = read_sql_typed(
+            "SELECT * FROM production_output WHERE timestamp >= %(start_time)s AND timestamp <= %(end_time)s "
+            "AND equipment_id = ANY(%(equipment_ids)s)",
+            conn, params=params, table='production_output')
+    finally:
+        conn.close()
+    return downtimes_df, production_df
+
+
+def calculate_shard_kpis(start_time, end_time, shard_equip_data, statement_timeout=None, read_data=read_shard_data):
+    """KPIs d'une partition ; None si elle n'a ni arrêt ni production sur la période."""
+    previous_timeout = get_statement_timeout()
+    set_statement_timeout(statement_timeout)
+    try:
+        downtimes_df, production_df = read_data(start_time, end_time, shard_equip_data['equipment_id'].tolist())
+    finally:
+        set_statement_timeout(previous_timeout) # Processus ou thread du pool réutilisé par d'autres requêtes
+    if downtimes_df.empty and production_df.empty:
+        return None
+    return calculate_kpis_from_data(shard_equip_data, shard_equip_data, downtimes_df, production_df, start_time, end_time)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_kpi_executor():
+    """Pool partagé, créé au premier calcul parallèle et conservé (démarrer des processus coûte plus qu'un calcul)."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            if KPI_PARALLEL_EXECUTOR == 'process':
+                # spawn : le serveur a déjà des threads (tâches de fond), fork pourrait copier des verrous pris
+                _executor = ProcessPoolExecutor(max_workers=KPI_PARALLEL_WORKERS,
+                                                mp_context=multiprocessing.get_context('spawn'))
+            else:
+                _executor = ThreadPoolExecutor(max_workers=KPI_PARALLEL_WORKERS, thread_name_prefix='kpi-shard')
+            atexit.register(_executor.shutdown, wait=False, cancel_futures=True)
+        return _executor
+
+
+def calculate_all_kpis_parallel(start_time, end_time, num_shards=KPI_PARALLEL_SHARDS, executor=None, read_data=read_shard_data):
+    """
+    Équivalent de calculate_all_kpis (toute la flotte) calculé par partitions d'équipements en parallèle.
+    read_data(start_time, end_time, equipment_ids) doit être une fonction de module (envoyée aux processus).
+    """
+    equip_data = get_equipments_data()
+    if equip_data.empty:
+        print("Attention : Impossible de récupérer les données équipements.")
+        return pd.DataFrame()
+
+    equipments_in_scope = equip_data[EQUIPMENT_SCOPE_COLUMNS].copy()
+    executor = executor or get_kpi_executor()
+    try:
+        statement_timeout = get_statement_timeout()
+        futures = [executor.submit(calculate_shard_kpis, start_time, end_time, shard, statement_timeout, read_data)
+                   for shard in partition_equipments(equip_data, num_shards)]
+        shard_results = [future.result() for future in futures]
+    except Exception as e:
+        print(f"Erreur lors du calcul parallèle des KPIs : {e}")
+        return pd.DataFrame()
+
+    shard_results = [kpis_df for kpis_df in shard_results if kpis_df is not None]
+    if not shard_results:
+        print("Attention : Aucune donnée de downtime ou de production trouvée pour la période/équipement spécifié.")
+        return build_empty_kpis(equipments_in_scope)
+    kpis_df = pd.concat(shard_results, ignore_index=True)
+    return kpis_df.sort_values('equipment_id', kind='stable').reset_index(drop=True)[
+        [col for col in KPI_OUTPUT_COLUMNS if col in kpis_df.columns]]
+
+
+def use_parallel_kpis(equipment_id=None):
+    """Calcul parallèle pour les requêtes sur toute la flotte (equipment_id absent) d'une flotte assez grande."""
+    if not KPI_PARALLEL_ENABLED or equipment_id or KPI_PARALLEL_WORKERS < 2:
+        return False
+    return len(get_equipments_data()) >= KPI_PARALLEL_MIN_EQUIPMENTS
@@ -0,0 +1,125 @@
+import os
+import threading
+from collections import OrderedDict
+import pandas as pd
+from data_processing.kpi_calculator import (
+    KPI_ADDITIVE_COLUMNS, KPI_OUTPUT_COLUMNS,
+    get_equipments_data, get_downtime_data, get_production_data,
+    calculate_kpi_partials, add_kpi_times, calculate_kpi_ratios
+)
+from data_processing.table_versions import get_table_versions
+
+# Agrégation hiérarchique des KPIs (ligne de production / usine).
+# Un OEE de ligne n'est PAS la moyenne des OEE des machines : il est recalculé à partir des temps et
+# quantités sommés. Pour les vues ligne et usine, les grandeurs additives par équipement d'une période
+# sont mises en cache, puis sommées pour chaque niveau demandé (la vue par équipement de /api/kpis
+# reste calculée par calculate_all_kpis). Une entrée reste valide tant que production_output et
+# downtime_logs n'ont pas été modifiées par un autre écrivain ; les lignes écrites par le tampon
+# d'ingestion de ce processus invalident les périodes qu'elles recouvrent.
+
+GROUP_BY_LEVELS = {
+    'equipment': 'equipment_id',
+    'line': 'production_line_id',
+    'plant': None, # Toute l'usine : un seul groupe
+}
+PLANT_GROUP_ID = 'PLANT'
+
+KPI_PARTIALS_CACHE_SIZE = int(os.getenv("KPI_PARTIALS_CACHE_SIZE", "32"))
+PARTIALS_TABLES = ('production_output', 'downtime_logs')
+
+_partials_cache = OrderedDict()
+_partials_cache_lock = threading.Lock()
+
+
+def get_kpi_partials(start_time, end_time, equipment_id=None):
+    """
+    Retourne les grandeurs additives par équipement pour la période, depuis un cache LRU.
+    Une entrée est recalculée si les tables ont été modifiées par un autre écrivain depuis sa lecture.
+    """
+    key = (pd.Timestamp(start_time), pd.Timestamp(end_time), equipment_id or None)
+    versions = get_table_versions()
+    with _partials_cache_lock:
+        entry = _partials_cache.get(key)
+    if entry is not None and not versions.changed_externally(entry['marks']):
+        with _partials_cache_lock:
+            if key in _partials_cache:
+                _partials_cache.move_to_end(key)
+        return entry['partials'].copy()
+
+    marks = versions.mark(*PARTIALS_TABLES) # Avant la lecture : une écriture pendant le calcul périme l'entrée
+    downtimes_df = get_downtime_data(start_time=start_time, end_time=end_time, equipment_id=equipment_id)
+    production_df = get_production_data(start_time=start_time, end_time=end_time, equipment_id=equipment_id)
+    partials_df = calculate_kpi_partials(downtimes_df, production_df, start_time, end_time)
+
+    with _partials_cache_lock:
+        _partials_cache[key] = {'partials': partials_df, 'marks': marks}
+        _partials_cache.move_to_end(key)
+        while len(_partials_cache) > KPI_PARTIALS_CACHE_SIZE:
+            _partials_cache.popitem(last=False)
+    return partials_df.copy()
+
+
+def clear_kpi_partials_cache():
+    with _partials_cache_lock:
+        _partials_cache.clear()
+
+
+def _invalidate_written(table, df, first_time, last_time):
+    # Lignes écrites par ce processus : les périodes qui les recouvrent sont recalculées
+    if table not in PARTIALS_TABLES or first_time is None:
+        return
+    with _partials_cache_lock:
+        for key in [key for key in _partials_cache if key[0] <= last_time and key[1] >= first_time]:
+            del _partials_cache[key]
+
+
+get_table_versions().subscribe(_invalidate_written)
+
+
+def rollup_kpis(partials_df, equip_df, start_time, end_time, group_by='line'):
+    """
+    Agrège des partiels par équipement au niveau 'line' ou 'plant' et recalcule les KPIs
+    à partir des sommes. Les équipements retenus sont ceux de la vue par équipement
+    (relevés de production dans la période), pour que l'agrégat corresponde aux lignes affichées.
+    """
+    if group_by not in GROUP_BY_LEVELS or group_by == 'equipment':
+        raise ValueError(f"Niveau d'agrégation non supporté : {group_by}")
+
+    group_cols = ['group_by', 'group_id', 'num_equipments']
+    output_cols = group_cols + [col for col in KPI_OUTPUT_COLUMNS if col not in ('equipment_id', 'equipment_name', 'production_line_id', 'equipment_type')]
+
+    kpis_df = partials_df[partials_df['production_records'] > 0]
+    kpis_df = kpis_df.merge(equip_df[['equipment_id', 'production_line_id', 'ideal_cycle_time_seconds']], on='equipment_id', how='inner')
+    if kpis_df.empty:
+        return pd.DataFrame(columns=output_cols)
+
+    kpis_df = add_kpi_times(kpis_df, start_time, end_time)
+    group_key = GROUP_BY_LEVELS[group_by]
+    kpis_df['group_id'] = kpis_df[group_key] if group_key else PLANT_GROUP_ID
+
+    grouped_df = kpis_df.groupby('group_id').agg(
+        num_equipments=('equipment_id', 'nunique'),
+        **{col: (col, 'sum') for col in KPI_ADDITIVE_COLUMNS}
+    ).reset_index()
+    grouped_df['group_by'] = group_by
+
+    grouped_df = calculate_kpi_ratios(grouped_df)
+    return grouped_df[output_cols]
+
+
+def calculate_grouped_kpis(start_time, end_time, equipment_id=None, group_by='line', partials_df=None):
+    """
+    KPIs par ligne ou pour l'usine, calculés à partir des partiels par équipement (cache partagé).
+    partials_df peut être fourni par une autre source (ex. index de cumuls).
+    """
+    equip_data = get_equipments_data()
+    if equip_data.empty:
+        print("Attention : Impossible de récupérer les données équipements.")
+        return pd.DataFrame()
+
+    if partials_df is None:
+        partials_df = get_kpi_partials(start_time, end_time, equipment_id)
+    if equipment_id:
+        partials_df = partials_df[partials_df['equipment_id'] == equipment_id]
+
+    return rollup_kpis(partials_df, equip_data, start_time, end_time, group_by)
@@ -0,0 +1,324 @@
+import os
+import json
+import queue
+import threading
+import pandas as pd
+from data_processing.db_connection import get_db_connection
+from data_processing.typed_reader import read_sql_typed
+from data_processing.interval_engine import resolve_downtime_intervals, clip_intervals
+from data_processing.kpi_calculator import (
+    PLANNED_DOWNTIME_CATEGORIES, KPI_PARTIAL_COLUMNS, KPI_OUTPUT_COLUMNS,
+    get_equipments_data, add_kpi_times, calculate_kpi_ratios
+)
+
+# Mode "live" : KPIs de la journée en cours tenus à jour de façon incrémentale.
+# Un seul poller par processus lit les nouvelles lignes (watermarks sur timestamp / identifiants ;
+# les relevés de production sont relus sur LIVE_LATE_SECONDS avant le watermark pour les arrivées tardives),
+# met à jour un état par équipement (O(1) par relevé ou événement ; arrêts de la journée recombinés
+# à chaque mise à jour de l'équipement), puis pousse les lignes de KPIs modifiées à tous les abonnés
+# (flux SSE). Les tableaux de bord ouverts ne requêtent donc plus /api/kpis.
+
+LIVE_POLL_INTERVAL_SECONDS = float(os.getenv("LIVE_POLL_INTERVAL_SECONDS", "5"))
+LIVE_SUBSCRIBER_QUEUE_SIZE = int(os.getenv("LIVE_SUBSCRIBER_QUEUE_SIZE", "100"))
+# Relevés de production relus avant le watermark : un relevé validé en retard (machine plus lente,
+# lot d'ingestion réessayé) de moins de LIVE_LATE_SECONDS est encore compté
+LIVE_LATE_SECONDS = float(os.getenv("LIVE_LATE_SECONDS", "300"))
+
+LIVE_EXTRA_COLUMNS = ['current_state', 'last_event_time', 'num_alarms', 'window_start', 'as_of']
+
+
+class LiveEquipmentState:
+    """
+    Agrégats courants d'un équipement sur la fenêtre live [window_start, maintenant).
+    Les arrêts de la fenêtre (clos et en cours) sont conservés et recombinés à chaque calcul avec
+    interval_engine.resolve_downtime_intervals, comme calculate_all_kpis : chaque seconde n'est comptée
+    qu'une fois, pour la catégorie prioritaire, quel que soit l'ordre de fin des arrêts.
+    """
+
+    def __init__(self, equipment_id, window_start):
+        self.equipment_id = equipment_id
+        self.window_start = window_start
+        self.totals = dict.fromkeys(KPI_PARTIAL_COLUMNS, 0)
+        self.open_downtimes = {} # downtime_id -> (start_time, catégorie, raison)
+        self.closed_downtimes = {} # downtime_id -> (start_time, end_time, catégorie, raison)
+        self.current_state = None
+        self.last_event_time = None
+        self.num_alarms = 0
+
+    def on_production(self, quantity_produced, quantity_rejected, running_duration_seconds):
+        self.totals['production_records'] += 1
+        self.totals['total_produced'] += quantity_produced
+        self.totals['total_rejected'] += quantity_rejected
+        self.totals['total_running_seconds'] += running_duration_seconds
+
+    def on_downtime_start(self, downtime_id, start_time, category, reason=None):
+        # Un arrêt commencé avant la fenêtre ne compte qu'à partir de window_start, et pas comme incident
+        self.open_downtimes[downtime_id] = (start_time, category, reason)
+        if category not in PLANNED_DOWNTIME_CATEGORIES and start_time >= self.window_start:
+            self.totals['num_unplanned_incidents'] += 1
+
+    def on_downtime_end(self, downtime_id, end_time):
+        start_time, category, reason = self.open_downtimes.pop(downtime_id)
+        self.closed_downtimes[downtime_id] = (start_time, end_time, category, reason)
+
+    def on_machine_event(self, timestamp, event_type):
+        if event_type == 'START':
+            self.current_state = 'RUNNING'
+        elif event_type == 'STOP':
+            self.current_state = 'STOPPED'
+        elif event_type == 'ALARM':
+            self.num_alarms += 1
+        self.last_event_time = timestamp
+
+    def downtime_seconds(self, now):
+        """(planifié, imprévu) : durée effective des arrêts sur [window_start, now), les arrêts en cours jusqu'à now."""
+        rows = list(self.closed_downtimes.values()) + [
+            (start_time, now, category, reason) for start_time, category, reason in self.open_downtimes.values()]
+        if not rows:
+            return 0.0, 0.0
+        downtimes_df = pd.DataFrame(rows, columns=['start_time', 'end_time', 'downtime_category', 'downtime_reason'])
+        downtimes_df['equipment_id'] = self.equipment_id
+        segments = clip_intervals(resolve_downtime_intervals(downtimes_df), self.window_start, now)
+        is_planned = segments['downtime_category'].isin(PLANNED_DOWNTIME_CATEGORIES)
+        return float(segments.loc[is_planned, 'duration_seconds'].sum()), float(segments.loc[~is_planned, 'duration_seconds'].sum())
+
+    def partials(self, now):
+        """Totaux additifs à l'instant now (les arrêts encore ouverts comptent jusqu'à now)."""
+        totals = dict(self.totals)
+        totals['total_planned_downtime_seconds'], totals['total_unplanned_downtime_seconds'] = self.downtime_seconds(now)
+        return totals
+
+
+class LiveKpiEngine:
+    """Poller partagé + état live par équipement + diffusion aux abonnés."""
+
+    def __init__(self, poll_interval_seconds=LIVE_POLL_INTERVAL_SECONDS):
+        self.poll_interval_seconds = poll_interval_seconds
+        self.states = {}
+        self.equipments = pd.DataFrame()
+        self.window_start = None
+        self.watermarks = {}
+        self.subscribers = set()
+        self.latest_rows = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    # --- Abonnements ---
+
+    def subscribe(self):
+        """Retourne une file qui recevra les messages JSON (lignes de KPIs modifiées)."""
+        subscriber = queue.Queue(maxsize=LIVE_SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self.subscribers.discard(subscriber)
+
+    def snapshot(self):
+        """Message JSON avec la dernière ligne connue de chaque équipement (envoyé à la connexion)."""
+        with self._lock:
+            return json.dumps(list(self.latest_rows.values()), default=str)
+
+    def _publish(self, rows):
+        if not rows:
+            return
+        message = json.dumps(rows, default=str) # Sérialisé une seule fois pour tous les abonnés
+        with self._lock:
+            for row in rows:
+                self.latest_rows[row['equipment_id']] = row
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(message)
+            except queue.Full:
+                # Client trop lent : on vide sa file et on la remplace par l'état complet
+                with subscriber.mutex:
+                    subscriber.queue.clear()
+                subscriber.put_nowait(self.snapshot())
+
+    # --- Application des événements ---
+
+    def _state(self, equipment_id):
+        if equipment_id not in self.states:
+            self.states[equipment_id] = LiveEquipmentState(equipment_id, self.window_start)
+        return self.states[equipment_id]
+
+    def apply_production(self, production_df):
+        for row in production_df.itertuples(index=False):
+            self._state(row.equipment_id).on_production(row.quantity_produced, row.quantity_rejected, row.running_duration_seconds)
+        return set(production_df['equipment_id']) if not production_df.empty else set()
+
+    def apply_downtimes(self, downtimes_df):
+        changed = set()
+        for row in downtimes_df.sort_values('start_time').itertuples(index=False):
+            state = self._state(row.equipment_id)
+            if row.downtime_id not in state.open_downtimes:
+                state.on_downtime_start(row.downtime_id, row.start_time, row.downtime_category, row.downtime_reason)
+            if pd.notna(row.end_time):
+                state.on_downtime_end(row.downtime_id, row.end_time)
+            changed.add(row.equipment_id)
+        return changed
+
+    def apply_machine_events(self, events_df):
+        for row in events_df.sort_values('timestamp').itertuples(index=False):
+            self._state(row.equipment_id).on_machine_event(row.timestamp, row.event_type)
+        return set(events_df['equipment_id']) if not events_df.empty else set()
+
+    def kpi_rows(self, equipment_ids, now):
+        """Lignes de KPIs (mêmes colonnes que /api/kpis + état live) pour les équipements donnés."""
+        equipment_ids = [eq_id for eq_id in equipment_ids if eq_id in self.states]
+        if not equipment_ids:
+            return []
+        partials_df = pd.DataFrame([{'equipment_id': eq_id, **self.states[eq_id].partials(now)} for eq_id in equipment_ids])
+        kpis_df = partials_df.merge(
+            self.equipments[['equipment_id', 'equipment_name', 'equipment_type', 'production_line_id', 'ideal_cycle_time_seconds']],
+            on='equipment_id', how='left'
+        )
+        kpis_df = calculate_kpi_ratios(add_kpi_times(kpis_df, self.window_start, now))
+        states = [self.states[eq_id] for eq_id in kpis_df['equipment_id']]
+        # dtype object : un état encore inconnu reste None (null en JSON) au lieu de NaN
+        kpis_df['current_state'] = pd.Series([state.current_state for state in states], dtype=object)
+        kpis_df['last_event_time'] = pd.Series([state.last_event_time for state in states], dtype=object)
+        kpis_df['num_alarms'] = [state.num_alarms for state in states]
+        kpis_df['window_start'] = self.window_start
+        kpis_df['as_of'] = now
+        return kpis_df[KPI_OUTPUT_COLUMNS + LIVE_EXTRA_COLUMNS].to_dict(orient='records')
+
+    # --- Lecture incrémentale (watermarks) ---
+
+    def _reset_watermarks(self):
+        self.watermarks = {
+            'production_timestamp': self.window_start, 'production_seen': {},
+            'downtime_id': -1, 'event_id': -1,
+        }
+
+    def _fetch_new_rows(self, conn):
+        """Lit les lignes arrivées depuis les watermarks et les avance."""
+        wm = self.watermarks
+        since = max(self.window_start, wm['production_timestamp'] - pd.Timedelta(seconds=LIVE_LATE_SECONDS))
+        production_df = read_sql_typed(
+            "SELECT * FROM production_output WHERE timestamp >= %(since)s ORDER BY timestamp",
+            conn, params={'since': since}, table='production_output'
+        )
+        # Les lignes relues (fenêtre de retard) ont déjà été appliquées : elles sont reconnues à leur contenu
+        # complet, numéroté parmi les lignes identiques (deux relevés identiques comptent deux fois)
+        if not production_df.empty:
+            row_hashes = pd.util.hash_pandas_object(production_df, index=False)
+            row_keys = list(zip(row_hashes, row_hashes.groupby(row_hashes).cumcount()))
+            seen = wm['production_seen']
+            is_new = pd.Series([key not in seen for key in row_keys], index=production_df.index)
+            seen.update((key, ts) for key, ts, new in zip(row_keys, production_df['timestamp'], is_new) if new)
+            production_df = production_df[is_new]
+        if not production_df.empty:
+            wm['production_timestamp'] = max(wm['production_timestamp'], production_df['timestamp'].max())
+            horizon = wm['production_timestamp'] - pd.Timedelta(seconds=LIVE_LATE_SECONDS)
+            wm['production_seen'] = {key: ts for key, ts in wm['production_seen'].items() if ts >= horizon}
+
+        open_ids = [dt_id for state in self.states.values() for dt_id in state.open_downtimes]
+        downtimes_df = read_sql_typed(
+            "SELECT * FROM downtime_logs WHERE downtime_id > %(last_id)s OR downtime_id = ANY(%(open_ids)s)",
+            conn, params={'last_id': wm['downtime_id'], 'open_ids': open_ids or [-1]}, table='downtime_logs'
+        )
+        # Un arrêt ouvert relu sans end_time n'apporte rien de nouveau
+        downtimes_df = downtimes_df[(downtimes_df['downtime_id'] > wm['downtime_id']) | downtimes_df['end_time'].notna()]
+        if not downtimes_df.empty:
+            wm['downtime_id'] = max(wm['downtime_id'], int(downtimes_df['downtime_id'].max()))
+
+        events_df = read_sql_typed(
+            "SELECT * FROM machine_events WHERE event_id > %(last_id)s ORDER BY event_id",
+            conn, params={'last_id': wm['event_id']}, table='machine_events'
+        )
+        if not events_df.empty:
+            wm['event_id'] = int(events_df['event_id'].max())
+        return production_df, downtimes_df, events_df
+
+    def seed(self, now=None):
+        """(Re)construit l'état de la journée en rejouant les lignes depuis minuit."""
+        now = pd.Timestamp(now) if now is not None else pd.Timestamp.now()
+        self.window_start = now.normalize()
+        self.states = {}
+        self.equipments = get_equipments_data()
+        self._reset_watermarks()
+
+        conn = get_db_connection()
+        try:
+            # Les arrêts commencés avant minuit mais encore en cours comptent à partir de minuit
+            previous_downtimes = read_sql_typed(
+                "SELECT * FROM downtime_logs WHERE start_time < %(window_start)s AND (end_time IS NULL OR end_time > %(window_start)s)",
+                conn, params={'window_start': self.window_start}, table='downtime_logs'
+            )
+            self.apply_downtimes(previous_downtimes)
+            self.watermarks['downtime_id'] = int(pd.read_sql(
+                "SELECT COALESCE(MAX(downtime_id), -1) AS last_id FROM downtime_logs WHERE start_time < %(window_start)s",
+                conn, params={'window_start': self.window_start}
+            )['last_id'].iloc[0])
+            self.watermarks['event_id'] = int(pd.read_sql(
+                "SELECT COALESCE(MAX(event_id), -1) AS last_id FROM machine_events WHERE timestamp < %(window_start)s",
+                conn, params={'window_start': self.window_start}
+            )['last_id'].iloc[0])
+
+            production_df, downtimes_df, events_df = self._fetch_new_rows(conn)
+        finally:
+            conn.close()
+
+        for equipment_id in self.equipments['equipment_id']:
+            self._state(equipment_id)
+        self.apply_production(production_df)
+        self.apply_downtimes(downtimes_df)
+        self.apply_machine_events(events_df)
+        self._publish(self.kpi_rows(list(self.states), now))
+
+    def poll_once(self, now=None):
+        """Un cycle de polling : lit les nouveautés, met à jour l'état, pousse les lignes modifiées."""
+        now = pd.Timestamp(now) if now is not None else pd.Timestamp.now()
+        if self.window_start is None or now.normalize() > self.window_start:
+            self.seed(now) # Changement de jour : nouvelle fenêtre
+            return
+
+        conn = get_db_connection()
+        try:
+            production_df, downtimes_df, events_df = self._fetch_new_rows(conn)
+        finally:
+            conn.close()
+
+        changed = self.apply_production(production_df) | self.apply_downtimes(downtimes_df) | self.apply_machine_events(events_df)
+        # Les arrêts en cours font évoluer les temps même sans nouvel événement
+        changed |= {eq_id for eq_id, state in self.states.items() if state.open_downtimes}
+        self._publish(self.kpi_rows(sorted(changed), now))
+
+    # --- Thread de fond ---
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='live-kpi-poller', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.poll_once()
+            except Exception as e:
+                print(f"Erreur lors de la mise à jour des KPIs live : {e}")
+            self._stop_event.wait(self.poll_interval_seconds)
+
+
+_live_engine = None
+_live_engine_lock = threading.Lock()
+
+
+def get_live_engine():
+    """Retourne le moteur live du processus (démarré au premier appel)."""
+    global _live_engine
+    with _live_engine_lock:
+        if _live_engine is None:
+            _live_engine = LiveKpiEngine()
+            _live_engine.start()
+    return _live_engine
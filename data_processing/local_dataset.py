@@ -0,0 +1,252 @@
+import os
+import json
+import hashlib
+import threading
+import pandas as pd
+from data_processing.typed_reader import DATETIME, TABLE_SCHEMAS, apply_schema
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute
+    import pyarrow.csv
+    import pyarrow.dataset
+    import pyarrow.parquet
+except ImportError: # Dépendance optionnelle : sans pyarrow, lecture CSV typée sans cache
+    pa = None
+
+# Chargement local typé du jeu de données simulé (notebooks, analyses hors ligne).
+# pd.read_csv sans types relisait à chaque session des millions de relevés et de timestamps en texte.
+# Ici chaque CSV est lu une seule fois par le lecteur CSV de pyarrow (multi-thread, schéma explicite :
+# catégories, float32 / int32, timestamp[ns]) puis converti en Parquet dans LOCAL_CACHE_DIR, trié par
+# (equipment_id, temps) en groupes de LOCAL_CACHE_ROW_GROUP_ROWS lignes. Les lectures suivantes ne lisent
+# que les colonnes demandées et sautent les groupes hors du filtre equipment_id / période (statistiques
+# min/max de chaque groupe). Le cache est reconstruit quand le CSV change : taille et mtime d'abord,
+# puis empreinte du contenu si seul le mtime a bougé (copie, checkout).
+
+LOCAL_DATA_DIR = os.getenv("LOCAL_DATA_DIR", "simulated_industrial_data_realistic")
+# Par défaut : sous-dossier .parquet_cache du dossier des CSV
+LOCAL_CACHE_DIR = os.getenv("LOCAL_CACHE_DIR")
+LOCAL_CACHE_ROW_GROUP_ROWS = int(os.getenv("LOCAL_CACHE_ROW_GROUP_ROWS", "262144"))
+
+LOCAL_SCHEMAS = dict(TABLE_SCHEMAS, **{
+    'equipments': {
+        'equipment_id': 'category', 'equipment_name': 'category', 'equipment_type': 'category',
+        'production_line_id': 'category', 'ideal_cycle_time_seconds': 'int32', 'location': 'category',
+        'installation_date': DATETIME,
+    },
+    'sensor_metadata': {'sensor_type': 'category', 'column_name': 'category', 'unit': 'category'},
+    # Colonnes des capteurs (une par sensor_type) : float32, comme value en format long
+    'sensor_readings_wide': {'timestamp': DATETIME, 'equipment_id': 'category'},
+})
+
+# Colonne de temps de chaque table pour le filtre de période (downtime_logs : chevauchement, comme get_downtime_data)
+TIME_COLUMNS = {
+    'sensor_readings': 'timestamp', 'sensor_readings_wide': 'timestamp', 'production_output': 'timestamp',
+    'machine_events': 'timestamp', 'downtime_logs': 'start_time',
+}
+
+_ARROW_TYPES = {DATETIME: 'timestamp[ns]', 'category': 'dictionary', 'float32': 'float32', 'float64': 'float64',
+                'int32': 'int32', 'int64': 'int64'}
+
+_cache_lock = threading.Lock()
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError("pyarrow est requis pour le cache Parquet (pip install pyarrow).")
+
+
+def _csv_path(table, data_dir):
+    return os.path.join(data_dir, f"{table}.csv")
+
+
+def _cache_dir(data_dir):
+    return LOCAL_CACHE_DIR or os.path.join(data_dir, '.parquet_cache')
+
+
+def _schema_for(table, columns):
+    """Schéma de table restreint aux colonnes du CSV (colonnes des capteurs en float32 pour le format large)."""
+    schema = LOCAL_SCHEMAS.get(table, {})
+    if table == 'sensor_readings_wide':
+        return {col: schema.get(col, 'float32') for col in columns}
+    return {col: dtype for col, dtype in schema.items() if col in columns}
+
+
+# --- Empreinte des CSV ---
+
+def _file_digest(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _cache_is_valid(csv_path, parquet_path, meta_path):
+    """
+    Vrai si le Parquet correspond au CSV. Taille et mtime identiques : valide sans lire le CSV ;
+    mtime différent mais même contenu : valide, le mtime enregistré est mis à jour.
+    """
+    if not (os.path.exists(parquet_path) and os.path.exists(meta_path)):
+        return False
+    with open(meta_path) as f:
+        meta = json.load(f)
+    stat = os.stat(csv_path)
+    if meta.get('size') != stat.st_size:
+        return False
+    if meta.get('mtime_ns') == stat.st_mtime_ns:
+        return True
+    if meta.get('digest') != _file_digest(csv_path):
+        return False
+    meta['mtime_ns'] = stat.st_mtime_ns
+    _write_json(meta, meta_path)
+    return True
+
+
+def _write_json(data, path):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+# --- Conversion CSV -> Parquet ---
+
+def _read_csv_arrow(csv_path, table):
+    """CSV lu par pyarrow avec les types du schéma (dictionnaire pour les catégories)."""
+    columns = pd.read_csv(csv_path, nrows=0).columns.tolist()
+    column_types = {}
+    for col, dtype in _schema_for(table, columns).items():
+        arrow_type = _ARROW_TYPES.get(dtype)
+        if arrow_type == 'dictionary':
+            column_types[col] = pa.dictionary(pa.int32(), pa.string())
+        elif arrow_type is not None:
+            column_types[col] = pa.type_for_alias(arrow_type)
+    return pa.csv.read_csv(csv_path, convert_options=pa.csv.ConvertOptions(column_types=column_types, strings_can_be_null=True))
+
+
+def convert_to_parquet(table, data_dir=LOCAL_DATA_DIR):
+    """Convertit <table>.csv en Parquet trié par (equipment_id, temps). Retourne le chemin du Parquet."""
+    _require_pyarrow()
+    csv_path = _csv_path(table, data_dir)
+    cache_dir = _cache_dir(data_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    parquet_path = os.path.join(cache_dir, f"{table}.parquet")
+
+    arrow_table = _read_csv_arrow(csv_path, table)
+    sort_keys = [col for col in ['equipment_id', TIME_COLUMNS.get(table)] if col in arrow_table.column_names]
+    if sort_keys:
+        # Tri sur les valeurs décodées (le tri des colonnes dictionnaire n'est pas implémenté par Arrow)
+        keys = pa.table({col: arrow_table[col].cast(pa.string()) if pa.types.is_dictionary(arrow_table[col].type)
+                         else arrow_table[col] for col in sort_keys})
+        arrow_table = arrow_table.take(pa.compute.sort_indices(keys, sort_keys=[(col, 'ascending') for col in sort_keys]))
+
+    # Écriture atomique : un lecteur concurrent voit l'ancien ou le nouveau fichier
+    stat = os.stat(csv_path)
+    tmp_path = parquet_path + '.tmp'
+    pa.parquet.write_table(arrow_table, tmp_path, row_group_size=LOCAL_CACHE_ROW_GROUP_ROWS, compression='zstd')
+    os.replace(tmp_path, parquet_path)
+    _write_json({'source': os.path.abspath(csv_path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                 'digest': _file_digest(csv_path), 'rows': arrow_table.num_rows},
+                os.path.join(cache_dir, f"{table}.json"))
+    print(f"Cache Parquet de {table} reconstruit : {arrow_table.num_rows} lignes.")
+    return parquet_path
+
+
+def ensure_parquet(table, data_dir=LOCAL_DATA_DIR):
+    """Chemin du Parquet de table, (re)converti si absent ou si le CSV a changé."""
+    _require_pyarrow()
+    cache_dir = _cache_dir(data_dir)
+    parquet_path = os.path.join(cache_dir, f"{table}.parquet")
+    with _cache_lock:
+        if not _cache_is_valid(_csv_path(table, data_dir), parquet_path, os.path.join(cache_dir, f"{table}.json")):
+            convert_to_parquet(table, data_dir)
+    return parquet_path
+
+
+# --- Lecture ---
+
+def _equipment_ids(equipment_id):
+    if equipment_id is None:
+        return None
+    return [equipment_id] if isinstance(equipment_id, str) else list(equipment_id)
+
+
+def _arrow_filter(table, equipment_ids, start_time, end_time):
+    field = pa.dataset.field
+    conditions = []
+    if equipment_ids is not None:
+        conditions.append(field('equipment_id').isin(equipment_ids))
+    time_column = TIME_COLUMNS.get(table)
+    if time_column is not None and start_time is not None:
+        start = pa.scalar(pd.Timestamp(start_time).to_datetime64().astype('datetime64[ns]'), pa.timestamp('ns'))
+        conditions.append(field('end_time') > start if table == 'downtime_logs' else field(time_column) >= start)
+    if time_column is not None and end_time is not None:
+        end = pa.scalar(pd.Timestamp(end_time).to_datetime64().astype('datetime64[ns]'), pa.timestamp('ns'))
+        conditions.append(field(time_column) < end if table == 'downtime_logs' else field(time_column) <= end)
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def _filter_frame(table, df, equipment_ids, start_time, end_time):
+    """Mêmes filtres que _arrow_filter, appliqués en pandas (lecture sans pyarrow)."""
+    start_time = pd.Timestamp(start_time) if start_time is not None else None
+    end_time = pd.Timestamp(end_time) if end_time is not None else None
+    mask = pd.Series(True, index=df.index)
+    if equipment_ids is not None:
+        mask &= df['equipment_id'].isin(equipment_ids)
+    time_column = TIME_COLUMNS.get(table)
+    if time_column is not None and start_time is not None:
+        mask &= (df['end_time'] > start_time) if table == 'downtime_logs' else (df[time_column] >= start_time)
+    if time_column is not None and end_time is not None:
+        mask &= (df[time_column] < end_time) if table == 'downtime_logs' else (df[time_column] <= end_time)
+    return df[mask].reset_index(drop=True)
+
+
+def load_table(table, columns=None, equipment_id=None, start_time=None, end_time=None, data_dir=LOCAL_DATA_DIR, use_cache=True):
+    """
+    Charge <data_dir>/<table>.csv typé selon LOCAL_SCHEMAS, via le cache Parquet.
+    columns : colonnes à lire (toutes par défaut). equipment_id : un identifiant ou une liste.
+    start_time / end_time : bornes incluses sur la colonne de temps (downtime_logs : arrêts qui
+    chevauchent la période). Les lignes sont triées par (equipment_id, temps).
+    """
+    equipment_ids = _equipment_ids(equipment_id)
+    if pa is None or not use_cache:
+        # Colonnes des filtres et du tri lues en plus de la projection, retirées ensuite (comme le filtre Arrow)
+        extra = ['equipment_id', TIME_COLUMNS.get(table)] + (['end_time'] if table == 'downtime_logs' else [])
+        usecols = None if columns is None else lambda col: col in columns or col in extra
+        df = pd.read_csv(_csv_path(table, data_dir), usecols=usecols)
+        df = apply_schema(df, _schema_for(table, df.columns))
+        df = _filter_frame(table, df, equipment_ids, start_time, end_time)
+        sort_keys = [col for col in ['equipment_id', TIME_COLUMNS.get(table)] if col in df.columns]
+        df = df.sort_values(sort_keys, kind='stable').reset_index(drop=True) if sort_keys else df
+        return df if columns is None else df[list(columns)]
+
+    dataset = pa.dataset.dataset(ensure_parquet(table, data_dir), format='parquet')
+    arrow_table = dataset.to_table(columns=columns, filter=_arrow_filter(table, equipment_ids, start_time, end_time))
+    return arrow_table.to_pandas()
+
+
+def load_dataset(tables=('equipments', 'machine_events', 'downtime_logs', 'production_output', 'sensor_readings'),
+                 equipment_id=None, start_time=None, end_time=None, data_dir=LOCAL_DATA_DIR):
+    """Plusieurs tables (dict table -> DataFrame) avec les mêmes filtres equipment_id / période."""
+    frames = {}
+    for table in tables:
+        period = {'start_time': start_time, 'end_time': end_time} if table in TIME_COLUMNS else {}
+        equipment_filter = equipment_id if table != 'sensor_metadata' else None
+        frames[table] = load_table(table, equipment_id=equipment_filter, data_dir=data_dir, **period)
+    return frames
+
+
+# Préparation du cache : python -m data_processing.local_dataset [dossier des CSV] (depuis la racine du projet)
+if __name__ == "__main__":
+    import sys
+    import time
+    data_dir = sys.argv[1] if len(sys.argv) > 1 else LOCAL_DATA_DIR
+    for csv_file in sorted(os.listdir(data_dir)):
+        if csv_file.endswith('.csv'):
+            started = time.perf_counter()
+            ensure_parquet(csv_file[:-len('.csv')], data_dir)
+            print(f"{csv_file} : cache à jour ({time.perf_counter() - started:.2f} s)")
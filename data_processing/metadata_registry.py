@@ -0,0 +1,233 @@
+import os
+import json
+import hashlib
+import select
+import threading
+import pandas as pd
+from data_processing.db_connection import get_db_connection
+from data_processing.sensor_layout import LONG_TABLE, METADATA_TABLE
+
+# Registre en mémoire des métadonnées (équipements, lignes, capteurs et unités).
+# Ces tables changent rarement mais étaient relues à chaque requête (get_equipments_data dans chaque
+# calcul de KPIs, /api/equipments). Le registre les charge une fois par processus et les recharge
+# quand elles changent, depuis une tâche de fond démarrée au premier accès. Si les triggers de
+# notification ont été installés (python -m data_processing.metadata_registry, par le propriétaire des
+# tables, à relancer après la création de sensor_metadata), elle écoute leurs NOTIFY sur
+# METADATA_CHANNEL (LISTEN) ; sinon l'empreinte des tables est vérifiée toutes les METADATA_REFRESH_SECONDS.
+# L'empreinte des tables donne la version (ETag de /api/metadata) : identique d'un processus à l'autre
+# et après un redémarrage tant que les tables n'ont pas changé.
+
+METADATA_REGISTRY_ENABLED = os.getenv("METADATA_REGISTRY_ENABLED", "1") == "1"
+METADATA_REFRESH_SECONDS = float(os.getenv("METADATA_REFRESH_SECONDS", "60"))
+METADATA_CHANNEL = 'metadata_changed'
+
+METADATA_NOTIFY_FUNCTION_DDL = f"""
+CREATE OR REPLACE FUNCTION notify_metadata_change() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('{METADATA_CHANNEL}', TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+# Table -> trigger de notification
+METADATA_TRIGGERS = {'equipments': 'equipments_metadata_notify', METADATA_TABLE: 'sensor_metadata_notify'}
+
+# Empreinte des deux tables : change à chaque modification de contenu
+METADATA_FINGERPRINT_QUERY = f"""
+SELECT (SELECT md5(COALESCE(string_agg(e::text, ',' ORDER BY e.equipment_id), '')) FROM equipments e),
+       (SELECT md5(COALESCE(string_agg(m::text, ',' ORDER BY m.sensor_type), '')) FROM {METADATA_TABLE} m)
+"""
+
+
+class MetadataRegistry:
+    """Métadonnées chargées une fois, rechargées quand l'empreinte des tables change."""
+
+    def __init__(self, refresh_seconds=METADATA_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self.lock = threading.Lock()
+        self.version = None
+        self.fingerprint = None
+        self.equipments = pd.DataFrame()
+        self.sensors = pd.DataFrame(columns=['sensor_type', 'unit'])
+        self.payload = None
+        self.loaded = False
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    # --- Chargement ---
+
+    def _read_fingerprint(self, conn):
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(METADATA_FINGERPRINT_QUERY)
+                return cursor.fetchone()
+        except Exception:
+            conn.rollback() # sensor_metadata absente (stockage long seulement) : empreinte des équipements
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT md5(COALESCE(string_agg(e::text, ',' ORDER BY e.equipment_id), '')) FROM equipments e")
+                return (cursor.fetchone()[0], None)
+
+    def _read_sensors(self, conn):
+        try:
+            sensors_df = pd.read_sql(f"SELECT sensor_type, unit FROM {METADATA_TABLE} ORDER BY sensor_type", conn)
+        except Exception:
+            conn.rollback()
+            sensors_df = pd.DataFrame(columns=['sensor_type', 'unit'])
+        if sensors_df.empty:
+            # Pas de table de métadonnées capteurs : déduites des relevés (une fois par rechargement)
+            sensors_df = pd.read_sql(
+                f"SELECT sensor_type, MAX(unit) AS unit FROM {LONG_TABLE} GROUP BY sensor_type ORDER BY sensor_type", conn)
+        return sensors_df
+
+    def refresh(self, force=False):
+        """Recharge les métadonnées si leur empreinte a changé. Retourne True si le registre a changé."""
+        conn = get_db_connection()
+        try:
+            fingerprint = self._read_fingerprint(conn)
+            if not force and self.loaded and fingerprint == self.fingerprint:
+                return False
+            equipments_df = pd.read_sql("SELECT * FROM equipments ORDER BY equipment_id", conn)
+            sensors_df = self._read_sensors(conn)
+        finally:
+            conn.close()
+
+        with self.lock:
+            self.equipments = equipments_df
+            self.sensors = sensors_df
+            self.fingerprint = fingerprint
+            self.version = hashlib.md5('|'.join(str(part) for part in fingerprint).encode()).hexdigest()
+            self.payload = None
+            self.loaded = True
+        return True
+
+    def ensure_loaded(self):
+        if not self.loaded:
+            self.refresh()
+
+    # --- Accès ---
+
+    def get_equipments(self):
+        """Copie de la table equipments (même contenu que SELECT * FROM equipments)."""
+        self.ensure_loaded()
+        with self.lock:
+            return self.equipments.copy()
+
+    def get_sensors(self):
+        """Capteurs connus (sensor_type, unit)."""
+        self.ensure_loaded()
+        with self.lock:
+            return self.sensors.copy()
+
+    def metadata_payload(self):
+        """(version, JSON de /api/metadata), sérialisé une fois par version."""
+        self.ensure_loaded()
+        with self.lock:
+            if self.payload is None:
+                equipments = self.equipments[['equipment_id', 'equipment_name', 'equipment_type', 'production_line_id', 'ideal_cycle_time_seconds']]
+                self.payload = json.dumps({
+                    'version': self.version,
+                    'equipments': equipments.astype(object).where(equipments.notna(), None).to_dict(orient='records'),
+                    'production_lines': sorted(equipments['production_line_id'].dropna().unique().tolist()),
+                    'sensors': self.sensors.astype(object).where(self.sensors.notna(), None).to_dict(orient='records'),
+                })
+            return self.version, self.payload
+
+    # --- Rafraîchissement ---
+
+    def start(self):
+        with self.lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name='metadata-registry', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _triggers_installed(self):
+        """True si au moins un trigger de notification est installé (lecture du catalogue, sans DDL)."""
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT COUNT(*) FROM pg_trigger WHERE tgname = ANY(%(triggers)s)",
+                               {'triggers': list(METADATA_TRIGGERS.values())})
+                installed = cursor.fetchone()[0] > 0
+        finally:
+            conn.close()
+        if not installed:
+            print("Triggers de notification des métadonnées non installés : vérification périodique.")
+        return installed
+
+    def _listen(self):
+        """Attend les NOTIFY ; l'empreinte est aussi vérifiée à chaque expiration du délai."""
+        conn = get_db_connection()
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(f"LISTEN {METADATA_CHANNEL}")
+            while not self._stop_event.is_set():
+                select.select([conn], [], [], self.refresh_seconds)
+                conn.poll()
+                conn.notifies.clear()
+                self.refresh()
+        finally:
+            conn.close()
+
+    def _run(self):
+        try:
+            listen = self._triggers_installed()
+        except Exception as e:
+            print(f"Erreur lors de la recherche des triggers de notification des métadonnées : {e}")
+            listen = False
+        while not self._stop_event.is_set():
+            try:
+                if listen:
+                    self._listen()
+                else:
+                    self.refresh()
+                    self._stop_event.wait(self.refresh_seconds)
+            except Exception as e:
+                print(f"Erreur lors du rafraîchissement des métadonnées : {e}")
+                self._stop_event.wait(self.refresh_seconds)
+
+
+def install_metadata_triggers():
+    """
+    Installe la fonction et les triggers de notification sur les tables de métadonnées existantes.
+    Modifie le schéma (propriétaire des tables requis) : script d'installation, jamais appelé par le serveur.
+    Retourne les tables équipées.
+    """
+    conn = get_db_connection()
+    try:
+        installed = []
+        with conn.cursor() as cursor:
+            cursor.execute(METADATA_NOTIFY_FUNCTION_DDL)
+            for table, trigger in METADATA_TRIGGERS.items():
+                cursor.execute("SELECT to_regclass(%s)", (table,))
+                if cursor.fetchone()[0] is None:
+                    continue
+                cursor.execute(f"DROP TRIGGER IF EXISTS {trigger} ON {table}")
+                cursor.execute(f"CREATE TRIGGER {trigger} AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table} "
+                               "FOR EACH STATEMENT EXECUTE FUNCTION notify_metadata_change()")
+                installed.append(table)
+        conn.commit()
+        return installed
+    finally:
+        conn.close()
+
+
+_registry = MetadataRegistry()
+
+
+def get_metadata_registry():
+    """Retourne le registre du processus (rafraîchissement démarré au premier appel)."""
+    if METADATA_REGISTRY_ENABLED:
+        _registry.start()
+    return _registry
+
+
+if __name__ == "__main__":
+    print("Installation des triggers de notification des métadonnées...")
+    tables = install_metadata_triggers()
+    print(f"Triggers installés sur : {', '.join(tables) or 'aucune table'}. Relancer après la création de {METADATA_TABLE}.")
@@ -0,0 +1,227 @@
+import os
+import numpy as np
+import pandas as pd
+from data_processing.db_connection import get_db_connection
+from data_processing.typed_reader import DATETIME, read_sql_typed
+from data_processing.sensor_layout import SENSOR_STORAGE_LAYOUT, LONG_TABLE, WIDE_TABLE, get_sensor_metadata, wide_to_long
+from data_processing.kpi_calculator import PLANNED_DOWNTIME_CATEGORIES, get_downtime_data
+
+try:
+    from data_processing.simulate_data import SENSOR_PROFILES
+except ImportError: # Dépendances du simulateur (faker, simpy) absentes : tous les capteurs sont analysés
+    SENSOR_PROFILES = {}
+
+# Analyse des signes avant-coureurs : chaque arrêt imprévu est aligné sur la fenêtre de relevés qui le
+# précède, pour chaque capteur lié à sa raison. On obtient le profil moyen avant panne par raison
+# (courbe en fonction du temps restant avant l'arrêt) et le délai entre l'apparition de la dérive et
+# l'arrêt. Les fenêtres sont découpées par recherche dichotomique dans des séries triées (pas de
+# double boucle relevés x arrêts) et seuls les relevés des fenêtres sont lus en base.
+
+PRECURSOR_WINDOW_HOURS = float(os.getenv("PRECURSOR_WINDOW_HOURS", "8"))
+PRECURSOR_STEP_MINUTES = int(os.getenv("PRECURSOR_STEP_MINUTES", "15"))
+PRECURSOR_BASELINE_MINUTES = 60 # Début de fenêtre servant de référence (comportement normal)
+PRECURSOR_ONSET_Z = 3.0 # Écart (en écarts-types de la référence) qui marque l'apparition de la dérive
+
+
+def related_sensor_map(sensor_profiles):
+    """Raison d'arrêt -> capteurs liés, d'après related_downtime_reason des profils du simulateur."""
+    sensor_map = {}
+    for sensor_type, profile in sensor_profiles.items():
+        if profile.get('related_downtime_reason'):
+            sensor_map.setdefault(profile['related_downtime_reason'], []).append(sensor_type)
+    return sensor_map
+
+
+# Capteurs liés à chaque raison d'arrêt ; None : tous les capteurs présents pour chaque arrêt
+PRECURSOR_SENSOR_MAP = related_sensor_map(SENSOR_PROFILES) or None
+
+PROFILE_COLUMNS = ['downtime_reason', 'sensor_type', 'minutes_before_downtime', 'num_events', 'num_readings', 'mean_value', 'std_value', 'mean_deviation']
+LEAD_TIME_COLUMNS = ['downtime_reason', 'sensor_type', 'num_events', 'num_with_precursor', 'mean_lead_time_hours',
+                     'median_lead_time_hours', 'p10_lead_time_hours', 'p90_lead_time_hours', 'mean_deviation_at_downtime']
+
+
+def _precursor_pairs(downtimes_df, sensor_types, sensor_map):
+    """Une ligne par (arrêt imprévu, capteur analysé)."""
+    unplanned = downtimes_df[~downtimes_df['downtime_category'].isin(PLANNED_DOWNTIME_CATEGORIES)]
+    unplanned = unplanned[['downtime_id', 'equipment_id', 'downtime_reason', 'start_time']].copy()
+    unplanned['start_time'] = pd.to_datetime(unplanned['start_time']).astype('datetime64[ns]')
+    if sensor_map is None:
+        pairs = unplanned.merge(pd.DataFrame({'sensor_type': sensor_types}), how='cross')
+    else:
+        related = pd.DataFrame([(reason, sensor) for reason, sensors in sensor_map.items() for sensor in sensors],
+                               columns=['downtime_reason', 'sensor_type'])
+        pairs = unplanned.merge(related, on='downtime_reason', how='inner')
+    return pairs.reset_index(drop=True)
+
+
+def align_precursor_windows(downtimes_df, readings_df, window_hours=PRECURSOR_WINDOW_HOURS,
+                            step_minutes=PRECURSOR_STEP_MINUTES, sensor_map=PRECURSOR_SENSOR_MAP):
+    """
+    Aligne les arrêts imprévus sur les relevés qui les précèdent.
+    sensor_map=None analyse tous les capteurs présents pour chaque arrêt.
+    Retourne (profiles_df, lead_times_df).
+    """
+    empty = pd.DataFrame(columns=PROFILE_COLUMNS), pd.DataFrame(columns=LEAD_TIME_COLUMNS)
+    if downtimes_df.empty or readings_df.empty:
+        return empty
+    pairs = _precursor_pairs(downtimes_df, readings_df['sensor_type'].unique(), sensor_map)
+    if pairs.empty:
+        return empty
+
+    window_ns = pd.Timedelta(hours=window_hours).value
+    step_ns = pd.Timedelta(minutes=step_minutes).value
+    n_bins = int(np.ceil(window_ns / step_ns))
+    baseline_bins = max(1, PRECURSOR_BASELINE_MINUTES // step_minutes)
+
+    # Relevés triés par (série, temps) : chaque série (équipement, capteur) occupe un bloc contigu
+    eq_codes, eq_values = pd.factorize(readings_df['equipment_id'])
+    sensor_codes, sensor_values = pd.factorize(readings_df['sensor_type'])
+    series_codes = eq_codes.astype(np.int64) * len(sensor_values) + sensor_codes
+    timestamps = pd.to_datetime(readings_df['timestamp']).to_numpy(dtype='datetime64[ns]').astype(np.int64)
+    order = np.lexsort((timestamps, series_codes))
+    series_codes, timestamps = series_codes[order], timestamps[order]
+    values = readings_df['value'].to_numpy(dtype=np.float64)[order]
+    block_first = np.flatnonzero(np.r_[True, series_codes[1:] != series_codes[:-1]])
+    block_last = np.r_[block_first[1:], len(series_codes)]
+    block_codes = series_codes[block_first]
+
+    # Fenêtre [début d'arrêt - window, début d'arrêt) de chaque paire -> tranche [lo, hi) des relevés
+    pair_end = pairs['start_time'].to_numpy(dtype='datetime64[ns]').astype(np.int64)
+    pair_start = pair_end - window_ns
+    pair_eq = pd.Index(eq_values).get_indexer(pairs['equipment_id'])
+    pair_sensor = pd.Index(sensor_values).get_indexer(pairs['sensor_type'])
+    pair_codes = np.where((pair_eq >= 0) & (pair_sensor >= 0), pair_eq.astype(np.int64) * len(sensor_values) + pair_sensor, -1)
+    pair_block = np.minimum(np.searchsorted(block_codes, pair_codes), len(block_codes) - 1)
+    pair_block = np.where(block_codes[pair_block] == pair_codes, pair_block, -1)
+    lo = np.zeros(len(pairs), dtype=np.int64)
+    hi = np.zeros(len(pairs), dtype=np.int64)
+    for block in np.unique(pair_block[pair_block >= 0]):
+        in_block = pair_block == block
+        block_ts = timestamps[block_first[block]:block_last[block]]
+        lo[in_block] = block_first[block] + np.searchsorted(block_ts, pair_start[in_block], side='left')
+        hi[in_block] = block_first[block] + np.searchsorted(block_ts, pair_end[in_block], side='left')
+
+    # Une ligne par (paire, relevé de sa fenêtre)
+    counts = hi - lo
+    pair = np.repeat(np.arange(len(pairs)), counts)
+    reading = lo[pair] + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    bin_idx = np.minimum((timestamps[reading] - pair_start[pair]) // step_ns, n_bins - 1)
+    reading_values = values[reading]
+
+    # Référence de chaque paire : moyenne / écart-type du début de fenêtre
+    in_baseline = bin_idx < baseline_bins
+    base_n = np.bincount(pair[in_baseline], minlength=len(pairs))
+    base_sum = np.bincount(pair[in_baseline], weights=reading_values[in_baseline], minlength=len(pairs))
+    base_sumsq = np.bincount(pair[in_baseline], weights=reading_values[in_baseline] ** 2, minlength=len(pairs))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        base_mean = base_sum / base_n
+        base_std = np.sqrt(np.maximum(base_sumsq / base_n - base_mean ** 2, 0))
+    deviation = reading_values - base_mean[pair]
+
+    exploded = pd.DataFrame({
+        'pair': pair, 'bin': bin_idx, 'value': reading_values, 'deviation': deviation,
+        'downtime_reason': pairs['downtime_reason'].to_numpy()[pair], 'sensor_type': pairs['sensor_type'].to_numpy()[pair],
+    })
+
+    # --- Profil moyen par raison et capteur ---
+    profiles_df = exploded.groupby(['downtime_reason', 'sensor_type', 'bin'], observed=True).agg(
+        num_events=('pair', 'nunique'), num_readings=('value', 'size'),
+        mean_value=('value', 'mean'), std_value=('value', 'std'), mean_deviation=('deviation', 'mean'),
+    ).reset_index()
+    profiles_df['minutes_before_downtime'] = window_ns / 6e10 - profiles_df['bin'] * step_minutes
+    profiles_df = profiles_df.sort_values(['downtime_reason', 'sensor_type', 'minutes_before_downtime'], ascending=[True, True, False])
+
+    # --- Délai d'anticipation : première tranche (après la référence) dont l'écart moyen dépasse le seuil ---
+    bin_means = exploded.groupby(['pair', 'bin'], as_index=False)['deviation'].mean()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        bin_z = np.abs(bin_means['deviation'].to_numpy()) / base_std[bin_means['pair'].to_numpy()]
+    onsets = bin_means[(bin_means['bin'] >= baseline_bins) & (bin_z > PRECURSOR_ONSET_Z)].groupby('pair')['bin'].min()
+    pairs['lead_time_hours'] = np.nan
+    pairs.loc[onsets.index, 'lead_time_hours'] = (window_ns / 3.6e12) - onsets.to_numpy() * step_minutes / 60
+
+    # Écart à l'arrêt : dernier relevé avant le début de l'arrêt (jointure as-of sur les relevés des
+    # fenêtres, tolérance d'une tranche)
+    window_readings = pd.DataFrame({
+        'series': pair_codes[pair], 'reading_time': timestamps[reading].astype('datetime64[ns]'), 'value_at_downtime': reading_values,
+    }).sort_values('reading_time', kind='stable')
+    pairs['series'] = pair_codes
+    pairs['baseline_mean'] = base_mean
+    pairs = pd.merge_asof(
+        pairs.sort_values('start_time'), window_readings,
+        left_on='start_time', right_on='reading_time', by='series',
+        direction='backward', allow_exact_matches=False, tolerance=pd.Timedelta(minutes=step_minutes)
+    )
+    pairs['deviation_at_downtime'] = pairs['value_at_downtime'] - pairs['baseline_mean']
+
+    lead_times_df = pairs.groupby(['downtime_reason', 'sensor_type'], observed=True).agg(
+        num_events=('downtime_id', 'count'),
+        num_with_precursor=('lead_time_hours', 'count'),
+        mean_lead_time_hours=('lead_time_hours', 'mean'),
+        median_lead_time_hours=('lead_time_hours', 'median'),
+        p10_lead_time_hours=('lead_time_hours', lambda s: s.quantile(0.1)),
+        p90_lead_time_hours=('lead_time_hours', lambda s: s.quantile(0.9)),
+        mean_deviation_at_downtime=('deviation_at_downtime', 'mean'),
+    ).reset_index()
+    return profiles_df[PROFILE_COLUMNS].reset_index(drop=True), lead_times_df[LEAD_TIME_COLUMNS]
+
+
+def get_precursor_readings(start_time, end_time, window_hours=PRECURSOR_WINDOW_HOURS, equipment_id=None, sensor_types=None):
+    """
+    Relevés situés dans la fenêtre précédant un arrêt imprévu de la période (seules ces fenêtres sont lues).
+    """
+    conn = get_db_connection()
+    if conn:
+        try:
+            window = pd.Timedelta(hours=window_hours).to_pytimedelta()
+            params = {'start_time': start_time, 'end_time': end_time, 'window': window, 'planned': PLANNED_DOWNTIME_CATEGORIES}
+            if SENSOR_STORAGE_LAYOUT == 'wide':
+                metadata = get_sensor_metadata(conn)
+                if sensor_types:
+                    metadata = metadata[metadata['sensor_type'].isin(sensor_types)]
+                if metadata.empty:
+                    return pd.DataFrame()
+                selected = ', '.join(f's."{col}" AS "{sensor}"' for col, sensor in zip(metadata['column_name'], metadata['sensor_type']))
+                query = f"SELECT s.timestamp, s.equipment_id, {selected} FROM {WIDE_TABLE} s"
+            else:
+                query = f"SELECT s.timestamp, s.equipment_id, s.sensor_type, s.value FROM {LONG_TABLE} s"
+            query += """
+                WHERE s.timestamp >= %(start_time)s - %(window)s AND s.timestamp < %(end_time)s
+                  AND EXISTS (
+                      SELECT 1 FROM downtime_logs d
+                      WHERE d.equipment_id = s.equipment_id
+                        AND d.downtime_category <> ALL(%(planned)s)
+                        AND d.start_time >= %(start_time)s AND d.start_time < %(end_time)s
+                        AND s.timestamp >= d.start_time - %(window)s AND s.timestamp < d.start_time
+                  )
+            """
+            if equipment_id:
+                query += " AND s.equipment_id = %(equipment_id)s"
+                params['equipment_id'] = equipment_id
+
+            if SENSOR_STORAGE_LAYOUT == 'wide':
+                schema = {'timestamp': DATETIME, 'equipment_id': 'category', **{sensor: 'float32' for sensor in metadata['sensor_type']}}
+                return wide_to_long(read_sql_typed(query, conn, params=params, table=WIDE_TABLE, schema=schema), units={})
+            if sensor_types:
+                query += " AND s.sensor_type = ANY(%(sensor_types)s)"
+                params['sensor_types'] = list(sensor_types)
+            return read_sql_typed(query, conn, params=params, table=LONG_TABLE)
+        except Exception as e:
+            print(f"Erreur lors de la récupération des relevés avant arrêt : {e}")
+            return pd.DataFrame()
+        finally:
+            conn.close()
+    return pd.DataFrame()
+
+
+def analyze_failure_precursors(start_time, end_time, equipment_id=None, window_hours=PRECURSOR_WINDOW_HOURS,
+                               step_minutes=PRECURSOR_STEP_MINUTES, related_only=True):
+    """Profils avant panne et délais d'anticipation pour les arrêts imprévus débutant dans la période."""
+    downtimes_df = get_downtime_data(start_time=start_time, end_time=end_time, equipment_id=equipment_id)
+    if downtimes_df.empty:
+        return pd.DataFrame(columns=PROFILE_COLUMNS), pd.DataFrame(columns=LEAD_TIME_COLUMNS)
+    downtimes_df = downtimes_df[(downtimes_df['start_time'] >= start_time) & (downtimes_df['start_time'] < end_time)]
+
+    sensor_map = PRECURSOR_SENSOR_MAP if related_only else None
+    sensor_types = sorted({sensor for sensors in sensor_map.values() for sensor in sensors}) if sensor_map else None
+    readings_df = get_precursor_readings(start_time, end_time, window_hours, equipment_id, sensor_types)
+    return align_precursor_windows(downtimes_df, readings_df, window_hours, step_minutes, sensor_map)
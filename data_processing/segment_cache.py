@@ -0,0 +1,254 @@
+import os
+import threading
+from collections import OrderedDict
+import pandas as pd
+from data_processing.db_connection import get_db_connection
+from data_processing.typed_reader import TABLE_SCHEMAS, apply_schema, memory_footprint
+from data_processing.table_versions import get_table_versions
+
+# Cache par segments journaliers des lectures brutes (production_output, downtime_logs).
+# Les fenêtres demandées par le tableau de bord se recouvrent (1er janv.-1er févr., puis 8 janv.-8 févr.) :
+# les données sont conservées par (table, équipement, jour) et une période est reconstituée à partir des
+# segments en cache ; seuls les jours manquants sont lus en base (une requête par suite de jours consécutifs).
+# Validité : chaque segment garde le repère table_versions pris avant sa lecture. Tant que la table n'a
+# pas été modifiée par un autre écrivain, il est servi tel quel ; sinon, l'empreinte de chaque jour
+# (nombre de lignes et derniers timestamps, une requête agrégée pour tous les jours demandés) est
+# comparée à celle du segment, et seuls les jours qui diffèrent sont relus. Les lignes écrites par le
+# tampon d'ingestion de ce processus invalident directement les jours touchés.
+# La taille totale est bornée (RANGE_CACHE_MAX_BYTES) avec éviction des segments les moins récemment utilisés.
+# Désactivé par défaut : les écritures des autres processus ne sont vues qu'après publication des
+# statistiques PostgreSQL et relecture des versions (quelques secondes).
+
+RANGE_CACHE_ENABLED = os.getenv("RANGE_CACHE_ENABLED", "0") == "1"
+RANGE_CACHE_MAX_BYTES = int(os.getenv("RANGE_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+DAY = pd.Timedelta(days=1)
+
+# Par table : comment découper une lecture en segments et filtrer une période exacte
+SEGMENTED_TABLES = {
+    # Relevé de production : appartient au jour de son timestamp (requête : start <= timestamp <= end)
+    'production_output': {
+        'key_column': 'timestamp', 'sort_by': None, 'fingerprint_columns': ['timestamp'],
+        'day_condition': "t.timestamp >= d.day AND t.timestamp < d.day + interval '1 day'",
+    },
+    # Arrêt : appartient à chaque jour qu'il chevauche (requête : end_time > start et start_time < end)
+    'downtime_logs': {
+        'key_column': 'start_time', 'sort_by': ['equipment_id', 'start_time'], 'fingerprint_columns': ['start_time', 'end_time'],
+        'day_condition': "t.end_time > d.day AND t.start_time < d.day + interval '1 day'",
+    },
+}
+
+
+def _segment_rows(table, df, day_start, day_end):
+    """Lignes d'une lecture appartenant au segment [day_start, day_end)."""
+    if table == 'production_output':
+        mask = (df['timestamp'] >= day_start) & (df['timestamp'] < day_end)
+    else:
+        mask = (df['end_time'] > day_start) & (df['start_time'] < day_end)
+    return df[mask.to_numpy()]
+
+
+def _frame_fingerprint(table, frame):
+    """Empreinte d'un segment : nombre de lignes et maximum de chaque colonne de temps."""
+    maxima = []
+    for col in SEGMENTED_TABLES[table]['fingerprint_columns']:
+        value = frame[col].max() if len(frame) else None
+        maxima.append(None if value is None or pd.isna(value) else pd.Timestamp(value))
+    return (len(frame), *maxima)
+
+
+def read_day_fingerprints(table, days, equipment_id=None):
+    """Empreintes en base des segments journaliers de table pour les jours demandés (une requête)."""
+    spec = SEGMENTED_TABLES[table]
+    maxima = ', '.join(f"MAX(t.{col})" for col in spec['fingerprint_columns'])
+    equipment_filter = " AND t.equipment_id = %(equipment_id)s" if equipment_id else ""
+    conn = get_db_connection()
+    if not conn:
+        return {} # Empreintes illisibles : les segments à vérifier seront relus
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"SELECT d.day, COUNT(t.{spec['key_column']}), {maxima} "
+                f"FROM unnest(%(days)s::timestamp[]) AS d(day) "
+                f"LEFT JOIN {table} t ON {spec['day_condition']}{equipment_filter} GROUP BY d.day",
+                {'days': [pd.Timestamp(day).to_pydatetime() for day in days], 'equipment_id': equipment_id})
+            return {
+                pd.Timestamp(day): (count, *(None if value is None else pd.Timestamp(value) for value in values))
+                for day, count, *values in cursor.fetchall()
+            }
+    finally:
+        conn.close()
+
+
+def _period_rows(table, df, start_time, end_time):
+    """Filtre exact de la période, identique aux conditions SQL de get_production_data / get_downtime_data."""
+    if table == 'production_output':
+        mask = (df['timestamp'] >= start_time) & (df['timestamp'] <= end_time)
+    else:
+        mask = (df['end_time'] > start_time) & (df['start_time'] < end_time)
+    return df[mask.to_numpy()]
+
+
+class RangeSegmentCache:
+    """Cache LRU de segments (table, equipment_id, jour) borné en octets."""
+
+    def __init__(self, max_bytes=RANGE_CACHE_MAX_BYTES, read_fingerprints=read_day_fingerprints):
+        self.max_bytes = max_bytes
+        self.read_fingerprints = read_fingerprints
+        self.segments = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.refetched = 0
+        self.lock = threading.Lock()
+
+    def _lookup(self, table, equipment_id, day):
+        """(clé, entrée) du segment servant le jour ; un segment « tous équipements » sert aussi un équipement."""
+        for key in [(table, equipment_id, day), (table, None, day)] if equipment_id else [(table, None, day)]:
+            entry = self.segments.get(key)
+            if entry is not None:
+                self.segments.move_to_end(key)
+                return key, entry
+        return None, None
+
+    def _validate(self, table, found):
+        """
+        Segments trouvés (jour -> (clé, entrée)) encore valides. Ceux dont la table a été modifiée par
+        un autre écrivain sont comparés à l'empreinte en base ; les segments différents sont retirés.
+        """
+        versions = get_table_versions()
+        suspects = {day: (key, entry) for day, (key, entry) in found.items() if versions.changed_externally(entry['marks'])}
+        if not suspects:
+            return found
+        marks = versions.mark(table)
+        valid = {day: found[day] for day in found if day not in suspects}
+        by_scope = {}
+        for day, (key, entry) in suspects.items():
+            by_scope.setdefault(key[1], []).append(day)
+        for equipment_id, days in by_scope.items():
+            try:
+                fingerprints = self.read_fingerprints(table, days, equipment_id)
+            except Exception as e:
+                print(f"Erreur lors de la vérification des segments en cache de {table} : {e}")
+                fingerprints = {}
+            with self.lock:
+                for day in days:
+                    key, entry = suspects[day]
+                    if fingerprints.get(day) == entry['fingerprint']:
+                        entry['marks'] = marks
+                        valid[day] = (key, entry)
+                        self.revalidated += 1
+                    else:
+                        if self.segments.get(key) is entry:
+                            self._remove(key)
+                        self.refetched += 1
+        return valid
+
+    def _remove(self, key):
+        entry = self.segments.pop(key)
+        self.total_bytes -= entry['bytes']
+
+    def _store(self, key, frame, marks):
+        size = memory_footprint(frame)
+        if size > self.max_bytes:
+            return
+        if key in self.segments:
+            self._remove(key)
+        self.segments[key] = {
+            'frame': frame, 'bytes': size, 'marks': marks, 'fingerprint': _frame_fingerprint(key[0], frame),
+        }
+        self.total_bytes += size
+        while self.total_bytes > self.max_bytes:
+            self._remove(next(iter(self.segments)))
+
+    def get(self, table, start_time, end_time, equipment_id, loader):
+        """
+        Lignes de `table` pour la période, reconstituées depuis les segments journaliers.
+        loader(start_time, end_time, equipment_id) lit la base pour les jours manquants.
+        """
+        start_time, end_time = pd.Timestamp(start_time), pd.Timestamp(end_time)
+        days = list(pd.date_range(start_time.floor('D'), end_time.floor('D'), freq='D'))
+        found = {}
+        with self.lock:
+            for day in days:
+                key, entry = self._lookup(table, equipment_id or None, day)
+                if entry is not None:
+                    found[day] = (key, entry)
+        found = self._validate(table, found)
+
+        frames = {}
+        for day, (key, entry) in found.items():
+            frame = entry['frame']
+            if key[1] is None and equipment_id:
+                frame = frame[(frame['equipment_id'] == equipment_id).to_numpy()]
+            frames[day] = frame
+        missing = [day for day in days if day not in frames]
+        with self.lock:
+            self.hits += len(frames)
+            self.misses += len(missing)
+
+        # Une lecture par suite de jours manquants consécutifs
+        runs = []
+        for day in missing:
+            if runs and runs[-1][-1] + DAY == day:
+                runs[-1].append(day)
+            else:
+                runs.append([day])
+        for run in runs:
+            run_start, run_end = run[0], run[-1] + DAY
+            marks = get_table_versions().mark(table) # Avant la lecture : une écriture pendant la lecture périme les segments
+            fetched = loader(run_start.to_pydatetime(), run_end.to_pydatetime(), equipment_id)
+            if SEGMENTED_TABLES[table]['key_column'] not in fetched.columns:
+                return pd.DataFrame() # Erreur de lecture (déjà signalée par le loader) : rien n'est mis en cache
+            with self.lock:
+                for day in run:
+                    frame = _segment_rows(table, fetched, day, day + DAY).reset_index(drop=True)
+                    frames[day] = frame
+                    self._store((table, equipment_id or None, day), frame, marks)
+
+        df = pd.concat([frames[day] for day in days], ignore_index=True)
+        if table == 'downtime_logs':
+            # Un arrêt sur plusieurs jours est présent dans chacun de leurs segments
+            df = df.drop_duplicates('downtime_id')
+        df = _period_rows(table, df, start_time, end_time)
+        sort_by = SEGMENTED_TABLES[table]['sort_by']
+        if sort_by:
+            df = df.sort_values(sort_by, kind='stable')
+        # Les catégories diffèrent d'un segment à l'autre : on retype après concaténation
+        return apply_schema(df.reset_index(drop=True), TABLE_SCHEMAS[table])
+
+    def invalidate(self, table=None, start_time=None, end_time=None):
+        """Supprime les segments d'une table (toutes si None) recouvrant [start_time, end_time]."""
+        first_day = pd.Timestamp(start_time).floor('D') if start_time is not None else None
+        last_day = pd.Timestamp(end_time).floor('D') if end_time is not None else None
+        with self.lock:
+            for key in list(self.segments):
+                if table is not None and key[0] != table:
+                    continue
+                if (first_day is not None and key[2] < first_day) or (last_day is not None and key[2] > last_day):
+                    continue
+                self._remove(key)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'segments': len(self.segments), 'bytes': self.total_bytes, 'max_bytes': self.max_bytes,
+                'hits': self.hits, 'misses': self.misses, 'revalidated': self.revalidated, 'refetched': self.refetched,
+            }
+
+
+_range_cache = RangeSegmentCache()
+
+
+def _invalidate_written(table, df, first_time, last_time):
+    # Lignes écrites par ce processus (tardives comprises) : les segments des jours touchés sont périmés
+    if table in SEGMENTED_TABLES and first_time is not None:
+        _range_cache.invalidate(table, first_time, last_time)
+
+
+get_table_versions().subscribe(_invalidate_written)
+
+
+def get_range_cache():
+    return _range_cache
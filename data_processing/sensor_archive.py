@@ -0,0 +1,218 @@
+import json
+import os
+import threading
+import numpy as np
+import pandas as pd
+from data_processing.db_connection import get_db_connection
+from data_processing.typed_reader import DATETIME, TABLE_SCHEMAS, apply_schema
+from data_processing.sensor_layout import active_sensor_table, read_sensor_readings
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError: # Dépendance optionnelle : requise seulement si l'archive est utilisée
+    pa = None
+
+# Archive froide des relevés de capteurs.
+# Les mois clos sont exportés en fichiers Arrow IPC (un fichier par mois et par équipement, triés par
+# timestamp) : colonnes typées (timestamp[ns], sensor_type/unit encodés en dictionnaire, value float32).
+# La lecture passe par un mmap : seules les pages de la plage demandée sont lues, sans copie ni
+# désérialisation. Un manifeste JSON liste les fichiers et la borne archived_until : les relevés
+# antérieurs sont lus dans l'archive, les suivants en base (la table chaude peut alors être purgée).
+
+# Lecture de l'archive par get_sensor_data
+SENSOR_ARCHIVE_ENABLED = os.getenv("SENSOR_ARCHIVE_ENABLED", "0") == "1"
+SENSOR_ARCHIVE_DIR = os.getenv("SENSOR_ARCHIVE_DIR", "sensor_archive")
+# Nombre de mois (mois en cours compris) gardés uniquement en base
+SENSOR_ARCHIVE_HOT_MONTHS = int(os.getenv("SENSOR_ARCHIVE_HOT_MONTHS", "3"))
+# 'none' : lecture mmap sans copie ; 'zstd' ou 'lz4' : fichiers ~3x plus petits, décompressés à la lecture
+SENSOR_ARCHIVE_COMPRESSION = os.getenv("SENSOR_ARCHIVE_COMPRESSION", "none")
+
+ARCHIVE_COLUMNS = ['timestamp', 'sensor_type', 'value', 'unit']
+MANIFEST_FILE = 'manifest.json'
+
+_manifest_lock = threading.Lock()
+_manifest_cache = {'key': None, 'manifest': None}
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError("pyarrow est requis pour l'archive des relevés de capteurs (pip install pyarrow).")
+
+
+def _month_start(timestamp):
+    return pd.Timestamp(timestamp).to_period('M').to_timestamp()
+
+
+# --- Manifeste ---
+
+def _manifest_path(archive_dir):
+    return os.path.join(archive_dir, MANIFEST_FILE)
+
+
+def load_manifest(archive_dir=SENSOR_ARCHIVE_DIR):
+    """Manifeste de l'archive ({'archived_until': ..., 'files': [...]}), relu seulement s'il a changé."""
+    path = _manifest_path(archive_dir)
+    if not os.path.exists(path):
+        return {'archived_until': None, 'files': []}
+    mtime = os.path.getmtime(path)
+    with _manifest_lock:
+        if _manifest_cache['key'] != (path, mtime):
+            with open(path) as f:
+                _manifest_cache['manifest'] = json.load(f)
+            _manifest_cache['key'] = (path, mtime)
+        return _manifest_cache['manifest']
+
+
+def save_manifest(manifest, archive_dir=SENSOR_ARCHIVE_DIR):
+    # Écriture atomique : un lecteur voit l'ancien ou le nouveau manifeste, jamais un fichier partiel
+    path = _manifest_path(archive_dir)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def get_archive_cutoff(archive_dir=SENSOR_ARCHIVE_DIR):
+    """Les relevés antérieurs à cette date sont dans l'archive (None si l'archive est vide)."""
+    archived_until = load_manifest(archive_dir)['archived_until']
+    return pd.Timestamp(archived_until) if archived_until else None
+
+
+# --- Export ---
+
+def write_archive_file(readings_df, path):
+    """Écrit les relevés d'un équipement (format long) dans un fichier Arrow IPC trié par timestamp."""
+    _require_pyarrow()
+    readings_df = readings_df.sort_values(['timestamp', 'sensor_type'], kind='stable')[ARCHIVE_COLUMNS].copy()
+    readings_df['timestamp'] = readings_df['timestamp'].astype(DATETIME) # Bornes de lecture comparées en ns
+    for col in ['sensor_type', 'unit']:
+        readings_df[col] = readings_df[col].astype('category').cat.remove_unused_categories()
+    table = pa.Table.from_pandas(readings_df, preserve_index=False)
+    compression = None if SENSOR_ARCHIVE_COMPRESSION == 'none' else SENSOR_ARCHIVE_COMPRESSION
+    tmp_path = path + '.tmp'
+    with pa.OSFile(tmp_path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema, options=pa.ipc.IpcWriteOptions(compression=compression)) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+    return os.path.getsize(path)
+
+
+def archive_month(conn, month_start, archive_dir=SENSOR_ARCHIVE_DIR):
+    """Exporte un mois de relevés (table active) : un fichier par équipement. Retourne les entrées du manifeste."""
+    month_end = month_start + pd.DateOffset(months=1)
+    readings_df = read_sensor_readings(conn, month_start.to_pydatetime(), month_end.to_pydatetime())
+    readings_df = readings_df[readings_df['timestamp'] < month_end]
+
+    month_dir = os.path.join(archive_dir, month_start.strftime('%Y-%m'))
+    os.makedirs(month_dir, exist_ok=True)
+    entries = []
+    for equipment_id, equipment_df in readings_df.groupby('equipment_id', observed=True):
+        relative_path = os.path.join(month_start.strftime('%Y-%m'), f"{equipment_id}.arrow")
+        size = write_archive_file(equipment_df, os.path.join(archive_dir, relative_path))
+        entries.append({
+            'equipment_id': str(equipment_id),
+            'month': month_start.strftime('%Y-%m'),
+            'path': relative_path,
+            'rows': len(equipment_df),
+            'min_timestamp': equipment_df['timestamp'].min().isoformat(),
+            'max_timestamp': equipment_df['timestamp'].max().isoformat(),
+            'bytes': size,
+        })
+    return entries
+
+
+def prune_hot_readings(conn, start_time, end_time):
+    """Supprime de la table active les relevés de [start_time, end_time) (déjà archivés)."""
+    with conn.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {active_sensor_table()} WHERE timestamp >= %(start_time)s AND timestamp < %(end_time)s",
+            {'start_time': start_time, 'end_time': end_time}
+        )
+        deleted = cursor.rowcount
+    conn.commit()
+    return deleted
+
+
+def archive_closed_months(prune=False, hot_months=SENSOR_ARCHIVE_HOT_MONTHS, archive_dir=SENSOR_ARCHIVE_DIR):
+    """
+    Tâche de mise en archive : exporte, mois par mois, les mois clos depuis archived_until en gardant
+    hot_months mois en base. Le manifeste est enregistré après chaque mois ; avec prune=True, les
+    relevés du mois sont ensuite supprimés de la table chaude.
+    """
+    _require_pyarrow()
+    os.makedirs(archive_dir, exist_ok=True)
+    manifest = dict(load_manifest(archive_dir))
+    manifest['files'] = list(manifest['files'])
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"SELECT MIN(timestamp), MAX(timestamp) FROM {active_sensor_table()}")
+            first_reading, last_reading = cursor.fetchone()
+        if last_reading is None:
+            return manifest
+
+        month = pd.Timestamp(manifest['archived_until']) if manifest['archived_until'] else _month_start(first_reading)
+        boundary = _month_start(last_reading) - pd.DateOffset(months=max(hot_months - 1, 0))
+        while month < boundary:
+            month_end = month + pd.DateOffset(months=1)
+            entries = archive_month(conn, month, archive_dir)
+            manifest['files'] = [entry for entry in manifest['files'] if entry['month'] != month.strftime('%Y-%m')] + entries
+            manifest['archived_until'] = month_end.isoformat()
+            save_manifest(manifest, archive_dir)
+            print(f"Archive {month:%Y-%m} : {sum(e['rows'] for e in entries)} relevés, {sum(e['bytes'] for e in entries) / 1e6:.1f} Mo")
+            if prune:
+                prune_hot_readings(conn, month.to_pydatetime(), month_end.to_pydatetime())
+            month = month_end
+    finally:
+        conn.close()
+    return manifest
+
+
+# --- Lecture ---
+
+def _read_archive_file(path, start_ns, end_ns, sensor_type=None):
+    """Relevés de [start_ns, end_ns] d'un fichier, lus via mmap (tranche contiguë : fichier trié par timestamp)."""
+    with pa.memory_map(path, 'r') as source:
+        table = pa.ipc.open_file(source).read_all()
+        timestamps = table.column('timestamp').to_numpy().astype(np.int64)
+        lo = np.searchsorted(timestamps, start_ns, side='left')
+        hi = np.searchsorted(timestamps, end_ns, side='right')
+        df = table.slice(lo, hi - lo).to_pandas()
+    if sensor_type:
+        df = df[df['sensor_type'] == sensor_type]
+    return df
+
+
+def read_archived_sensor_data(start_time=None, end_time=None, equipment_id=None, sensor_type=None, archive_dir=SENSOR_ARCHIVE_DIR):
+    """Relevés archivés au format long de get_sensor_data (mêmes filtres, bornes incluses)."""
+    _require_pyarrow()
+    start = pd.Timestamp(start_time) if start_time is not None else pd.Timestamp.min
+    end = pd.Timestamp(end_time) if end_time is not None else pd.Timestamp.max
+    frames = []
+    for entry in load_manifest(archive_dir)['files']:
+        if equipment_id and entry['equipment_id'] != equipment_id:
+            continue
+        if pd.Timestamp(entry['max_timestamp']) < start or pd.Timestamp(entry['min_timestamp']) > end:
+            continue
+        df = _read_archive_file(os.path.join(archive_dir, entry['path']), start.value, end.value, sensor_type)
+        df.insert(1, 'equipment_id', entry['equipment_id'])
+        frames.append(df)
+
+    columns = ['timestamp', 'equipment_id', 'sensor_type', 'value', 'unit']
+    if not frames:
+        return apply_schema(pd.DataFrame(columns=columns), TABLE_SCHEMAS['sensor_readings'])
+    df = pd.concat(frames, ignore_index=True)
+    df = df.sort_values('timestamp', kind='stable').reset_index(drop=True)[columns]
+    return apply_schema(df, TABLE_SCHEMAS['sensor_readings'])
+
+
+# Mise en archive : python -m data_processing.sensor_archive [--prune] (depuis la racine du projet)
+if __name__ == "__main__":
+    import sys
+    prune = '--prune' in sys.argv
+    print(f"Mise en archive des mois clos dans '{SENSOR_ARCHIVE_DIR}'{' avec purge de la table chaude' if prune else ''}...")
+    manifest = archive_closed_months(prune=prune)
+    print(f"Archive à jour jusqu'au {manifest['archived_until']} ({len(manifest['files'])} fichiers). "
+          f"Activer la lecture avec SENSOR_ARCHIVE_ENABLED=1.")
@@ -0,0 +1,324 @@
+import os
+import json
+import queue
+import threading
+import numpy as np
+import pandas as pd
+from data_processing.typed_reader import to_records
+from data_processing.kpi_calculator import get_sensor_data
+from data_processing.sensor_layout import LONG_TABLE, WIDE_TABLE, active_sensor_table
+from data_processing.table_versions import get_table_versions
+
+# Tampon circulaire en mémoire des derniers relevés de capteurs, par (equipment_id, sensor_type).
+# Les graphiques live demandent presque toujours les dernières minutes : elles sont servies depuis
+# la mémoire. La mémoire est fixe (SENSOR_BUFFER_CAPACITY relevés par série, 12 octets par relevé)
+# et toute lecture qui remonte avant l'horizon du tampon repart vers la base.
+# Le tampon est alimenté par les écritures du tampon d'ingestion (abonné à table_versions) et par un
+# poller de la base pour les autres écrivains.
+# Relevés tardifs : le poller relit les SENSOR_BUFFER_LATE_SECONDS précédant son watermark et les
+# relevés arrivés dans le désordre sont insérés à leur place (les doublons sont ignorés). Un relevé
+# plus ancien que l'horizon complet d'une série n'y est pas ajouté : ces lectures passent par la base.
+# Un relevé d'un autre écrivain arrivé après la fenêtre de relecture n'est pas vu par le poller : il
+# est détecté en comparant les modifications de la table (table_versions) aux lignes trouvées, et
+# plus aucune série n'est alors considérée complète avant la fenêtre relue (lectures vers la base).
+
+SENSOR_BUFFER_CAPACITY = int(os.getenv("SENSOR_BUFFER_CAPACITY", "2880")) # 24 h à un relevé / 30 s
+SENSOR_BUFFER_SEED_MINUTES = int(os.getenv("SENSOR_BUFFER_SEED_MINUTES", "120"))
+SENSOR_BUFFER_LATE_SECONDS = float(os.getenv("SENSOR_BUFFER_LATE_SECONDS", "60"))
+SENSOR_BUFFER_POLL_INTERVAL_SECONDS = float(os.getenv("SENSOR_BUFFER_POLL_INTERVAL_SECONDS", "5"))
+SENSOR_STREAM_QUEUE_SIZE = int(os.getenv("SENSOR_STREAM_QUEUE_SIZE", "100"))
+
+SENSOR_COLUMNS = ['timestamp', 'equipment_id', 'sensor_type', 'value', 'unit']
+
+
+class _SensorSeries:
+    """Tableaux NumPy de taille fixe (timestamps en ns, valeurs) écrits en rond."""
+
+    def __init__(self, capacity, complete_since):
+        self.timestamps = np.zeros(capacity, dtype=np.int64)
+        self.values = np.zeros(capacity, dtype=np.float32) # Même précision que la lecture typée
+        self.head = 0 # Prochaine position d'écriture
+        self.count = 0
+        self.unit = None
+        # Instant à partir duquel le tampon contient TOUS les relevés de la série
+        self.complete_since = complete_since
+
+    @property
+    def capacity(self):
+        return len(self.timestamps)
+
+    @property
+    def last_timestamp(self):
+        return self.timestamps[(self.head - 1) % self.capacity] if self.count else None
+
+    def append(self, timestamps, values):
+        """
+        Ajoute des relevés triés. Retourne le masque des relevés ajoutés : ceux déjà présents (même
+        timestamp) ou antérieurs à complete_since sont ignorés, les relevés tardifs insérés à leur place.
+        """
+        added = timestamps >= self.complete_since
+        if self.count:
+            kept_timestamps, _ = self.ordered()
+            added &= ~np.isin(timestamps, kept_timestamps)
+            late = added & (timestamps < self.last_timestamp)
+            if late.any():
+                self._insert(timestamps[added], values[added])
+                return added
+        self._append_newer(timestamps[added], values[added])
+        return added
+
+    def _insert(self, timestamps, values):
+        # Fusion triée avec les relevés en mémoire, puis réécriture à partir de la position 0
+        kept_timestamps, kept_values = self.ordered()
+        merged_timestamps = np.concatenate([kept_timestamps, timestamps])
+        order = np.argsort(merged_timestamps, kind='stable')
+        merged_timestamps = merged_timestamps[order][-self.capacity:]
+        merged_values = np.concatenate([kept_values, values])[order][-self.capacity:]
+        if len(order) > self.capacity:
+            self.complete_since = max(self.complete_since, int(merged_timestamps[0]))
+        self.count = len(merged_timestamps)
+        self.timestamps[:self.count] = merged_timestamps
+        self.values[:self.count] = merged_values
+        self.head = self.count % self.capacity
+
+    def _append_newer(self, timestamps, values):
+        n = len(timestamps)
+        if n == 0:
+            return
+        overwritten = self.count + n > self.capacity
+        if n > self.capacity:
+            timestamps, values = timestamps[-self.capacity:], values[-self.capacity:]
+            n = self.capacity
+
+        positions = (self.head + np.arange(n)) % self.capacity
+        self.timestamps[positions] = timestamps
+        self.values[positions] = values
+        self.head = (self.head + n) % self.capacity
+        self.count = min(self.capacity, self.count + n)
+        if overwritten:
+            # Les relevés les plus anciens ont été écrasés : l'horizon avance
+            self.complete_since = max(self.complete_since, int(self.ordered()[0][0]))
+
+    def ordered(self):
+        """Copie des relevés dans l'ordre chronologique."""
+        if self.count < self.capacity:
+            return self.timestamps[:self.count].copy(), self.values[:self.count].copy()
+        return np.roll(self.timestamps, -self.head), np.roll(self.values, -self.head)
+
+    def window(self, start_ns, end_ns):
+        timestamps, values = self.ordered()
+        lo = np.searchsorted(timestamps, start_ns, side='left')
+        hi = np.searchsorted(timestamps, end_ns, side='right') # Borne de fin incluse, comme get_sensor_data
+        return timestamps[lo:hi], values[lo:hi]
+
+
+class SensorRingBuffer:
+    """Ensemble des séries en mémoire, alimenté par l'ingestion (append) et par le poller de la base."""
+
+    def __init__(self, capacity=SENSOR_BUFFER_CAPACITY):
+        self.capacity = capacity
+        self.series = {}
+        self.subscribers = {} # file -> (equipment_id, sensor_type) filtrés (None = tous)
+        self.listeners = [] # Fonctions appelées avec chaque lot de nouveaux relevés (ex. détection d'anomalies)
+        self.watermark = None
+        self.poll_marks = None # Repère table_versions de référence du poller
+        self.found_rows = 0 # Lignes de la table trouvées par le poller depuis ce repère
+        self.missed_late_writes = 0
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def memory_bytes(self):
+        return len(self.series) * self.capacity * 12
+
+    def append(self, readings_df, complete_since=None):
+        """
+        Ajoute des relevés (colonnes SENSOR_COLUMNS). complete_since indique depuis quand le flux est
+        complet pour les nouvelles séries (par défaut : leur premier relevé reçu). Retourne les relevés ajoutés.
+        """
+        if readings_df.empty:
+            return readings_df
+        readings_df = readings_df.sort_values('timestamp')
+        timestamps = pd.to_datetime(readings_df['timestamp']).to_numpy(dtype='datetime64[ns]').astype(np.int64)
+        values = readings_df['value'].to_numpy(dtype=np.float32)
+        keys = list(zip(readings_df['equipment_id'], readings_df['sensor_type']))
+        codes, uniques = pd.factorize(pd.Series(keys, dtype=object))
+
+        added = np.zeros(len(readings_df), dtype=bool)
+        with self._lock:
+            for code, key in enumerate(uniques):
+                mask = codes == code
+                if key not in self.series:
+                    since = pd.Timestamp(complete_since).value if complete_since is not None else int(timestamps[mask][0])
+                    self.series[key] = _SensorSeries(self.capacity, since)
+                added[mask] = self.series[key].append(timestamps[mask], values[mask])
+                self.series[key].unit = readings_df.loc[mask, 'unit'].iloc[-1] if 'unit' in readings_df else None
+        # Seuls les relevés nouveaux sont diffusés (les relectures du poller sont des doublons)
+        readings_df = readings_df[added]
+        if readings_df.empty:
+            return readings_df
+        self._publish(readings_df)
+        for listener in list(self.listeners):
+            try:
+                listener(readings_df)
+            except Exception as e:
+                print(f"Erreur dans un consommateur du tampon de capteurs : {e}")
+        return readings_df
+
+    def mark_incomplete(self, since):
+        """Aucune série n'est plus considérée complète avant since (des relevés antérieurs peuvent manquer)."""
+        since_ns = pd.Timestamp(since).value
+        with self._lock:
+            for series in self.series.values():
+                series.complete_since = max(series.complete_since, since_ns)
+
+    def query(self, start_time, end_time, equipment_id=None, sensor_type=None):
+        """
+        Relevés [start_time, end_time] depuis la mémoire, au format de get_sensor_data.
+        Retourne None si une série concernée ne couvre pas start_time (il faut alors lire la base).
+        """
+        start_ns, end_ns = pd.Timestamp(start_time).value, pd.Timestamp(end_time).value
+        with self._lock:
+            keys = [key for key in self.series
+                    if (equipment_id is None or key[0] == equipment_id) and (sensor_type is None or key[1] == sensor_type)]
+            if not keys or any(self.series[key].complete_since > start_ns for key in keys):
+                return None
+            frames = []
+            for key in keys:
+                timestamps, values = self.series[key].window(start_ns, end_ns)
+                frames.append(pd.DataFrame({
+                    'timestamp': pd.to_datetime(timestamps.astype('datetime64[ns]')),
+                    'equipment_id': key[0], 'sensor_type': key[1],
+                    'value': values, 'unit': self.series[key].unit,
+                }))
+        df = pd.concat(frames, ignore_index=True)
+        return df.sort_values('timestamp', kind='stable').reset_index(drop=True)[SENSOR_COLUMNS]
+
+    # --- Flux des nouveaux relevés ---
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def subscribe(self, equipment_id=None, sensor_type=None):
+        subscriber = queue.Queue(maxsize=SENSOR_STREAM_QUEUE_SIZE)
+        with self._lock:
+            self.subscribers[subscriber] = (equipment_id, sensor_type)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self.subscribers.pop(subscriber, None)
+
+    def _publish(self, readings_df):
+        with self._lock:
+            subscribers = list(self.subscribers.items())
+        for subscriber, (equipment_id, sensor_type) in subscribers:
+            selected = readings_df
+            if equipment_id:
+                selected = selected[selected['equipment_id'] == equipment_id]
+            if sensor_type:
+                selected = selected[selected['sensor_type'] == sensor_type]
+            if selected.empty:
+                continue
+            message = json.dumps(to_records(selected[SENSOR_COLUMNS]), default=str)
+            try:
+                subscriber.put_nowait(message)
+            except queue.Full:
+                pass # Client trop lent : les relevés manqués restent disponibles via /api/sensor-data
+
+    # --- Alimentation depuis la base ---
+
+    def poll_once(self, now=None):
+        """
+        Lit les relevés arrivés depuis le watermark, en relisant SENSOR_BUFFER_LATE_SECONDS avant lui pour
+        les relevés tardifs (amorçage sur SENSOR_BUFFER_SEED_MINUTES au premier appel).
+        """
+        table = active_sensor_table()
+        marks = get_table_versions().mark(table) # Avant la lecture : tout ce qu'il compte est relu ci-dessous
+        complete_since = None
+        if self.watermark is None:
+            now = pd.Timestamp(now) if now is not None else pd.Timestamp.now()
+            self.watermark = complete_since = now - pd.Timedelta(minutes=SENSOR_BUFFER_SEED_MINUTES)
+            since = self.watermark
+            self.poll_marks, self.found_rows = marks, 0
+        else:
+            since = self.watermark - pd.Timedelta(seconds=SENSOR_BUFFER_LATE_SECONDS)
+
+        # get_sensor_data lit la table longue ou large selon SENSOR_STORAGE_LAYOUT
+        readings_df = get_sensor_data(start_time=since)
+        if not readings_df.empty:
+            self.watermark = max(self.watermark, readings_df['timestamp'].max())
+            added = self.append(readings_df, complete_since=complete_since)
+            if complete_since is not None:
+                return # Amorçage : lignes pour la plupart antérieures au repère
+            # Une ligne de la table large porte tous les capteurs d'un équipement à un instant
+            self.found_rows += len(added.drop_duplicates(['equipment_id', 'timestamp'])) if table == WIDE_TABLE else len(added)
+
+        if self._missed_external_rows(table, marks):
+            print(f"Relevés tardifs non relus dans {table} : tampon de capteurs incomplet avant {since}.")
+            self.missed_late_writes += 1
+            self.mark_incomplete(since)
+            self.poll_marks, self.found_rows = marks, 0
+
+    def _missed_external_rows(self, table, marks):
+        """
+        True si les autres écrivains ont modifié plus de lignes depuis le repère du poller qu'il n'en a
+        trouvé : des relevés ont été écrits avant sa fenêtre de relecture (ou mis à jour, supprimés).
+        """
+        base, current = (self.poll_marks or {}).get(table), marks.get(table)
+        if base is None or current is None:
+            return False
+        if current[0] != base[0]:
+            return True # Table recréée
+        external_changes = (current[1] - base[1]) - (current[2] - base[2])
+        return external_changes > self.found_rows
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='sensor-buffer-poller', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.poll_once()
+            except Exception as e:
+                print(f"Erreur lors de la mise à jour du tampon de capteurs : {e}")
+            self._stop_event.wait(SENSOR_BUFFER_POLL_INTERVAL_SECONDS)
+
+
+_sensor_buffer = None
+_sensor_buffer_lock = threading.Lock()
+
+
+def get_sensor_buffer():
+    """Retourne le tampon du processus (poller démarré au premier appel)."""
+    global _sensor_buffer
+    with _sensor_buffer_lock:
+        if _sensor_buffer is None:
+            _sensor_buffer = SensorRingBuffer()
+            _sensor_buffer.start()
+    return _sensor_buffer
+
+
+def _append_written(table, df, first_time, last_time):
+    """Relevés écrits par le tampon d'ingestion : ajoutés au tampon s'il est démarré."""
+    if table not in (LONG_TABLE, WIDE_TABLE) or _sensor_buffer is None:
+        return
+    _sensor_buffer.append(df[[col for col in SENSOR_COLUMNS if col in df.columns]])
+
+
+get_table_versions().subscribe(_append_written)
+
+
+def get_recent_sensor_data(start_time, end_time, equipment_id=None, sensor_type=None):
+    """Comme get_sensor_data, mais servi depuis la mémoire quand la fenêtre est dans l'horizon du tampon."""
+    df = get_sensor_buffer().query(start_time, end_time, equipment_id, sensor_type)
+    if df is None:
+        return get_sensor_data(start_time, end_time, equipment_id, sensor_type)
+    return df
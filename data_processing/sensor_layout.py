@@ -0,0 +1,351 @@
+import io
+import os
+import re
+import threading
+import numpy as np
+import pandas as pd
+from data_processing.db_connection import get_db_connection
+from data_processing.typed_reader import DATETIME, read_sql_typed
+
+# Stockage « large » des relevés de capteurs.
+# La table longue sensor_readings contient une ligne par capteur et par relevé (timestamp,
+# equipment_id et unit répétés à chaque ligne). La table large sensor_readings_wide contient une
+# ligne par (equipment_id, timestamp) et une colonne REAL par capteur : 4x moins de lignes et
+# d'entrées d'index, et un graphique multi-capteurs se lit en un seul parcours d'index.
+# Les unités (constantes par capteur) passent dans la table de métadonnées sensor_metadata.
+# Les capteurs déjà déclarés (métadonnées et colonnes de la table large, lues une fois dans
+# information_schema) sont gardés en mémoire : une écriture ne verrouille la table (ALTER TABLE) que
+# pour un nouveau capteur. Après une erreur d'écriture, ce cache est relu.
+
+# 'long' (sensor_readings) ou 'wide' (sensor_readings_wide) : table lue par get_sensor_data
+SENSOR_STORAGE_LAYOUT = os.getenv("SENSOR_STORAGE_LAYOUT", "long")
+
+LONG_TABLE = 'sensor_readings'
+WIDE_TABLE = 'sensor_readings_wide'
+METADATA_TABLE = 'sensor_metadata'
+
+SENSOR_LAYOUT_DDL = f"""
+CREATE TABLE IF NOT EXISTS {METADATA_TABLE} (
+    sensor_type VARCHAR(50) PRIMARY KEY,
+    column_name VARCHAR(63) NOT NULL UNIQUE,
+    unit VARCHAR(20)
+);
+CREATE TABLE IF NOT EXISTS {WIDE_TABLE} (
+    equipment_id VARCHAR(50) NOT NULL,
+    timestamp TIMESTAMP NOT NULL,
+    PRIMARY KEY (equipment_id, timestamp)
+);
+CREATE INDEX IF NOT EXISTS idx_{WIDE_TABLE}_timestamp ON {WIDE_TABLE} (timestamp);
+"""
+
+MIGRATION_BATCH_DAYS = int(os.getenv("SENSOR_MIGRATION_BATCH_DAYS", "7"))
+
+# Cache du processus : tables créées, colonnes de la table large, unité connue par capteur
+_layout_state = {'tables_ready': False, 'columns': None, 'units': None}
+_layout_lock = threading.Lock()
+
+
+def sensor_column_name(sensor_type):
+    """Nom de colonne SQL d'un capteur (ex. 'Temperature_Motor' -> 'temperature_motor')."""
+    return re.sub(r'\W', '_', sensor_type.strip().lower())[:63]
+
+
+def active_sensor_table():
+    return WIDE_TABLE if SENSOR_STORAGE_LAYOUT == 'wide' else LONG_TABLE
+
+
+# --- Conversions long <-> large (vectorisées) ---
+
+def long_to_wide(readings_df):
+    """
+    Relevés longs (timestamp, equipment_id, sensor_type, value[, unit]) -> une ligne par
+    (timestamp, equipment_id) et une colonne par sensor_type. Les unités sont placées dans attrs['units'].
+    """
+    if readings_df.empty:
+        wide_df = pd.DataFrame(columns=['timestamp', 'equipment_id'])
+        wide_df.attrs['units'] = {}
+        return wide_df
+    deduplicated = readings_df.drop_duplicates(['timestamp', 'equipment_id', 'sensor_type'], keep='last')
+    wide_df = deduplicated.set_index(['timestamp', 'equipment_id', 'sensor_type'])['value'].unstack('sensor_type')
+    wide_df.columns = [str(col) for col in wide_df.columns]
+    wide_df = wide_df.reset_index().sort_values(['timestamp', 'equipment_id'], kind='stable').reset_index(drop=True)
+    units = {}
+    if 'unit' in readings_df.columns:
+        units = deduplicated.drop_duplicates('sensor_type', keep='last').set_index('sensor_type')['unit'].astype(object).to_dict()
+        units = {str(sensor): unit for sensor, unit in units.items()}
+    wide_df.attrs['units'] = units
+    return wide_df
+
+
+def wide_to_long(wide_df, units=None):
+    """
+    Une ligne par (timestamp, equipment_id) et une colonne par capteur -> format long de get_sensor_data.
+    Les cellules vides (capteur sans relevé à ce timestamp) sont ignorées.
+    """
+    units = units if units is not None else wide_df.attrs.get('units', {})
+    sensor_cols = [col for col in wide_df.columns if col not in ('timestamp', 'equipment_id')]
+    columns = ['timestamp', 'equipment_id', 'sensor_type', 'value', 'unit']
+    if wide_df.empty or not sensor_cols:
+        return pd.DataFrame(columns=columns)
+
+    values = wide_df[sensor_cols].to_numpy(dtype=np.float32)
+    present = ~np.isnan(values)
+    rows, sensors = np.nonzero(present) # Ordre : timestamp puis capteur, comme la lecture longue
+    sensor_names = np.asarray(sensor_cols, dtype=object)
+    return pd.DataFrame({
+        'timestamp': wide_df['timestamp'].to_numpy()[rows],
+        'equipment_id': pd.Categorical(wide_df['equipment_id'].to_numpy()[rows]),
+        'sensor_type': pd.Categorical(sensor_names[sensors], categories=sensor_cols),
+        'value': values[rows, sensors],
+        'unit': pd.Categorical(np.asarray([units.get(sensor) for sensor in sensor_cols], dtype=object)[sensors]),
+    })[columns]
+
+
+# --- Métadonnées ---
+
+def ensure_sensor_layout_tables(conn):
+    with _layout_lock:
+        if _layout_state['tables_ready']:
+            return
+        with conn.cursor() as cursor:
+            cursor.execute(SENSOR_LAYOUT_DDL)
+        conn.commit()
+        _layout_state['tables_ready'] = True
+
+
+def forget_sensor_layout():
+    """Oublie les tables, colonnes et capteurs connus (relus à la prochaine écriture)."""
+    with _layout_lock:
+        _layout_state.update(tables_ready=False, columns=None, units=None)
+
+
+def _load_sensor_layout(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT column_name FROM information_schema.columns WHERE table_name = %s", (WIDE_TABLE,))
+        _layout_state['columns'] = {row[0] for row in cursor.fetchall()}
+        cursor.execute(f"SELECT sensor_type, unit FROM {METADATA_TABLE}")
+        _layout_state['units'] = dict(cursor.fetchall())
+
+
+def get_sensor_metadata(conn=None):
+    """Capteurs connus : sensor_type, column_name (colonne de la table large), unit."""
+    own_conn = conn is None
+    conn = conn or get_db_connection()
+    try:
+        return pd.read_sql(f"SELECT sensor_type, column_name, unit FROM {METADATA_TABLE} ORDER BY sensor_type", conn)
+    except Exception as e:
+        print(f"Erreur lors de la récupération des métadonnées capteurs : {e}")
+        return pd.DataFrame(columns=['sensor_type', 'column_name', 'unit'])
+    finally:
+        if own_conn:
+            conn.close()
+
+
+def register_sensors(conn, units_by_sensor):
+    """
+    Déclare des capteurs (métadonnées + colonne dans la table large) ; les capteurs existants sont conservés.
+    Seuls les capteurs nouveaux (ou dont l'unité change) sont écrits ; la colonne n'est ajoutée que si elle manque.
+    """
+    with _layout_lock:
+        if _layout_state['columns'] is None:
+            _load_sensor_layout(conn)
+        known_units, columns = _layout_state['units'], _layout_state['columns']
+        changed = {sensor_type: unit for sensor_type, unit in units_by_sensor.items()
+                   if sensor_type not in known_units or (unit is not None and unit != known_units[sensor_type])}
+        if not changed:
+            return
+        with conn.cursor() as cursor:
+            for sensor_type, unit in changed.items():
+                column = sensor_column_name(sensor_type)
+                cursor.execute(
+                    f"INSERT INTO {METADATA_TABLE} (sensor_type, column_name, unit) VALUES (%s, %s, %s) "
+                    "ON CONFLICT (sensor_type) DO UPDATE SET unit = COALESCE(EXCLUDED.unit, sensor_metadata.unit)",
+                    (sensor_type, column, unit)
+                )
+                if column not in columns:
+                    cursor.execute(f'ALTER TABLE {WIDE_TABLE} ADD COLUMN IF NOT EXISTS "{column}" REAL')
+        conn.commit()
+        for sensor_type, unit in changed.items():
+            known_units[sensor_type] = unit if unit is not None else known_units.get(sensor_type)
+            columns.add(sensor_column_name(sensor_type))
+
+
+# --- Écriture / migration ---
+
+def write_wide_sensor_readings(readings_df, conn=None):
+    """
+    Écrit des relevés (format long ou large) dans la table large par COPY.
+    Les lignes (equipment_id, timestamp) déjà présentes sont complétées, pas dupliquées.
+    """
+    if readings_df.empty:
+        return 0
+    if 'sensor_type' in readings_df.columns:
+        wide_df = long_to_wide(readings_df)
+    else:
+        wide_df = readings_df
+    units = wide_df.attrs.get('units', {})
+    sensor_cols = [col for col in wide_df.columns if col not in ('timestamp', 'equipment_id')]
+
+    own_conn = conn is None
+    conn = conn or get_db_connection()
+    try:
+        ensure_sensor_layout_tables(conn)
+        register_sensors(conn, {sensor: units.get(sensor) for sensor in sensor_cols})
+        columns = [sensor_column_name(sensor) for sensor in sensor_cols]
+        buffer = io.StringIO()
+        wide_df[['equipment_id', 'timestamp'] + sensor_cols].to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+        quoted = ', '.join(f'"{col}"' for col in columns)
+        with conn.cursor() as cursor:
+            # Table temporaire puis upsert : COPY seul échouerait sur une clé déjà présente
+            cursor.execute(f"CREATE TEMP TABLE wide_staging (LIKE {WIDE_TABLE} INCLUDING DEFAULTS) ON COMMIT DROP")
+            cursor.copy_expert(f"COPY wide_staging (equipment_id, timestamp, {quoted}) FROM STDIN WITH (FORMAT CSV)", buffer)
+            updates = ', '.join(f'"{col}" = COALESCE(EXCLUDED."{col}", {WIDE_TABLE}."{col}")' for col in columns)
+            cursor.execute(
+                f"INSERT INTO {WIDE_TABLE} (equipment_id, timestamp, {quoted}) "
+                f"SELECT equipment_id, timestamp, {quoted} FROM wide_staging "
+                f"ON CONFLICT (equipment_id, timestamp) DO UPDATE SET {updates}"
+            )
+        conn.commit()
+    except Exception:
+        forget_sensor_layout() # Table recréée ou modifiée par ailleurs : le cache est relu au prochain lot
+        raise
+    finally:
+        if own_conn:
+            conn.close()
+    return len(wide_df)
+
+
+def load_wide_sensor_csv(csv_path, units_csv_path=None):
+    """Charge un fichier sensor_readings_wide.csv produit par le simulateur (et ses unités)."""
+    wide_df = pd.read_csv(csv_path, parse_dates=['timestamp'])
+    if units_csv_path:
+        units_df = pd.read_csv(units_csv_path)
+        wide_df.attrs['units'] = dict(zip(units_df['sensor_type'], units_df['unit']))
+    return write_wide_sensor_readings(wide_df)
+
+
+def migrate_sensor_readings_to_wide(batch_days=MIGRATION_BATCH_DAYS):
+    """
+    Recopie la table longue dans la table large, par tranches de batch_days (pivot côté SQL avec
+    MAX(value) FILTER). Relançable : les lignes déjà migrées sont mises à jour, pas dupliquées.
+    """
+    conn = get_db_connection()
+    try:
+        ensure_sensor_layout_tables(conn)
+        units = pd.read_sql(f"SELECT sensor_type, MAX(unit) AS unit FROM {LONG_TABLE} GROUP BY sensor_type", conn)
+        register_sensors(conn, dict(zip(units['sensor_type'], units['unit'])))
+        with conn.cursor() as cursor:
+            cursor.execute(f"SELECT MIN(timestamp), MAX(timestamp) FROM {LONG_TABLE}")
+            first, last = cursor.fetchone()
+        if first is None:
+            return 0
+
+        columns = [sensor_column_name(sensor) for sensor in units['sensor_type']]
+        quoted = ', '.join(f'"{col}"' for col in columns)
+        pivots = ', '.join(f'MAX(value) FILTER (WHERE sensor_type = %(sensor_{i})s)' for i in range(len(columns)))
+        updates = ', '.join(f'"{col}" = EXCLUDED."{col}"' for col in columns)
+        params = {f'sensor_{i}': sensor for i, sensor in enumerate(units['sensor_type'])}
+
+        total = 0
+        batch_start = pd.Timestamp(first).normalize()
+        while batch_start <= pd.Timestamp(last):
+            batch_end = batch_start + pd.Timedelta(days=batch_days)
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    f"INSERT INTO {WIDE_TABLE} (equipment_id, timestamp, {quoted}) "
+                    f"SELECT equipment_id, timestamp, {pivots} FROM {LONG_TABLE} "
+                    "WHERE timestamp >= %(batch_start)s AND timestamp < %(batch_end)s "
+                    "GROUP BY equipment_id, timestamp "
+                    f"ON CONFLICT (equipment_id, timestamp) DO UPDATE SET {updates}",
+                    {**params, 'batch_start': batch_start.to_pydatetime(), 'batch_end': batch_end.to_pydatetime()}
+                )
+                total += cursor.rowcount
+            conn.commit()
+            print(f"Migration capteurs : {batch_start.date()} -> {batch_end.date()} ({total} lignes larges)")
+            batch_start = batch_end
+        return total
+    finally:
+        conn.close()
+
+
+# --- Lecture ---
+
+def read_wide_sensor_data(conn, start_time=None, end_time=None, equipment_id=None, sensor_type=None):
+    """
+    Lit la table large. Retourne une ligne par (timestamp, equipment_id) avec une colonne par
+    sensor_type (noms de capteurs, pas de colonnes SQL) et les unités dans attrs['units'].
+    """
+    metadata = get_sensor_metadata(conn)
+    if sensor_type:
+        metadata = metadata[metadata['sensor_type'] == sensor_type]
+    if metadata.empty:
+        wide_df = pd.DataFrame(columns=['timestamp', 'equipment_id'])
+        wide_df.attrs['units'] = {}
+        return wide_df
+
+    selected = ', '.join(f'"{col}" AS "{sensor}"' for col, sensor in zip(metadata['column_name'], metadata['sensor_type']))
+    query = f"SELECT timestamp, equipment_id, {selected} FROM {WIDE_TABLE}"
+    conditions = []
+    params = {}
+    if start_time:
+        conditions.append("timestamp >= %(start_time)s")
+        params['start_time'] = start_time
+    if end_time:
+        conditions.append("timestamp <= %(end_time)s")
+        params['end_time'] = end_time
+    if equipment_id:
+        conditions.append("equipment_id = %(equipment_id)s")
+        params['equipment_id'] = equipment_id
+    if sensor_type:
+        # Les lignes où ce capteur n'a pas de valeur ne sont pas utiles
+        conditions.append(f'"{metadata["column_name"].iloc[0]}" IS NOT NULL')
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY timestamp"
+
+    schema = {'timestamp': DATETIME, 'equipment_id': 'category', **{sensor: 'float32' for sensor in metadata['sensor_type']}}
+    wide_df = read_sql_typed(query, conn, params=params, table=WIDE_TABLE, schema=schema)
+    wide_df.attrs['units'] = dict(zip(metadata['sensor_type'], metadata['unit']))
+    return wide_df
+
+
+def read_long_sensor_data(conn, start_time=None, end_time=None, equipment_id=None, sensor_type=None):
+    """Lit la table longue : une ligne par relevé (timestamp, equipment_id, sensor_type, value, unit)."""
+    query = f"SELECT timestamp, equipment_id, sensor_type, value, unit FROM {LONG_TABLE}"
+    conditions = []
+    params = {}
+
+    if start_time:
+        conditions.append("timestamp >= %(start_time)s")
+        params['start_time'] = start_time
+    if end_time:
+        conditions.append("timestamp <= %(end_time)s")
+        params['end_time'] = end_time
+    if equipment_id:
+        conditions.append("equipment_id = %(equipment_id)s")
+        params['equipment_id'] = equipment_id
+    if sensor_type:
+        conditions.append("sensor_type = %(sensor_type)s")
+        params['sensor_type'] = sensor_type
+
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+
+    query += " ORDER BY timestamp" # Ordonner par temps pour les séries temporelles
+
+    return read_sql_typed(query, conn, params=params, table=LONG_TABLE) # timestamp déjà en datetime64
+
+
+def read_sensor_readings(conn, start_time=None, end_time=None, equipment_id=None, sensor_type=None):
+    """Relevés au format long depuis la table active (SENSOR_STORAGE_LAYOUT)."""
+    if SENSOR_STORAGE_LAYOUT == 'wide':
+        return wide_to_long(read_wide_sensor_data(conn, start_time, end_time, equipment_id, sensor_type))
+    return read_long_sensor_data(conn, start_time, end_time, equipment_id, sensor_type)
+
+
+# Migration : python -m data_processing.sensor_layout (depuis la racine du projet)
+if __name__ == "__main__":
+    print("Migration de sensor_readings vers sensor_readings_wide...")
+    migrated = migrate_sensor_readings_to_wide()
+    print(f"Migration terminée : {migrated} lignes larges écrites. Activer la lecture avec SENSOR_STORAGE_LAYOUT=wide.")
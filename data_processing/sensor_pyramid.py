@@ -0,0 +1,297 @@
+import os
+import threading
+import pandas as pd
+from data_processing.db_connection import get_db_connection
+from data_processing.typed_reader import DATETIME, read_sql_typed
+from data_processing.sensor_layout import (
+    SENSOR_STORAGE_LAYOUT, LONG_TABLE, WIDE_TABLE, get_sensor_metadata, active_sensor_table
+)
+from data_processing.table_versions import get_table_versions
+
+# Pyramide multi-résolution des relevés de capteurs.
+# Pour chaque niveau (1 min, 15 min, 1 h), une table d'agrégats par (equipment_id, sensor_type, tranche) :
+# nombre de relevés, min, max, moyenne et dernière valeur. Le niveau le plus fin est calculé depuis les
+# relevés bruts, chaque niveau suivant depuis le précédent, le tout côté PostgreSQL (INSERT ... SELECT).
+# get_sensor_data(points=N) lit le niveau le plus grossier qui donne encore au moins N points sur la
+# fenêtre demandée : un graphique sur un an lit ~9 000 lignes horaires au lieu d'un million de relevés.
+# Relevés tardifs : chaque mise à jour recalcule les SENSOR_PYRAMID_LATE_MINUTES précédant la dernière
+# tranche, ainsi que les tranches touchées par les écritures du tampon d'ingestion (table_versions),
+# quelle que soit leur ancienneté.
+
+# Lecture et maintenance de la pyramide (tables créées par ensure_pyramid_tables)
+SENSOR_PYRAMID_ENABLED = os.getenv("SENSOR_PYRAMID_ENABLED", "0") == "1"
+# Nombre de points souhaité par série pour un graphique (/api/sensor-data)
+SENSOR_CHART_POINTS = int(os.getenv("SENSOR_CHART_POINTS", "1000"))
+SENSOR_PYRAMID_UPDATE_INTERVAL_SECONDS = float(os.getenv("SENSOR_PYRAMID_UPDATE_INTERVAL_SECONDS", "60"))
+SENSOR_PYRAMID_BACKFILL_DAYS = int(os.getenv("SENSOR_PYRAMID_BACKFILL_DAYS", "7"))
+# Recalculé avant la dernière tranche à chaque mise à jour (relevés arrivés en retard d'autres écrivains)
+SENSOR_PYRAMID_LATE_MINUTES = int(os.getenv("SENSOR_PYRAMID_LATE_MINUTES", "180"))
+
+# Niveaux du plus fin au plus grossier (nom -> minutes) ; chaque niveau divise le suivant
+SENSOR_PYRAMID_LEVELS = {'1min': 1, '15min': 15, '1h': 60}
+PYRAMID_COLUMNS = ['timestamp', 'equipment_id', 'sensor_type', 'value', 'unit', 'min_value', 'max_value', 'last_value', 'num_readings']
+PYRAMID_SCHEMA = {
+    'timestamp': DATETIME, 'equipment_id': 'category', 'sensor_type': 'category', 'unit': 'category',
+    'value': 'float32', 'min_value': 'float32', 'max_value': 'float32', 'last_value': 'float32',
+    'num_readings': 'int32',
+}
+
+
+def pyramid_table(level):
+    return f"{LONG_TABLE}_{level}"
+
+
+PYRAMID_TABLE_DDL = "".join(f"""
+CREATE TABLE IF NOT EXISTS {pyramid_table(level)} (
+    equipment_id VARCHAR(50) NOT NULL,
+    sensor_type VARCHAR(50) NOT NULL,
+    bucket_start TIMESTAMP NOT NULL,
+    unit VARCHAR(20),
+    num_readings INTEGER NOT NULL,
+    min_value REAL,
+    max_value REAL,
+    mean_value REAL,
+    last_value REAL,
+    PRIMARY KEY (equipment_id, sensor_type, bucket_start)
+);
+CREATE INDEX IF NOT EXISTS idx_{pyramid_table(level)}_bucket ON {pyramid_table(level)} (bucket_start);
+""" for level in SENSOR_PYRAMID_LEVELS)
+
+_UPSERT_SET = ", ".join(f"{col} = EXCLUDED.{col}" for col in
+                        ['unit', 'num_readings', 'min_value', 'max_value', 'mean_value', 'last_value'])
+
+
+def _bucket_sql(column, minutes):
+    # Début de tranche aligné sur l'époque, comme pd.Timestamp.floor (colonnes TIMESTAMP sans fuseau)
+    seconds = minutes * 60
+    return f"(TO_TIMESTAMP(FLOOR(EXTRACT(EPOCH FROM {column}) / {seconds}) * {seconds}) AT TIME ZONE 'UTC')"
+
+
+def _coarsest_floor(timestamp):
+    return pd.Timestamp(timestamp).floor(f"{max(SENSOR_PYRAMID_LEVELS.values())}min")
+
+
+# --- Choix du niveau ---
+
+def choose_sensor_level(start_time, end_time, points=SENSOR_CHART_POINTS):
+    """
+    Niveau le plus grossier donnant au moins `points` tranches sur [start_time, end_time].
+    Retourne None si même le niveau le plus fin en donne moins : la fenêtre est courte, on lit le brut.
+    """
+    if not points or start_time is None or end_time is None:
+        return None
+    window_minutes = (pd.Timestamp(end_time) - pd.Timestamp(start_time)).total_seconds() / 60
+    for level, minutes in reversed(SENSOR_PYRAMID_LEVELS.items()):
+        if window_minutes / minutes >= points:
+            return level
+    return None
+
+
+# --- Maintenance ---
+
+def ensure_pyramid_tables(conn):
+    with conn.cursor() as cursor:
+        cursor.execute(PYRAMID_TABLE_DDL)
+    conn.commit()
+
+
+def _raw_readings_sql(conn):
+    """Relevés bruts au format long (timestamp, equipment_id, sensor_type, value, unit) selon la table active."""
+    if SENSOR_STORAGE_LAYOUT != 'wide':
+        return f"SELECT timestamp, equipment_id, sensor_type, value, unit FROM {LONG_TABLE}", {}
+    metadata = get_sensor_metadata(conn)
+    if metadata.empty:
+        return None, {}
+    # Dépivotage côté serveur : une ligne par capteur renseigné
+    columns = ', '.join(f'w."{col}"' for col in metadata['column_name'])
+    query = (
+        f"SELECT w.timestamp, w.equipment_id, s.sensor_type, s.value, s.unit FROM {WIDE_TABLE} w "
+        f"CROSS JOIN LATERAL UNNEST(%(sensor_types)s::text[], ARRAY[{columns}]::real[], %(units)s::text[]) "
+        f"AS s(sensor_type, value, unit) WHERE s.value IS NOT NULL"
+    )
+    return query, {'sensor_types': list(metadata['sensor_type']), 'units': list(metadata['unit'])}
+
+
+def build_pyramid(conn, start_time, end_time):
+    """
+    (Re)calcule toutes les tranches de [start_time, end_time) à chaque niveau (bornes alignées sur
+    le niveau le plus grossier, pour que chaque tranche soit recalculée en entier).
+    """
+    levels = list(SENSOR_PYRAMID_LEVELS.items())
+    raw_query, params = _raw_readings_sql(conn)
+    if raw_query is None:
+        return 0
+    params = {**params, 'start_time': start_time, 'end_time': end_time}
+    total = 0
+    with conn.cursor() as cursor:
+        finest, finest_minutes = levels[0]
+        cursor.execute(
+            f"INSERT INTO {pyramid_table(finest)} "
+            f"(equipment_id, sensor_type, bucket_start, unit, num_readings, min_value, max_value, mean_value, last_value) "
+            f"SELECT equipment_id, sensor_type, {_bucket_sql('timestamp', finest_minutes)}, MAX(unit), COUNT(*), "
+            f"MIN(value), MAX(value), AVG(value), (ARRAY_AGG(value ORDER BY timestamp DESC))[1] "
+            f"FROM ({raw_query}) r WHERE timestamp >= %(start_time)s AND timestamp < %(end_time)s "
+            f"GROUP BY 1, 2, 3 ON CONFLICT (equipment_id, sensor_type, bucket_start) DO UPDATE SET {_UPSERT_SET}",
+            params
+        )
+        total += cursor.rowcount
+        for (finer, _), (level, minutes) in zip(levels, levels[1:]):
+            cursor.execute(
+                f"INSERT INTO {pyramid_table(level)} "
+                f"(equipment_id, sensor_type, bucket_start, unit, num_readings, min_value, max_value, mean_value, last_value) "
+                f"SELECT equipment_id, sensor_type, {_bucket_sql('bucket_start', minutes)}, MAX(unit), SUM(num_readings), "
+                f"MIN(min_value), MAX(max_value), SUM(mean_value::float8 * num_readings) / SUM(num_readings), "
+                f"(ARRAY_AGG(last_value ORDER BY bucket_start DESC))[1] "
+                f"FROM {pyramid_table(finer)} WHERE bucket_start >= %(start_time)s AND bucket_start < %(end_time)s "
+                f"GROUP BY 1, 2, 3 ON CONFLICT (equipment_id, sensor_type, bucket_start) DO UPDATE SET {_UPSERT_SET}",
+                params
+            )
+            total += cursor.rowcount
+    conn.commit()
+    return total
+
+
+def backfill_sensor_pyramid(start_time, end_time):
+    """Construit les tranches couvrant [start_time, end_time), par blocs de SENSOR_PYRAMID_BACKFILL_DAYS."""
+    conn = get_db_connection()
+    try:
+        ensure_pyramid_tables(conn)
+        chunk_start = _coarsest_floor(start_time)
+        total = 0
+        while chunk_start < pd.Timestamp(end_time):
+            chunk_end = chunk_start + pd.Timedelta(days=SENSOR_PYRAMID_BACKFILL_DAYS)
+            total += build_pyramid(conn, chunk_start.to_pydatetime(), chunk_end.to_pydatetime())
+            chunk_start = chunk_end
+        return total
+    finally:
+        conn.close()
+
+
+_written_ranges = [] # (premier, dernier relevé) écrits par le tampon d'ingestion, pas encore agrégés
+_written_ranges_lock = threading.Lock()
+
+
+def _record_written(table, df, first_time, last_time):
+    """Relevés écrits par le tampon d'ingestion : leurs tranches seront recalculées à la prochaine mise à jour."""
+    if not SENSOR_PYRAMID_ENABLED or table not in (LONG_TABLE, WIDE_TABLE) or first_time is None:
+        return
+    with _written_ranges_lock:
+        # Gardées fusionnées (bornes incluses : dernier instant de la dernière tranche)
+        _written_ranges[:] = [(start, end - pd.Timedelta(nanoseconds=1))
+                              for start, end in rebuild_ranges(_written_ranges + [(first_time, last_time)])]
+
+
+get_table_versions().subscribe(_record_written)
+
+
+def rebuild_ranges(ranges):
+    """Plages [début, fin) alignées sur le niveau le plus grossier couvrant les plages (premier, dernier relevé), fusionnées."""
+    coarsest = pd.Timedelta(minutes=max(SENSOR_PYRAMID_LEVELS.values()))
+    merged = []
+    for start, end in sorted((_coarsest_floor(first), _coarsest_floor(last) + coarsest) for first, last in ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+
+def update_sensor_pyramid():
+    """
+    Mise à jour incrémentale : recalcule depuis SENSOR_PYRAMID_LATE_MINUTES avant la dernière tranche
+    du niveau le plus grossier jusqu'au dernier relevé (tranche en cours comprise), plus les tranches
+    touchées par les écritures du tampon d'ingestion depuis la mise à jour précédente.
+    """
+    coarsest = list(SENSOR_PYRAMID_LEVELS)[-1]
+    conn = get_db_connection()
+    try:
+        ensure_pyramid_tables(conn)
+        with conn.cursor() as cursor:
+            cursor.execute(f"SELECT MAX(bucket_start) FROM {pyramid_table(coarsest)}")
+            last_bucket = cursor.fetchone()[0]
+            cursor.execute(f"SELECT MIN(timestamp), MAX(timestamp) FROM {active_sensor_table()}")
+            first_reading, last_reading = cursor.fetchone()
+    finally:
+        conn.close()
+    if last_reading is None:
+        return 0
+    start_time = first_reading
+    if last_bucket is not None:
+        start_time = max(first_reading, pd.Timestamp(last_bucket) - pd.Timedelta(minutes=SENSOR_PYRAMID_LATE_MINUTES))
+    with _written_ranges_lock:
+        written = _written_ranges[:]
+        _written_ranges.clear()
+    try:
+        return sum(backfill_sensor_pyramid(start, end) for start, end in rebuild_ranges([(start_time, last_reading)] + written))
+    except Exception:
+        with _written_ranges_lock:
+            _written_ranges[:0] = written # Recalculées à la prochaine mise à jour
+        raise
+
+
+class SensorPyramidUpdater:
+    """Tâche de fond qui appelle update_sensor_pyramid à intervalle régulier."""
+
+    def __init__(self, interval_seconds=SENSOR_PYRAMID_UPDATE_INTERVAL_SECONDS):
+        self.interval_seconds = interval_seconds
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='sensor-pyramid-updater', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                update_sensor_pyramid()
+            except Exception as e:
+                print(f"Erreur lors de la mise à jour de la pyramide de capteurs : {e}")
+            self._stop_event.wait(self.interval_seconds)
+
+
+# --- Lecture ---
+
+def read_sensor_level(conn, level, start_time=None, end_time=None, equipment_id=None, sensor_type=None):
+    """
+    Lit un niveau de la pyramide au format long de get_sensor_data : timestamp = début de tranche,
+    value = moyenne de la tranche, plus min_value, max_value, last_value et num_readings.
+    """
+    query = (
+        f"SELECT bucket_start AS timestamp, equipment_id, sensor_type, mean_value AS value, unit, "
+        f"min_value, max_value, last_value, num_readings FROM {pyramid_table(level)}"
+    )
+    conditions = []
+    params = {}
+    if start_time:
+        # Tranche contenant start_time incluse
+        conditions.append("bucket_start >= %(start_time)s")
+        params['start_time'] = pd.Timestamp(start_time).floor(f"{SENSOR_PYRAMID_LEVELS[level]}min").to_pydatetime()
+    if end_time:
+        conditions.append("bucket_start <= %(end_time)s")
+        params['end_time'] = end_time
+    if equipment_id:
+        conditions.append("equipment_id = %(equipment_id)s")
+        params['equipment_id'] = equipment_id
+    if sensor_type:
+        conditions.append("sensor_type = %(sensor_type)s")
+        params['sensor_type'] = sensor_type
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY bucket_start"
+
+    df = read_sql_typed(query, conn, params=params, table=pyramid_table(level), schema=PYRAMID_SCHEMA)
+    return df[PYRAMID_COLUMNS]
+
+
+# Construction initiale : python -m data_processing.sensor_pyramid (depuis la racine du projet)
+if __name__ == "__main__":
+    print("Construction de la pyramide de capteurs...")
+    written = update_sensor_pyramid()
+    print(f"Pyramide à jour : {written} tranches écrites. Activer la lecture avec SENSOR_PYRAMID_ENABLED=1.")
@@ -248,10 +248,13 @@ def generate_machine_lifecycle(equip_df, start_date, end_date, params):
             dt['duration_seconds'] = (dt['end_time'] - dt['start_time']).total_seconds()
 
     events_df = pd.DataFrame(all_events).sort_values(by=['equipment_id', 'timestamp']).reset_index(drop=True)
-    downtimes_df = pd.DataFrame(all_downtimes).sort_values(by=['equipment_id', 'start_time']).reset_index(drop=True)
+    # Explicit columns: a short span (replay chunks) may have no downtime at all
+    downtimes_df = pd.DataFrame(all_downtimes, columns=['downtime_id', 'equipment_id', 'start_time', 'downtime_category', 'downtime_reason', 'end_time', 'duration_seconds'])
+    downtimes_df = downtimes_df.sort_values(by=['equipment_id', 'start_time']).reset_index(drop=True)
 
     # Ensure downtime durations are non-negative (can happen due to edge cases / floating point)
-    downtimes_df['duration_seconds'] = downtimes_df.apply(lambda row: max(0, (row['end_time'] - row['start_time']).total_seconds()), axis=1)
+    if not downtimes_df.empty:
+        downtimes_df['duration_seconds'] = downtimes_df.apply(lambda row: max(0, (row['end_time'] - row['start_time']).total_seconds()), axis=1)
 
 
     return events_df, downtimes_df
@@ -395,7 +398,7 @@ def generate_production_data(equip_df, events_df, end_date, params):
     return production_df
 
 
-def generate_sensor_readings_realistic(equip_df, events_df, start_date, end_date, params):
+def generate_sensor_readings_realistic(equip_df, events_df, start_date, end_date, params, downtimes_df=None):
     all_sensor_data = []
     time_delta_sensor = timedelta(seconds=params['SENSOR_READING_FREQUENCY_SECONDS'])
 
@@ -403,7 +406,9 @@ def generate_sensor_readings_realistic(equip_df, events_df, start_date, end_date
     unplanned_stops = events_df[(events_df['event_type'] == 'STOP') & (events_df['details'].str.contains('Unplanned'))].copy()
     # Need to link back to the cause determined in generate_machine_lifecycle
     # A simpler way is to find the downtime log that starts at the same time as the STOP event
-    downtime_causes = { (row['equipment_id'], row['start_time']): {'category': row['downtime_category'], 'reason': row['downtime_reason']} for index, row in generate_machine_lifecycle(equip_df, start_date, end_date, params)[1].iterrows() } # Regenerate just downtimes to get the mapping
+    if downtimes_df is None:
+        downtimes_df = generate_machine_lifecycle(equip_df, start_date, end_date, params)[1] # Regenerate just downtimes to get the mapping
+    downtime_causes = { (row['equipment_id'], row['start_time']): {'category': row['downtime_category'], 'reason': row['downtime_reason']} for index, row in downtimes_df.iterrows() }
 
     alarm_points = []
     for index, row in unplanned_stops.iterrows():
@@ -494,22 +499,29 @@ def generate_all_data_realistic(num_machines, start_date, end_date, params):
     return equip_df, events_df, downtimes_df, production_df, sensor_df
 
 
-
-# --- Main Execution ---
-if __name__ == "__main__":
-    print("Starting realistic data simulation...")
-
-    # Pass all parameters in a dictionary for cleaner function calls
-    sim_params = {
-        'AVG_MTBF_HOURS': 150,
-        'AVG_MTTR_HOURS_BREAKDOWN': 4,
-        'AVG_MTTR_HOURS_PROCESS': 1,
-        'AVG_MTTR_HOURS_CHANGEOVER': 0.5,
-        'AVG_MTTR_HOURS_MAINTENANCE': 8,
-        'PROB_STOP_IS_PLANNED_MAINT': 0.05,
-        'PROB_BREAKDOWN_IS_PROCESS': 0.3,
-        'PROB_CHANGEOVER': 0.15,
-        'DOWNTIME_REASONS': DOWNTIME_REASONS, 
+def to_wide_sensor_layout(sensor_df):
+    """
+    Wide layout: one row per (timestamp, equipment_id) with one column per sensor type.
+    Units are constant per sensor, so they are returned separately as sensor metadata.
+    """
+    wide_df = sensor_df.pivot_table(index=['timestamp', 'equipment_id'], columns='sensor_type', values='value', aggfunc='last').reset_index()
+    wide_df.columns.name = None
+    units_df = sensor_df.drop_duplicates('sensor_type')[['sensor_type', 'unit']].reset_index(drop=True)
+    return wide_df, units_df
+
+
+def default_params():
+    """Simulation parameters as passed to the generation functions (module defaults)."""
+    return {
+        'AVG_MTBF_HOURS': AVG_MTBF_HOURS,
+        'AVG_MTTR_HOURS_BREAKDOWN': AVG_MTTR_HOURS_BREAKDOWN,
+        'AVG_MTTR_HOURS_PROCESS': AVG_MTTR_HOURS_PROCESS,
+        'AVG_MTTR_HOURS_CHANGEOVER': AVG_MTTR_HOURS_CHANGEOVER,
+        'AVG_MTTR_HOURS_MAINTENANCE': AVG_MTTR_HOURS_MAINTENANCE,
+        'PROB_STOP_IS_PLANNED_MAINT': PROB_STOP_IS_PLANNED_MAINT,
+        'PROB_BREAKDOWN_IS_PROCESS': PROB_BREAKDOWN_IS_PROCESS,
+        'PROB_CHANGEOVER': PROB_CHANGEOVER,
+        'DOWNTIME_REASONS': DOWNTIME_REASONS,
         'IDEAL_CYCLE_TIME_SECONDS_MEAN': IDEAL_CYCLE_TIME_SECONDS_MEAN,
         'IDEAL_CYCLE_TIME_SECONDS_STD': IDEAL_CYCLE_TIME_SECONDS_STD,
         'PERFORMANCE_FACTOR_MEAN': PERFORMANCE_FACTOR_MEAN,
@@ -526,6 +538,14 @@ if __name__ == "__main__":
     }
 
 
+# --- Main Execution ---
+if __name__ == "__main__":
+    print("Starting realistic data simulation...")
+
+    # Pass all parameters in a dictionary for cleaner function calls
+    sim_params = default_params()
+
+
     equipments, events, downtimes, production, sensors = generate_all_data_realistic(
         NUM_MACHINES, PROJECT_START_DATE, PROJECT_END_DATE, sim_params
     )
@@ -540,6 +560,10 @@ if __name__ == "__main__":
     downtimes.to_csv(f'{output_dir}/downtime_logs.csv', index=False)
     production.to_csv(f'{output_dir}/production_output.csv', index=False)
     sensors.to_csv(f'{output_dir}/sensor_readings.csv', index=False)
+    # Same readings in the wide layout (table sensor_readings_wide, see data_processing/sensor_layout.py)
+    sensors_wide, sensor_units = to_wide_sensor_layout(sensors)
+    sensors_wide.to_csv(f'{output_dir}/sensor_readings_wide.csv', index=False)
+    sensor_units.to_csv(f'{output_dir}/sensor_metadata.csv', index=False)
 
     print(f"\nRealistic data simulation finished. CSV files saved in '{output_dir}' directory.")
     print("Summary:")
@@ -547,4 +571,4 @@ if __name__ == "__main__":
     print(f"- Machine Events: {len(events)} rows")
     print(f"- Downtime Logs: {len(downtimes)} rows")
     print(f"- Production Output: {len(production)} rows")
-    print(f"- Sensor Readings: {len(sensors)} rows")
+    print(f"- Sensor Readings: {len(sensors)} rows ({len(sensors_wide)} rows in the wide layout)")
@@ -0,0 +1,306 @@
+import os
+import sys
+import json
+import time
+import argparse
+import urllib.request
+import urllib.error
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+
+# Allow running as a script from the project root or from data_processing/
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+
+from data_processing.simulate_data import (
+    NUM_MACHINES, default_params, generate_equipment_data, generate_machine_lifecycle,
+    generate_production_data, generate_sensor_readings_realistic,
+)
+
+# Replay / live mode for the simulator.
+# The machine lifecycle (events, downtimes) and hourly production reports are generated for the whole
+# span with the batch functions; sensor readings are generated chunk by chunk with the same function.
+# Everything is then emitted in timestamp order, paced at `speed` x real time (None = as fast as possible):
+#   - machine events at their timestamp,
+#   - a downtime when it starts (end_time empty), then again with end_time/duration when it ends,
+#   - production reports at their timestamp (end of each running hour),
+#   - sensor readings every SENSOR_READING_FREQUENCY_SECONDS.
+# Records go to a sink: stdout (NDJSON stream), the ingestion API (/api/ingest/<table>) or the database
+# (COPY through data_processing.ingestion.write_batches).
+#
+# Examples (from the project root):
+#   python -m data_processing.simulate_replay --sink stdout --speed 60 --hours 1
+#   python -m data_processing.simulate_replay --sink ingest --speed 1            # live, starting now
+#   python -m data_processing.simulate_replay --sink db --speed max --start 2024-01-01 --hours 720
+
+REPLAY_TABLES = ['machine_events', 'downtime_logs', 'production_output', 'sensor_readings']
+# Column holding the emission time of each record
+EMIT_COLUMN = {'machine_events': 'timestamp', 'downtime_logs': 'emit_time', 'production_output': 'timestamp', 'sensor_readings': 'timestamp'}
+
+
+# --- Record streams ---
+
+def downtime_updates(downtimes_df, end_date):
+    """One record when a downtime starts (still open) and one when it ends, with an emit_time column."""
+    opened = downtimes_df.assign(end_time=pd.NaT, duration_seconds=np.nan, emit_time=downtimes_df['start_time'])
+    # Downtimes still running at the end of the span were closed at end_date by the generator: keep them open
+    closed = downtimes_df[downtimes_df['end_time'] < end_date]
+    closed = closed.assign(emit_time=closed['end_time'])
+    return pd.concat([opened, closed], ignore_index=True).sort_values('emit_time', kind='stable').reset_index(drop=True)
+
+
+def iter_replay_chunks(equip_df, events_df, downtimes_df, production_df, params, start_date, end_date, chunk_hours=1):
+    """Yields (chunk_start, {table: DataFrame sorted by emission time}) for consecutive chunks of the span."""
+    downtime_df = downtime_updates(downtimes_df, end_date)
+    trend_window = timedelta(hours=params['ALARM_PRE_TREND_WINDOW_HOURS'])
+    sources = {'machine_events': events_df.sort_values('timestamp', kind='stable'), 'downtime_logs': downtime_df,
+               'production_output': production_df.sort_values('timestamp', kind='stable')}
+
+    chunk_start = start_date
+    while chunk_start < end_date:
+        chunk_end = min(chunk_start + timedelta(hours=chunk_hours), end_date)
+        frames = {}
+        for table, df in sources.items():
+            emit = df[EMIT_COLUMN[table]]
+            frames[table] = df[((emit >= chunk_start) & (emit < chunk_end)).to_numpy()].reset_index(drop=True)
+
+        # Only alarms within the pre-trend window after the chunk can shape its readings
+        alarm_events = events_df[((events_df['timestamp'] >= chunk_start) & (events_df['timestamp'] <= chunk_end + trend_window)).to_numpy()]
+        sensors_df = generate_sensor_readings_realistic(equip_df, alarm_events, chunk_start, chunk_end, params, downtimes_df=downtimes_df)
+        if not sensors_df.empty:
+            sensors_df = sensors_df[sensors_df['timestamp'] < chunk_end].sort_values('timestamp', kind='stable').reset_index(drop=True)
+        frames['sensor_readings'] = sensors_df
+        yield chunk_start, frames
+        chunk_start = chunk_end
+
+
+def split_by_emit_time(frames):
+    """Splits a chunk into batches sharing the same emission time, in timestamp order: [(time, {table: df})]."""
+    times = {table: df[EMIT_COLUMN[table]].to_numpy(dtype='datetime64[ns]') for table, df in frames.items() if not df.empty}
+    if not times:
+        return []
+    batches = []
+    for emit_time in np.unique(np.concatenate(list(times.values()))):
+        batch = {}
+        for table, values in times.items():
+            lo, hi = np.searchsorted(values, emit_time, side='left'), np.searchsorted(values, emit_time, side='right')
+            if hi > lo:
+                batch[table] = frames[table].iloc[lo:hi]
+        batches.append((pd.Timestamp(emit_time), batch))
+    return batches
+
+
+# --- Sinks ---
+
+def _records_frame(table, df):
+    return df.drop(columns=['emit_time']) if 'emit_time' in df.columns else df
+
+
+class StdoutSink:
+    """NDJSON on stdout, one object per record with a "table" field, in timestamp order."""
+
+    def prepare(self, equip_df):
+        return equip_df
+
+    def id_offsets(self, id_counts):
+        return 0, 0
+
+    def write(self, batch):
+        lines = []
+        for table, df in batch.items():
+            emit = df[EMIT_COLUMN[table]].to_numpy()
+            payload = _records_frame(table, df).assign(table=table).to_json(orient='records', lines=True, date_format='iso')
+            lines.extend(zip(emit, payload.splitlines()))
+        lines.sort(key=lambda line: line[0])
+        sys.stdout.write(''.join(line + '\n' for _, line in lines))
+        sys.stdout.flush()
+
+    def close(self):
+        pass
+
+
+class IngestSink:
+    """POSTs NDJSON batches to /api/ingest/<table>, retrying on backpressure (503 + Retry-After)."""
+
+    def __init__(self, base_url, run_id, timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.run_id = run_id
+        self.timeout = timeout
+        self.sequence = 0
+
+    def prepare(self, equip_df):
+        # Reuse the equipments known by the backend so KPIs join on existing machines
+        try:
+            with urllib.request.urlopen(f"{self.base_url}/metadata", timeout=self.timeout) as response:
+                equipments = json.loads(response.read())['equipments']
+            if equipments:
+                return pd.DataFrame(equipments)
+        except Exception as e:
+            print(f"Could not read equipments from the backend ({e}), using generated machines.", file=sys.stderr)
+        return equip_df
+
+    def id_offsets(self, id_counts):
+        """Id ranges reserved by the backend (past the ids in the database, buffered or already reserved)."""
+        body = json.dumps({'machine_events': id_counts[0], 'downtime_logs': id_counts[1]}).encode()
+        request = urllib.request.Request(f"{self.base_url}/ingest/ids", data=body, method='POST',
+                                         headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                starts = json.loads(response.read())
+        except Exception as e:
+            raise SystemExit(f"Could not reserve ids from the backend ({e}); pass --id-offset past the existing "
+                             f"event_id/downtime_id values.")
+        return starts['machine_events'], starts['downtime_logs']
+
+    def _post(self, table, body, key):
+        while True:
+            request = urllib.request.Request(
+                f"{self.base_url}/ingest/{table}", data=body, method='POST',
+                headers={'Content-Type': 'application/x-ndjson', 'Idempotency-Key': key},
+            )
+            try:
+                with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                    return response.status
+            except urllib.error.HTTPError as e:
+                if e.code != 503 or 'Retry-After' not in e.headers:
+                    raise
+                time.sleep(float(e.headers['Retry-After']))
+
+    def write(self, batch):
+        for table, df in batch.items():
+            self.sequence += 1
+            body = _records_frame(table, df).to_json(orient='records', lines=True, date_format='iso').encode()
+            # Same key if this batch is re-sent: written once by the backend
+            self._post(table, body, f"replay-{self.run_id}-{self.sequence}")
+
+    def close(self):
+        pass
+
+
+class DatabaseSink:
+    """Writes batches directly with COPY (same write path as the ingestion API, without the HTTP hop)."""
+
+    def __init__(self, flush_rows=20000):
+        from data_processing.db_connection import get_db_connection
+        self.conn = get_db_connection()
+        self.flush_rows = flush_rows
+        self.pending = {table: [] for table in REPLAY_TABLES}
+        self.pending_rows = 0
+
+    def prepare(self, equip_df):
+        existing = pd.read_sql("SELECT * FROM equipments ORDER BY equipment_id", self.conn)
+        if not existing.empty:
+            return existing
+        columns = list(equip_df.columns)
+        with self.conn.cursor() as cursor:
+            for row in equip_df.itertuples(index=False):
+                cursor.execute(
+                    f"INSERT INTO equipments ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))}) ON CONFLICT DO NOTHING",
+                    [value.item() if hasattr(value, 'item') else value for value in row]
+                )
+        self.conn.commit()
+        return equip_df
+
+    def id_offsets(self, id_counts):
+        """Next free event_id / downtime_id, so replayed records do not collide with existing ones."""
+        with self.conn.cursor() as cursor:
+            cursor.execute("SELECT (SELECT COALESCE(MAX(event_id), -1) + 1 FROM machine_events), "
+                           "(SELECT COALESCE(MAX(downtime_id), -1) + 1 FROM downtime_logs)")
+            return cursor.fetchone()
+
+    def write(self, batch):
+        for table, df in batch.items():
+            self.pending[table].append({'df': _records_frame(table, df), 'key': None})
+            self.pending_rows += len(df)
+        if self.pending_rows >= self.flush_rows:
+            self.flush()
+
+    def flush(self):
+        from data_processing.ingestion import write_batches
+        for table in REPLAY_TABLES: # Events and downtime starts before the readings that follow them
+            if self.pending[table]:
+                write_batches(self.conn, table, self.pending[table])
+        self.pending = {table: [] for table in REPLAY_TABLES}
+        self.pending_rows = 0
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+
+# --- Replay ---
+
+def replay(sink, start_date, end_date, speed=None, num_machines=NUM_MACHINES, params=None, chunk_hours=1, id_offsets=None):
+    """
+    Generates the span [start_date, end_date) and emits it through `sink`, paced at `speed` x real time
+    (None: as fast as possible). Returns the number of records emitted per table.
+    id_offsets: added to (event_id, downtime_id); None asks the sink for free ids.
+    """
+    params = params or default_params()
+    equip_df = sink.prepare(generate_equipment_data(num_machines))
+    events_df, downtimes_df = generate_machine_lifecycle(equip_df, start_date, end_date, params)
+    production_df = generate_production_data(equip_df, events_df, end_date, params)
+    if id_offsets is None:
+        id_counts = tuple(int(df[col].max()) + 1 if not df.empty else 0
+                          for df, col in [(events_df, 'event_id'), (downtimes_df, 'downtime_id')])
+        id_offsets = sink.id_offsets(id_counts)
+    events_df['event_id'] += id_offsets[0]
+    downtimes_df['downtime_id'] += id_offsets[1]
+
+    counts = {table: 0 for table in REPLAY_TABLES}
+    wall_start = time.monotonic()
+    last_report = wall_start
+    try:
+        for chunk_start, frames in iter_replay_chunks(equip_df, events_df, downtimes_df, production_df, params, start_date, end_date, chunk_hours):
+            frames = {table: df for table, df in frames.items() if not df.empty}
+            batches = [(chunk_start, frames)] if speed is None else split_by_emit_time(frames)
+            for emit_time, batch in batches:
+                if speed is not None:
+                    # Sleep until this batch is due in (accelerated) real time
+                    delay = wall_start + (emit_time - pd.Timestamp(start_date)).total_seconds() / speed - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                sink.write(batch)
+                for table, df in batch.items():
+                    counts[table] += len(df)
+            if time.monotonic() - last_report >= 10:
+                elapsed = time.monotonic() - wall_start
+                print(f"[replay] simulated up to {chunk_start + timedelta(hours=chunk_hours)}, {sum(counts.values())} records, "
+                      f"{counts['sensor_readings'] / elapsed:.0f} sensor readings/s", file=sys.stderr)
+                last_report = time.monotonic()
+    finally:
+        sink.close()
+    return counts
+
+
+def parse_speed(value):
+    return None if value == 'max' else float(value.rstrip('x'))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay the simulator as a live data source.")
+    parser.add_argument('--sink', choices=['stdout', 'ingest', 'db'], default='stdout')
+    parser.add_argument('--speed', type=parse_speed, default=1.0, help="Speed-up factor (1, 60, ...) or 'max'")
+    parser.add_argument('--start', default='now', help="Start of the simulated span ('now' for a live feed)")
+    parser.add_argument('--hours', type=float, default=24, help="Length of the simulated span")
+    parser.add_argument('--machines', type=int, default=NUM_MACHINES)
+    parser.add_argument('--chunk-hours', type=float, default=1, help="Sensor generation chunk")
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000/api', help="Backend API for --sink ingest")
+    parser.add_argument('--id-offset', type=int, default=None,
+                        help="Added to event_id/downtime_id (default: next free ids for --sink db, ids reserved "
+                             "by the backend for --sink ingest, 0 for stdout)")
+    args = parser.parse_args()
+
+    start = datetime.now().replace(second=0, microsecond=0) if args.start == 'now' else datetime.fromisoformat(args.start)
+    end = start + timedelta(hours=args.hours)
+    if args.sink == 'stdout':
+        sink = StdoutSink()
+    elif args.sink == 'ingest':
+        sink = IngestSink(args.base_url, run_id=f"{start:%Y%m%d%H%M}-{os.getpid()}-{int(time.time())}")
+    else:
+        sink = DatabaseSink()
+    offsets = (args.id_offset, args.id_offset) if args.id_offset is not None else None
+
+    print(f"[replay] {start} -> {end} at {'max speed' if args.speed is None else f'{args.speed:g}x'} to {args.sink}", file=sys.stderr)
+    counts = replay(sink, start, end, speed=args.speed, num_machines=args.machines, chunk_hours=args.chunk_hours, id_offsets=offsets)
+    print(f"[replay] done: {counts}", file=sys.stderr)
@@ -0,0 +1,78 @@
+import threading
+
+# Regroupement des appels identiques simultanés (« single-flight »).
+# Au début d'un poste, des dizaines de tableaux de bord demandent la même période au même moment :
+# le premier appel pour une clé exécute le calcul, les appels identiques qui arrivent pendant ce
+# calcul l'attendent et partagent son résultat (déjà sérialisé) au lieu de relancer les requêtes en base.
+# Rien n'est conservé après la fin du calcul : ce n'est pas un cache.
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Exécute fn une seule fois par clé parmi les appels concurrents."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.metrics = {}
+
+    def _count(self, name, field):
+        counters = self.metrics.setdefault(name, {'executions': 0, 'coalesced': 0, 'errors': 0})
+        counters[field] += 1
+
+    def do(self, name, key, fn):
+        """
+        Retourne (résultat, partagé). name identifie l'appel dans les métriques (ex. l'endpoint),
+        key les paramètres normalisés. Une exception de fn est transmise à tous les appels en attente.
+        """
+        full_key = (name, key)
+        with self.lock:
+            call = self.calls.get(full_key)
+            if call is not None:
+                call.waiters += 1
+                self._count(name, 'coalesced')
+                leader = False
+            else:
+                call = self.calls[full_key] = _Call()
+                self._count(name, 'executions')
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            with self.lock:
+                self._count(name, 'errors')
+            raise
+        finally:
+            with self.lock:
+                del self.calls[full_key]
+            call.done.set()
+        return call.result, False
+
+    def stats(self):
+        with self.lock:
+            return {
+                'in_flight': len(self.calls),
+                'endpoints': {name: dict(counters) for name, counters in self.metrics.items()},
+            }
+
+
+_single_flight = SingleFlight()
+
+
+def get_single_flight():
+    return _single_flight
@@ -0,0 +1,135 @@
+import os
+import time
+import threading
+from collections import Counter
+import pandas as pd
+from data_processing.db_connection import get_db_connection
+
+# Versions des tables en base, pour la validité des caches (index de cumuls, partiels, segments
+# journaliers, résultats préchauffés).
+# La version d'une table est (relid, n_tup_ins + n_tup_upd + n_tup_del) lue dans pg_stat_user_tables :
+# elle change à chaque écriture, quel que soit l'écrivain (autre worker, simulate_data.py,
+# simulate_replay --sink db, SQL manuel), y compris après TRUNCATE ou DROP / CREATE (nouveau relid).
+# Lecture peu coûteuse (vue de statistiques), relue au plus toutes les TABLE_VERSION_TTL_SECONDS ;
+# PostgreSQL publie ces compteurs en fin de transaction, avec quelques secondes de décalage au plus.
+# Les écritures de ce processus (tampon d'ingestion) sont déclarées par record_local_write : elles
+# sont comptées à part et transmises aux caches (abonnés), qui les appliquent ou invalident
+# précisément la période écrite. changed_externally ne signale donc que les écritures des autres.
+
+TABLE_VERSION_TTL_SECONDS = float(os.getenv("TABLE_VERSION_TTL_SECONDS", "5"))
+
+
+class TableVersions:
+    """Versions des tables (TTL), écritures locales et abonnés prévenus de ces écritures."""
+
+    def __init__(self, ttl_seconds=TABLE_VERSION_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.lock = threading.Lock()
+        self.observed = {} # table -> (lu à, relid, compteur de modifications)
+        self.local_changes = Counter() # table -> lignes écrites par ce processus
+        self.listeners = []
+        self.metrics = {'reads': 0, 'read_errors': 0, 'local_writes': 0, 'listener_errors': 0}
+
+    def _read_versions(self, tables):
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "SELECT relname, relid, n_tup_ins + n_tup_upd + n_tup_del FROM pg_stat_user_tables "
+                    "WHERE relname = ANY(%(tables)s)", {'tables': list(tables)})
+                return {relname: (relid, changes) for relname, relid, changes in cursor.fetchall()}
+        finally:
+            conn.close()
+
+    def current(self, table):
+        """(relid, compteur de modifications) de table, relu au plus toutes les ttl_seconds ; None si illisible."""
+        with self.lock:
+            cached = self.observed.get(table)
+        if cached is not None and time.monotonic() - cached[0] < self.ttl_seconds:
+            return cached[1:]
+        try:
+            versions = self._read_versions([table])
+        except Exception as e:
+            print(f"Erreur lors de la lecture de la version de la table {table} : {e}")
+            with self.lock:
+                self.metrics['read_errors'] += 1
+            return cached[1:] if cached is not None else None
+        relid, changes = versions.get(table, (None, 0))
+        with self.lock:
+            self.metrics['reads'] += 1
+            self.observed[table] = (time.monotonic(), relid, changes)
+        return relid, changes
+
+    def mark(self, *tables):
+        """Repère à conserver avec une donnée mise en cache (à prendre AVANT la lecture en base)."""
+        marks = {}
+        for table in tables:
+            version = self.current(table)
+            with self.lock:
+                marks[table] = None if version is None else (*version, self.local_changes[table])
+        return marks
+
+    def changed_externally(self, marks):
+        """
+        True si une table du repère a été modifiée par un autre écrivain depuis le repère : relid
+        différent, ou plus de modifications que les écritures locales déclarées depuis. Version
+        illisible : considérée inchangée (les écritures locales restent appliquées par les abonnés).
+        """
+        for table, mark in marks.items():
+            version = self.current(table)
+            if mark is None or version is None:
+                continue
+            relid, changes, local_changes = mark
+            with self.lock:
+                local_since = self.local_changes[table] - local_changes
+            if version[0] != relid or version[1] - changes > local_since:
+                return True
+        return False
+
+    def subscribe(self, listener):
+        """listener(table, df, first_time, last_time) est appelé après chaque écriture locale validée."""
+        with self.lock:
+            if listener not in self.listeners:
+                self.listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        with self.lock:
+            if listener in self.listeners:
+                self.listeners.remove(listener)
+
+    def record_local_write(self, table, df, changes=None, time_columns=()):
+        """
+        Déclare des lignes écrites (validées) par ce processus ; changes : modifications comptées par
+        PostgreSQL (lignes insérées ou mises à jour, len(df) par défaut). Prévient les abonnés.
+        """
+        times = [df[col] for col in time_columns if col in df.columns and df[col].notna().any()]
+        first_time = min(pd.Timestamp(values.min()) for values in times) if times else None
+        last_time = max(pd.Timestamp(values.max()) for values in times) if times else None
+        with self.lock:
+            self.local_changes[table] += len(df) if changes is None else changes
+            self.metrics['local_writes'] += 1
+            listeners = list(self.listeners)
+        for listener in listeners:
+            try:
+                listener(table, df, first_time, last_time)
+            except Exception as e:
+                print(f"Erreur lors de la mise à jour d'un cache après écriture dans {table} : {e}")
+                with self.lock:
+                    self.metrics['listener_errors'] += 1
+
+    def stats(self):
+        with self.lock:
+            return {**self.metrics, 'local_changes': dict(self.local_changes),
+                    'versions': {table: list(observed[1:]) for table, observed in self.observed.items()}}
+
+
+_table_versions = None
+_table_versions_lock = threading.Lock()
+
+
+def get_table_versions():
+    global _table_versions
+    with _table_versions_lock:
+        if _table_versions is None:
+            _table_versions = TableVersions()
+        return _table_versions
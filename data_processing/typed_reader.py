@@ -0,0 +1,102 @@
+import io
+import os
+import pandas as pd
+
+# Couche de lecture typée.
+# pd.read_sql infère les types ligne à ligne : les identifiants et libellés reviennent en objets Python
+# (une chaîne par ligne, répétée des millions de fois) et les valeurs en float64. Ici la requête est
+# exportée par COPY ... TO STDOUT (CSV) et relue avec un schéma explicite : catégories pour les
+# chaînes à faible cardinalité, float32 / int32 quand la précision le permet, datetime64[ns]
+# parsé une seule fois à la lecture. Les colonnes absentes du schéma gardent l'inférence de pandas.
+
+READER_MEMORY_REPORT = os.getenv("READER_MEMORY_REPORT", "0") == "1"
+
+DATETIME = 'datetime64[ns]'
+
+TABLE_SCHEMAS = {
+    'sensor_readings': {
+        'timestamp': DATETIME, 'equipment_id': 'category', 'sensor_type': 'category',
+        'value': 'float32', # ~7 chiffres significatifs : largement au-dessus de la résolution des capteurs
+        'unit': 'category',
+    },
+    'downtime_logs': {
+        'downtime_id': 'int64', 'equipment_id': 'category', 'start_time': DATETIME, 'end_time': DATETIME,
+        'downtime_category': 'category', 'downtime_reason': 'category',
+        'duration_seconds': 'float64', # Sommé sur de longues périodes : on garde la double précision
+    },
+    'production_output': {
+        'timestamp': DATETIME, 'equipment_id': 'category', 'product_id': 'category',
+        'quantity_produced': 'int32', 'quantity_rejected': 'int32',
+        'running_duration_seconds': 'float64', # Sommé pour les temps de fonctionnement
+    },
+    'machine_events': {
+        'event_id': 'int64', 'timestamp': DATETIME, 'equipment_id': 'category', 'event_type': 'category',
+    },
+}
+
+
+def memory_footprint(df):
+    """Taille réelle d'un DataFrame en octets (chaînes comprises)."""
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def report_memory_footprint(df, label):
+    """Affiche l'empreinte mémoire d'un DataFrame lu et la conserve dans df.attrs['memory_bytes']."""
+    size = memory_footprint(df)
+    df.attrs['memory_bytes'] = size
+    if READER_MEMORY_REPORT:
+        per_row = size / len(df) if len(df) else 0
+        print(f"Lecture {label} : {len(df)} lignes, {size / 1e6:.2f} Mo ({per_row:.1f} octets/ligne)")
+    return size
+
+
+def apply_schema(df, schema):
+    """Convertit les colonnes d'un DataFrame déjà chargé (ex. CSV) vers les types du schéma."""
+    for col, dtype in schema.items():
+        if col not in df.columns:
+            continue
+        if dtype == DATETIME:
+            if not pd.api.types.is_datetime64_dtype(df[col]):
+                df[col] = pd.to_datetime(df[col], format='ISO8601')
+            df[col] = df[col].astype(DATETIME)
+        elif df[col].dtype != dtype:
+            df[col] = df[col].astype(dtype)
+    return df
+
+
+def to_records(df):
+    """
+    to_dict(orient='records') pour la sérialisation JSON : les float32 sont élargis via leur
+    représentation décimale la plus courte (1.1 et non 1.100000023841858) et les valeurs
+    manquantes deviennent None (NaN n'est pas du JSON valide).
+    """
+    float32_cols = [col for col in df.columns if df[col].dtype == 'float32']
+    if float32_cols:
+        df = df.copy()
+        for col in float32_cols:
+            df[col] = df[col].astype(str).astype('float64')
+    if df.isna().to_numpy().any():
+        df = df.astype(object).where(df.notna(), None)
+    return df.to_dict(orient='records')
+
+
+def read_sql_typed(query, conn, params=None, table=None, schema=None):
+    """
+    Exécute une requête et retourne un DataFrame typé selon schema (ou TABLE_SCHEMAS[table]).
+    Les données passent par COPY en CSV : aucun objet Python par valeur n'est créé.
+    """
+    schema = schema if schema is not None else TABLE_SCHEMAS.get(table, {})
+    with conn.cursor() as cursor:
+        sql = cursor.mogrify(query, params).decode()
+        buffer = io.BytesIO()
+        cursor.copy_expert(f"COPY ({sql}) TO STDOUT WITH (FORMAT CSV, HEADER)", buffer)
+    buffer.seek(0)
+
+    columns = pd.read_csv(buffer, nrows=0).columns
+    buffer.seek(0)
+    dtypes = {col: dtype for col, dtype in schema.items() if col in columns and dtype != DATETIME}
+    df = pd.read_csv(buffer, dtype=dtypes)
+    df = apply_schema(df, {col: dtype for col, dtype in schema.items() if dtype == DATETIME})
+
+    report_memory_footprint(df, table or 'requête')
+    return df
@@ -44,21 +44,13 @@ function App() {
 
   const fetchEquipmentList = async () => {
     try {
-      const response = await fetch(`${API_BASE_URL}/equipments`);
-      if (!response.ok) { throw new Error(`HTTP error! status: ${response.status} for equipments`); }
+      const response = await fetch(`${API_BASE_URL}/metadata`);
+      if (!response.ok) { throw new Error(`HTTP error! status: ${response.status} for metadata`); }
       const data = await response.json();
-      const options = [{ id: '', name: 'Tous les équipements' }, ...data.map(eq => ({ id: eq.equipment_id, name: eq.equipment_name }))];
+      const options = [{ id: '', name: 'Tous les équipements' }, ...data.equipments.map(eq => ({ id: eq.equipment_id, name: eq.equipment_name }))];
       setEquipmentOptions(options);
 
-      const uniqueSensorTypes = [
-          'Temperature_Motor', 'Vibration_Bearing', 'Pressure_Hydraulic', 'Current_Consumption'
-      ];
-      const unitsMap = {
-          'Temperature_Motor': '°C',
-          'Vibration_Bearing': 'g',
-          'Pressure_Hydraulic': 'bar',
-          'Current_Consumption': 'A'
-      };
+      const unitsMap = Object.fromEntries(data.sensors.map(sensor => [sensor.sensor_type, sensor.unit]));
       setSensorUnits(unitsMap);
 
     } catch (err) {
@@ -86,7 +78,10 @@ function App() {
       const kpisData = await kpisResponse.json();
       setKpis(kpisData);
 
-      const downtimeResponse = await fetch(`${API_BASE_URL}/downtime-reasons?${kpiParams.toString()}`);
+      // Principales raisons classées en base, le reste regroupé dans « Autres »
+      const paretoParams = new URLSearchParams(kpiParams);
+      paretoParams.append('top_n', '8');
+      const downtimeResponse = await fetch(`${API_BASE_URL}/downtime-pareto?${paretoParams.toString()}`);
       if (!downtimeResponse.ok) { throw new Error(`HTTP error! status: ${downtimeResponse.status} for Downtime Reasons`); }
       const downtimeData = await downtimeResponse.json();
       setDowntimeReasons(downtimeData);
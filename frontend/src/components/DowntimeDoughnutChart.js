@@ -24,7 +24,7 @@ function DowntimeDoughnutChart({ data, title }) {
     return <p>Aucune donnée de répartition des arrêts disponible.</p>;
   }
 
-  const labels = data.map(item => `${item.downtime_category} - ${item.downtime_reason}`);
+  const labels = data.map(item => item.is_other ? 'Autres' : `${item.downtime_category} - ${item.downtime_reason}`);
   const durations = data.map(item => item.duration_seconds);
   const totalDuration = durations.reduce((sum, current) => sum + current, 0);
 
@@ -0,0 +1,86 @@
+import os
+import sys
+import random
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import pytest
+
+# Les modules s'importent depuis la racine du projet (from data_processing.xxx import ...)
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+
+from data_processing import simulate_data
+from data_processing import kpi_calculator
+
+SIM_START = datetime(2023, 1, 1, 7, 0, 0)
+SIM_END = datetime(2023, 2, 15, 17, 0, 0)
+
+
+@pytest.fixture(scope='session')
+def sim_data():
+    """Jeu de données simulé (graine fixe) : equipments, machine_events, downtime_logs, production_output."""
+    random.seed(1)
+    np.random.seed(1)
+    simulate_data.fake.seed_instance(1)
+    params = simulate_data.default_params()
+    params['AVG_MTBF_HOURS'] = 20 # Plus d'arrêts sur une période courte
+    equip_df = simulate_data.generate_equipment_data(4)
+    events_df, downtimes_df = simulate_data.generate_machine_lifecycle(equip_df, SIM_START, SIM_END, params)
+    production_df = simulate_data.generate_production_data(equip_df, events_df, SIM_END, params)
+
+    downtimes_df = downtimes_df.sort_values(['equipment_id', 'start_time']).reset_index(drop=True)
+    # Arrêts chevauchants (autre catégorie) pour exercer la résolution des intervalles
+    overlapping = downtimes_df.iloc[:3].copy()
+    overlapping['downtime_id'] += 10000
+    overlapping['start_time'] += pd.Timedelta(minutes=10)
+    overlapping['downtime_category'] = 'Unplanned - Process'
+    downtimes_df = pd.concat([downtimes_df, overlapping]).sort_values(['equipment_id', 'start_time']).reset_index(drop=True)
+    return {
+        'equipments': equip_df, 'machine_events': events_df,
+        'downtime_logs': downtimes_df, 'production_output': production_df, 'params': params,
+    }
+
+
+def make_sources(equip_df, downtimes_df, production_df):
+    """Lectures en mémoire avec les filtres SQL de get_downtime_data / get_production_data."""
+    def get_downtime_data(start_time=None, end_time=None, equipment_id=None):
+        df = downtimes_df
+        if start_time is not None:
+            df = df[df['end_time'] > start_time]
+        if end_time is not None:
+            df = df[df['start_time'] < end_time]
+        if equipment_id:
+            df = df[df['equipment_id'] == equipment_id]
+        return df.reset_index(drop=True).copy()
+
+    def get_production_data(start_time=None, end_time=None, equipment_id=None):
+        df = production_df
+        if start_time is not None:
+            df = df[df['timestamp'] >= start_time]
+        if end_time is not None:
+            df = df[df['timestamp'] <= end_time]
+        if equipment_id:
+            df = df[df['equipment_id'] == equipment_id]
+        return df.reset_index(drop=True).copy()
+
+    def get_equipments_data():
+        return equip_df.copy()
+
+    return get_downtime_data, get_production_data, get_equipments_data
+
+
+@pytest.fixture
+def patch_sources(monkeypatch):
+    """
+    Remplace les lectures en base par des lectures en mémoire dans kpi_calculator et dans les
+    modules passés (qui importent ces fonctions par leur nom). Retourne les trois fonctions.
+    """
+    def patch(equip_df, downtimes_df, production_df, *modules):
+        get_downtime_data, get_production_data, get_equipments_data = make_sources(equip_df, downtimes_df, production_df)
+        for module in (kpi_calculator,) + modules:
+            for name, function in (('get_downtime_data', get_downtime_data), ('get_production_data', get_production_data),
+                                   ('get_equipments_data', get_equipments_data)):
+                if hasattr(module, name):
+                    monkeypatch.setattr(module, name, function)
+        return get_downtime_data, get_production_data, get_equipments_data
+    return patch
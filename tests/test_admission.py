@@ -0,0 +1,104 @@
+import threading
+import pandas as pd
+import pytest
+
+from data_processing import admission
+from data_processing.admission import AdmissionController, AdmissionQueueTimeout, QueryBudgetExceeded
+from data_processing.db_connection import get_statement_timeout, set_statement_timeout
+from data_processing.sensor_layout import WIDE_TABLE
+
+# Un an de données par table, 4 équipements et 5 capteurs
+STATS = {
+    'production_output': (365 * 24 * 4, pd.Timestamp('2023-01-01'), pd.Timestamp('2024-01-01')),
+    'downtime_logs': (3650, pd.Timestamp('2023-01-01'), pd.Timestamp('2024-01-01')),
+    'sensor_readings': (365 * 24 * 60 * 4 * 5, pd.Timestamp('2023-01-01'), pd.Timestamp('2024-01-01')),
+    WIDE_TABLE: (365 * 24 * 60 * 4, pd.Timestamp('2023-01-01'), pd.Timestamp('2024-01-01')),
+}
+
+
+class FakeRegistry:
+    def get_equipments(self):
+        return pd.DataFrame({'equipment_id': ['MCH001', 'MCH002', 'MCH003', 'MCH004']})
+
+    def get_sensors(self):
+        return pd.DataFrame({'sensor_type': ['Temperature', 'Vibration', 'Pressure', 'Current', 'Speed']})
+
+
+@pytest.fixture
+def controller(monkeypatch):
+    monkeypatch.setattr(admission, 'get_metadata_registry', FakeRegistry)
+    controller = AdmissionController(max_rows=1_000_000, heavy_rows=100_000, heavy_concurrency=1, queue_timeout=0.2)
+    monkeypatch.setattr(controller, 'table_stats_for', lambda table: STATS[table])
+    return controller
+
+
+def test_wide_table_counts_one_value_per_requested_sensor(controller):
+    week = (pd.Timestamp('2023-03-01'), pd.Timestamp('2023-03-08'))
+    long_rows = controller.estimate_rows('sensor_readings', *week)
+    assert long_rows == pytest.approx(7 * 24 * 60 * 4 * 5, rel=1e-6)
+    assert controller.estimate_rows(WIDE_TABLE, *week) == pytest.approx(long_rows, rel=1e-6)
+    one_sensor = controller.estimate_rows(WIDE_TABLE, *week, equipment_id='MCH001', sensor_type='Temperature')
+    assert one_sensor == pytest.approx(7 * 24 * 60, rel=1e-6)
+    assert controller.estimate_rows('sensor_readings', *week, 'MCH001', 'Temperature') == pytest.approx(one_sensor, rel=1e-6)
+    # Période hors des données : rien à lire ; période plus large que les données : bornée à la table
+    assert controller.estimate_rows('production_output', pd.Timestamp('2025-01-01'), pd.Timestamp('2025-02-01')) == 0
+    assert controller.estimate_rows('production_output', pd.Timestamp('2020-01-01'), pd.Timestamp('2030-01-01')) == STATS['production_output'][0]
+
+
+def test_over_budget_requests_are_rejected(controller):
+    estimated_rows = controller.estimate_rows('sensor_readings', pd.Timestamp('2023-01-01'), pd.Timestamp('2023-07-01'))
+    with pytest.raises(QueryBudgetExceeded) as excinfo:
+        controller.check_budget('sensor-data', estimated_rows)
+    assert excinfo.value.estimated_rows == estimated_rows and excinfo.value.max_rows == 1_000_000
+    controller.check_budget('sensor-data', None) # Sans statistiques : admise
+    assert controller.stats()['endpoints']['sensor-data']['rejected'] == 1
+
+
+def test_sensor_requests_fall_back_to_the_finest_pyramid_level_within_budget(controller):
+    months = (pd.Timestamp('2023-03-01'), pd.Timestamp('2023-05-01'))
+    assert controller.estimate_sensor_rows(*months) > controller.max_rows
+    # 61 j * 1440 min * 20 séries : 1min dépasse le budget, 15min tient ; 1min tient pour un seul équipement
+    assert controller.sensor_level_within_budget(*months) == '15min'
+    assert controller.sensor_level_within_budget(*months, equipment_id='MCH001') == '1min'
+    assert controller.sensor_level_within_budget(pd.Timestamp('2000-01-01'), pd.Timestamp('2100-01-01')) is None
+
+
+def test_heavy_requests_queue_and_time_out(controller):
+    inside, release = threading.Event(), threading.Event()
+
+    def heavy_request():
+        with controller.admit('kpis', 200_000):
+            inside.set()
+            release.wait(5)
+
+    worker = threading.Thread(target=heavy_request)
+    worker.start()
+    assert inside.wait(5)
+    with controller.admit('kpis', 10): # Légère : n'attend pas de place
+        pass
+    with pytest.raises(AdmissionQueueTimeout) as excinfo:
+        with controller.admit('kpis', 200_000):
+            pass
+    assert excinfo.value.retry_after == 1
+    release.set()
+    worker.join(5)
+
+    with controller.admit('kpis', 200_000): # Place libérée
+        pass
+    counters = controller.stats()['endpoints']['kpis']
+    assert (counters['admitted'], counters['heavy'], counters['queue_timeouts']) == (3, 2, 1)
+    assert controller.stats()['running_heavy'] == 0
+
+
+def test_admit_restores_the_previous_statement_timeout(controller):
+    set_statement_timeout(admission.ADMISSION_STATEMENT_TIMEOUT_MS)
+    try:
+        with controller.admit('kpis', 200_000):
+            assert get_statement_timeout() == admission.ADMISSION_HEAVY_STATEMENT_TIMEOUT_MS
+        assert get_statement_timeout() == admission.ADMISSION_STATEMENT_TIMEOUT_MS
+        with pytest.raises(RuntimeError):
+            with controller.admit('kpis', 200_000):
+                raise RuntimeError("requête interrompue")
+        assert get_statement_timeout() == admission.ADMISSION_STATEMENT_TIMEOUT_MS
+    finally:
+        set_statement_timeout(None)
@@ -0,0 +1,34 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_processing.anomaly_detection import (
+    ANOMALY_COLUMNS, ANOMALY_DETECTOR_PARAMS, StreamingAnomalyDetector, detect_anomalies_batch
+)
+
+
+def _series(seed, n=2000):
+    """Relevés à 30 s : bruit, saut brutal puis dérive lente (profil avant panne du simulateur)."""
+    rng = np.random.default_rng(seed)
+    values = 60 + rng.normal(0, 2, n)
+    values[900:960] += 15
+    values[1500:] += np.linspace(0, 12, n - 1500)
+    timestamps = pd.date_range('2023-01-10', periods=n, freq='30s')
+    return timestamps, values
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_streaming_detections_match_batch(seed):
+    timestamps, values = _series(seed)
+    batch = detect_anomalies_batch(timestamps, values)
+    assert set(batch['detector']) == {'ewma', 'zscore', 'cusum'}
+
+    readings = pd.DataFrame({'timestamp': timestamps, 'equipment_id': 'EQ1', 'sensor_type': 'Temperature_Motor', 'value': values})
+    detector = StreamingAnomalyDetector(ANOMALY_DETECTOR_PARAMS)
+    # Lots successifs, comme le tampon de capteurs
+    stream = pd.concat([detector.process_readings(chunk) for chunk in (readings.iloc[i:i + 300] for i in range(0, len(readings), 300))], ignore_index=True)
+    stream = stream.sort_values(['detected_at', 'detector'], kind='stable').reset_index(drop=True)
+
+    columns = ['detector', 'detected_at', 'value', 'score', 'direction']
+    assert list(stream.columns) == ANOMALY_COLUMNS
+    pd.testing.assert_frame_equal(stream[columns], batch[columns], check_dtype=False, atol=1e-6)
@@ -0,0 +1,122 @@
+import json
+from datetime import datetime
+import pandas as pd
+import pytest
+
+from data_processing import cache_warmer
+from data_processing.cache_warmer import KpiAccessLog, KpiCacheWarmer, kpi_request_key
+from data_processing.table_versions import TableVersions
+
+
+class FakeVersions(TableVersions):
+    def __init__(self):
+        super().__init__(ttl_seconds=0)
+        self.db = {table: (1, 0) for table in cache_warmer.WARMED_TABLES}
+
+    def _read_versions(self, tables):
+        return {table: self.db[table] for table in tables}
+
+
+@pytest.fixture
+def warmer(monkeypatch):
+    versions = FakeVersions()
+    monkeypatch.setattr(cache_warmer, 'get_table_versions', lambda: versions)
+    warmer = KpiCacheWarmer(lambda key: None, lambda: ['EQ1', 'EQ2'], access_log=KpiAccessLog(path=''))
+    return warmer, versions
+
+
+JANUARY = kpi_request_key(datetime(2023, 1, 1), datetime(2023, 2, 1))
+JANUARY_EQ2 = kpi_request_key(datetime(2023, 1, 1), datetime(2023, 2, 1), 'EQ2')
+FEBRUARY = kpi_request_key(datetime(2023, 2, 1), datetime(2023, 3, 1))
+
+
+def _production(equipment_id, timestamp):
+    return pd.DataFrame({'equipment_id': [equipment_id], 'timestamp': [pd.Timestamp(timestamp)], 'quantity_produced': [1]})
+
+
+def test_local_write_drops_overlapping_results_only(warmer):
+    warmer, versions = warmer
+    for key in [JANUARY, JANUARY_EQ2, FEBRUARY]:
+        warmer.store(key, f'"{key}"', warmer.snapshot())
+
+    # Relevé tardif de EQ1 dans une période déjà « close » : janvier (tous équipements) est périmé
+    versions.db['production_output'] = (1, 1)
+    versions.record_local_write('production_output', _production('EQ1', '2023-01-15 10:00'), time_columns=('timestamp',))
+    assert warmer.lookup(JANUARY) is None
+    assert warmer.lookup(JANUARY_EQ2) is not None
+    assert warmer.lookup(FEBRUARY) is not None
+
+
+def test_write_during_compute_discards_the_result(warmer):
+    warmer, versions = warmer
+    snapshot = warmer.snapshot() # Pris avant le calcul
+    versions.db['downtime_logs'] = (1, 1)
+    written = pd.DataFrame({'equipment_id': ['EQ2'], 'start_time': [pd.Timestamp('2023-01-20 08:00')],
+                            'end_time': [pd.Timestamp('2023-01-20 09:00')]})
+    versions.record_local_write('downtime_logs', written, time_columns=('start_time', 'end_time'))
+    warmer.store(JANUARY, '"stale"', snapshot)
+    warmer.store(FEBRUARY, '"fresh"', snapshot)
+    assert warmer.lookup(JANUARY) is None
+    assert warmer.lookup(FEBRUARY) == '"fresh"'
+    assert warmer.stats()['discarded_stale'] == 1
+
+
+def test_external_write_invalidates_results(warmer):
+    warmer, versions = warmer
+    warmer.store(JANUARY, '"january"', warmer.snapshot())
+    assert warmer.lookup(JANUARY) == '"january"'
+    versions.db['downtime_logs'] = (1, 3) # simulate_data.py, un autre worker, SQL manuel...
+    assert warmer.lookup(JANUARY) is None
+
+
+def test_access_log_counts_decay_and_are_capped():
+    log = KpiAccessLog(path='', max_keys=3, half_life_hours=1)
+    for day in range(1, 11):
+        key = kpi_request_key(datetime(2023, 1, day), datetime(2023, 1, day + 1))
+        for _ in range(day):
+            log.record(key)
+    for _ in range(4):
+        log.record(JANUARY)
+    assert log.top(2) == [kpi_request_key(datetime(2023, 1, 10), datetime(2023, 1, 11)), kpi_request_key(datetime(2023, 1, 9), datetime(2023, 1, 10))]
+    assert len(log.counts) == 3 and JANUARY not in log.counts
+
+    # Deux demi-vies plus tard : compteurs divisés par 4, les clés décrues sous le seuil sont oubliées
+    before = dict(log.counts)
+    log.decayed_at -= 2 * 3600
+    log.top()
+    assert log.counts == pytest.approx({key: count / 4 for key, count in before.items()})
+    log.decayed_at -= 20 * 3600
+    assert log.top() == [] and not log.counts
+
+
+def test_access_log_is_written_in_batches_and_compacted(tmp_path, monkeypatch):
+    path = str(tmp_path / 'kpi_access.jsonl')
+    log = KpiAccessLog(path=path, max_keys=4, half_life_hours=1000)
+    for key in [JANUARY, JANUARY, FEBRUARY]:
+        log.record(key)
+    assert not (tmp_path / 'kpi_access.jsonl').exists() # Rien n'est écrit sur le chemin de la requête
+    assert log.flush() == 3 and log.flush() == 0
+    assert KpiAccessLog(path=path).counts == {JANUARY: 2, FEBRUARY: 1}
+
+    # Lot plein (préchauffage arrêté) : écrit par l'appel qui le remplit
+    for _ in range(4):
+        log.record(JANUARY_EQ2)
+    assert len((tmp_path / 'kpi_access.jsonl').read_text().splitlines()) == 7
+    # Au-delà de 2 x max_keys lignes, le fichier est réécrit avec les compteurs courants
+    log.record(FEBRUARY)
+    log.record(FEBRUARY)
+    log.flush()
+    assert len((tmp_path / 'kpi_access.jsonl').read_text().splitlines()) == 3
+    reloaded = KpiAccessLog(path=path)
+    assert reloaded.counts == pytest.approx({JANUARY: 2, FEBRUARY: 3, JANUARY_EQ2: 4}, rel=1e-3)
+    assert reloaded.top(1) == [JANUARY_EQ2]
+
+
+def test_warm_cycle_flushes_the_access_log(warmer, tmp_path, monkeypatch):
+    warmer, _ = warmer
+    warmer.access_log = KpiAccessLog(path=str(tmp_path / 'kpi_access.jsonl'))
+    warmer.access_log.record(FEBRUARY)
+    monkeypatch.setattr(cache_warmer, 'get_ingestion_watermark', lambda: (None, None, None))
+    warmer.warm_once()
+    assert (tmp_path / 'kpi_access.jsonl').read_text().splitlines() == [json.dumps(list(FEBRUARY))]
+    assert warmer.stats()['access_log_keys'] == 1
@@ -0,0 +1,57 @@
+from datetime import datetime
+import pandas as pd
+import pytest
+
+from data_processing import db_connection, downtime_pareto
+from data_processing.interval_engine import resolve_downtime_intervals, clip_intervals
+from data_processing.kpi_calculator import count_downtimes_by_reason
+
+START, END = datetime(2023, 1, 8, 3, 17, 5), datetime(2023, 2, 8, 11, 0, 30)
+
+
+@pytest.fixture
+def pareto_cursor(sim_data):
+    """Curseur d'une connexion où une table temporaire downtime_logs (sim_data) masque la table réelle."""
+    try:
+        conn = db_connection.get_db_connection()
+    except Exception:
+        pytest.skip("Base de données indisponible")
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("CREATE TEMP TABLE downtime_logs (downtime_id INTEGER, equipment_id TEXT, start_time TIMESTAMP, "
+                           "end_time TIMESTAMP, downtime_category TEXT, downtime_reason TEXT)")
+            columns = ['downtime_id', 'equipment_id', 'start_time', 'end_time', 'downtime_category', 'downtime_reason']
+            cursor.executemany("INSERT INTO downtime_logs VALUES (%s, %s, %s, %s, %s, %s)",
+                               [tuple(row) for row in sim_data['downtime_logs'][columns].astype(object).itertuples(index=False)])
+            yield cursor
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+def _expected(downtimes_df, keys):
+    """Incidents (count_downtimes_by_reason) et durées effectives (interval_engine) par clé."""
+    downtimes_df = downtimes_df[(downtimes_df['end_time'] > START) & (downtimes_df['start_time'] < END)]
+    incidents = count_downtimes_by_reason(downtimes_df.copy(), START, END).groupby(keys)['incident_count'].sum()
+    durations = clip_intervals(resolve_downtime_intervals(downtimes_df), START, END).groupby(keys)['duration_seconds'].sum()
+    return pd.concat([incidents, durations], axis=1).fillna(0).sort_index()
+
+
+@pytest.mark.parametrize('level', list(downtime_pareto.PARETO_LEVELS))
+def test_pareto_matches_interval_engine(sim_data, pareto_cursor, level):
+    keys = downtime_pareto.PARETO_LEVELS[level]
+    pareto_cursor.execute(downtime_pareto.build_pareto_query(level), {'start_time': START, 'end_time': END, 'top_n': 1000})
+    columns = [desc[0] for desc in pareto_cursor.description]
+    actual = pd.DataFrame.from_records(pareto_cursor.fetchall(), columns=columns)
+    actual = actual.set_index(keys)[['incident_count', 'duration_seconds']].astype(float).sort_index()
+    expected = _expected(sim_data['downtime_logs'], keys)
+    pd.testing.assert_frame_equal(expected, actual, check_dtype=False, check_names=False, atol=1e-3)
+
+
+def test_pareto_groups_the_tail_into_other(sim_data, pareto_cursor):
+    pareto_cursor.execute(downtime_pareto.build_pareto_query('reason'), {'start_time': START, 'end_time': END, 'top_n': 3})
+    rows = pareto_cursor.fetchall()
+    expected = _expected(sim_data['downtime_logs'], downtime_pareto.PARETO_LEVELS['reason'])
+    assert len(rows) == 4 and rows[-1][1] == downtime_pareto.OTHER_LABEL
+    assert sum(float(row[4]) for row in rows) == pytest.approx(expected['duration_seconds'].sum(), abs=1e-3)
+    assert float(rows[-1][8]) == pytest.approx(1.0) # Part cumulée
@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_processing import feature_store
+from data_processing.feature_store import FEATURE_BUCKET_MINUTES, FEATURE_COLUMNS, FEATURE_WINDOWS, compute_rolling_features
+
+START, END = pd.Timestamp('2023-01-10 08:00'), pd.Timestamp('2023-01-10 14:00')
+
+
+@pytest.fixture
+def readings():
+    """Relevés irréguliers avec un trou de deux heures, des relevés sur les bords de tranche et hors période."""
+    rng = np.random.default_rng(3)
+    frames = []
+    for equipment_id, sensor_type, count in [('EQ1', 'Temperature_Motor', 900), ('EQ1', 'Vibration_Bearing', 300), ('EQ2', 'Temperature_Motor', 600)]:
+        offsets = rng.uniform(-5 * 3600, 6.5 * 3600, count)
+        offsets = offsets[(offsets < 2 * 3600) | (offsets > 4 * 3600)]
+        timestamps = START + pd.to_timedelta(np.sort(offsets), unit='s')
+        values = 50 + 0.002 * offsets / 60 + rng.normal(0, 2, len(offsets))
+        frames.append(pd.DataFrame({'timestamp': timestamps, 'equipment_id': equipment_id, 'sensor_type': sensor_type, 'value': values}))
+    edges = pd.date_range(START - pd.Timedelta(hours=4), END, freq=f"{FEATURE_BUCKET_MINUTES}min")[::7]
+    frames.append(pd.DataFrame({'timestamp': edges, 'equipment_id': 'EQ2', 'sensor_type': 'Temperature_Motor', 'value': np.arange(len(edges), dtype=float)}))
+    # Relevés simultanés : pente indéfinie sur la fenêtre la plus courte
+    frames.append(pd.DataFrame({'timestamp': [START + pd.Timedelta(minutes=62)] * 3, 'equipment_id': 'EQ3', 'sensor_type': 'Current_Consumption', 'value': [1.0, 2.0, 4.0]}))
+    return pd.concat(frames, ignore_index=True).sample(frac=1, random_state=0)
+
+
+def _naive(readings_df):
+    """Fenêtres [fin de tranche - fenêtre, fin de tranche) recalculées relevé par relevé."""
+    bucket = pd.Timedelta(minutes=FEATURE_BUCKET_MINUTES)
+    rows = []
+    for (equipment_id, sensor_type), series in readings_df.groupby(['equipment_id', 'sensor_type']):
+        for bucket_start in pd.date_range(START, END - bucket, freq=bucket):
+            bucket_end = bucket_start + bucket
+            in_bucket = series[(series['timestamp'] >= bucket_start) & (series['timestamp'] < bucket_end)]
+            if in_bucket.empty:
+                continue
+            row = {'equipment_id': equipment_id, 'sensor_type': sensor_type, 'bucket_start': bucket_start, 'num_readings': len(in_bucket)}
+            for suffix, minutes in FEATURE_WINDOWS.items():
+                window = series[(series['timestamp'] >= bucket_end - pd.Timedelta(minutes=minutes)) & (series['timestamp'] < bucket_end)]
+                hours = (window['timestamp'] - START).dt.total_seconds().to_numpy() / 3600
+                values = window['value'].to_numpy()
+                row[f"mean_{suffix}"] = values.mean()
+                row[f"std_{suffix}"] = values.std() if len(values) > 1 else np.nan
+                row[f"slope_{suffix}"] = np.polyfit(hours, values, 1)[0] if np.ptp(hours) > 0 else np.nan
+                row[f"max_{suffix}"] = values.max()
+            rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def test_rolling_features_match_a_per_window_calculation(readings):
+    result = compute_rolling_features(readings, START, END)
+    expected = _naive(readings).sort_values(['equipment_id', 'sensor_type', 'bucket_start']).reset_index(drop=True)
+
+    pd.testing.assert_frame_equal(result.drop(columns=FEATURE_COLUMNS), expected[result.columns.drop(FEATURE_COLUMNS)], check_dtype=False)
+    for col in FEATURE_COLUMNS:
+        np.testing.assert_allclose(result[col].to_numpy(dtype=float), expected[col].to_numpy(dtype=float), rtol=1e-4, atol=1e-4, err_msg=col)
+    # Pas de ligne pour les tranches du trou ; pente indéfinie pour des relevés simultanés
+    assert not result[(result['bucket_start'] >= START + pd.Timedelta(hours=2)) & (result['bucket_start'] < START + pd.Timedelta(hours=4))
+                      & (result['equipment_id'] == 'EQ1')].shape[0]
+    assert result.loc[result['equipment_id'] == 'EQ3', 'slope_15m'].isna().all()
+
+
+def test_bucket_must_divide_every_window(monkeypatch, readings):
+    monkeypatch.setattr(feature_store, 'FEATURE_BUCKET_MINUTES', 7)
+    with pytest.raises(ValueError, match='15m'):
+        compute_rolling_features(readings, START, END)
@@ -0,0 +1,103 @@
+import pandas as pd
+
+from data_processing import ingestion
+from data_processing.table_versions import TableVersions
+
+
+class FakeConnection:
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, *args):
+        pass
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_flush_declares_written_rows_to_downstream_caches(monkeypatch):
+    versions = TableVersions(ttl_seconds=0)
+    received = []
+    versions.subscribe(lambda table, df, first_time, last_time: received.append((table, len(df), first_time, last_time)))
+    monkeypatch.setattr(ingestion, 'get_table_versions', lambda: versions)
+    monkeypatch.setattr(ingestion, 'get_db_connection', FakeConnection)
+    monkeypatch.setattr(ingestion, 'write_batches', lambda conn, table, batches: batches)
+
+    buffer = ingestion.IngestionBuffer(flush_rows=10**6)
+    # Un arrêt envoyé à son début puis renvoyé avec end_time (upsert : une seule modification en base)
+    batch = ingestion.validate_batch('downtime_logs', pd.DataFrame({
+        'downtime_id': [7, 7], 'equipment_id': ['MCH001', 'MCH001'],
+        'start_time': ['2023-01-02 10:00:00', '2023-01-02 10:00:00'], 'end_time': [None, '2023-01-02 12:30:00'],
+        'downtime_category': ['Unplanned - Breakdown'] * 2, 'downtime_reason': ['Electrical Fault'] * 2,
+    }))
+    buffer.submit('downtime_logs', batch)
+    assert buffer.flush() == 2
+
+    assert received == [('downtime_logs', 2, pd.Timestamp('2023-01-02 10:00'), pd.Timestamp('2023-01-02 12:30'))]
+    assert versions.local_changes['downtime_logs'] == 1
+
+
+def test_reserved_id_ranges_do_not_overlap(monkeypatch):
+    class MaxIdConnection(FakeConnection):
+        def fetchone(self):
+            return (500, 40) # Prochains event_id / downtime_id libres en base
+
+    monkeypatch.setattr(ingestion, 'get_db_connection', MaxIdConnection)
+    buffer = ingestion.IngestionBuffer(flush_rows=10**6)
+    buffer.submit('downtime_logs', ingestion.validate_batch('downtime_logs', pd.DataFrame({
+        'downtime_id': [60], 'equipment_id': ['MCH001'], 'start_time': ['2023-01-02 10:00:00'],
+    })))
+
+    first = buffer.reserve_ids({'machine_events': 100, 'downtime_logs': 10})
+    second = buffer.reserve_ids({'machine_events': 5, 'downtime_logs': 5})
+    assert first == {'machine_events': 500, 'downtime_logs': 61} # Au-delà de l'arrêt encore en tampon
+    assert second == {'machine_events': 600, 'downtime_logs': 71}
+
+
+def test_failed_batches_are_requeued_once_when_the_connection_breaks(monkeypatch):
+    class BrokenConnection(FakeConnection):
+        rollbacks = 0
+
+        def rollback(self):
+            BrokenConnection.rollbacks += 1
+            if BrokenConnection.rollbacks > 1:
+                raise ConnectionError("connexion perdue")
+
+    def write_batches(conn, table, batches):
+        if table == 'sensor_readings':
+            raise ValueError("valeur invalide") # Erreur de données : seule la table est annulée
+        if table == 'production_output':
+            raise ConnectionError("connexion perdue")
+        return batches
+
+    monkeypatch.setattr(ingestion, 'get_db_connection', BrokenConnection)
+    monkeypatch.setattr(ingestion, 'write_batches', write_batches)
+    monkeypatch.setattr(ingestion, 'get_table_versions', lambda: TableVersions(ttl_seconds=0))
+    buffer = ingestion.IngestionBuffer(flush_rows=10**6)
+    buffer.submit('sensor_readings', ingestion.validate_batch('sensor_readings', pd.DataFrame({
+        'timestamp': ['2023-01-02 10:00:00'], 'equipment_id': ['MCH001'], 'sensor_type': ['Temperature'], 'value': [71.5],
+    })))
+    buffer.submit('production_output', ingestion.validate_batch('production_output', pd.DataFrame({
+        'equipment_id': ['MCH001'], 'timestamp': ['2023-01-02 10:00:00'], 'quantity_produced': [12],
+    })))
+    buffer.submit('downtime_logs', ingestion.validate_batch('downtime_logs', pd.DataFrame({
+        'downtime_id': [8], 'equipment_id': ['MCH001'], 'start_time': ['2023-01-02 11:00:00'],
+    })))
+
+    assert buffer.flush() == 0
+    # Chaque lot est remis en attente une seule fois, y compris celui dont l'écriture n'a pas été tentée
+    for table in ['sensor_readings', 'production_output', 'downtime_logs']:
+        assert [batch['attempts'] for batch in buffer.pending[table]] == [1]
+    assert buffer.pending_rows == 3
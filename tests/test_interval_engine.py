@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_processing.interval_engine import (
+    DOWNTIME_CATEGORY_PRECEDENCE, clip_intervals, durations_by_bucket, resolve_downtime_intervals
+)
+
+BASE = pd.Timestamp('2023-01-10')
+
+
+def _random_downtimes(seed, n=200):
+    rng = np.random.default_rng(seed)
+    starts = BASE + pd.to_timedelta(rng.integers(0, 3 * 24 * 60, n), unit='min')
+    return pd.DataFrame({
+        'equipment_id': rng.choice(['EQ1', 'EQ2', 'EQ3'], n),
+        'downtime_category': rng.choice(DOWNTIME_CATEGORY_PRECEDENCE + ['Unknown'], n),
+        'downtime_reason': rng.choice(['a', 'b', 'c'], n),
+        'start_time': starts,
+        'end_time': starts + pd.to_timedelta(rng.integers(1, 6 * 60, n), unit='min'),
+    })
+
+
+def _reference_seconds(downtimes_df):
+    """Balayage naïf : chaque segment élémentaire va à la catégorie active la plus prioritaire."""
+    precedence = DOWNTIME_CATEGORY_PRECEDENCE + sorted(set(downtimes_df['downtime_category']) - set(DOWNTIME_CATEGORY_PRECEDENCE))
+    totals = {}
+    for equipment_id, group in downtimes_df.groupby('equipment_id'):
+        bounds = sorted(set(group['start_time']) | set(group['end_time']))
+        for seg_start, seg_end in zip(bounds[:-1], bounds[1:]):
+            active = group[(group['start_time'] <= seg_start) & (group['end_time'] >= seg_end)]
+            if active.empty:
+                continue
+            category = min(active['downtime_category'], key=precedence.index)
+            key = (equipment_id, category)
+            totals[key] = totals.get(key, 0.0) + (seg_end - seg_start).total_seconds()
+    return totals
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_resolved_segments_match_a_naive_sweep(seed):
+    downtimes_df = _random_downtimes(seed)
+    segments = resolve_downtime_intervals(downtimes_df)
+
+    # Segments disjoints par équipement
+    for _, group in segments.groupby('equipment_id'):
+        assert (group['start_time'].iloc[1:].to_numpy() >= group['end_time'].iloc[:-1].to_numpy()).all()
+
+    durations = (segments['end_time'] - segments['start_time']).dt.total_seconds()
+    resolved = durations.groupby([segments['equipment_id'], segments['downtime_category']]).sum().to_dict()
+    assert resolved == pytest.approx(_reference_seconds(downtimes_df))
+
+
+def test_overlap_goes_to_the_priority_category_and_keeps_the_first_reason():
+    downtimes_df = pd.DataFrame({
+        'equipment_id': ['EQ1'] * 3,
+        'downtime_category': ['Unplanned - Process', 'Unplanned - Process', 'Planned Maintenance'],
+        'downtime_reason': ['Bourrage', 'Outil', 'Préventive'],
+        'start_time': pd.to_datetime(['2023-01-10 08:00', '2023-01-10 08:30', '2023-01-10 09:00']),
+        'end_time': pd.to_datetime(['2023-01-10 09:30', '2023-01-10 10:00', '2023-01-10 09:15']),
+    })
+    segments = resolve_downtime_intervals(downtimes_df)
+    assert segments[['downtime_category', 'downtime_reason']].values.tolist() == [
+        ['Unplanned - Process', 'Bourrage'], ['Planned Maintenance', 'Préventive'], ['Unplanned - Process', 'Bourrage']]
+    assert segments['start_time'].dt.strftime('%H:%M').tolist() == ['08:00', '09:00', '09:15']
+    assert segments['end_time'].dt.strftime('%H:%M').tolist() == ['09:00', '09:15', '10:00']
+
+
+def test_bucketed_durations_add_up_to_the_clipped_period():
+    segments = resolve_downtime_intervals(_random_downtimes(3))
+    start, end = BASE + pd.Timedelta(hours=5), BASE + pd.Timedelta(days=2, hours=5)
+    clipped = clip_intervals(segments, start, end)
+    buckets = durations_by_bucket(segments, pd.date_range(start, end, freq='6h'))
+    assert buckets['duration_seconds'].sum() == pytest.approx(clipped['duration_seconds'].sum())
+    assert buckets['bucket_start'].min() >= start and buckets['bucket_start'].max() < end
@@ -0,0 +1,66 @@
+from datetime import datetime
+import pandas as pd
+import pytest
+
+from data_processing import kpi_calculator, kpi_chunked
+
+
+class FakeConnection:
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def chunked_sources(sim_data, monkeypatch):
+    """Blocs lus en mémoire, avec les filtres et l'ordre des requêtes de calculate_kpi_partials_chunked."""
+    downtimes_df, production_df = sim_data['downtime_logs'], sim_data['production_output']
+
+    def iter_query_chunks(conn, query, params, table, chunk_rows=kpi_chunked.KPI_CHUNK_ROWS):
+        start_time, end_time = params['start_time'], params['end_time']
+        if table == 'production_output':
+            df = production_df[(production_df['timestamp'] >= start_time) & (production_df['timestamp'] <= end_time)]
+        else:
+            df = downtimes_df[(downtimes_df['end_time'] > start_time) & (downtimes_df['start_time'] < end_time)]
+            df = df.sort_values(['equipment_id', 'start_time'], kind='stable')
+        if 'equipment_id' in params:
+            df = df[df['equipment_id'] == params['equipment_id']]
+        for offset in range(0, len(df), chunk_rows):
+            yield df.iloc[offset:offset + chunk_rows].reset_index(drop=True)
+
+    monkeypatch.setattr(kpi_chunked, 'get_db_connection', FakeConnection)
+    monkeypatch.setattr(kpi_chunked, 'iter_query_chunks', iter_query_chunks)
+    return downtimes_df, production_df
+
+
+# Blocs plus petits que les arrêts d'un équipement (44 à 55) : report du dernier équipement sur plusieurs blocs
+@pytest.mark.parametrize('chunk_rows', [17, 60, 10**6])
+@pytest.mark.parametrize('start_time, end_time, equipment_id', [
+    (datetime(2023, 1, 1), datetime(2023, 2, 15), None),
+    (datetime(2023, 1, 8, 3, 17, 5), datetime(2023, 2, 8, 11, 0, 30), None),
+    (datetime(2023, 1, 1), datetime(2023, 2, 1), 'MCH002'),
+])
+def test_chunked_partials_match_single_pass(chunked_sources, chunk_rows, start_time, end_time, equipment_id):
+    downtimes_df, production_df = chunked_sources
+    downtimes_df = downtimes_df[(downtimes_df['end_time'] > start_time) & (downtimes_df['start_time'] < end_time)]
+    production_df = production_df[(production_df['timestamp'] >= start_time) & (production_df['timestamp'] <= end_time)]
+    if equipment_id:
+        downtimes_df = downtimes_df[downtimes_df['equipment_id'] == equipment_id]
+        production_df = production_df[production_df['equipment_id'] == equipment_id]
+    expected = kpi_calculator.calculate_kpi_partials(downtimes_df, production_df, start_time, end_time)
+
+    actual = kpi_chunked.calculate_kpi_partials_chunked(start_time, end_time, equipment_id, chunk_rows=chunk_rows)
+    expected = expected.astype({'equipment_id': str}).sort_values('equipment_id').reset_index(drop=True)
+    pd.testing.assert_frame_equal(expected, actual.sort_values('equipment_id').reset_index(drop=True),
+                                  check_dtype=False, atol=1e-6)
+
+
+def test_overlapping_downtimes_split_across_chunks_are_resolved_together(sim_data):
+    # Les arrêts chevauchants ajoutés par sim_data sont en tête : des blocs d'une ligne les séparent
+    start_time, end_time = datetime(2023, 1, 1), datetime(2023, 2, 15)
+    downtimes_df = sim_data['downtime_logs']
+    chunks = [downtimes_df.iloc[i:i + 1] for i in range(len(downtimes_df))]
+    actual = kpi_chunked.fold_downtime_chunks(chunks, start_time, end_time)
+    expected = kpi_calculator.calculate_kpi_partials(downtimes_df, pd.DataFrame(), start_time, end_time)
+    expected = expected.set_index(expected['equipment_id'].astype(str)).drop(columns='equipment_id')
+    pd.testing.assert_frame_equal(expected.loc[actual.index, actual.columns], actual,
+                                  check_dtype=False, check_names=False, atol=1e-6)
@@ -0,0 +1,68 @@
+from datetime import datetime
+import pandas as pd
+import pytest
+
+from data_processing import kpi_calculator, kpi_compare, kpi_rollup
+
+# Mois courant, mois précédent, période chevauchant les deux et période décalée à la seconde près
+WINDOWS = [
+    (datetime(2023, 2, 1), datetime(2023, 2, 15)),
+    (datetime(2023, 1, 18), datetime(2023, 2, 1)),
+    (datetime(2023, 1, 25), datetime(2023, 2, 8)),
+    (datetime(2023, 1, 3, 6, 12, 45), datetime(2023, 1, 9, 22, 0, 30)),
+]
+
+
+def assert_same_kpis(expected, actual):
+    pd.testing.assert_frame_equal(expected.reset_index(drop=True), actual.reset_index(drop=True),
+                                  check_dtype=False, atol=1e-6)
+
+
+@pytest.fixture
+def read_windows(sim_data, patch_sources):
+    """Lecture en mémoire de l'union des périodes (filtres de read_windows_data combinés par OR)."""
+    patch_sources(sim_data['equipments'], sim_data['downtime_logs'], sim_data['production_output'], kpi_compare, kpi_rollup)
+    downtimes_df, production_df = sim_data['downtime_logs'], sim_data['production_output']
+
+    def read_data(windows, equipment_id=None):
+        downtime_mask = pd.Series(False, index=downtimes_df.index)
+        production_mask = pd.Series(False, index=production_df.index)
+        for start, end in kpi_compare.merge_windows(windows):
+            downtime_mask |= (downtimes_df['end_time'] > start) & (downtimes_df['start_time'] < end)
+            production_mask |= (production_df['timestamp'] >= start) & (production_df['timestamp'] <= end)
+        if equipment_id:
+            downtime_mask &= downtimes_df['equipment_id'] == equipment_id
+            production_mask &= production_df['equipment_id'] == equipment_id
+        return downtimes_df[downtime_mask].reset_index(drop=True), production_df[production_mask].reset_index(drop=True)
+    return read_data
+
+
+@pytest.mark.parametrize('equipment_id', [None, 'MCH002'])
+def test_window_kpis_match_direct_calculation(read_windows, equipment_id):
+    window_kpis, deltas = kpi_compare.compare_kpis(WINDOWS, equipment_id, read_data=read_windows)
+    assert len(window_kpis) == len(WINDOWS) and len(deltas) == len(WINDOWS) - 1
+    for (start_time, end_time), actual in zip(WINDOWS, window_kpis):
+        assert_same_kpis(kpi_calculator.calculate_all_kpis(start_time, end_time, equipment_id), actual)
+
+    for compared, delta in zip(window_kpis[1:], deltas):
+        merged = window_kpis[0].merge(compared, on='equipment_id', suffixes=('', '_compared'))
+        assert delta['equipment_id'].tolist() == merged['equipment_id'].tolist()
+        for col in ['oee', 'mtbf_hours', 'total_produced']:
+            assert (delta[col] - (merged[col] - merged[f'{col}_compared'])).abs().max() < 1e-9
+
+
+def test_grouped_window_kpis_match_rollup(read_windows):
+    window_kpis, deltas = kpi_compare.compare_kpis(WINDOWS, group_by='line', read_data=read_windows)
+    get_downtime_data, get_production_data = kpi_rollup.get_downtime_data, kpi_rollup.get_production_data
+    for (start_time, end_time), actual in zip(WINDOWS, window_kpis):
+        partials_df = kpi_calculator.calculate_kpi_partials(get_downtime_data(start_time, end_time),
+                                                            get_production_data(start_time, end_time), start_time, end_time)
+        expected = kpi_rollup.calculate_grouped_kpis(start_time, end_time, group_by='line', partials_df=partials_df)
+        assert_same_kpis(expected, actual)
+    assert all(not delta.empty for delta in deltas)
+
+
+def test_merge_windows_joins_overlapping_and_contiguous_ranges():
+    merged = kpi_compare.merge_windows([(datetime(2023, 2, 1), datetime(2023, 3, 1)), (datetime(2023, 1, 1), datetime(2023, 2, 1)),
+                                        (datetime(2023, 5, 1), datetime(2023, 6, 1))])
+    assert merged == [(pd.Timestamp('2023-01-01'), pd.Timestamp('2023-03-01')), (pd.Timestamp('2023-05-01'), pd.Timestamp('2023-06-01'))]
@@ -0,0 +1,140 @@
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_processing import kpi_calculator, kpi_index
+from data_processing.table_versions import TableVersions
+
+
+def assert_same_kpis(expected, actual):
+    pd.testing.assert_frame_equal(expected.reset_index(drop=True), actual.reset_index(drop=True),
+                                  check_dtype=False, atol=1e-6)
+
+
+@pytest.fixture
+def sim_index(sim_data, patch_sources):
+    patch_sources(sim_data['equipments'], sim_data['downtime_logs'], sim_data['production_output'], kpi_index)
+    return kpi_index.build_kpi_index()
+
+
+@pytest.mark.parametrize('start_time, end_time, equipment_id', [
+    (datetime(2023, 1, 1), datetime(2023, 2, 1), None),
+    (datetime(2023, 1, 10), datetime(2023, 2, 10), None),
+    (datetime(2023, 1, 8, 3, 17, 5), datetime(2023, 2, 8, 11, 0, 30), None),
+    (datetime(2023, 1, 1), datetime(2023, 2, 1), 'MCH002'),
+])
+def test_indexed_kpis_match_direct_calculation(sim_index, start_time, end_time, equipment_id):
+    expected = kpi_calculator.calculate_all_kpis(start_time, end_time, equipment_id)
+    actual = kpi_index.calculate_all_kpis_indexed(start_time, end_time, equipment_id, index=sim_index)
+    assert_same_kpis(expected, actual)
+
+
+@pytest.fixture
+def edge_case_data():
+    """Relevé exactement à la fin de la période et arrêt couvrant toute la période (temps de marche nul)."""
+    equip_df = pd.DataFrame({
+        'equipment_id': ['MCH001', 'MCH002'], 'equipment_name': ['A', 'B'], 'equipment_type': ['Usinage'] * 2,
+        'production_line_id': ['LINE_A'] * 2, 'ideal_cycle_time_seconds': [10.0, 10.0],
+    })
+    production_df = pd.DataFrame({
+        'production_id': [1, 2, 3, 4],
+        'equipment_id': ['MCH001', 'MCH001', 'MCH002', 'MCH002'],
+        'timestamp': pd.to_datetime(['2023-01-05 03:00:00.123457', '2023-02-10 00:00:00',
+                                     '2023-01-10 00:00:00', '2023-01-20 00:00:00'], format='ISO8601'),
+        'quantity_produced': [100, 200, 50, 60], 'quantity_rejected': [1, 2, 0, 1],
+        'running_duration_seconds': [3600.0, 3600.0, 1000.0, 1000.0],
+    })
+    downtimes_df = pd.DataFrame({
+        'downtime_id': [1, 2, 3],
+        'equipment_id': ['MCH001', 'MCH001', 'MCH002'],
+        'start_time': pd.to_datetime(['2023-01-03 07:13:22.401445', '2023-01-20 05:00:00.773311', '2023-01-21 00:00:00'], format='ISO8601'),
+        'end_time': pd.to_datetime(['2023-01-25 09:41:07.238101', '2023-03-01 00:00:00.5', '2023-01-21 01:00:00'], format='ISO8601'),
+        'downtime_category': ['Unplanned - Breakdown', 'Unplanned - Process', 'Changeover'],
+        'downtime_reason': ['Electrical Fault', 'Tooling Issue', 'Product Change'],
+    })
+    downtimes_df['duration_seconds'] = (downtimes_df['end_time'] - downtimes_df['start_time']).dt.total_seconds()
+    return equip_df, downtimes_df, production_df
+
+
+def test_indexed_kpis_edge_cases(edge_case_data, patch_sources):
+    patch_sources(*edge_case_data, kpi_index)
+    index = kpi_index.build_kpi_index()
+    start_time, end_time = datetime(2023, 1, 10), datetime(2023, 2, 10)
+    expected = kpi_calculator.calculate_all_kpis(start_time, end_time)
+    actual = kpi_index.calculate_all_kpis_indexed(start_time, end_time, index=index)
+    assert_same_kpis(expected, actual)
+    # Relevé à end_time inclus, comme get_production_data
+    assert actual['total_produced'].tolist() == [200, 110]
+    # Arrêt sur toute la période : temps de marche exactement nul, pas de résidu flottant
+    assert actual.loc[0, 'run_time_hours'] == 0 and actual.loc[0, 'performance'] == 0
+
+
+def test_index_appends_match_full_build(sim_data, sim_index):
+    production_df, downtimes_df = sim_data['production_output'], sim_data['downtime_logs']
+    split = datetime(2023, 1, 20)
+    index = kpi_index.KpiPrefixIndex(sim_index.origin)
+    index.append_production(production_df[production_df['timestamp'] < split])
+    index.append_downtimes(downtimes_df[downtimes_df['start_time'] < split])
+    index.append_production(production_df[production_df['timestamp'] >= split])
+    index.append_downtimes(downtimes_df[downtimes_df['start_time'] >= split])
+
+    start_time, end_time = datetime(2023, 1, 5), datetime(2023, 2, 3, 5, 3)
+    expected = sim_index.query(start_time, end_time)
+    actual = index.query(start_time, end_time)
+    assert np.allclose(expected.iloc[:, 1:].to_numpy(dtype=float), actual.iloc[:, 1:].to_numpy(dtype=float))
+
+
+def test_saved_index_reloads_memory_mapped(sim_index, tmp_path):
+    sim_index.save(tmp_path)
+    reloaded = kpi_index.KpiPrefixIndex.load(tmp_path)
+    start_time, end_time = datetime(2023, 1, 8, 3, 17, 5), datetime(2023, 2, 8, 11, 0, 30)
+    pd.testing.assert_frame_equal(sim_index.query(start_time, end_time), reloaded.query(start_time, end_time))
+
+
+class FakeVersions(TableVersions):
+    def __init__(self):
+        super().__init__(ttl_seconds=0)
+        self.db = {table: (1, 0) for table in kpi_index.INDEXED_TABLES}
+
+    def _read_versions(self, tables):
+        return {table: self.db[table] for table in tables}
+
+
+@pytest.fixture
+def process_index(sim_data, patch_sources, monkeypatch):
+    """Index du processus alimenté par les jours antérieurs au 20 janvier, avec des versions de tables simulées."""
+    split = datetime(2023, 1, 20)
+    downtimes_df, production_df = sim_data['downtime_logs'], sim_data['production_output']
+    patch_sources(sim_data['equipments'], downtimes_df[downtimes_df['start_time'] < split],
+                  production_df[production_df['timestamp'] < split], kpi_index)
+    versions = FakeVersions()
+    monkeypatch.setattr(kpi_index, 'get_table_versions', lambda: versions)
+    monkeypatch.setattr(kpi_index, '_kpi_index', None)
+    versions.subscribe(kpi_index._apply_written)
+    return versions, split
+
+
+def test_ingested_rows_are_applied_to_process_index(sim_data, sim_index, process_index):
+    versions, split = process_index
+    index = kpi_index.get_kpi_index()
+    downtimes_df, production_df = sim_data['downtime_logs'], sim_data['production_output']
+    late_downtimes = downtimes_df[downtimes_df['start_time'] >= split]
+    # Arrêt reçu ouvert puis renvoyé terminé : compté une seule fois
+    versions.record_local_write('downtime_logs', late_downtimes.assign(end_time=pd.NaT))
+    versions.record_local_write('downtime_logs', late_downtimes)
+    versions.record_local_write('production_output', production_df[production_df['timestamp'] >= split])
+    for table in kpi_index.INDEXED_TABLES:
+        versions.db[table] = (1, versions.local_changes[table])
+
+    assert kpi_index.get_kpi_index() is index # Écritures locales : pas de reconstruction
+    start_time, end_time = datetime(2023, 1, 5), datetime(2023, 2, 3, 5, 3)
+    assert np.allclose(sim_index.query(start_time, end_time).iloc[:, 1:].to_numpy(dtype=float),
+                       index.query(start_time, end_time).iloc[:, 1:].to_numpy(dtype=float))
+
+
+def test_process_index_is_rebuilt_after_external_writes(process_index):
+    versions, _ = process_index
+    index = kpi_index.get_kpi_index()
+    versions.db['production_output'] = (1, 5) # Lignes écrites par un autre processus
+    assert kpi_index.get_kpi_index() is not index
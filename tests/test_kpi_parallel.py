@@ -0,0 +1,64 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+import pandas as pd
+import pytest
+
+from data_processing import kpi_calculator, kpi_parallel
+from data_processing.db_connection import get_statement_timeout, set_statement_timeout
+
+
+@pytest.fixture
+def shard_sources(sim_data, patch_sources):
+    """Lectures en mémoire ; retourne l'équivalent de read_shard_data (filtre equipment_id = ANY)."""
+    get_downtime_data, get_production_data, _ = patch_sources(
+        sim_data['equipments'], sim_data['downtime_logs'], sim_data['production_output'], kpi_parallel)
+
+    def read_shard_data(start_time, end_time, equipment_ids):
+        downtimes_df = get_downtime_data(start_time, end_time)
+        production_df = get_production_data(start_time, end_time)
+        return (downtimes_df[downtimes_df['equipment_id'].isin(equipment_ids)].reset_index(drop=True),
+                production_df[production_df['equipment_id'].isin(equipment_ids)].reset_index(drop=True))
+
+    return read_shard_data
+
+
+@pytest.mark.parametrize('num_shards', [1, 2, 3, 10])
+@pytest.mark.parametrize('start_time, end_time', [
+    (datetime(2023, 1, 1), datetime(2023, 2, 1)),
+    (datetime(2023, 1, 8, 3, 17, 5), datetime(2023, 2, 8, 11, 0, 30)),
+])
+def test_parallel_kpis_match_direct_calculation(shard_sources, num_shards, start_time, end_time):
+    expected = kpi_calculator.calculate_all_kpis(start_time, end_time)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        actual = kpi_parallel.calculate_all_kpis_parallel(start_time, end_time, num_shards=num_shards, executor=executor,
+                                                          read_data=shard_sources)
+    pd.testing.assert_frame_equal(expected.reset_index(drop=True), actual, check_dtype=False, atol=1e-6)
+
+
+def test_partitions_cover_every_equipment_once(sim_data):
+    shards = kpi_parallel.partition_equipments(sim_data['equipments'], 3)
+    assert [len(shard) for shard in shards] == [2, 1, 1]
+    assert sorted(pd.concat(shards)['equipment_id']) == sorted(sim_data['equipments']['equipment_id'])
+
+
+def read_timeout_probe(start_time, end_time, equipment_ids):
+    """Lecture de partition exécutée dans le processus du pool : un relevé par équipement, quantité = statement_timeout."""
+    production_df = pd.DataFrame({
+        'equipment_id': equipment_ids, 'timestamp': pd.Timestamp(start_time), 'quantity_produced': get_statement_timeout() or 0,
+        'quantity_rejected': 0, 'running_duration_seconds': 60.0,
+    })
+    return pd.DataFrame(columns=['equipment_id', 'start_time', 'end_time', 'downtime_category', 'downtime_reason']), production_df
+
+
+def test_process_pool_shards_run_with_the_request_statement_timeout(sim_data, patch_sources):
+    patch_sources(sim_data['equipments'], sim_data['downtime_logs'], sim_data['production_output'], kpi_parallel)
+    set_statement_timeout(1234)
+    try:
+        with ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context('spawn')) as executor:
+            kpis_df = kpi_parallel.calculate_all_kpis_parallel(datetime(2023, 1, 1), datetime(2023, 2, 1), num_shards=2,
+                                                               executor=executor, read_data=read_timeout_probe)
+    finally:
+        set_statement_timeout(None)
+    assert kpis_df['equipment_id'].tolist() == sorted(sim_data['equipments']['equipment_id'])
+    assert kpis_df['total_produced'].tolist() == [1234] * len(kpis_df)
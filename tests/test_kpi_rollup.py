@@ -0,0 +1,74 @@
+from datetime import datetime
+import pandas as pd
+import pytest
+
+from data_processing import kpi_calculator, kpi_rollup
+from data_processing.table_versions import TableVersions
+
+
+class FakeVersions(TableVersions):
+    def __init__(self):
+        super().__init__(ttl_seconds=0)
+        self.db = {table: (1, 0) for table in kpi_rollup.PARTIALS_TABLES}
+
+    def _read_versions(self, tables):
+        return {table: self.db[table] for table in tables}
+
+
+@pytest.fixture
+def counted_reads(sim_data, patch_sources, monkeypatch):
+    """Sources en mémoire comptant les lectures de production, cache vide et versions simulées."""
+    _, get_production_data, _ = patch_sources(sim_data['equipments'], sim_data['downtime_logs'],
+                                              sim_data['production_output'], kpi_rollup)
+    reads = []
+
+    def counted(*args, **kwargs):
+        reads.append(kwargs)
+        return get_production_data(*args, **kwargs)
+
+    monkeypatch.setattr(kpi_rollup, 'get_production_data', counted)
+    versions = FakeVersions()
+    monkeypatch.setattr(kpi_rollup, 'get_table_versions', lambda: versions)
+    versions.subscribe(kpi_rollup._invalidate_written)
+    kpi_rollup.clear_kpi_partials_cache()
+    yield versions, reads
+    kpi_rollup.clear_kpi_partials_cache()
+
+
+def test_plant_kpis_are_computed_from_summed_equipment_values(sim_data, patch_sources):
+    patch_sources(sim_data['equipments'], sim_data['downtime_logs'], sim_data['production_output'], kpi_rollup)
+    kpi_rollup.clear_kpi_partials_cache()
+    start_time, end_time = datetime(2023, 1, 1), datetime(2023, 2, 1)
+    equipment_kpis = kpi_calculator.calculate_all_kpis(start_time, end_time)
+    plant_kpis = kpi_rollup.calculate_grouped_kpis(start_time, end_time, group_by='plant')
+
+    assert plant_kpis.loc[0, 'num_equipments'] == len(equipment_kpis)
+    for col in ['total_produced', 'total_rejected', 'total_downtime_hours', 'run_time_hours', 'planned_production_time_hours']:
+        assert plant_kpis.loc[0, col] == pytest.approx(equipment_kpis[col].sum())
+    assert plant_kpis.loc[0, 'availability'] == pytest.approx(
+        equipment_kpis['run_time_hours'].sum() / equipment_kpis['planned_production_time_hours'].sum())
+
+
+def test_cached_partials_follow_table_writes(counted_reads):
+    versions, reads = counted_reads
+    start_time, end_time = datetime(2023, 1, 1), datetime(2023, 2, 1)
+    kpi_rollup.get_kpi_partials(start_time, end_time)
+    kpi_rollup.get_kpi_partials(start_time, end_time)
+    assert len(reads) == 1
+
+    # Écriture locale hors de la période : entrée conservée ; dans la période : recalcul
+    late_row = pd.DataFrame({'timestamp': pd.to_datetime(['2023-02-10 08:00'])})
+    versions.record_local_write('production_output', late_row, time_columns=['timestamp'])
+    versions.db['production_output'] = (1, 1)
+    kpi_rollup.get_kpi_partials(start_time, end_time)
+    assert len(reads) == 1
+    late_row = pd.DataFrame({'timestamp': pd.to_datetime(['2023-01-10 08:00'])})
+    versions.record_local_write('production_output', late_row, time_columns=['timestamp'])
+    versions.db['production_output'] = (1, 2)
+    kpi_rollup.get_kpi_partials(start_time, end_time)
+    assert len(reads) == 2
+
+    # Écriture d'un autre processus : recalcul
+    versions.db['downtime_logs'] = (1, 1)
+    kpi_rollup.get_kpi_partials(start_time, end_time)
+    assert len(reads) == 3
@@ -0,0 +1,111 @@
+import pandas as pd
+import pytest
+
+from data_processing.kpi_calculator import calculate_effective_downtime_in_period, calculate_downtime_kpis
+from data_processing import live_kpis
+from data_processing.live_kpis import LiveEquipmentState, LiveKpiEngine
+
+DAY = pd.Timestamp('2023-01-10')
+
+
+def _t(hhmm):
+    return DAY + pd.Timedelta(hhmm + ':00')
+
+
+def _hours(state, now):
+    totals = state.partials(now)
+    return totals['total_planned_downtime_seconds'] / 3600, totals['total_unplanned_downtime_seconds'] / 3600
+
+
+def test_nested_stop_closing_first_is_not_lost():
+    state = LiveEquipmentState('EQ1', DAY)
+    state.on_downtime_start(1, _t('09:00'), 'Unplanned - Breakdown', 'Panne')
+    state.on_downtime_start(2, _t('10:00'), 'Unplanned - Process', 'Bourrage')
+    state.on_downtime_end(2, _t('10:30'))
+    assert _hours(state, _t('11:00')) == (0.0, 2.0) # Arrêts ouverts ou non : union, pas de double compte
+    state.on_downtime_end(1, _t('12:00'))
+    assert _hours(state, _t('13:00')) == (0.0, 3.0)
+
+
+def test_planned_and_unplanned_overlap_follows_precedence():
+    state = LiveEquipmentState('EQ1', DAY)
+    state.on_downtime_start(1, _t('08:00'), 'Unplanned - Process', 'Bourrage')
+    state.on_downtime_start(2, _t('08:30'), 'Planned Maintenance', 'Préventive')
+    state.on_downtime_end(2, _t('09:00'))
+    state.on_downtime_end(1, _t('10:00'))
+    assert _hours(state, _t('12:00')) == (0.5, 1.5)
+    assert state.partials(_t('12:00'))['num_unplanned_incidents'] == 1
+
+
+@pytest.mark.parametrize('now', ['11:00', '14:00', '23:59'])
+def test_live_downtime_matches_full_computation(now):
+    # Arrêt commencé la veille, arrêts imbriqués, chevauchants et en cours
+    stops = [
+        (1, '2023-01-09 22:00', '2023-01-10 01:00', 'Unplanned - Breakdown'),
+        (2, '2023-01-10 09:00', '2023-01-10 12:00', 'Unplanned - Breakdown'),
+        (3, '2023-01-10 10:00', '2023-01-10 10:30', 'Unplanned - Process'),
+        (4, '2023-01-10 11:30', '2023-01-10 13:00', 'Changeover'),
+        (5, '2023-01-10 12:45', None, 'Unplanned - Process'),
+    ]
+    now = _t(now)
+    state = LiveEquipmentState('EQ1', DAY)
+    for downtime_id, start, end, category in stops:
+        if pd.Timestamp(start) < now:
+            state.on_downtime_start(downtime_id, pd.Timestamp(start), category, 'r')
+    for downtime_id, start, end, category in sorted(stops, key=lambda stop: stop[2] or '~'):
+        if end is not None and pd.Timestamp(end) <= now:
+            state.on_downtime_end(downtime_id, pd.Timestamp(end))
+
+    seen = pd.DataFrame([{
+        'equipment_id': 'EQ1', 'downtime_category': category, 'downtime_reason': 'r',
+        'start_time': pd.Timestamp(start), 'end_time': min(pd.Timestamp(end), now) if end else now,
+    } for _, start, end, category in stops if pd.Timestamp(start) < now])
+    _, planned, unplanned, _ = calculate_downtime_kpis(calculate_effective_downtime_in_period(seen, DAY, now))
+    expected_planned = planned['total_planned_downtime_seconds'].sum()
+    expected_unplanned = unplanned['total_unplanned_downtime_seconds'].sum()
+
+    totals = state.partials(now)
+    assert totals['total_planned_downtime_seconds'] == pytest.approx(expected_planned)
+    assert totals['total_unplanned_downtime_seconds'] == pytest.approx(expected_unplanned)
+
+
+class FakeConnection:
+    def close(self):
+        pass
+
+
+def test_poller_applies_late_and_identical_production_rows(monkeypatch):
+    db = {'production_output': pd.DataFrame(columns=['timestamp', 'equipment_id', 'product_id', 'quantity_produced',
+                                                        'quantity_rejected', 'running_duration_seconds'])}
+
+    def read_sql_typed(query, conn, params=None, table=None):
+        if 'production_output' in query:
+            df = db['production_output']
+            return df[df['timestamp'] >= params['since']].sort_values('timestamp').reset_index(drop=True)
+        columns = ['downtime_id', 'end_time', 'start_time'] if 'downtime_logs' in query else ['event_id', 'timestamp']
+        return pd.DataFrame(columns=columns)
+
+    def insert(*rows):
+        new_rows = pd.DataFrame([{'timestamp': _t(hhmm), 'equipment_id': eq_id, 'product_id': 'P1', 'quantity_produced': quantity,
+                                  'quantity_rejected': 0, 'running_duration_seconds': 60.0} for hhmm, eq_id, quantity in rows])
+        db['production_output'] = pd.concat([db['production_output'], new_rows], ignore_index=True)
+
+    monkeypatch.setattr(live_kpis, 'get_db_connection', FakeConnection)
+    monkeypatch.setattr(live_kpis, 'read_sql_typed', read_sql_typed)
+    monkeypatch.setattr(live_kpis, 'LIVE_LATE_SECONDS', 600)
+    engine = LiveKpiEngine()
+    engine.window_start = DAY
+    engine.equipments = pd.DataFrame({'equipment_id': ['EQ1', 'EQ2'], 'equipment_name': ['A', 'B'], 'equipment_type': ['T'] * 2,
+                                      'production_line_id': ['L1'] * 2, 'ideal_cycle_time_seconds': [1.0, 1.0]})
+    engine._reset_watermarks()
+
+    insert(('10:00', 'EQ1', 10), ('10:05', 'EQ2', 20))
+    engine.poll_once(_t('10:06'))
+    # EQ1 valide en retard un relevé antérieur au watermark, et un second relevé identique à 10:05
+    insert(('10:02', 'EQ1', 5), ('10:05', 'EQ2', 20))
+    engine.poll_once(_t('10:07'))
+    engine.poll_once(_t('10:08')) # Relecture de la fenêtre de retard : rien n'est compté deux fois
+
+    assert engine.states['EQ1'].totals['total_produced'] == 15
+    assert engine.states['EQ2'].totals['total_produced'] == 40
+    assert engine.states['EQ2'].totals['production_records'] == 2
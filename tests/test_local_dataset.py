@@ -0,0 +1,80 @@
+import os
+import pandas as pd
+import pytest
+
+from data_processing import local_dataset
+from data_processing.local_dataset import load_table
+
+pytest.importorskip('pyarrow')
+
+START, END = '2023-01-20 06:30:00', '2023-02-02 18:00:00'
+
+
+@pytest.fixture
+def data_dir(sim_data, tmp_path):
+    """CSV du jeu simulé, comme écrits par simulate_data (cache Parquet dans tmp_path/.parquet_cache)."""
+    for table in ['equipments', 'machine_events', 'downtime_logs', 'production_output']:
+        sim_data[table].to_csv(tmp_path / f"{table}.csv", index=False)
+    return str(tmp_path)
+
+
+def _rebuilds(capsys):
+    return capsys.readouterr().out.count('reconstruit')
+
+
+@pytest.mark.parametrize('table, options', [
+    ('equipments', {}),
+    ('machine_events', {'columns': ['timestamp', 'event_type', 'details']}),
+    ('downtime_logs', {'equipment_id': 'MCH002', 'start_time': START, 'end_time': END}),
+    ('downtime_logs', {'columns': ['downtime_id', 'downtime_reason'], 'start_time': START, 'end_time': END}),
+    ('production_output', {'equipment_id': ['MCH001', 'MCH003'], 'start_time': START}),
+    ('production_output', {'columns': ['quantity_produced', 'equipment_id'], 'equipment_id': 'MCH004', 'end_time': END}),
+])
+def test_parquet_cache_matches_the_csv_read(data_dir, table, options):
+    cached = load_table(table, data_dir=data_dir, **options)
+    uncached = load_table(table, data_dir=data_dir, use_cache=False, **options)
+    assert os.path.exists(os.path.join(data_dir, '.parquet_cache', f"{table}.parquet"))
+    assert list(cached.columns) == (options.get('columns') or list(uncached.columns))
+    pd.testing.assert_frame_equal(cached, uncached, check_categorical=False)
+    assert len(cached) > 0
+
+
+def test_filters_match_the_sql_reads(data_dir, sim_data):
+    production_df = load_table('production_output', equipment_id='MCH002', start_time=START, end_time=END, data_dir=data_dir)
+    source = sim_data['production_output']
+    expected = source[(source['equipment_id'] == 'MCH002') & (source['timestamp'] >= START) & (source['timestamp'] <= END)]
+    assert len(production_df) == len(expected) and production_df['timestamp'].is_monotonic_increasing
+    assert str(production_df['equipment_id'].dtype) == 'category' and production_df['quantity_produced'].dtype == 'int32'
+
+    # downtime_logs : arrêts qui chevauchent la période
+    downtimes_df = load_table('downtime_logs', start_time=START, end_time=END, data_dir=data_dir)
+    source = sim_data['downtime_logs']
+    expected = source[(source['end_time'] > START) & (source['start_time'] < END)]
+    assert sorted(downtimes_df['downtime_id']) == sorted(expected['downtime_id'])
+
+
+def test_cache_is_rebuilt_only_when_the_csv_changes(data_dir, sim_data, capsys):
+    csv_path = os.path.join(data_dir, 'machine_events.csv')
+    assert len(load_table('machine_events', data_dir=data_dir)) == len(sim_data['machine_events'])
+    assert _rebuilds(capsys) == 1
+    load_table('machine_events', data_dir=data_dir)
+    assert _rebuilds(capsys) == 0
+
+    # Même contenu, mtime différent (copie, checkout) : empreinte identique, pas de reconstruction
+    stat = os.stat(csv_path)
+    os.utime(csv_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    load_table('machine_events', data_dir=data_dir)
+    assert _rebuilds(capsys) == 0
+
+    # Contenu modifié à taille égale, puis lignes supprimées : le cache suit le CSV
+    with open(csv_path) as f:
+        content = f.read()
+    with open(csv_path, 'w') as f:
+        f.write(content.replace('Initial startup', 'Initial st4rtup'))
+    os.utime(csv_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2 * 10**9))
+    assert (load_table('machine_events', data_dir=data_dir)['details'] == 'Initial st4rtup').sum() == 4
+    assert _rebuilds(capsys) == 1
+
+    sim_data['machine_events'].iloc[:10].to_csv(csv_path, index=False)
+    assert len(load_table('machine_events', data_dir=data_dir)) == 10
+    assert _rebuilds(capsys) == 1
@@ -0,0 +1,100 @@
+import random
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_processing import simulate_data
+from data_processing.kpi_calculator import PLANNED_DOWNTIME_CATEGORIES
+from data_processing.precursor_analysis import (PRECURSOR_BASELINE_MINUTES, PRECURSOR_ONSET_Z, PRECURSOR_SENSOR_MAP,
+                                                align_precursor_windows)
+
+SPAN_START, SPAN_END = pd.Timestamp('2023-01-20'), pd.Timestamp('2023-01-27')
+
+
+@pytest.fixture(scope='module')
+def precursor_data(sim_data):
+    """Arrêts de la période et relevés simulés (avec dérive avant les arrêts liés), toutes les 10 minutes."""
+    random.seed(2)
+    np.random.seed(2)
+    params = dict(sim_data['params'], SENSOR_READING_FREQUENCY_SECONDS=600)
+    downtimes_df = sim_data['downtime_logs']
+    downtimes_df = downtimes_df[(downtimes_df['start_time'] >= SPAN_START + pd.Timedelta(hours=8)) & (downtimes_df['start_time'] < SPAN_END)]
+    events_df = sim_data['machine_events']
+    events_df = events_df[(events_df['timestamp'] >= SPAN_START) & (events_df['timestamp'] < SPAN_END)]
+    readings_df = simulate_data.generate_sensor_readings_realistic(sim_data['equipments'], events_df, SPAN_START.to_pydatetime(),
+                                                                   SPAN_END.to_pydatetime(), params, downtimes_df)
+    # Arrêt calé sur la grille des relevés : un relevé tombe au début d'arrêt (exclu), au début de
+    # fenêtre (inclus) et sur chaque bord de tranche
+    aligned = downtimes_df[downtimes_df['downtime_reason'].isin(list(PRECURSOR_SENSOR_MAP))].iloc[[0]].copy()
+    aligned['downtime_id'] += 20000
+    aligned['start_time'] = aligned['start_time'].dt.floor('h') + pd.Timedelta(hours=12)
+    return pd.concat([downtimes_df, aligned], ignore_index=True), readings_df
+
+
+def _naive(downtimes_df, readings_df, window_hours, step_minutes):
+    """Boucle par (arrêt imprévu, capteur lié) : fenêtres, référence, profils et délais d'anticipation."""
+    window, step = pd.Timedelta(hours=window_hours), pd.Timedelta(minutes=step_minutes)
+    n_bins = int(np.ceil(window / step))
+    baseline_bins = max(1, PRECURSOR_BASELINE_MINUTES // step_minutes)
+    window_rows, pair_rows = [], []
+    for _, downtime in downtimes_df.iterrows():
+        if downtime['downtime_category'] in PLANNED_DOWNTIME_CATEGORIES:
+            continue
+        for sensor_type in PRECURSOR_SENSOR_MAP.get(downtime['downtime_reason'], []):
+            start = downtime['start_time']
+            series = readings_df[(readings_df['equipment_id'] == downtime['equipment_id']) & (readings_df['sensor_type'] == sensor_type)]
+            readings = series[(series['timestamp'] >= start - window) & (series['timestamp'] < start)]
+            bins = ((readings['timestamp'] - (start - window)) // step).clip(upper=n_bins - 1)
+            baseline = readings['value'][bins < baseline_bins]
+            base_mean, base_std = baseline.mean(), baseline.std(ddof=0)
+            deviation = readings['value'] - base_mean
+            lead_time = np.nan
+            for bin_number, bin_deviation in deviation.groupby(bins).mean().items():
+                if bin_number >= baseline_bins and abs(bin_deviation) / base_std > PRECURSOR_ONSET_Z:
+                    lead_time = window_hours - bin_number * step_minutes / 60
+                    break
+            last = readings[readings['timestamp'] > start - step].tail(1)
+            pair_rows.append({
+                'downtime_reason': downtime['downtime_reason'], 'sensor_type': sensor_type, 'downtime_id': downtime['downtime_id'],
+                'lead_time_hours': lead_time, 'deviation_at_downtime': last['value'].iloc[0] - base_mean if len(last) else np.nan,
+            })
+            window_rows.append(pd.DataFrame({
+                'downtime_reason': downtime['downtime_reason'], 'sensor_type': sensor_type, 'downtime_id': downtime['downtime_id'],
+                'bin': bins, 'value': readings['value'], 'deviation': deviation,
+            }))
+
+    windows = pd.concat(window_rows, ignore_index=True)
+    profiles = windows.groupby(['downtime_reason', 'sensor_type', 'bin']).agg(
+        num_events=('downtime_id', 'nunique'), num_readings=('value', 'size'),
+        mean_value=('value', 'mean'), std_value=('value', 'std'), mean_deviation=('deviation', 'mean'),
+    ).reset_index()
+    profiles['minutes_before_downtime'] = window_hours * 60 - profiles['bin'] * step_minutes
+
+    pairs = pd.DataFrame(pair_rows)
+    lead_times = pairs.groupby(['downtime_reason', 'sensor_type']).agg(
+        num_events=('downtime_id', 'count'), num_with_precursor=('lead_time_hours', 'count'),
+        mean_lead_time_hours=('lead_time_hours', 'mean'), median_lead_time_hours=('lead_time_hours', 'median'),
+        p10_lead_time_hours=('lead_time_hours', lambda s: s.quantile(0.1)),
+        p90_lead_time_hours=('lead_time_hours', lambda s: s.quantile(0.9)),
+        mean_deviation_at_downtime=('deviation_at_downtime', 'mean'),
+    ).reset_index()
+    return profiles, lead_times
+
+
+@pytest.mark.parametrize('window_hours, step_minutes', [(8, 15), (2.5, 20)])
+def test_alignment_matches_a_per_downtime_loop(precursor_data, window_hours, step_minutes):
+    downtimes_df, readings_df = precursor_data
+    profiles_df, lead_times_df = align_precursor_windows(downtimes_df, readings_df, window_hours, step_minutes)
+    expected_profiles, expected_lead_times = _naive(downtimes_df, readings_df, window_hours, step_minutes)
+
+    keys = ['downtime_reason', 'sensor_type', 'minutes_before_downtime']
+    profiles_df = profiles_df.sort_values(keys).reset_index(drop=True)
+    expected_profiles = expected_profiles.sort_values(keys).reset_index(drop=True)[profiles_df.columns]
+    pd.testing.assert_frame_equal(profiles_df, expected_profiles, check_dtype=False, atol=1e-9)
+
+    keys = ['downtime_reason', 'sensor_type']
+    lead_times_df = lead_times_df.sort_values(keys).reset_index(drop=True)
+    expected_lead_times = expected_lead_times.sort_values(keys).reset_index(drop=True)[lead_times_df.columns]
+    pd.testing.assert_frame_equal(lead_times_df, expected_lead_times, check_dtype=False, atol=1e-9)
+    # La dérive simulée précède les arrêts liés : des délais sont bien détectés
+    assert lead_times_df['num_with_precursor'].sum() > 0
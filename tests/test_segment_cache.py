@@ -0,0 +1,118 @@
+from datetime import datetime
+import pandas as pd
+import pytest
+
+from data_processing import segment_cache
+from data_processing.segment_cache import RangeSegmentCache, _frame_fingerprint
+from data_processing.table_versions import TableVersions
+
+
+class FakeVersions(TableVersions):
+    def __init__(self):
+        super().__init__(ttl_seconds=0)
+        self.db = {'production_output': (1, 0), 'downtime_logs': (1, 0)}
+
+    def _read_versions(self, tables):
+        return {table: self.db[table] for table in tables}
+
+
+@pytest.fixture
+def production():
+    """Table production_output simulée (modifiable par le test) et lecteur comptant ses appels."""
+    table = {'rows': pd.DataFrame({
+        'equipment_id': ['EQ1', 'EQ2'] * 4,
+        'timestamp': pd.to_datetime(['2023-01-01 08:00', '2023-01-01 09:00', '2023-01-02 08:00', '2023-01-02 09:00',
+                                     '2023-01-03 08:00', '2023-01-03 09:00', '2023-01-04 08:00', '2023-01-04 09:00']),
+        'quantity_produced': [10, 20, 30, 40, 50, 60, 70, 80],
+    })}
+    reads = []
+
+    def loader(start_time, end_time, equipment_id=None):
+        reads.append((pd.Timestamp(start_time), pd.Timestamp(end_time)))
+        df = table['rows']
+        mask = (df['timestamp'] >= start_time) & (df['timestamp'] <= end_time)
+        if equipment_id:
+            mask &= df['equipment_id'] == equipment_id
+        return df[mask].reset_index(drop=True)
+
+    def fingerprints(table_name, days, equipment_id=None):
+        df = table['rows']
+        if equipment_id:
+            df = df[df['equipment_id'] == equipment_id]
+        return {day: _frame_fingerprint(table_name, df[(df['timestamp'] >= day) & (df['timestamp'] < day + segment_cache.DAY)])
+                for day in days}
+
+    return table, loader, reads, fingerprints
+
+
+@pytest.fixture
+def versions(monkeypatch):
+    versions = FakeVersions()
+    monkeypatch.setattr(segment_cache, 'get_table_versions', lambda: versions)
+    return versions
+
+
+def _quantities(df):
+    return df['quantity_produced'].tolist()
+
+
+def test_only_missing_days_are_read(production, versions):
+    _, loader, reads, fingerprints = production
+    cache = RangeSegmentCache(read_fingerprints=fingerprints)
+    first = cache.get('production_output', datetime(2023, 1, 1), datetime(2023, 1, 2, 23), None, loader)
+    second = cache.get('production_output', datetime(2023, 1, 2), datetime(2023, 1, 3, 23), None, loader)
+    assert _quantities(first) == [10, 20, 30, 40]
+    assert _quantities(second) == [30, 40, 50, 60]
+    assert reads == [(pd.Timestamp('2023-01-01'), pd.Timestamp('2023-01-03')),
+                     (pd.Timestamp('2023-01-03'), pd.Timestamp('2023-01-04'))]
+
+
+def test_external_write_refetches_only_changed_days(production, versions):
+    table, loader, reads, fingerprints = production
+    cache = RangeSegmentCache(read_fingerprints=fingerprints)
+    cache.get('production_output', datetime(2023, 1, 1), datetime(2023, 1, 3, 23), None, loader)
+    reads.clear()
+
+    # Autre écrivain (simulate_data.py, SQL manuel...) : un relevé ajouté le 2 janvier, jour « clos »
+    late = pd.DataFrame({'equipment_id': ['EQ1'], 'timestamp': pd.to_datetime(['2023-01-02 12:00']), 'quantity_produced': [5]})
+    table['rows'] = pd.concat([table['rows'], late], ignore_index=True)
+    versions.db['production_output'] = (1, 1)
+
+    df = cache.get('production_output', datetime(2023, 1, 1), datetime(2023, 1, 3, 23), None, loader)
+    assert sorted(_quantities(df)) == [5, 10, 20, 30, 40, 50, 60]
+    assert reads == [(pd.Timestamp('2023-01-02'), pd.Timestamp('2023-01-03'))]
+    assert cache.stats()['revalidated'] == 2 and cache.stats()['refetched'] == 1
+
+    # Segments revalidés : plus de vérification tant que la table ne change pas
+    reads.clear()
+    cache.get('production_output', datetime(2023, 1, 1), datetime(2023, 1, 3, 23), None, loader)
+    assert reads == [] and cache.stats()['revalidated'] == 2
+
+
+def test_recreated_table_drops_segments(production, versions):
+    table, loader, reads, fingerprints = production
+    cache = RangeSegmentCache(read_fingerprints=fingerprints)
+    cache.get('production_output', datetime(2023, 1, 1), datetime(2023, 1, 1, 23), 'EQ1', loader)
+    table['rows'] = table['rows'].iloc[0:0]
+    versions.db['production_output'] = (2, 0) # TRUNCATE / DROP + CREATE : nouveau relid
+    assert cache.get('production_output', datetime(2023, 1, 1), datetime(2023, 1, 1, 23), 'EQ1', loader).empty
+    assert len(reads) == 2
+
+
+def test_local_write_invalidates_touched_days(production, versions, monkeypatch):
+    table, loader, reads, fingerprints = production
+    cache = RangeSegmentCache(read_fingerprints=fingerprints)
+    monkeypatch.setattr(segment_cache, '_range_cache', cache)
+    versions.subscribe(segment_cache._invalidate_written)
+    cache.get('production_output', datetime(2023, 1, 1), datetime(2023, 1, 3, 23), None, loader)
+    reads.clear()
+
+    written = pd.DataFrame({'equipment_id': ['EQ2'], 'timestamp': pd.to_datetime(['2023-01-03 12:00']), 'quantity_produced': [7]})
+    table['rows'] = pd.concat([table['rows'], written], ignore_index=True)
+    versions.db['production_output'] = (1, 1)
+    versions.record_local_write('production_output', written, time_columns=('timestamp',))
+
+    df = cache.get('production_output', datetime(2023, 1, 1), datetime(2023, 1, 3, 23), None, loader)
+    assert sorted(_quantities(df)) == [7, 10, 20, 30, 40, 50, 60]
+    assert reads == [(pd.Timestamp('2023-01-03'), pd.Timestamp('2023-01-04'))]
+    assert cache.stats()['revalidated'] == 0
@@ -0,0 +1,127 @@
+from functools import partial
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_processing import kpi_calculator, sensor_archive
+from data_processing.typed_reader import TABLE_SCHEMAS, apply_schema
+
+pytest.importorskip('pyarrow')
+
+UNITS = {'Temperature_Motor': '°C', 'Pressure_Hydraulic': 'bar'}
+
+
+@pytest.fixture(scope='module')
+def readings():
+    """Relevés toutes les 5 minutes de janvier à avril (un relevé tombe sur chaque début de mois)."""
+    timestamps = pd.date_range('2023-01-01', '2023-04-10', freq='5min')
+    frames = []
+    for i, (equipment_id, sensor_type) in enumerate([(eq, sensor) for eq in ['EQ1', 'EQ2'] for sensor in UNITS]):
+        values = np.random.default_rng(i).normal(50, 5, len(timestamps))
+        frames.append(pd.DataFrame({'timestamp': timestamps, 'equipment_id': equipment_id, 'sensor_type': sensor_type,
+                                    'value': values, 'unit': UNITS[sensor_type]}))
+    return apply_schema(pd.concat(frames, ignore_index=True), TABLE_SCHEMAS['sensor_readings'])
+
+
+def _select(df, start_time=None, end_time=None, equipment_id=None, sensor_type=None):
+    """Filtres de read_long_sensor_data (bornes incluses)."""
+    mask = pd.Series(True, index=df.index)
+    if start_time is not None:
+        mask &= df['timestamp'] >= start_time
+    if end_time is not None:
+        mask &= df['timestamp'] <= end_time
+    if equipment_id:
+        mask &= df['equipment_id'] == equipment_id
+    if sensor_type:
+        mask &= df['sensor_type'] == sensor_type
+    return df[mask]
+
+
+class FakeConnection:
+    """Table chaude en mémoire (non purgée : un double comptage à la bordure serait visible)."""
+
+    def __init__(self, readings_df, reads):
+        self.readings_df, self.reads = readings_df, reads
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, *args):
+        pass
+
+    def fetchone(self):
+        return self.readings_df['timestamp'].min(), self.readings_df['timestamp'].max()
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def archive(readings, tmp_path, monkeypatch):
+    """Archive des mois clos (deux mois gardés en base) dans tmp_path ; retourne (dossier, lectures chaudes)."""
+    reads = []
+
+    def read_sensor_readings(conn, start_time=None, end_time=None, equipment_id=None, sensor_type=None):
+        reads.append((start_time, end_time))
+        return _select(conn.readings_df, start_time, end_time, equipment_id, sensor_type).reset_index(drop=True)
+
+    for module in (sensor_archive, kpi_calculator):
+        monkeypatch.setattr(module, 'get_db_connection', lambda: FakeConnection(readings, reads))
+        monkeypatch.setattr(module, 'read_sensor_readings', read_sensor_readings)
+    sensor_archive.archive_closed_months(hot_months=2, archive_dir=str(tmp_path))
+    reads.clear()
+    return str(tmp_path), reads
+
+
+def _sorted(df):
+    return df.sort_values(['timestamp', 'equipment_id', 'sensor_type'], kind='stable').reset_index(drop=True)
+
+
+def test_manifest_lists_closed_months(archive, readings):
+    archive_dir, _ = archive
+    manifest = sensor_archive.load_manifest(archive_dir)
+    assert manifest['archived_until'] == '2023-03-01T00:00:00'
+    assert sensor_archive.get_archive_cutoff(archive_dir) == pd.Timestamp('2023-03-01')
+    assert sorted((entry['month'], entry['equipment_id']) for entry in manifest['files']) == [
+        ('2023-01', 'EQ1'), ('2023-01', 'EQ2'), ('2023-02', 'EQ1'), ('2023-02', 'EQ2')]
+    for entry in manifest['files']:
+        month = pd.Timestamp(entry['month'])
+        expected = readings[(readings['equipment_id'] == entry['equipment_id']) & (readings['timestamp'] >= month)
+                            & (readings['timestamp'] < month + pd.DateOffset(months=1))]
+        assert entry['rows'] == len(expected)
+        assert (entry['min_timestamp'], entry['max_timestamp']) == (month.isoformat(), expected['timestamp'].max().isoformat())
+
+
+@pytest.mark.parametrize('equipment_id, sensor_type', [(None, None), ('EQ2', None), ('EQ1', 'Pressure_Hydraulic')])
+def test_archived_reads_include_both_bounds(archive, readings, equipment_id, sensor_type):
+    archive_dir, _ = archive
+    # Bornes sur des relevés, de part et d'autre d'un changement de mois (deux fichiers par équipement)
+    start, end = pd.Timestamp('2023-01-31 22:05'), pd.Timestamp('2023-02-01 03:00')
+    result = sensor_archive.read_archived_sensor_data(start, end, equipment_id, sensor_type, archive_dir=archive_dir)
+    expected = _sorted(_select(readings, start, end, equipment_id, sensor_type))
+    assert result['timestamp'].min() == start and result['timestamp'].max() == end
+    pd.testing.assert_frame_equal(_sorted(result), expected, check_categorical=False)
+
+
+@pytest.mark.parametrize('start, end, hot_read', [
+    ('2023-02-27 12:00', '2023-03-02 08:00', True), # À cheval : archive puis base à partir de la borne
+    ('2023-01-15 00:00', '2023-03-01 00:00', True), # Fin exactement sur la borne : relevé lu en base
+    ('2023-01-15 00:00', '2023-02-28 23:55', False), # Entièrement archivé : pas de lecture en base
+])
+def test_get_sensor_data_splits_reads_at_the_cutoff(archive, readings, monkeypatch, start, end, hot_read):
+    archive_dir, reads = archive
+    monkeypatch.setattr(kpi_calculator, 'SENSOR_ARCHIVE_ENABLED', True)
+    monkeypatch.setattr(kpi_calculator, 'SENSOR_PYRAMID_ENABLED', False)
+    monkeypatch.setattr(kpi_calculator, 'get_archive_cutoff', partial(sensor_archive.get_archive_cutoff, archive_dir))
+    monkeypatch.setattr(kpi_calculator, 'read_archived_sensor_data', partial(sensor_archive.read_archived_sensor_data, archive_dir=archive_dir))
+
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    result = kpi_calculator.get_sensor_data(start.to_pydatetime(), end.to_pydatetime(), 'EQ1')
+    pd.testing.assert_frame_equal(_sorted(result), _sorted(_select(readings, start, end, 'EQ1')), check_categorical=False)
+    assert reads == ([(pd.Timestamp('2023-03-01'), end.to_pydatetime())] if hot_read else [])
@@ -0,0 +1,103 @@
+import pandas as pd
+import pytest
+
+from data_processing import sensor_buffer
+from data_processing.sensor_buffer import SensorRingBuffer
+from data_processing.table_versions import TableVersions
+
+
+class FakeVersions(TableVersions):
+    def __init__(self):
+        super().__init__(ttl_seconds=0)
+        self.db = {'sensor_readings': (1, 0)}
+
+    def _read_versions(self, tables):
+        return {table: self.db[table] for table in tables}
+
+
+@pytest.fixture
+def versions(monkeypatch):
+    versions = FakeVersions()
+    monkeypatch.setattr(sensor_buffer, 'get_table_versions', lambda: versions)
+    return versions
+
+
+def _readings(*minutes, equipment_id='EQ1', base='2023-01-10 08:00'):
+    timestamps = [pd.Timestamp(base) + pd.Timedelta(minutes=minute) for minute in minutes]
+    return pd.DataFrame({'timestamp': timestamps, 'equipment_id': equipment_id, 'sensor_type': 'Temperature',
+                         'value': [float(minute) for minute in minutes], 'unit': '°C'})
+
+
+def _minutes(df):
+    return ((df['timestamp'] - pd.Timestamp('2023-01-10 08:00')) / pd.Timedelta(minutes=1)).astype(int).tolist()
+
+
+def test_late_readings_are_inserted_in_order():
+    buffer = SensorRingBuffer(capacity=10)
+    published = []
+    buffer.add_listener(published.append)
+    buffer.append(_readings(0, 1, 2, 4, 5), complete_since=pd.Timestamp('2023-01-10 08:00'))
+    buffer.append(_readings(3, 4, 6)) # 3 arrive en retard, 4 est un doublon
+
+    df = buffer.query('2023-01-10 08:00', '2023-01-10 09:00')
+    assert _minutes(df) == [0, 1, 2, 3, 4, 5, 6]
+    assert df['value'].tolist() == [0, 1, 2, 3, 4, 5, 6]
+    assert _minutes(published[-1]) == [3, 6] # Seuls les nouveaux relevés sont diffusés
+
+
+def test_late_readings_past_the_horizon_fall_back_to_the_database():
+    buffer = SensorRingBuffer(capacity=4)
+    buffer.append(_readings(0, 1, 2, 3, 4, 5), complete_since=pd.Timestamp('2023-01-10 08:00'))
+    buffer.append(_readings(1)) # Antérieur à l'horizon : ignoré
+    assert buffer.query('2023-01-10 08:01', '2023-01-10 09:00') is None
+    assert _minutes(buffer.query('2023-01-10 08:02', '2023-01-10 09:00')) == [2, 3, 4, 5]
+
+    # Un relevé tardif dans l'horizon repousse le plus ancien : l'horizon avance
+    buffer.append(_readings(2.5))
+    assert buffer.query('2023-01-10 08:02', '2023-01-10 09:00') is None
+    assert buffer.query('2023-01-10 08:02:30', '2023-01-10 09:00')['value'].tolist() == [2.5, 3, 4, 5]
+
+
+def test_poller_rereads_the_late_window(monkeypatch, versions):
+    table = {'rows': _readings(0, 1, 2)}
+    monkeypatch.setattr(sensor_buffer, 'get_sensor_data',
+                        lambda start_time=None, **kwargs: table['rows'][table['rows']['timestamp'] >= start_time])
+    buffer = SensorRingBuffer(capacity=100)
+    buffer.poll_once(now=pd.Timestamp('2023-01-10 08:30'))
+
+    # Relevé de 08:01:30 écrit après le passage du poller (watermark à 08:02)
+    table['rows'] = pd.concat([table['rows'], _readings(1.5, 3)], ignore_index=True)
+    buffer.poll_once()
+    df = buffer.query('2023-01-10 08:00', '2023-01-10 09:00')
+    assert df['value'].tolist() == [0, 1, 1.5, 2, 3]
+
+
+def test_readings_written_too_late_for_the_poller_make_the_buffer_incomplete(monkeypatch, versions):
+    table = {'rows': _readings(*range(10))}
+    monkeypatch.setattr(sensor_buffer, 'get_sensor_data',
+                        lambda start_time=None, **kwargs: table['rows'][table['rows']['timestamp'] >= start_time])
+    buffer = SensorRingBuffer(capacity=100)
+    versions.db['sensor_readings'] = (1, 10)
+    buffer.poll_once(now=pd.Timestamp('2023-01-10 08:30'))
+
+    table['rows'] = pd.concat([table['rows'], _readings(10)], ignore_index=True)
+    versions.db['sensor_readings'] = (1, 11)
+    buffer.poll_once()
+    assert buffer.query('2023-01-10 08:00', '2023-01-10 09:00') is not None
+
+    # Relevé de 08:02 écrit par un autre processus bien après la fenêtre de relecture (watermark à 08:10)
+    table['rows'] = pd.concat([table['rows'], _readings(2.5)], ignore_index=True)
+    versions.db['sensor_readings'] = (1, 12)
+    buffer.poll_once()
+    assert buffer.missed_late_writes == 1
+    assert buffer.query('2023-01-10 08:00', '2023-01-10 09:00') is None
+    assert _minutes(buffer.query('2023-01-10 08:09', '2023-01-10 09:00')) == [9, 10]
+
+
+def test_ingested_readings_reach_the_buffer(monkeypatch, versions):
+    buffer = SensorRingBuffer(capacity=100)
+    buffer.append(_readings(0, 1), complete_since=pd.Timestamp('2023-01-10 08:00'))
+    monkeypatch.setattr(sensor_buffer, '_sensor_buffer', buffer)
+    versions.subscribe(sensor_buffer._append_written)
+    versions.record_local_write('sensor_readings', _readings(0.5, 2), time_columns=('timestamp',))
+    assert buffer.query('2023-01-10 08:00', '2023-01-10 09:00')['value'].tolist() == [0, 0.5, 1, 2]
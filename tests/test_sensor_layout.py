@@ -0,0 +1,62 @@
+import pytest
+
+from data_processing import sensor_layout
+
+
+class RecordingConnection:
+    """Connexion simulée : colonnes de la table large et métadonnées existantes, requêtes enregistrées."""
+
+    def __init__(self, columns, units):
+        self.columns, self.units = columns, units
+        self.statements = []
+        self.result = []
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params=None):
+        self.statements.append(query)
+        if 'information_schema' in query:
+            self.result = [(column,) for column in self.columns]
+        elif query.startswith('SELECT sensor_type, unit'):
+            self.result = list(self.units.items())
+
+    def fetchall(self):
+        return self.result
+
+    def commit(self):
+        pass
+
+    def alters(self):
+        return [statement for statement in self.statements if statement.startswith('ALTER TABLE')]
+
+
+@pytest.fixture(autouse=True)
+def fresh_layout_cache():
+    sensor_layout.forget_sensor_layout()
+    yield
+    sensor_layout.forget_sensor_layout()
+
+
+def test_known_sensors_do_not_alter_the_wide_table():
+    conn = RecordingConnection(['equipment_id', 'timestamp', 'temperature', 'vibration'],
+                               {'Temperature': '°C', 'Vibration': 'mm/s'})
+    for _ in range(3):
+        sensor_layout.register_sensors(conn, {'Temperature': '°C', 'Vibration': 'mm/s'})
+    assert conn.alters() == []
+    assert sum('information_schema' in statement for statement in conn.statements) == 1
+    assert not any(statement.startswith('INSERT') for statement in conn.statements)
+
+
+def test_new_sensor_is_added_once():
+    conn = RecordingConnection(['equipment_id', 'timestamp', 'temperature'], {'Temperature': '°C'})
+    sensor_layout.register_sensors(conn, {'Temperature': '°C', 'Pressure': 'bar'})
+    sensor_layout.register_sensors(conn, {'Temperature': '°C', 'Pressure': 'bar'})
+    assert conn.alters() == [f'ALTER TABLE {sensor_layout.WIDE_TABLE} ADD COLUMN IF NOT EXISTS "pressure" REAL']
+    assert sum(statement.startswith('INSERT') for statement in conn.statements) == 1
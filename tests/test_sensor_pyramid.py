@@ -0,0 +1,73 @@
+import pandas as pd
+import pytest
+
+from data_processing import sensor_pyramid
+from data_processing.sensor_pyramid import choose_sensor_level, rebuild_ranges
+
+
+@pytest.mark.parametrize('start_time, end_time, points, expected', [
+    ('2023-01-01', '2024-01-01', 1000, '1h'), # 8760 tranches horaires
+    ('2023-01-01', '2023-01-15', 1000, '15min'), # 336 tranches horaires : trop peu
+    ('2023-01-01', '2023-01-02', 1000, '1min'),
+    ('2023-01-01 08:00', '2023-01-01 20:00', 1000, None), # 720 minutes : lecture brute
+    ('2023-01-01', '2024-01-01', None, None),
+])
+def test_choose_sensor_level(start_time, end_time, points, expected):
+    assert choose_sensor_level(pd.Timestamp(start_time), pd.Timestamp(end_time), points) == expected
+
+
+def test_rebuild_ranges_are_aligned_on_the_coarsest_level_and_merged():
+    ranges = rebuild_ranges([
+        (pd.Timestamp('2023-01-01 08:20'), pd.Timestamp('2023-01-01 09:00')), # Relevé à 09:00 : tranche 09:00 incluse
+        (pd.Timestamp('2023-01-01 09:59:59'), pd.Timestamp('2023-01-01 09:59:59')),
+        (pd.Timestamp('2023-01-01 12:30'), pd.Timestamp('2023-01-01 12:31')),
+    ])
+    assert ranges == [(pd.Timestamp('2023-01-01 08:00'), pd.Timestamp('2023-01-01 10:00')),
+                      (pd.Timestamp('2023-01-01 12:00'), pd.Timestamp('2023-01-01 13:00'))]
+
+
+class FakeConnection:
+    def __init__(self, last_bucket, first_reading, last_reading):
+        self.rows = [(last_bucket,), (first_reading, last_reading)]
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, *args):
+        pass
+
+    def commit(self):
+        pass
+
+    def fetchone(self):
+        return self.rows.pop(0)
+
+    def close(self):
+        pass
+
+
+def test_update_rebuilds_the_late_window_and_locally_written_buckets(monkeypatch):
+    built = []
+    monkeypatch.setattr(sensor_pyramid, 'get_db_connection', lambda: FakeConnection(
+        pd.Timestamp('2023-03-01 10:00'), pd.Timestamp('2023-01-01'), pd.Timestamp('2023-03-01 10:42')))
+    monkeypatch.setattr(sensor_pyramid, 'backfill_sensor_pyramid', lambda start, end: built.append((start, end)) or 1)
+    monkeypatch.setattr(sensor_pyramid, 'SENSOR_PYRAMID_ENABLED', True)
+    monkeypatch.setattr(sensor_pyramid, 'SENSOR_PYRAMID_LATE_MINUTES', 120)
+    monkeypatch.setattr(sensor_pyramid, '_written_ranges', [])
+
+    # Relevés ingérés en retard pour des tranches déjà agrégées
+    written = pd.DataFrame({'timestamp': pd.to_datetime(['2023-02-10 14:05', '2023-02-10 14:50'])})
+    sensor_pyramid._record_written('sensor_readings', written, written['timestamp'].min(), written['timestamp'].max())
+    sensor_pyramid._record_written('sensor_readings', written, pd.Timestamp('2023-02-10 15:10'), pd.Timestamp('2023-02-10 15:10'))
+    sensor_pyramid._record_written('production_output', written, pd.Timestamp('2023-01-05'), pd.Timestamp('2023-01-05'))
+
+    assert sensor_pyramid.update_sensor_pyramid() == 2
+    assert built == [(pd.Timestamp('2023-02-10 14:00'), pd.Timestamp('2023-02-10 16:00')),
+                     (pd.Timestamp('2023-03-01 08:00'), pd.Timestamp('2023-03-01 11:00'))]
+    assert sensor_pyramid._written_ranges == []
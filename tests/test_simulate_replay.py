@@ -0,0 +1,90 @@
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_processing.simulate_replay import EMIT_COLUMN, REPLAY_TABLES, downtime_updates, iter_replay_chunks, split_by_emit_time
+
+from conftest import SIM_END
+
+SPAN_START = datetime(2023, 2, 12, 7, 0)
+
+
+@pytest.fixture(scope='module')
+def replay_data(sim_data):
+    """
+    sim_data avec des arrêts clôturés (le générateur ne clôt les arrêts qu'à la fin de la période) :
+    tous durent 40 minutes, sauf le dernier de chaque équipement, encore en cours à la fin.
+    """
+    downtimes_df = sim_data['downtime_logs'].copy()
+    still_open = downtimes_df.groupby('equipment_id')['start_time'].transform('max') == downtimes_df['start_time']
+    downtimes_df['end_time'] = downtimes_df['end_time'].where(still_open, downtimes_df['start_time'] + pd.Timedelta(minutes=40))
+    downtimes_df['duration_seconds'] = (downtimes_df['end_time'] - downtimes_df['start_time']).dt.total_seconds()
+    return dict(sim_data, downtime_logs=downtimes_df)
+
+
+@pytest.fixture(scope='module')
+def replay_params(replay_data):
+    """Profils sans bruit : les relevés ne dépendent que du temps et des alarmes, quel que soit le découpage."""
+    profiles = {sensor: dict(profile, noise_std=0) for sensor, profile in replay_data['params']['SENSOR_PROFILES'].items()}
+    return dict(replay_data['params'], SENSOR_PROFILES=profiles, SENSOR_READING_FREQUENCY_SECONDS=300)
+
+
+def _replay(data, params, chunk_hours):
+    return list(iter_replay_chunks(data['equipments'], data['machine_events'], data['downtime_logs'],
+                                   data['production_output'], params, SPAN_START, SIM_END, chunk_hours))
+
+
+def test_downtimes_are_emitted_open_then_closed(replay_data):
+    downtimes_df = replay_data['downtime_logs']
+    updates = downtime_updates(downtimes_df, SIM_END)
+
+    assert updates['emit_time'].is_monotonic_increasing
+    for downtime in downtimes_df.itertuples():
+        records = updates[updates['downtime_id'] == downtime.downtime_id]
+        opened = records.iloc[0]
+        assert opened['emit_time'] == downtime.start_time and pd.isna(opened['end_time']) and pd.isna(opened['duration_seconds'])
+        if downtime.end_time < SIM_END:
+            assert len(records) == 2
+            closed = records.iloc[1]
+            assert closed['emit_time'] == closed['end_time'] == downtime.end_time
+            assert closed['duration_seconds'] == downtime.duration_seconds
+        else: # Encore en cours en fin de période : jamais clôturé
+            assert len(records) == 1
+    assert (downtimes_df['end_time'] >= SIM_END).any() and (downtimes_df['end_time'] < SIM_END).any()
+
+
+def test_chunks_are_emitted_in_global_timestamp_order(replay_data, replay_params):
+    chunks = _replay(replay_data, replay_params, chunk_hours=1)
+    assert [chunk_start for chunk_start, _ in chunks] == list(pd.date_range(SPAN_START, SIM_END, freq='h', inclusive='left'))
+
+    last_time = pd.Timestamp.min
+    for chunk_start, frames in chunks:
+        assert set(frames) == set(REPLAY_TABLES)
+        batches = split_by_emit_time(frames)
+        times = [emit_time for emit_time, _ in batches]
+        # Lots strictement croissants, dans la tranche et après ceux de la tranche précédente
+        assert times == sorted(set(times)) and (not times or (times[0] > last_time and times[-1] < chunk_start + pd.Timedelta(hours=1)))
+        last_time = times[-1] if times else last_time
+        for table, df in frames.items():
+            emitted = pd.concat([batch[table] for _, batch in batches if table in batch]) if len(df) else df
+            pd.testing.assert_frame_equal(emitted, df)
+            for emit_time, batch in batches:
+                if table in batch:
+                    assert (batch[table][EMIT_COLUMN[table]] == emit_time).all()
+
+
+@pytest.mark.parametrize('chunk_hours', [1, 2.5])
+def test_chunked_generation_equals_a_single_span_run(replay_data, replay_params, chunk_hours):
+    span_hours = (SIM_END - SPAN_START).total_seconds() / 3600
+    (_, single), = _replay(replay_data, replay_params, chunk_hours=span_hours)
+    chunks = _replay(replay_data, replay_params, chunk_hours)
+    assert len(chunks) == int(np.ceil(span_hours / chunk_hours))
+
+    for table in REPLAY_TABLES:
+        chunked = pd.concat([frames[table] for _, frames in chunks], ignore_index=True)
+        pd.testing.assert_frame_equal(chunked, single[table], check_index_type=False)
+    # La période contient des ouvertures et des clôtures d'arrêts
+    downtimes = single['downtime_logs']
+    assert downtimes['end_time'].isna().any() and downtimes['end_time'].notna().any()
+    assert single['sensor_readings']['timestamp'].max() < pd.Timestamp(SIM_END)
@@ -0,0 +1,98 @@
+import threading
+import pytest
+
+from data_processing.single_flight import SingleFlight
+
+WAITERS = 5
+
+
+def _run_concurrently(flight, fn, key='2023-01'):
+    """Lance un appel meneur (bloqué dans fn) puis WAITERS appels identiques ; retourne résultats et erreurs."""
+    results, errors = [], []
+
+    def call():
+        try:
+            results.append(flight.do('kpis', key, fn))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(WAITERS + 1)]
+    threads[0].start()
+    return threads, results, errors
+
+
+def _wait_for_waiters(flight, key='2023-01'):
+    # Les appels suivants sont enregistrés comme attendant le meneur avant qu'il ne termine
+    for _ in range(500):
+        with flight.lock:
+            call = flight.calls.get(('kpis', key))
+            if call is not None and call.waiters == WAITERS:
+                return
+        threading.Event().wait(0.01)
+    raise AssertionError("Les appels concurrents n'ont pas rejoint le calcul en cours")
+
+
+def test_concurrent_identical_calls_run_once():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    executions = []
+
+    def compute():
+        executions.append(1)
+        started.set()
+        release.wait(5)
+        return '[{"oee": 0.8}]'
+
+    threads, results, errors = _run_concurrently(flight, compute)
+    assert started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    _wait_for_waiters(flight)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(executions) == 1 and errors == []
+    assert sorted(results) == [('[{"oee": 0.8}]', False)] + [('[{"oee": 0.8}]', True)] * WAITERS
+    assert flight.stats() == {'in_flight': 0, 'endpoints': {'kpis': {'executions': 1, 'coalesced': WAITERS, 'errors': 0}}}
+
+
+def test_error_reaches_every_waiter_and_the_key_is_released():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+
+    def failing():
+        started.set()
+        release.wait(5)
+        raise RuntimeError("base indisponible")
+
+    threads, results, errors = _run_concurrently(flight, failing)
+    assert started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    _wait_for_waiters(flight)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert results == [] and len(errors) == WAITERS + 1
+    assert all(isinstance(error, RuntimeError) and str(error) == "base indisponible" for error in errors)
+    assert flight.stats()['endpoints']['kpis']['errors'] == 1
+    # Clé libérée : l'appel suivant recalcule au lieu de recevoir l'erreur
+    assert flight.calls == {}
+    assert flight.do('kpis', '2023-01', lambda: 'ok') == ('ok', False)
+
+
+def test_distinct_keys_do_not_wait_for_each_other():
+    flight = SingleFlight()
+    release = threading.Event()
+    leader = threading.Thread(target=flight.do, args=('kpis', '2023-01', lambda: release.wait(5)))
+    leader.start()
+    try:
+        assert flight.do('kpis', '2023-02', lambda: 'février') == ('février', False)
+    finally:
+        release.set()
+        leader.join(5)
+    with pytest.raises(ValueError):
+        flight.do('kpis', '2023-03', lambda: int('x'))
+    assert flight.stats()['in_flight'] == 0
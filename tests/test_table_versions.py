@@ -0,0 +1,42 @@
+import pandas as pd
+
+from data_processing.table_versions import TableVersions
+
+
+class FakeVersions(TableVersions):
+    """Versions lues dans un dict au lieu de pg_stat_user_tables."""
+
+    def __init__(self):
+        super().__init__(ttl_seconds=0)
+        self.db = {'production_output': (1, 100)}
+
+    def _read_versions(self, tables):
+        return {table: self.db[table] for table in tables if table in self.db}
+
+
+def test_local_writes_are_not_external_changes():
+    versions = FakeVersions()
+    mark = versions.mark('production_output')
+    written = pd.DataFrame({'timestamp': pd.to_datetime(['2023-01-02 10:00', '2023-01-03 11:00'])})
+    versions.record_local_write('production_output', written, time_columns=['timestamp'])
+    versions.db['production_output'] = (1, 102) # Compteurs publiés par PostgreSQL
+    assert not versions.changed_externally(mark)
+
+    versions.db['production_output'] = (1, 103) # Une ligne écrite par un autre processus
+    assert versions.changed_externally(mark)
+
+
+def test_recreated_table_is_an_external_change():
+    versions = FakeVersions()
+    mark = versions.mark('production_output')
+    versions.db['production_output'] = (2, 0) # DROP / CREATE (simulate_data.py relancé)
+    assert versions.changed_externally(mark)
+
+
+def test_listeners_receive_written_period():
+    versions = FakeVersions()
+    received = []
+    versions.subscribe(lambda table, df, first_time, last_time: received.append((table, len(df), first_time, last_time)))
+    written = pd.DataFrame({'start_time': pd.to_datetime(['2023-01-02 10:00']), 'end_time': pd.to_datetime(['2023-01-04 08:00'])})
+    versions.record_local_write('downtime_logs', written, time_columns=['start_time', 'end_time'])
+    assert received == [('downtime_logs', 1, pd.Timestamp('2023-01-02 10:00'), pd.Timestamp('2023-01-04 08:00'))]
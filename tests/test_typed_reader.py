@@ -0,0 +1,91 @@
+import io
+import json
+import random
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_processing import simulate_data
+from data_processing.typed_reader import DATETIME, TABLE_SCHEMAS, memory_footprint, read_sql_typed, to_records
+
+
+class FakeCursor:
+    """COPY ... TO STDOUT servi depuis un DataFrame (CSV avec en-tête, comme PostgreSQL)."""
+
+    def __init__(self, df):
+        self.df, self.copied = df, []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def mogrify(self, query, params):
+        return (query % {key: repr(value) for key, value in (params or {}).items()}).encode()
+
+    def copy_expert(self, sql, buffer):
+        self.copied.append(sql)
+        buffer.write(self.df.to_csv(index=False).encode())
+
+
+class FakeConnection:
+    def __init__(self, df):
+        self.cursor_ = FakeCursor(df)
+
+    def cursor(self):
+        return self.cursor_
+
+
+@pytest.fixture(scope='module')
+def sensor_readings(sim_data):
+    """Relevés simulés sur deux jours, tels que renvoyés par la table sensor_readings."""
+    random.seed(4)
+    np.random.seed(4)
+    start, end = pd.Timestamp('2023-01-10'), pd.Timestamp('2023-01-12')
+    events_df = sim_data['machine_events']
+    events_df = events_df[(events_df['timestamp'] >= start) & (events_df['timestamp'] < end)]
+    params = dict(sim_data['params'], SENSOR_READING_FREQUENCY_SECONDS=120)
+    return simulate_data.generate_sensor_readings_realistic(sim_data['equipments'], events_df, start.to_pydatetime(),
+                                                            end.to_pydatetime(), params, sim_data['downtime_logs'])
+
+
+def test_columns_are_read_with_the_table_schema(sensor_readings):
+    conn = FakeConnection(sensor_readings.assign(quality=1))
+    df = read_sql_typed("SELECT * FROM sensor_readings WHERE equipment_id = %(equipment_id)s", conn,
+                        params={'equipment_id': 'EQ1'}, table='sensor_readings')
+
+    assert conn.cursor_.copied == ["COPY (SELECT * FROM sensor_readings WHERE equipment_id = 'EQ1') TO STDOUT WITH (FORMAT CSV, HEADER)"]
+    assert {col: str(df[col].dtype) for col in TABLE_SCHEMAS['sensor_readings']} == {
+        'timestamp': DATETIME, 'equipment_id': 'category', 'sensor_type': 'category', 'value': 'float32', 'unit': 'category'}
+    assert df['quality'].dtype == 'int64' # Colonne hors schéma : inférence de pandas
+    pd.testing.assert_series_equal(df['timestamp'], sensor_readings['timestamp'].astype(DATETIME))
+    np.testing.assert_allclose(df['value'], sensor_readings['value'], rtol=1e-6)
+    assert df.attrs['memory_bytes'] == memory_footprint(df)
+
+
+def test_typed_read_is_at_least_three_times_smaller(sensor_readings):
+    csv = sensor_readings.to_csv(index=False).encode()
+    untyped = pd.read_csv(io.BytesIO(csv))
+    typed = read_sql_typed("SELECT * FROM sensor_readings", FakeConnection(sensor_readings), table='sensor_readings')
+    assert len(typed) == len(untyped) > 10000
+    assert memory_footprint(untyped) >= 3 * memory_footprint(typed)
+
+
+def test_records_render_float32_shortest_and_missing_values_as_none():
+    df = pd.DataFrame({
+        'timestamp': pd.to_datetime(['2023-01-01 07:00', None]),
+        'equipment_id': pd.Categorical(['EQ1', None]),
+        'value': np.array([1.1, np.nan], dtype='float32'),
+        'quantity_produced': np.array([3, 4], dtype='int32'),
+        'duration_seconds': [0.1, 2.5],
+    })
+    records = to_records(df)
+
+    assert records[0]['value'] == 1.1 and records[0]['duration_seconds'] == 0.1
+    assert [records[1][col] for col in ['timestamp', 'equipment_id', 'value']] == [None, None, None]
+    assert [record['quantity_produced'] for record in records] == [3, 4]
+    assert json.dumps({'value': records[0]['value']}) == '{"value": 1.1}'
+    assert df['value'].dtype == 'float32' # Le DataFrame d'origine n'est pas modifié
+    # Sans valeur manquante, les types numériques sont conservés
+    assert to_records(df.iloc[:1][['value', 'quantity_produced']]) == [{'value': 1.1, 'quantity_produced': 3}]